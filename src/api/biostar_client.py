@@ -1,9 +1,12 @@
 """
 Cliente básico para la API de BioStar 2.
 """
+import threading
+import time
 import requests
 import urllib3
-from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional
 
 from src.utils.logger import get_logger
 
@@ -12,6 +15,19 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 logger = get_logger(__name__)
 
+# Índice dispositivo -> puerta compartido por todas las instancias del cliente
+# (get_monitor() y door_control crean un cliente nuevo por petición).
+# {host: {'index': {device_id: door_id}, 'timestamp': float, 'refreshing': bool}}
+_door_index_cache = {}
+_door_index_lock = threading.Lock()
+DOOR_INDEX_TTL = 300  # 5 minutos
+
+# Dispositivos sin puerta (checadores) fallan siempre la búsqueda: como máximo
+# una reconstrucción forzada por host en este intervalo.
+# {host: timestamp de la última reconstrucción forzada}
+_door_index_forced_at = {}
+DOOR_INDEX_FORCE_INTERVAL = 30  # segundos
+
 
 class BioStarAPIClient:
     """Cliente para interactuar con la API de BioStar 2."""
@@ -405,36 +421,128 @@ class BioStarAPIClient:
             logger.error(f"✗ Error al obtener puertas: {str(e)}")
             return []
     
+    @staticmethod
+    def build_door_index(doors: List[Dict]) -> Dict[str, int]:
+        """
+        Construye el índice dispositivo -> puerta a partir de la lista de puertas.
+        
+        Considera tanto el dispositivo de entrada como el de salida de cada puerta.
+        
+        Args:
+            doors: Lista de puertas tal como la devuelve get_all_doors()
+            
+        Returns:
+            Diccionario {device_id (str): door_id (int)}
+        """
+        index = {}
+        for door in doors:
+            door_id = door.get('id')
+            if not door_id:
+                continue
+            for key in ('entry_device_id', 'exit_device_id'):
+                device = door.get(key, {})
+                if isinstance(device, dict) and device.get('id'):
+                    # Si un dispositivo aparece en varias puertas, se conserva la primera
+                    index.setdefault(str(device['id']), int(door_id))
+        return index
+    
+    def _refresh_door_index(self) -> Optional[Dict[str, int]]:
+        """Descarga las puertas y reemplaza el índice compartido de este host."""
+        try:
+            doors = self.get_all_doors()
+            if not doors:
+                return None
+            index = self.build_door_index(doors)
+            with _door_index_lock:
+                _door_index_cache[self.host] = {
+                    'index': index,
+                    'timestamp': time.time(),
+                    'refreshing': False
+                }
+            logger.info(f"✓ Índice de puertas actualizado: {len(index)} dispositivos")
+            return index
+        finally:
+            with _door_index_lock:
+                entry = _door_index_cache.get(self.host)
+                if entry:
+                    entry['refreshing'] = False
+    
+    def get_door_index(self, force_refresh: bool = False) -> Dict[str, int]:
+        """
+        Obtiene el índice dispositivo -> puerta desde caché.
+        
+        Si el índice expiró se devuelve el actual y se refresca en segundo plano;
+        solo se consulta /api/doors de forma síncrona cuando no hay índice.
+        
+        Args:
+            force_refresh: Si True, reconstruye el índice antes de devolverlo
+                (como máximo una vez cada DOOR_INDEX_FORCE_INTERVAL segundos)
+            
+        Returns:
+            Diccionario {device_id (str): door_id (int)}
+        """
+        with _door_index_lock:
+            entry = _door_index_cache.get(self.host)
+            if entry and force_refresh:
+                now = time.time()
+                if now - _door_index_forced_at.get(self.host, 0) < DOOR_INDEX_FORCE_INTERVAL:
+                    return entry['index']
+                _door_index_forced_at[self.host] = now
+            if entry and not force_refresh:
+                if time.time() - entry['timestamp'] < DOOR_INDEX_TTL:
+                    return entry['index']
+                if not entry['refreshing']:
+                    entry['refreshing'] = True
+                    threading.Thread(target=self._refresh_door_index, daemon=True).start()
+                return entry['index']
+        
+        index = self._refresh_door_index()
+        if index is not None:
+            return index
+        return entry['index'] if entry else {}
+    
+    @staticmethod
+    def invalidate_door_index(host: str = None):
+        """
+        Invalida el índice de puertas de un host (o de todos).
+        
+        Args:
+            host: URL del servidor BioStar, None para invalidar todos
+        """
+        with _door_index_lock:
+            if host is None:
+                _door_index_cache.clear()
+                _door_index_forced_at.clear()
+            else:
+                _door_index_cache.pop(host.rstrip('/'), None)
+                _door_index_forced_at.pop(host.rstrip('/'), None)
+    
     def get_door_id_for_device(self, device_id: int) -> int:
         """
         Obtiene el ID de la puerta asociada a un dispositivo.
         
+        Usa el índice en caché; si el dispositivo no aparece se reconstruye
+        (como máximo una vez por intervalo) por si la configuración de puertas
+        cambió en BioStar.
+        
         Args:
             device_id: ID del dispositivo
             
         Returns:
             ID de la puerta asociada, o None si no se encuentra
         """
-        doors = self.get_all_doors()
         device_id_str = str(device_id)
+        door_id = self.get_door_index().get(device_id_str)
         
-        for door in doors:
-            # Buscar en entry_device_id
-            entry_device = door.get('entry_device_id', {})
-            if isinstance(entry_device, dict) and entry_device.get('id') == device_id_str:
-                door_id = door.get('id')
-                logger.info(f"✓ Dispositivo {device_id} -> Puerta {door_id} ({door.get('name')})")
-                return int(door_id)
-            
-            # Buscar también en exit_device_id si existe
-            exit_device = door.get('exit_device_id', {})
-            if isinstance(exit_device, dict) and exit_device.get('id') == device_id_str:
-                door_id = door.get('id')
-                logger.info(f"✓ Dispositivo {device_id} -> Puerta {door_id} ({door.get('name')}) [exit]")
-                return int(door_id)
-        
-        logger.warning(f"⚠ No se encontró puerta para dispositivo {device_id}")
-        return None
+        if door_id is None:
+            door_id = self.get_door_index(force_refresh=True).get(device_id_str)
+        
+        if door_id is None:
+            logger.warning(f"⚠ No se encontró puerta para dispositivo {device_id}")
+            return None
+        
+        logger.info(f"✓ Dispositivo {device_id} -> Puerta {door_id}")
+        return door_id
     
     def open_door_by_device(self, device_id: int) -> bool:
         """
@@ -710,3 +818,100 @@ class BioStarAPIClient:
         # En una emergencia real, el desbloqueo de puerta es más importante que la alarma
         logger.info(f"ℹ Alarmas de puerta no soportadas directamente por API REST (door_id={door_id})")
         return False
+    
+    # ==================== ACCIONES MASIVAS ====================
+    
+    def execute_emergency_actions(self, device_ids: Iterable[int], unlock: bool = True,
+                                  alarm: bool = False, deadline: float = 20.0,
+                                  max_workers: int = 8) -> Dict[int, Dict]:
+        """
+        Desbloquea puertas y activa alarmas de varios dispositivos en paralelo.
+        
+        Resuelve todas las puertas desde el índice en caché (a lo sumo una consulta
+        a /api/doors) y lanza las acciones de forma concurrente. Las acciones que no terminan antes del
+        deadline se reportan como fallidas (sin bloquear la respuesta), pero siguen
+        ejecutándose en segundo plano: el deadline no cancela ninguna acción.
+        
+        Args:
+            device_ids: IDs de los dispositivos a activar
+            unlock: Desbloquear permanentemente la puerta de cada dispositivo
+            alarm: Intentar activar la alarma de cada dispositivo
+            deadline: Tiempo máximo de espera en segundos para reportar resultados
+            max_workers: Número máximo de alarmas simultáneas (cada puerta tiene
+                su propio hilo para que ningún desbloqueo espere en cola)
+            
+        Returns:
+            Diccionario {device_id: {'device_id', 'door_id', 'unlocked', 'alarm', 'error'}}
+        """
+        device_ids = list(dict.fromkeys(int(d) for d in device_ids))
+        results = {
+            device_id: {'device_id': device_id, 'door_id': None,
+                        'unlocked': False, 'alarm': False, 'error': None}
+            for device_id in device_ids
+        }
+        if not device_ids or not (unlock or alarm):
+            return results
+        
+        if not self.token:
+            logger.error("No hay token de sesión. Ejecuta login() primero.")
+            for result in results.values():
+                result['error'] = 'Sin sesión en BioStar'
+            return results
+        
+        started = time.monotonic()
+        
+        # Una puerta puede tener dispositivo de entrada y de salida en la misma zona:
+        # se desbloquea una sola vez y el resultado se comparte.
+        devices_by_door = {}
+        if unlock:
+            door_index = self.get_door_index()
+            if any(str(device_id) not in door_index for device_id in device_ids):
+                door_index = self.get_door_index(force_refresh=True)
+            for device_id in device_ids:
+                door_id = door_index.get(str(device_id))
+                if door_id:
+                    results[device_id]['door_id'] = door_id
+                    devices_by_door.setdefault(door_id, []).append(device_id)
+                else:
+                    results[device_id]['error'] = 'Sin puerta asociada'
+        
+        alarm_workers = min(max_workers, len(device_ids)) if alarm else 0
+        executor = ThreadPoolExecutor(max_workers=max(1, len(devices_by_door) + alarm_workers))
+        futures = {}
+        try:
+            for door_id in devices_by_door:
+                futures[executor.submit(self.unlock_door, door_id)] = ('unlock', door_id)
+            if alarm:
+                for device_id in device_ids:
+                    futures[executor.submit(self.trigger_alarm, device_id)] = ('alarm', device_id)
+            
+            remaining = max(0.0, deadline - (time.monotonic() - started))
+            done, pending = wait(futures, timeout=remaining)
+            
+            for future, (action, target_id) in futures.items():
+                if future in pending:
+                    ok, error = False, f'Tiempo agotado ({deadline:.0f}s)'
+                else:
+                    try:
+                        ok, error = bool(future.result()), None
+                    except Exception as e:
+                        ok, error = False, str(e)
+                
+                if action == 'unlock':
+                    for device_id in devices_by_door[target_id]:
+                        results[device_id]['unlocked'] = ok
+                        if not ok:
+                            results[device_id]['error'] = error or 'No se pudo desbloquear la puerta'
+                else:
+                    results[target_id]['alarm'] = ok
+                    if error and not results[target_id]['error']:
+                        results[target_id]['error'] = error
+        finally:
+            # No esperar a las peticiones que excedieron el deadline, pero tampoco
+            # cancelarlas: una puerta reportada como agotada todavía debe abrirse
+            executor.shutdown(wait=False)
+        
+        activated = sum(1 for r in results.values() if r['unlocked'] or r['alarm'])
+        logger.info(f"✓ Acciones de emergencia: {activated}/{len(device_ids)} dispositivos "
+                    f"en {time.monotonic() - started:.2f}s")
+        return results
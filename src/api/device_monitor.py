@@ -2,9 +2,12 @@
 Monitor especializado para dispositivos/checadores de BioStar 2.
 Enfocado en debugging y obtención de logs diarios.
 """
+import threading
+import time
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Iterable, Set
 from pathlib import Path
 import pytz
 
@@ -17,6 +20,36 @@ logger = get_logger(__name__)
 # Timezone de México
 MEXICO_TZ = pytz.timezone('America/Mexico_City')
 
+# Registro de dispositivos compartido por todas las instancias del monitor
+# (get_monitor() crea un DeviceMonitor nuevo por petición).
+# {host: {'devices': [...], 'by_id': {device_id (str): device}, 'timestamp': float, 'refreshing': bool}}
+_device_registry = {}
+_device_registry_lock = threading.Lock()
+DEVICE_REGISTRY_TTL = 300  # 5 minutos
+
+# IDs desconocidos (p. ej. /debug/device/<id> inválido) no descargan /api/devices
+# en cada petición: como máximo una recarga forzada por host en este intervalo.
+# {host: timestamp de la última recarga forzada}
+_device_registry_forced_at = {}
+DEVICE_REGISTRY_FORCE_INTERVAL = 30  # segundos
+
+# Funciones que agregan datos locales a la lista de dispositivos al construir el registro
+_device_enrichers: List[Callable[[List[Dict]], None]] = []
+
+
+def register_device_enricher(enricher: Callable[[List[Dict]], None]):
+    """
+    Registra una función que completa los dispositivos del registro (p. ej. con DeviceConfig).
+
+    La función recibe la lista de dispositivos y los modifica en sitio; puede
+    ejecutarse en un hilo en segundo plano.
+
+    Args:
+        enricher: Función (devices) -> None
+    """
+    _device_enrichers.append(enricher)
+    DeviceMonitor.invalidate_device_registry()
+
 # Códigos de eventos de BioStar 2
 EVENT_CODES = {
     # Accesos exitosos (VERIFY_SUCCESS)
@@ -109,31 +142,17 @@ class DeviceMonitor:
             password=biostar_cfg['password']
         )
         
-        self.devices_cache = []
     
     def login(self) -> bool:
         """Autentica con BioStar."""
         return self.client.login()
     
-    def get_all_devices(self, refresh: bool = False) -> List[Dict]:
-        """
-        Obtiene todos los dispositivos/checadores.
-        
-        Args:
-            refresh: Si True, fuerza actualización del cache
-            
-        Returns:
-            Lista de dispositivos con información completa
-        """
-        if not self.devices_cache or refresh:
-            self.devices_cache = self.client.get_all_devices()
-        
-        # Enriquecer con aliases
+    def _build_device_registry(self, devices: List[Dict]) -> Dict:
+        """Combina la lista de BioStar con aliases y datos locales, e indexa por ID."""
         enriched_devices = []
-        for device in self.devices_cache:
+        for device in devices:
             device_copy = device.copy()
-            device_id = str(device['id'])
-            alias_info = self.config.get_device_alias(device_id)
+            alias_info = self.config.get_device_alias(str(device['id']))
             
             if alias_info:
                 device_copy['alias'] = alias_info.get('alias', '')
@@ -146,7 +165,91 @@ class DeviceMonitor:
             
             enriched_devices.append(device_copy)
         
-        return enriched_devices
+        for enricher in list(_device_enrichers):
+            try:
+                enricher(enriched_devices)
+            except Exception as e:
+                logger.error(f"✗ Error al completar registro de dispositivos: {e}")
+        
+        return {
+            'devices': enriched_devices,
+            'by_id': {str(device['id']): device for device in enriched_devices},
+            'timestamp': time.time(),
+            'refreshing': False
+        }
+    
+    def _refresh_device_registry(self) -> Optional[Dict]:
+        """Descarga los dispositivos y reemplaza el registro compartido de este host."""
+        try:
+            devices = self.client.get_all_devices()
+            if not devices:
+                return None
+            entry = self._build_device_registry(devices)
+            with _device_registry_lock:
+                _device_registry[self.client.host] = entry
+            logger.info(f"✓ Registro de dispositivos actualizado: {len(devices)} dispositivos")
+            return entry
+        finally:
+            with _device_registry_lock:
+                entry = _device_registry.get(self.client.host)
+                if entry:
+                    entry['refreshing'] = False
+    
+    def _get_device_registry(self, force_refresh: bool = False) -> Optional[Dict]:
+        """
+        Obtiene el registro de dispositivos desde caché.
+        
+        Si expiró se devuelve el actual y se refresca en segundo plano; solo se
+        consulta /api/devices de forma síncrona cuando no hay registro o al forzar
+        la recarga (como máximo una vez cada DEVICE_REGISTRY_FORCE_INTERVAL segundos).
+        """
+        with _device_registry_lock:
+            entry = _device_registry.get(self.client.host)
+            if entry and force_refresh:
+                now = time.time()
+                if now - _device_registry_forced_at.get(self.client.host, 0) < DEVICE_REGISTRY_FORCE_INTERVAL:
+                    return entry
+                _device_registry_forced_at[self.client.host] = now
+            if entry and not force_refresh:
+                if time.time() - entry['timestamp'] < DEVICE_REGISTRY_TTL:
+                    return entry
+                if not entry['refreshing']:
+                    entry['refreshing'] = True
+                    threading.Thread(target=self._refresh_device_registry, daemon=True).start()
+                return entry
+        
+        return self._refresh_device_registry() or entry
+    
+    @staticmethod
+    def invalidate_device_registry(host: str = None):
+        """
+        Invalida el registro de dispositivos de un host (o de todos).
+        
+        Args:
+            host: URL del servidor BioStar, None para invalidar todos
+        """
+        with _device_registry_lock:
+            if host is None:
+                _device_registry.clear()
+                _device_registry_forced_at.clear()
+            else:
+                _device_registry.pop(host.rstrip('/'), None)
+                _device_registry_forced_at.pop(host.rstrip('/'), None)
+    
+    def get_all_devices(self, refresh: bool = False) -> List[Dict]:
+        """
+        Obtiene todos los dispositivos/checadores desde el registro compartido.
+        
+        Args:
+            refresh: Si True, fuerza actualización del registro
+            
+        Returns:
+            Lista de dispositivos con aliases y datos locales (copias, se pueden modificar)
+        """
+        entry = self._get_device_registry(force_refresh=refresh)
+        if not entry:
+            return []
+        return [device.copy() for device in entry['devices']]
     
     def get_device_by_id(self, device_id: int) -> Optional[Dict]:
         """
@@ -158,32 +261,16 @@ class DeviceMonitor:
         Returns:
             Información del dispositivo o None si no existe
         """
-        # Try to get device directly from API first
-        device = self.client.get_device_by_id(device_id)
-        
-        if device:
-            # Enrich with alias info
-            device_id_str = str(device['id'])
-            alias_info = self.config.get_device_alias(device_id_str)
-            
-            if alias_info:
-                device['alias'] = alias_info.get('alias', '')
-                device['location'] = alias_info.get('location', '')
-                device['notes'] = alias_info.get('notes', '')
-            else:
-                device['alias'] = ''
-                device['location'] = ''
-                device['notes'] = ''
-            
-            return device
+        entry = self._get_device_registry()
+        device = entry['by_id'].get(str(device_id)) if entry else None
         
-        # Fallback: search in cached list
-        devices = self.get_all_devices(refresh=True)
-        for dev in devices:
-            if dev['id'] == device_id:
-                return dev
+        if device is None:
+            # Dispositivo nuevo todavía no registrado: se recarga el registro
+            # (limitado por DEVICE_REGISTRY_FORCE_INTERVAL)
+            entry = self._get_device_registry(force_refresh=True)
+            device = entry['by_id'].get(str(device_id)) if entry else None
         
-        return None
+        return device.copy() if device else None
     
     def set_device_alias(self, device_id: int, alias: str, location: str = "", notes: str = ""):
         """
@@ -196,6 +283,7 @@ class DeviceMonitor:
             notes: Notas adicionales
         """
         self.config.set_device_alias(str(device_id), alias, location, notes)
+        self.invalidate_device_registry(self.client.host)
         logger.info(f"✓ Alias asignado al dispositivo {device_id}: '{alias}'")
     
     def _filter_events_by_time(self, events: List[Dict], start_hour: int = 5, 
@@ -301,6 +389,73 @@ class DeviceMonitor:
         
         return events
     
+    @staticmethod
+    def extract_user_id(event: Dict) -> Optional[str]:
+        """
+        Extrae el user_id de un evento de BioStar como string.
+        
+        Args:
+            event: Evento tal como lo devuelve search_events()
+            
+        Returns:
+            user_id o None si el evento no tiene usuario válido
+        """
+        user_data = event.get('user_id', {})
+        if isinstance(user_data, dict):
+            user_id = user_data.get('user_id') or user_data.get('id')
+        else:
+            user_id = user_data
+        
+        if not user_id or str(user_id) in ['', 'None', 'nan']:
+            return None
+        return str(user_id)
+    
+    def get_checked_in_user_ids_today(self, device_ids: Optional[Iterable[int]] = None,
+                                      max_workers: int = 8) -> Set[str]:
+        """
+        Obtiene los usuarios con acceso concedido hoy (misma lógica que "Usuarios del Día").
+        
+        Consulta los dispositivos en paralelo reutilizando la caché de eventos del día,
+        por lo que normalmente no genera peticiones nuevas si el dashboard está abierto.
+        
+        Args:
+            device_ids: IDs de dispositivos a considerar (None = todos)
+            max_workers: Número máximo de consultas simultáneas
+            
+        Returns:
+            Conjunto de user_ids (str)
+        """
+        if device_ids is None:
+            device_ids = [d['id'] for d in self.get_all_devices(refresh=False)]
+        device_ids = list(device_ids)
+        
+        def fetch_user_ids(device_id):
+            try:
+                events = self._filter_events_by_time(self.get_device_events_today(device_id))
+            except Exception as e:
+                logger.error(f"Error obteniendo eventos del dispositivo {device_id}: {e}")
+                return set()
+            
+            user_ids = set()
+            for event in events:
+                event_code = event.get('event_type_id', {}).get('code', '')
+                if event_code not in EVENT_CODES['ACCESS_GRANTED']:
+                    continue
+                user_id = self.extract_user_id(event)
+                if user_id:
+                    user_ids.add(user_id)
+            return user_ids
+        
+        checked_in = set()
+        if not device_ids:
+            return checked_in
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(device_ids)))) as executor:
+            for user_ids in executor.map(fetch_user_ids, device_ids):
+                checked_in.update(user_ids)
+        
+        return checked_in
+    
     def get_device_events(self, device_id: int, start_date: datetime, 
                          end_date: datetime, limit: int = 2000) -> List[Dict]:
         """
@@ -148,3 +148,14 @@ def sample_events_list():
         }
         for i in range(10)
     ]
+
+
+@pytest.fixture(autouse=True)
+def isolated_document_cache(tmp_path, monkeypatch):
+    """Cache de documentos MovPer en un directorio temporal por test."""
+    from webapp import mobper_excel
+    from webapp.document_cache import DocumentCache
+
+    cache = DocumentCache(str(tmp_path / 'doc_cache'))
+    monkeypatch.setattr(mobper_excel, 'document_cache', cache)
+    return cache
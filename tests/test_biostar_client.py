@@ -0,0 +1,187 @@
+"""
+Tests para las operaciones de puertas del cliente de BioStar.
+"""
+import time
+import pytest
+from unittest.mock import patch
+
+from src.api import biostar_client as biostar_client_module
+from src.api.biostar_client import BioStarAPIClient
+
+
+DOORS = [
+    {'id': '1', 'name': 'Acceso principal',
+     'entry_device_id': {'id': '100'}, 'exit_device_id': {'id': '101'}},
+    {'id': '2', 'name': 'Almacén', 'entry_device_id': {'id': '200'}},
+]
+
+
+@pytest.fixture(autouse=True)
+def clear_door_index():
+    """Limpia el índice de puertas compartido entre tests."""
+    BioStarAPIClient.invalidate_door_index()
+    yield
+    BioStarAPIClient.invalidate_door_index()
+
+
+@pytest.fixture
+def client():
+    """Cliente con sesión simulada (sin conexión a BioStar)."""
+    client = BioStarAPIClient('https://biostar.local', 'admin', 'secret')
+    client.token = 'token-test'
+    return client
+
+
+class TestDoorIndex:
+    """Tests del índice dispositivo -> puerta."""
+
+    def test_build_door_index_entry_and_exit(self):
+        """Test de índice con dispositivos de entrada y salida"""
+        index = BioStarAPIClient.build_door_index(DOORS)
+        assert index == {'100': 1, '101': 1, '200': 2}
+
+    def test_build_door_index_ignores_incomplete_rows(self):
+        """Test de índice ignorando puertas sin dispositivos"""
+        index = BioStarAPIClient.build_door_index([{'id': '3'}, {'name': 'sin id'}])
+        assert index == {}
+
+    def test_door_lookup_uses_cache(self, client):
+        """Test de búsqueda de puerta sin volver a consultar /api/doors"""
+        with patch.object(client, 'get_all_doors', return_value=DOORS) as get_doors:
+            assert client.get_door_id_for_device(100) == 1
+            assert client.get_door_id_for_device(101) == 1
+            assert client.get_door_id_for_device(200) == 2
+
+        get_doors.assert_called_once()
+
+    def test_index_shared_between_clients(self, client):
+        """Test de índice compartido por clientes del mismo host"""
+        other = BioStarAPIClient('https://biostar.local/', 'admin', 'secret')
+        other.token = 'token-test'
+        with patch.object(client, 'get_all_doors', return_value=DOORS):
+            client.get_door_index()
+        with patch.object(other, 'get_all_doors') as get_doors:
+            assert other.get_door_id_for_device(200) == 2
+
+        get_doors.assert_not_called()
+
+    def test_miss_rebuilds_index(self, client):
+        """Test de reconstrucción del índice cuando el dispositivo no aparece"""
+        new_door = {'id': '3', 'entry_device_id': {'id': '300'}}
+        with patch.object(client, 'get_all_doors', side_effect=[DOORS, DOORS + [new_door]]) as get_doors:
+            assert client.get_door_id_for_device(100) == 1
+            assert client.get_door_id_for_device(300) == 3
+
+        assert get_doors.call_count == 2
+
+    def test_forced_rebuilds_throttled(self, client):
+        """Test de dispositivos sin puerta sin reconstruir el índice en cada búsqueda"""
+        with patch.object(client, 'get_all_doors', return_value=DOORS) as get_doors, \
+             patch.object(client, 'unlock_door', return_value=True):
+            assert client.get_door_id_for_device(999) is None
+            assert client.get_door_id_for_device(999) is None
+            client.execute_emergency_actions([100, 999])
+
+        # Construcción inicial + una sola reconstrucción forzada
+        assert get_doors.call_count == 2
+
+        biostar_client_module._door_index_forced_at[client.host] = 0
+        with patch.object(client, 'get_all_doors', return_value=DOORS) as get_doors:
+            assert client.get_door_id_for_device(999) is None
+        get_doors.assert_called_once()
+
+    def test_expired_index_refreshes_in_background(self, client):
+        """Test de índice expirado devuelto mientras se refresca"""
+        with patch.object(client, 'get_all_doors', return_value=DOORS):
+            client.get_door_index()
+        biostar_client_module._door_index_cache[client.host]['timestamp'] = 0
+
+        refreshed = [{'id': '9', 'entry_device_id': {'id': '100'}}]
+        with patch.object(client, 'get_all_doors', return_value=refreshed):
+            # Se devuelve el índice anterior sin esperar al refresco
+            assert client.get_door_index()['100'] == 1
+            for _ in range(50):
+                if client.get_door_index()['100'] == 9:
+                    break
+                time.sleep(0.01)
+
+        assert client.get_door_index()['100'] == 9
+
+
+class TestEmergencyActions:
+    """Tests del ejecutor masivo de acciones de emergencia."""
+
+    def test_unlock_resolves_doors_once(self, client):
+        """Test de desbloqueo con una sola consulta de puertas"""
+        with patch.object(client, 'get_all_doors', return_value=DOORS) as get_doors, \
+             patch.object(client, 'unlock_door', return_value=True) as unlock:
+            results = client.execute_emergency_actions([100, 101, 200, 300])
+
+        # El dispositivo 300 no aparece: se reconstruye el índice una sola vez
+        assert get_doors.call_count == 2
+        # La puerta 1 se desbloquea una sola vez aunque tenga dos dispositivos
+        assert sorted(call.args[0] for call in unlock.call_args_list) == [1, 2]
+        assert results[100]['unlocked'] and results[100]['door_id'] == 1
+        assert results[101]['unlocked'] and results[101]['door_id'] == 1
+        assert results[200]['unlocked'] and results[200]['door_id'] == 2
+        assert not results[300]['unlocked']
+        assert results[300]['error'] == 'Sin puerta asociada'
+
+    def test_alarm_per_device(self, client):
+        """Test de alarmas por dispositivo sin desbloqueo"""
+        with patch.object(client, 'get_all_doors') as get_doors, \
+             patch.object(client, 'trigger_alarm', side_effect=lambda d: d == 100):
+            results = client.execute_emergency_actions([100, 200], unlock=False, alarm=True)
+
+        get_doors.assert_not_called()
+        assert results[100]['alarm'] is True
+        assert results[200]['alarm'] is False
+
+    def test_deadline_reports_timeout(self, client):
+        """Test de acciones que exceden el deadline"""
+        def slow_unlock(door_id):
+            time.sleep(0.5)
+            return True
+
+        with patch.object(client, 'get_all_doors', return_value=DOORS), \
+             patch.object(client, 'unlock_door', side_effect=slow_unlock):
+            started = time.monotonic()
+            results = client.execute_emergency_actions([200], deadline=0.05)
+            elapsed = time.monotonic() - started
+
+        assert elapsed < 0.4
+        assert results[200]['unlocked'] is False
+        assert 'Tiempo agotado' in results[200]['error']
+
+    def test_slow_unlocks_all_sent_beyond_max_workers(self, client):
+        """Test de desbloqueos lentos enviados aunque haya más puertas que hilos"""
+        import threading
+        doors = [{'id': str(i), 'entry_device_id': {'id': str(1000 + i)}} for i in range(1, 13)]
+        sent = []
+        release = threading.Event()
+
+        def slow_unlock(door_id):
+            sent.append(door_id)
+            release.wait(2)
+            return True
+
+        with patch.object(client, 'get_all_doors', return_value=doors), \
+             patch.object(client, 'unlock_door', side_effect=slow_unlock):
+            results = client.execute_emergency_actions(
+                [1000 + i for i in range(1, 13)], deadline=0.1, max_workers=4
+            )
+            for _ in range(100):
+                if len(sent) == 12:
+                    break
+                time.sleep(0.01)
+            release.set()
+
+        assert sorted(sent) == list(range(1, 13))
+        assert all('Tiempo agotado' in r['error'] for r in results.values())
+
+    def test_without_session(self):
+        """Test de ejecución sin sesión iniciada"""
+        client = BioStarAPIClient('https://biostar.local', 'admin', 'secret')
+        results = client.execute_emergency_actions([100])
+        assert results[100]['unlocked'] is False
+        assert results[100]['error'] == 'Sin sesión en BioStar'
@@ -3,7 +3,78 @@ Tests para el sistema de caché.
 """
 import pytest
 import time
-from webapp.cache_manager import CacheManager, cached
+import json
+import pickle
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from webapp.cache_manager import CacheManager, LRUMemoryCache, cached
+from webapp.cache_codecs import NamespaceCodec, CacheCodecError, decode, register_cache_type
+
+
+class Punto:
+    """Tipo propio para probar el registro de tipos del codec pickle."""
+    
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+    
+    def __eq__(self, other):
+        return (self.x, self.y) == (other.x, other.y)
+
+
+class FakeRedis:
+    """Redis mínimo en memoria compartido por varias instancias de CacheManager."""
+    
+    def __init__(self):
+        self.data = {}
+        self.sets = {}
+        self.subscribers = []
+    
+    def get(self, key):
+        return self.data.get(key)
+    
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+    
+    def pttl(self, key):
+        return 60000 if key in self.data else -2
+    
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+    
+    def eval(self, script, numkeys, tag_key, member, ttl):
+        self.sets.setdefault(tag_key, set()).add(member.encode())
+    
+    def smembers(self, key):
+        return set(self.sets.get(key, ()))
+    
+    def unlink(self, *keys):
+        deleted = 0
+        for key in keys:
+            deleted += int(self.data.pop(key, None) is not None or self.sets.pop(key, None) is not None)
+        return deleted
+    
+    delete = unlink
+    
+    def publish(self, channel, message):
+        for cache in self.subscribers:
+            cache._on_invalidation({'data': message})
+    
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+    
+    def __getattr__(self, name):
+        method = getattr(self.redis, name)
+        return lambda *args, **kwargs: self.calls.append((method, args, kwargs))
+    
+    def execute(self):
+        return [method(*args, **kwargs) for method, args, kwargs in self.calls]
 
 
 class TestCacheManager:
@@ -99,6 +170,328 @@ class TestCacheManager:
         assert key1 != key3
 
 
+class TestLRUMemoryCache:
+    """Tests para la caché L1 en memoria."""
+    
+    def test_entry_limit_evicts_least_recent(self):
+        """Test de límite de entradas con expulsión LRU."""
+        l1 = LRUMemoryCache(max_entries=2, max_bytes=1000)
+        l1.set('a', 1, ttl=60, size=1)
+        l1.set('b', 2, ttl=60, size=1)
+        l1.get('a')
+        l1.set('c', 3, ttl=60, size=1)
+        
+        assert l1.get('b') is None
+        assert l1.get('a') == 1
+        assert l1.get_stats()['evictions'] == 1
+    
+    def test_byte_budget(self):
+        """Test de presupuesto de bytes."""
+        l1 = LRUMemoryCache(max_entries=100, max_bytes=100)
+        l1.set('a', 'x', ttl=60, size=60)
+        l1.set('b', 'y', ttl=60, size=60)
+        l1.set('huge', 'z', ttl=60, size=500)
+        
+        assert l1.get('a') is None
+        assert l1.get('b') == 'y'
+        assert l1.get('huge') is None
+        assert l1.get_stats()['bytes'] == 60
+    
+    def test_expired_entries_are_purged_on_pressure(self):
+        """Test de limpieza de expiradas sin necesidad de leerlas."""
+        l1 = LRUMemoryCache(max_entries=2, max_bytes=1000)
+        l1.set('old', 1, ttl=-1, size=1)
+        l1.set('a', 2, ttl=60, size=1)
+        l1.set('b', 3, ttl=60, size=1)
+        
+        assert len(l1) == 2
+        assert l1.get('a') == 2 and l1.get('b') == 3
+
+
+class TestTwoTierCache:
+    """Tests para la coordinación entre niveles."""
+    
+    @pytest.fixture
+    def cache(self):
+        return CacheManager(redis_url='redis://localhost:6379/0', enabled=True, l1_max_entries=10)
+    
+    def test_stats_per_tier(self, cache):
+        """Test de tasa de aciertos por nivel."""
+        cache.set('k', {'a': 1}, ttl=60)
+        cache.get('k')
+        cache.get('missing')
+        stats = cache.get_stats()
+        
+        assert stats['l1']['hits'] == 1
+        assert stats['l1']['misses'] == 1
+        assert stats['l1']['hit_ratio'] == 0.5
+        assert 'hit_ratio' in stats['l2']
+    
+    def test_invalidation_message_from_other_process(self, cache):
+        """Test de invalidación recibida por pub/sub."""
+        cache.set('a', 1, ttl=60)
+        cache.set('b', 2, ttl=60)
+        cache.set('prefix:c', 3, ttl=60)
+        
+        cache._on_invalidation({'data': json.dumps({'origin': cache.instance_id, 'keys': ['a']})})
+        assert cache.get('a') == 1
+        
+        cache._on_invalidation({'data': json.dumps({'origin': 'otro', 'keys': ['a']})})
+        cache._on_invalidation({'data': json.dumps({'origin': 'otro', 'pattern': 'prefix:*'})})
+        assert cache.get('a') is None
+        assert cache.get('prefix:c') is None
+        assert cache.get('b') == 2
+        
+        cache._on_invalidation({'data': json.dumps({'origin': 'otro', 'clear': True})})
+        assert cache.get('b') is None
+
+
+class TestBatchOperations:
+    """Tests para get_many/set_many/delete_many."""
+    
+    @pytest.fixture
+    def cache(self):
+        return CacheManager(redis_url='redis://localhost:6379/0', enabled=True)
+    
+    def test_set_many_and_get_many(self, cache):
+        """Test de lote con solo las claves encontradas."""
+        cache.set_many({'d:1': {'n': 1}, 'd:2': {'n': 2}}, ttl=60, tags={'d:1': ['device:1']})
+        
+        assert cache.get_many(['d:1', 'd:2', 'd:3']) == {'d:1': {'n': 1}, 'd:2': {'n': 2}}
+        cache.invalidate_tags('device:1')
+        assert cache.get_many(['d:1', 'd:2']) == {'d:2': {'n': 2}}
+    
+    def test_delete_many(self, cache):
+        """Test de borrado en lote."""
+        cache.set_many({'a': 1, 'b': 2, 'c': 3}, ttl=60)
+        
+        assert cache.delete_many(['a', 'b', 'x']) == 2
+        assert cache.get_many(['a', 'b', 'c']) == {'c': 3}
+    
+    def test_disabled_cache(self):
+        """Test de lote con caché deshabilitado."""
+        cache = CacheManager(enabled=False)
+        assert cache.set_many({'a': 1}) is False
+        assert cache.get_many(['a']) == {}
+
+
+class TestTagInvalidation:
+    """Tests para la invalidación por tags."""
+    
+    @pytest.fixture
+    def cache(self):
+        return CacheManager(redis_url='redis://localhost:6379/0', enabled=True)
+    
+    def test_invalidate_tags(self, cache):
+        """Test de invalidación de las entradas de un tag."""
+        cache.set('summary:12', 1, ttl=60, tags=['device:12'])
+        cache.set('events:12:45', 2, ttl=60, tags=['device:12', 'user:45'])
+        cache.set('events:13:45', 3, ttl=60, tags=['device:13', 'user:45'])
+        
+        assert cache.invalidate_tags('device:12') == 2
+        assert cache.get('summary:12') is None
+        assert cache.get('events:12:45') is None
+        assert cache.get('events:13:45') == 3
+        
+        cache.invalidate_tags('user:45')
+        assert cache.get('events:13:45') is None
+        assert cache.get_stats()['l1']['tags'] == 0
+    
+    def test_tag_message_from_other_process(self, cache):
+        """Test de invalidación por tags recibida por pub/sub."""
+        cache.set('a', 1, ttl=60, tags=['user:1'])
+        cache._on_invalidation({'data': json.dumps({'origin': 'otro', 'tags': ['user:1']})})
+        assert cache.get('a') is None
+    
+    def test_invalidate_tags_clears_l1_filled_from_redis(self):
+        """Test de tags invalidados en L1 de valores leídos de Redis (dos procesos)."""
+        redis = FakeRedis()
+        a = CacheManager(enabled=False)
+        b = CacheManager(enabled=False)
+        for cache in (a, b):
+            cache.enabled = True
+            cache.redis_client = redis
+            redis.subscribers.append(cache)
+        
+        a.set('resumen:1', 'viejo', ttl=60, tags=['user:1'])
+        a.set('resumen:2', 'otro', ttl=60, tags=['user:2'])
+        assert b.get('resumen:1') == 'viejo'
+        assert b.get_many(['resumen:2']) == {'resumen:2': 'otro'}
+        
+        # B invalida un valor que solo conoce por Redis
+        assert b.invalidate_tags('user:1') == 1
+        assert b.get('resumen:1') is None
+        
+        # A invalida y B (con el valor en L1) recibe las claves por pub/sub
+        a.invalidate_tags('user:2')
+        assert b.get('resumen:2') is None
+    
+    def test_delete_pattern_is_glob(self, cache):
+        """Test de patrón glob en lugar de subcadena."""
+        cache.set('prefix:key1', 1, ttl=60)
+        cache.set('other:prefix:key', 2, ttl=60)
+        
+        assert cache.delete_pattern('prefix:*') == 1
+        assert cache.get('other:prefix:key') == 2
+    
+    def test_cached_decorator_tags(self, app):
+        """Test de tags declarados en el decorador."""
+        calls = []
+        
+        @cached(ttl=60, key_prefix='test_tags', tags=lambda device_id: [f'device:{device_id}'])
+        def summary(device_id):
+            calls.append(device_id)
+            return device_id
+        
+        with app.app_context():
+            cache_manager = app.extensions['cache_manager']
+            summary(7)
+            summary(7)
+            cache_manager.invalidate_tags('device:7')
+            summary(7)
+        
+        assert calls == [7, 7]
+
+
+class TestStampedeProtection:
+    """Tests para get_or_compute (stale-while-revalidate)."""
+    
+    @pytest.fixture
+    def cache(self):
+        return CacheManager(redis_url='redis://localhost:6379/0', enabled=True)
+    
+    def test_concurrent_miss_computes_once(self, cache):
+        """Test de un solo cálculo con peticiones concurrentes."""
+        calls = []
+        
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'valor'
+        
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get_or_compute('hot', compute, ttl=60)))
+            for _ in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        assert len(calls) == 1
+        assert results == ['valor'] * 8
+    
+    def test_stale_value_served_while_refreshing(self, cache):
+        """Test de valor obsoleto servido mientras se recalcula en segundo plano."""
+        done = threading.Event()
+        
+        def slow():
+            time.sleep(0.2)
+            done.set()
+            return 'nuevo'
+        
+        cache.get_or_compute('k', lambda: 'viejo', ttl=0, stale_ttl=60, beta=0)
+        assert cache.get_or_compute('k', slow, ttl=60, beta=0) == 'viejo'
+        # Mientras el refresco está en curso no se lanza otro
+        assert cache.get_or_compute('k', lambda: 'otro', ttl=60, beta=0) == 'viejo'
+        
+        assert done.wait(2)
+        time.sleep(0.05)
+        assert cache.get_or_compute('k', lambda: 'otro', ttl=60, beta=0) == 'nuevo'
+        assert cache.get_stats()['stale_served'] == 2
+    
+    def test_fresh_value_not_recomputed(self, cache):
+        """Test de valor vigente sin recálculo y con None cacheable."""
+        calls = []
+        
+        def compute():
+            calls.append(1)
+            return None
+        
+        cache.get_or_compute('none', compute, ttl=60, beta=0)
+        assert cache.get_or_compute('none', compute, ttl=60, beta=0) is None
+        assert len(calls) == 1
+    
+    def test_probabilistic_early_expiration(self, cache):
+        """Test de recálculo anticipado cuando el cálculo es costoso."""
+        cache.set('early', {'__swr__': 1, 'value': 1, 'soft_expires': time.time() + 1, 'delta': 1000}, ttl=60)
+        assert cache.get_or_compute('early', lambda: 2, ttl=60, background=False) == 2
+
+
+class TestCacheCodecs:
+    """Tests para los codecs de serialización."""
+    
+    def test_pickle_round_trip_keeps_types(self):
+        """Test de tipos conservados (datetime y claves date)."""
+        value = {date(2025, 2, 3): [{'fecha': datetime(2025, 2, 3, 9, 5), 'tags': {'a'}}]}
+        assert decode(NamespaceCodec('pickle').encode(value)) == value
+    
+    def test_compression_above_threshold(self):
+        """Test de compresión solo por encima del umbral."""
+        codec = NamespaceCodec('pickle', 'zlib', threshold=100)
+        small = codec.encode('x')
+        large = codec.encode(['evento'] * 1000)
+        
+        assert small[2] == 0
+        assert large[2] == 1
+        assert len(large) < len(pickle.dumps(['evento'] * 1000))
+        assert decode(large) == ['evento'] * 1000
+    
+    def test_legacy_json_values(self):
+        """Test de lectura de valores JSON sin cabecera."""
+        assert decode(b'{"a": 1}') == {'a': 1}
+        assert decode(NamespaceCodec('json').encode({'a': 1})) == {'a': 1}
+    
+    def test_timezone_aware_datetimes(self):
+        """Test de datetime con zona horaria zoneinfo y pytz."""
+        import pytz
+        from zoneinfo import ZoneInfo
+        
+        value = [
+            datetime(2025, 2, 3, 9, 5, tzinfo=ZoneInfo('America/Mexico_City')),
+            pytz.timezone('America/Mexico_City').localize(datetime(2025, 2, 3, 9, 5)),
+        ]
+        assert decode(NamespaceCodec('pickle').encode(value)) == value
+    
+    def test_getattr_only_for_zoneinfo(self):
+        """Test de builtins.getattr rechazado fuera de ZoneInfo."""
+        class Ataque:
+            def __reduce__(self):
+                return (getattr, (set, '__subclasses__'))
+        
+        payload = b'\x00\x02\x00' + pickle.dumps(Ataque())
+        with pytest.raises(CacheCodecError, match='Atributo no permitido'):
+            decode(payload)
+    
+    def test_bad_legacy_value_is_codec_error(self):
+        """Test de valor sin cabecera ilegible como CacheCodecError."""
+        with pytest.raises(CacheCodecError):
+            decode(b'no es json')
+        with pytest.raises(CacheCodecError):
+            decode('{roto')
+    
+    def test_unregistered_types_are_rejected(self):
+        """Test de pickle restringido a tipos registrados."""
+        payload = NamespaceCodec('pickle').encode(Punto(1, 2))
+        with pytest.raises(CacheCodecError):
+            decode(payload)
+        
+        register_cache_type(Punto)
+        assert decode(payload) == Punto(1, 2)
+    
+    def test_namespace_codec(self):
+        """Test de codec elegido por namespace."""
+        cache = CacheManager(enabled=True)
+        cache.configure_namespace('legacy', codec='json', compression='none')
+        
+        assert cache._codec_for('legacy:x').describe() == ('json', 'none')
+        assert cache._codec_for('events:1').describe() == ('pickle', 'zlib')
+        
+        cache.set('events:1', OrderedDict(a=date(2025, 1, 1)), ttl=60)
+        assert cache.get('events:1') == {'a': date(2025, 1, 1)}
+
+
 class TestCacheDecorator:
     """Tests para el decorador @cached."""
     
@@ -0,0 +1,117 @@
+"""
+Tests para el registro de dispositivos compartido del monitor.
+"""
+import time
+import pytest
+from unittest.mock import patch
+
+from src.api import device_monitor as device_monitor_module
+from src.api.device_monitor import DeviceMonitor
+from src.utils.config import Config
+
+
+DEVICES = [
+    {'id': '100', 'name': 'Checador entrada'},
+    {'id': '200', 'name': 'Puerta almacén'},
+]
+
+
+@pytest.fixture(autouse=True)
+def clear_device_registry():
+    """Limpia el registro de dispositivos compartido entre tests."""
+    DeviceMonitor.invalidate_device_registry()
+    yield
+    DeviceMonitor.invalidate_device_registry()
+
+
+@pytest.fixture
+def config():
+    return Config()
+
+
+@pytest.fixture
+def monitor(config):
+    """Monitor sin conexión a BioStar."""
+    return DeviceMonitor(config)
+
+
+class TestDeviceRegistry:
+    """Tests del registro de dispositivos."""
+
+    def test_registry_shared_between_monitors(self, monitor, config):
+        """Test de lista descargada una sola vez para todas las instancias"""
+        with patch.object(monitor.client, 'get_all_devices', return_value=DEVICES) as get_devices:
+            assert len(monitor.get_all_devices()) == 2
+
+        other = DeviceMonitor(config)
+        with patch.object(other.client, 'get_all_devices') as other_get:
+            assert [d['id'] for d in other.get_all_devices()] == ['100', '200']
+            assert other.get_device_by_id(200)['name'] == 'Puerta almacén'
+
+        get_devices.assert_called_once()
+        other_get.assert_not_called()
+
+    def test_device_lookup_does_not_call_api(self, monitor):
+        """Test de búsqueda por ID sin consultar /api/devices/<id>"""
+        with patch.object(monitor.client, 'get_all_devices', return_value=DEVICES), \
+                patch.object(monitor.client, 'get_device_by_id') as get_device:
+            device = monitor.get_device_by_id(100)
+
+        assert device['name'] == 'Checador entrada'
+        assert 'alias' in device
+        get_device.assert_not_called()
+
+    def test_unknown_device_reloads_once(self, monitor):
+        """Test de recarga del registro para un dispositivo nuevo"""
+        new_device = {'id': '300', 'name': 'Nuevo'}
+        with patch.object(monitor.client, 'get_all_devices',
+                          side_effect=[DEVICES, DEVICES + [new_device], DEVICES + [new_device]]) as get_devices:
+            monitor.get_all_devices()
+            assert monitor.get_device_by_id(300)['name'] == 'Nuevo'
+            assert monitor.get_device_by_id(999) is None
+
+        # La búsqueda de 999 no recarga: ya hubo una recarga forzada en el intervalo
+        assert get_devices.call_count == 2
+
+    def test_unknown_ids_do_not_reload_every_time(self, monitor):
+        """Test de IDs inválidos repetidos con una sola recarga por intervalo"""
+        with patch.object(monitor.client, 'get_all_devices', return_value=DEVICES) as get_devices:
+            for _ in range(5):
+                assert monitor.get_device_by_id(999) is None
+            assert get_devices.call_count == 2
+
+            device_monitor_module._device_registry_forced_at[monitor.client.host] = 0
+            assert monitor.get_device_by_id(999) is None
+            assert get_devices.call_count == 3
+
+    def test_returned_devices_are_copies(self, monitor):
+        """Test de copias para que los llamadores puedan modificarlas"""
+        with patch.object(monitor.client, 'get_all_devices', return_value=DEVICES):
+            monitor.get_all_devices()[0]['alias'] = 'Modificado'
+            assert monitor.get_all_devices()[0]['alias'] != 'Modificado'
+
+    def test_enrichers_run_on_build(self, monitor):
+        """Test de datos locales combinados al construir el registro"""
+        def enricher(devices):
+            for device in devices:
+                device['device_type'] = 'puerta' if device['id'] == '200' else 'checador'
+
+        with patch.object(device_monitor_module, '_device_enrichers', [enricher]), \
+                patch.object(monitor.client, 'get_all_devices', return_value=DEVICES):
+            assert monitor.get_device_by_id(200)['device_type'] == 'puerta'
+
+    def test_expired_registry_refreshes_in_background(self, monitor):
+        """Test de registro expirado devuelto mientras se refresca"""
+        with patch.object(monitor.client, 'get_all_devices', return_value=DEVICES):
+            monitor.get_all_devices()
+        device_monitor_module._device_registry[monitor.client.host]['timestamp'] = 0
+
+        renamed = [{'id': '100', 'name': 'Renombrado'}]
+        with patch.object(monitor.client, 'get_all_devices', return_value=renamed):
+            assert monitor.get_device_by_id(100)['name'] == 'Checador entrada'
+            for _ in range(50):
+                if monitor.get_device_by_id(100)['name'] == 'Renombrado':
+                    break
+                time.sleep(0.01)
+
+        assert monitor.get_device_by_id(100)['name'] == 'Renombrado'
@@ -0,0 +1,64 @@
+"""
+Tests para el calendario de días inhábiles oficiales.
+"""
+from datetime import date
+
+from webapp.dias_inhabiles import (
+    calcular_domingo_pascua, calendario_inhabiles, es_dia_inhabil, inhabiles_en_rango,
+    obtener_dias_inhabiles, obtener_nombre_dia_inhabil,
+)
+
+
+class TestCalendarioInhabiles:
+    """Tests de generación por reglas."""
+
+    def test_known_years(self):
+        """Test de fechas conocidas generadas por reglas"""
+        assert obtener_dias_inhabiles(2025) == [
+            date(2025, 1, 1), date(2025, 2, 3), date(2025, 3, 17), date(2025, 4, 17),
+            date(2025, 4, 18), date(2025, 5, 1), date(2025, 9, 16), date(2025, 11, 17),
+            date(2025, 12, 25),
+        ]
+        assert date(2027, 3, 26) in calendario_inhabiles(2027)
+
+    def test_easter(self):
+        """Test de cálculo del Domingo de Pascua"""
+        assert calcular_domingo_pascua(2019) == date(2019, 4, 21)
+        assert calcular_domingo_pascua(2024) == date(2024, 3, 31)
+        assert calcular_domingo_pascua(2038) == date(2038, 4, 25)
+
+    def test_years_outside_old_lists(self):
+        """Test de años lejanos y transmisión del Poder Ejecutivo"""
+        assert es_dia_inhabil(date(2031, 2, 3))
+        assert obtener_nombre_dia_inhabil(date(2019, 4, 19)) == "Viernes Santo"
+        assert obtener_nombre_dia_inhabil(date(2030, 10, 1)) == "Transmisión del Poder Ejecutivo Federal"
+        assert not es_dia_inhabil(date(2026, 10, 1))
+
+    def test_names(self):
+        """Test de nombre solo para días inhábiles"""
+        assert obtener_nombre_dia_inhabil(date(2026, 11, 16)) == "Revolución Mexicana"
+        assert obtener_nombre_dia_inhabil(date(2026, 11, 17)) is None
+
+    def test_memoized_per_year(self):
+        """Test de conjunto memorizado por año"""
+        assert calendario_inhabiles(2040) is calendario_inhabiles(2040)
+        assert isinstance(calendario_inhabiles(2040), frozenset)
+
+
+class TestInhabilesEnRango:
+    """Tests de combinación con los días del preset."""
+
+    def test_merges_preset_days(self):
+        """Test de combinación de días oficiales y del preset (date o ISO)"""
+        dias = inhabiles_en_rango(date(2025, 9, 1), date(2025, 9, 15), ['2025-09-15', date(2025, 9, 2)])
+        assert dias == {date(2025, 9, 2), date(2025, 9, 15)}
+
+        dias = inhabiles_en_rango(date(2025, 9, 16), date(2025, 9, 30), ['2025-09-15', 'no-fecha'])
+        assert dias == {date(2025, 9, 16)}
+
+    def test_cached_per_range_and_list(self):
+        """Test de conjunto reutilizado para el mismo rango y lista"""
+        primero = inhabiles_en_rango(date(2025, 12, 16), date(2026, 1, 15), ['2025-12-24'])
+        segundo = inhabiles_en_rango(date(2025, 12, 16), date(2026, 1, 15), [date(2025, 12, 24)])
+        assert primero is segundo
+        assert primero == {date(2025, 12, 24), date(2025, 12, 25), date(2026, 1, 1)}
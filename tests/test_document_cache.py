@@ -0,0 +1,110 @@
+"""
+Tests para la cache en disco de documentos MovPer.
+"""
+import os
+import time
+from datetime import date
+from types import SimpleNamespace
+
+from webapp import mobper_excel
+from webapp.document_cache import DocumentCache
+from webapp.mobper_excel import construir_documento_movper, renderizar_documento
+
+QUINCENA = {'inicio': date(2025, 2, 1), 'fin': date(2025, 2, 15)}
+INCIDENCIAS = [{'fecha': date(2025, 2, 3), 'estado_auto': 'RETARDO'}]
+
+
+def make_documento(con_goce=True, incidencias=INCIDENCIAS):
+    """Documento MovPer con datos mínimos."""
+    user = SimpleNamespace(nombre_completo='JUAN PEREZ', numero_socio='55')
+    preset = SimpleNamespace(nombre_formato=None, departamento_formato='Sistemas',
+                             jefe_directo_nombre='Ana Ruiz', company=None)
+    return construir_documento_movper(user, preset, incidencias, QUINCENA, con_goce=con_goce)
+
+
+class TestDocumentCache:
+    """Tests de DocumentCache."""
+
+    def test_put_and_get(self, tmp_path):
+        """Test de guardar y recuperar un documento"""
+        cache = DocumentCache(str(tmp_path), max_bytes=1024)
+        cache.put('a' * 64, b'contenido')
+
+        assert cache.get('a' * 64) == b'contenido'
+        assert cache.get('b' * 64) is None
+        stats = cache.get_stats()
+        assert stats['hits'] == 1 and stats['misses'] == 1
+        assert stats['entries'] == 1 and stats['bytes'] == len(b'contenido')
+
+    def test_lru_eviction_by_size(self, tmp_path):
+        """Test de expulsión del menos usado al exceder el tamaño"""
+        cache = DocumentCache(str(tmp_path), max_bytes=25)
+        cache.put('a', b'x' * 10)
+        time.sleep(0.01)
+        cache.put('b', b'x' * 10)
+        time.sleep(0.01)
+        cache.get('a')  # 'a' pasa a ser el más reciente
+        time.sleep(0.01)
+        cache.put('c', b'x' * 10)
+
+        assert cache.get('b') is None
+        assert cache.get('a') is not None
+        assert cache.get('c') is not None
+        assert cache.get_stats()['bytes'] <= 25
+
+    def test_index_survives_restart(self, tmp_path):
+        """Test de entradas visibles desde otra instancia (otro proceso)"""
+        DocumentCache(str(tmp_path)).put('a', b'datos')
+        other = DocumentCache(str(tmp_path))
+
+        assert other.get_stats()['entries'] == 1
+        assert other.get('a') == b'datos'
+
+    def test_key_depends_on_inputs(self):
+        """Test de clave estable que cambia con las entradas del documento"""
+        key = DocumentCache.clave(make_documento(), mobper_excel.TEMPLATE_PATH, 'xml')
+
+        assert key == DocumentCache.clave(make_documento(), mobper_excel.TEMPLATE_PATH, 'xml')
+        assert key != DocumentCache.clave(make_documento(con_goce=False), mobper_excel.TEMPLATE_PATH, 'xml')
+        assert key != DocumentCache.clave(make_documento(incidencias=[]), mobper_excel.TEMPLATE_PATH, 'xml')
+        assert key != DocumentCache.clave(make_documento(), mobper_excel.TEMPLATE_PATH, 'win32com')
+
+    def test_key_ignores_filename(self):
+        """Test de clave independiente del nombre del archivo"""
+        documento = make_documento()
+        renombrado = dict(documento, filename='otro.xlsx')
+        assert DocumentCache.clave(documento, mobper_excel.TEMPLATE_PATH, 'xml') == \
+            DocumentCache.clave(renombrado, mobper_excel.TEMPLATE_PATH, 'xml')
+
+
+class TestRenderizarConCache:
+    """Tests de renderizar_documento con la cache de documentos."""
+
+    def test_second_render_served_from_cache(self, isolated_document_cache, monkeypatch):
+        """Test de segundo renderizado servido sin volver a generar"""
+        primero = renderizar_documento(make_documento()).getvalue()
+        assert isolated_document_cache.get_stats()['entries'] == 1
+
+        def fail(*args, **kwargs):
+            raise AssertionError('No debería renderizar de nuevo')
+
+        monkeypatch.setattr(mobper_excel.PlantillaXlsx, 'renderizar', fail)
+        assert renderizar_documento(make_documento()).getvalue() == primero
+
+    def test_template_change_misses_cache(self, isolated_document_cache, tmp_path, monkeypatch):
+        """Test de documento regenerado cuando cambia el template"""
+        renderizar_documento(make_documento())
+
+        template = tmp_path / 'template.xlsx'
+        with open(mobper_excel.TEMPLATE_PATH, 'rb') as src, open(template, 'wb') as dst:
+            dst.write(src.read())
+        monkeypatch.setattr(mobper_excel, 'TEMPLATE_PATH', str(template))
+        renderizar_documento(make_documento())
+
+        assert isolated_document_cache.get_stats()['entries'] == 2
+        assert os.path.exists(template)
+
+    def test_cache_disabled(self, isolated_document_cache):
+        """Test de renderizado sin consultar la cache"""
+        renderizar_documento(make_documento(), usar_cache=False)
+        assert isolated_document_cache.get_stats()['entries'] == 0
@@ -0,0 +1,329 @@
+"""
+Tests para la lógica de emergencias (pase de lista).
+"""
+import pytest
+from webapp.models import db, User, Zone, Group, GroupMember, EmergencySession, RollCallEntry, ZoneDevice
+from webapp.emergency_routes import create_roll_call_entries
+
+
+@pytest.fixture
+def emergency_zone(app, db_session):
+    """Zona con dos grupos activos y uno inactivo, y una emergencia abierta."""
+    zone = Zone(name='Zona Test Pase de Lista')
+    db_session.add(zone)
+    db_session.flush()
+
+    it = Group(name='IT', zone_id=zone.id)
+    rh = Group(name='RH', zone_id=zone.id)
+    old = Group(name='Archivo', zone_id=zone.id, is_active=False)
+    db_session.add_all([it, rh, old])
+    db_session.flush()
+
+    db_session.add_all([
+        GroupMember(group_id=it.id, biostar_user_id='1', user_name='Ana'),
+        GroupMember(group_id=it.id, biostar_user_id='2', user_name='Beto'),
+        GroupMember(group_id=rh.id, biostar_user_id='1', user_name='Ana'),
+        GroupMember(group_id=rh.id, biostar_user_id='3', user_name='Carla'),
+        GroupMember(group_id=old.id, biostar_user_id='4', user_name='Diego'),
+    ])
+
+    user = User.query.filter_by(username='testadmin').first()
+    emergency = EmergencySession(zone_id=zone.id, started_by=user.id)
+    db_session.add(emergency)
+    db_session.flush()
+
+    return zone, emergency, {'IT': it, 'RH': rh}
+
+
+class TestRollCallMaterialization:
+    """Tests para la creación masiva del pase de lista."""
+
+    def test_only_checked_in_members(self, emergency_zone, db_session):
+        """Test de pase de lista solo con miembros que hicieron check-in"""
+        zone, emergency, groups = emergency_zone
+
+        created, skipped = create_roll_call_entries(emergency.id, zone.id, {'1', '3', '4'})
+
+        entries = RollCallEntry.query.filter_by(emergency_id=emergency.id).all()
+        assert created == 3
+        assert skipped == 1
+        assert sorted((e.group_id, e.biostar_user_id) for e in entries) == sorted([
+            (groups['IT'].id, '1'),
+            (groups['RH'].id, '1'),
+            (groups['RH'].id, '3'),
+        ])
+        assert all(e.status == 'pending' for e in entries)
+
+    def test_nobody_checked_in(self, emergency_zone, db_session):
+        """Test de pase de lista vacío sin check-ins"""
+        zone, emergency, _ = emergency_zone
+
+        created, skipped = create_roll_call_entries(emergency.id, zone.id, set())
+
+        assert created == 0
+        assert skipped == 4
+        assert RollCallEntry.query.filter_by(emergency_id=emergency.id).count() == 0
+
+
+class TestRollCallStats:
+    """Tests para las estadísticas agregadas del pase de lista."""
+
+    def test_grouped_stats(self, emergency_zone, db_session):
+        """Test de conteo por estado con una consulta agregada"""
+        from webapp.emergency_routes import get_roll_call_stats
+
+        zone, emergency, _ = emergency_zone
+        create_roll_call_entries(emergency.id, zone.id, {'1', '2', '3'})
+        entries = RollCallEntry.query.filter_by(emergency_id=emergency.id).all()
+        entries[0].status = 'present'
+        entries[1].status = 'absent'
+        db_session.flush()
+
+        stats = get_roll_call_stats([emergency.id, 999999])
+
+        assert stats[emergency.id] == {'total': 4, 'present': 1, 'absent': 1, 'pending': 2}
+        assert stats[999999] == {'total': 0, 'present': 0, 'absent': 0, 'pending': 0}
+
+    def test_refresh_stores_denormalized_stats(self, emergency_zone, db_session):
+        """Test de guardado de estadísticas desnormalizadas"""
+        import json
+        from webapp.emergency_routes import refresh_roll_call_stats
+
+        zone, emergency, _ = emergency_zone
+        create_roll_call_entries(emergency.id, zone.id, {'1'})
+        refresh_roll_call_stats(emergency.id)
+
+        db_session.refresh(emergency)
+        assert json.loads(emergency.roll_call_stats) == {
+            'total': 2, 'present': 0, 'absent': 0, 'pending': 2
+        }
+
+
+class TestEmergencyHistory:
+    """Tests para el historial de emergencias."""
+
+    def test_history_stats(self, app, admin_client):
+        """Test de historial con estadísticas calculadas y guardadas"""
+        import json
+        from webapp.emergency_routes import refresh_roll_call_stats
+
+        with app.app_context():
+            admin = User.query.filter_by(username='testadmin').first()
+            zone = Zone(name='Zona Historial')
+            db.session.add(zone)
+            db.session.flush()
+            old = EmergencySession(zone_id=zone.id, started_by=admin.id, status='resolved')
+            new = EmergencySession(zone_id=zone.id, started_by=admin.id, status='resolved')
+            db.session.add_all([old, new])
+            db.session.flush()
+            db.session.add_all([
+                RollCallEntry(emergency_id=old.id, biostar_user_id='1', status='present'),
+                RollCallEntry(emergency_id=old.id, biostar_user_id='2', status='pending'),
+                RollCallEntry(emergency_id=new.id, biostar_user_id='3', status='absent'),
+            ])
+            refresh_roll_call_stats(new.id)
+            db.session.commit()
+            zone_id, old_id, new_id = zone.id, old.id, new.id
+
+        try:
+            response = admin_client.get('/emergency/api/emergencies/history?zone=Historial')
+            data = response.get_json()
+
+            assert data['success'] is True
+            stats = {e['id']: e['stats'] for e in data['emergencies']}
+            assert stats[old_id] == {'total': 2, 'present': 1, 'absent': 0, 'pending': 1}
+            assert stats[new_id] == {'total': 1, 'present': 0, 'absent': 1, 'pending': 0}
+
+            with app.app_context():
+                # La emergencia sin estadísticas quedó guardada para la próxima consulta
+                assert json.loads(db.session.get(EmergencySession, old_id).roll_call_stats)['total'] == 2
+        finally:
+            with app.app_context():
+                for emergency_id in (old_id, new_id):
+                    db.session.delete(db.session.get(EmergencySession, emergency_id))
+                db.session.delete(db.session.get(Zone, zone_id))
+                db.session.commit()
+
+
+@pytest.fixture
+def committed_roll_call(app):
+    """Zona con grupos, miembros y pase de lista guardados (visibles para el cliente)."""
+    with app.app_context():
+        admin = User.query.filter_by(username='testadmin').first()
+        zone = Zone(name='Zona Perfiles de Carga')
+        db.session.add(zone)
+        db.session.flush()
+        groups = [Group(name=f'Grupo {i}', zone_id=zone.id, color=f'#00000{i}') for i in range(3)]
+        db.session.add_all(groups)
+        db.session.flush()
+        db.session.add_all([
+            GroupMember(group_id=group.id, biostar_user_id=f'{group.id}-{n}', user_name=f'Miembro {n}')
+            for group in groups for n in range(4)
+        ])
+        emergency = EmergencySession(zone_id=zone.id, started_by=admin.id)
+        db.session.add(emergency)
+        db.session.flush()
+        entries = [
+            RollCallEntry(emergency_id=emergency.id, group_id=group.id,
+                          biostar_user_id=f'{group.id}-{n}', user_name=f'Miembro {n}',
+                          status='present' if n % 2 else 'pending',
+                          marked_by=admin.id if n % 2 else None)
+            for group in groups for n in range(4)
+        ]
+        entries.append(RollCallEntry(emergency_id=emergency.id, biostar_user_id='99',
+                                     user_name='Visitante', manual_group_name='Visitas'))
+        db.session.add_all(entries)
+        db.session.commit()
+        ids = {'zone': zone.id, 'emergency': emergency.id, 'groups': [g.id for g in groups]}
+
+    yield ids
+
+    with app.app_context():
+        db.session.delete(db.session.get(EmergencySession, ids['emergency']))
+        db.session.delete(db.session.get(Zone, ids['zone']))
+        db.session.commit()
+
+
+class TestLoadingProfiles:
+    """Tests de consultas constantes en endpoints de pase de lista y grupos."""
+
+    @pytest.fixture(autouse=True)
+    def strict_budget(self, app):
+        """Falla el request si excede su @query_budget o repite sentencias."""
+        previous = app.config.get('QUERY_BUDGET_STRICT')
+        app.config['QUERY_BUDGET_STRICT'] = True
+        yield
+        app.config['QUERY_BUDGET_STRICT'] = previous
+
+    def test_roll_call(self, admin_client, committed_roll_call):
+        """Test de pase de lista agrupado sin cargas por fila"""
+        response = admin_client.get(f"/emergency/api/emergency/{committed_roll_call['emergency']}/roll-call")
+        data = response.get_json()
+
+        assert data['success'] is True
+        by_name = {g['group_name']: g for g in data['groups']}
+        assert len(by_name['Grupo 0']['members']) == 4
+        assert by_name['Grupo 0']['group_color'] == '#000000'
+        assert by_name['Visitas']['is_temporary'] is True
+        marked = [m for m in by_name['Grupo 1']['members'] if m['status'] == 'present']
+        assert marked and all(m['marked_by'] == 'Test Admin' for m in marked)
+        assert all(m['marked_by'] is None for m in by_name['Grupo 1']['members'] if m['status'] == 'pending')
+
+    def test_group_lists(self, admin_client, committed_roll_call):
+        """Test de conteos y nombres de zona con una consulta"""
+        zone_id = committed_roll_call['zone']
+
+        groups = admin_client.get(f'/emergency/api/zones/{zone_id}/groups').get_json()['groups']
+        assert [g['members_count'] for g in groups] == [4, 4, 4]
+
+        all_groups = admin_client.get('/emergency/api/groups/all').get_json()['groups']
+        assert {g['zone_name'] for g in all_groups if g['zone_id'] == zone_id} == {'Zona Perfiles de Carga'}
+
+        zones = admin_client.get('/emergency/api/zones').get_json()['zones']
+        assert next(z for z in zones if z['id'] == zone_id)['groups_count'] == 3
+
+        members = admin_client.get(
+            f"/emergency/api/groups/{committed_roll_call['groups'][0]}/members"
+        ).get_json()['members']
+        assert len(members) == 4
+
+
+class TestEmergencyDoors:
+    """Tests de puertas desbloqueadas durante una emergencia."""
+
+    def test_timed_out_unlock_released_on_resolve(self, app, admin_client):
+        """Test de puerta con desbloqueo lento liberada al resolver"""
+        import time
+        from unittest.mock import MagicMock, patch
+        from src.api.biostar_client import BioStarAPIClient
+
+        with app.app_context():
+            zone = Zone(name='Zona Puerta Lenta')
+            db.session.add(zone)
+            db.session.flush()
+            db.session.add(ZoneDevice(zone_id=zone.id, device_id=200, device_name='Almacén'))
+            db.session.commit()
+            zone_id = zone.id
+
+        biostar = BioStarAPIClient('https://biostar.local', 'admin', 'secret')
+        biostar.token = 'token-test'
+        execute = biostar.execute_emergency_actions
+        monitor = MagicMock(client=biostar)
+        monitor.get_checked_in_user_ids_today.return_value = set()
+
+        def slow_unlock(door_id):
+            time.sleep(0.3)
+            return True
+
+        emergency_id = None
+        try:
+            with patch('webapp.app.get_monitor', return_value=monitor), \
+                 patch.object(biostar, 'get_door_index', return_value={'200': 2}), \
+                 patch.object(biostar, 'unlock_door', side_effect=slow_unlock), \
+                 patch.object(biostar, 'execute_emergency_actions',
+                              side_effect=lambda ids, **kw: execute(ids, deadline=0.05, **kw)), \
+                 patch.object(biostar, 'release_door', return_value=True) as release:
+                data = admin_client.post('/emergency/api/emergency/activate',
+                                         json={'zone_id': zone_id}).get_json()
+                emergency_id = data['emergency_id']
+                assert data['devices']['failed'][0]['device_id'] == 200
+
+                data = admin_client.post(f'/emergency/api/emergency/{emergency_id}/resolve').get_json()
+
+            release.assert_called_once_with(2)
+            assert data['doors']['released'] == [2]
+        finally:
+            with app.app_context():
+                if emergency_id:
+                    db.session.delete(db.session.get(EmergencySession, emergency_id))
+                ZoneDevice.query.filter_by(zone_id=zone_id).delete()
+                db.session.delete(db.session.get(Zone, zone_id))
+                db.session.commit()
+
+
+class TestActivationCheckIns:
+    """Tests de check-ins del día al activar una emergencia."""
+
+    def test_uses_presence_index(self, app, admin_client):
+        """Test de pase de lista desde el índice de presencia sin consultar dispositivos"""
+        from datetime import timedelta
+        from unittest.mock import MagicMock, patch
+        from webapp.presence_index import checkin_day_start, presence_index
+
+        with app.app_context():
+            zone = Zone(name='Zona Índice Presencia')
+            db.session.add(zone)
+            db.session.flush()
+            group = Group(name='Turno', zone_id=zone.id)
+            db.session.add(group)
+            db.session.flush()
+            db.session.add_all([
+                GroupMember(group_id=group.id, biostar_user_id='501', user_name='Presente'),
+                GroupMember(group_id=group.id, biostar_user_id='502', user_name='Ausente'),
+            ])
+            db.session.commit()
+            zone_id = zone.id
+
+        day_start = checkin_day_start()
+        presence_index.clear()
+        presence_index._last_seen['501'] = (day_start + timedelta(seconds=1), 100)
+        presence_index.mark_synced(day_start - timedelta(hours=1))
+        monitor = MagicMock()
+        emergency_id = None
+        try:
+            with patch('webapp.app.get_monitor', return_value=monitor):
+                data = admin_client.post('/emergency/api/emergency/activate',
+                                         json={'zone_id': zone_id}).get_json()
+            emergency_id = data['emergency_id']
+
+            monitor.get_checked_in_user_ids_today.assert_not_called()
+            with app.app_context():
+                entries = RollCallEntry.query.filter_by(emergency_id=emergency_id).all()
+                assert [e.biostar_user_id for e in entries] == ['501']
+        finally:
+            presence_index.clear()
+            with app.app_context():
+                if emergency_id:
+                    db.session.delete(db.session.get(EmergencySession, emergency_id))
+                db.session.delete(db.session.get(Zone, zone_id))
+                db.session.commit()
@@ -0,0 +1,90 @@
+"""
+Tests para el exportador de pase de lista a Excel.
+"""
+import io
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from openpyxl import load_workbook
+
+from webapp.excel_exporter import EmergencyExcelExporter, MAX_COLUMN_WIDTH
+
+
+@pytest.fixture
+def emergency():
+    """Emergencia simulada."""
+    return SimpleNamespace(
+        zone=SimpleNamespace(name='Planta Norte'),
+        emergency_type='incendio',
+        started_by_user=SimpleNamespace(full_name='Admin Uno', username='admin'),
+        started_at=datetime(2025, 3, 1, 18, 30),
+        resolved_at=None,
+        status='active',
+    )
+
+
+def make_roll_call(count):
+    """Pase de lista con `count` miembros en un grupo."""
+    statuses = ['present', 'absent', 'pending']
+    members = [
+        {
+            'id': i,
+            'biostar_user_id': str(1000 + i),
+            'user_name': f'Empleado {i}',
+            'status': statuses[i % 3],
+            'marked_by': 'Admin Uno' if i % 3 != 2 else None,
+            'marked_at': '2025-03-01T18:45:00' if i % 3 != 2 else None,
+            'notes': '',
+        }
+        for i in range(count)
+    ]
+    return {
+        'groups': [{'group_name': 'Producción', 'group_color': '#000', 'members': members}],
+        'stats': {'total': count, 'present': 0, 'absent': 0, 'pending': 0},
+    }
+
+
+class TestEmergencyExcelExporter:
+    """Tests del exportador en modo write_only."""
+
+    def test_export_content(self, emergency):
+        """Test de contenido, estilos y celdas combinadas del archivo"""
+        output = EmergencyExcelExporter.export_emergency(emergency, make_roll_call(3))
+        ws = load_workbook(output).active
+
+        assert ws['A1'].value == 'PASE DE LISTA DE EMERGENCIA'
+        assert 'A1:G1' in ws.merged_cells
+        assert ws['B3'].value == 'Planta Norte'
+
+        header_row = next(row for row in ws.iter_rows() if row[0].value == 'Grupo')
+        first = header_row[0].row + 1
+        assert ws.cell(first, 2).value == 'Empleado 0'
+        assert ws.cell(first, 4).value == 'PRESENTE'
+        assert ws.cell(first, 4).style == 'pl_status_present'
+        assert ws.cell(first, 1).fill.fgColor.rgb.endswith('F5F5F5')
+        assert ws.cell(first + 1, 1).style == 'pl_group'
+        assert ws.cell(first + 2, 6).value == 'Sin marcar'
+        # 18:45 UTC -> 12:45 en Ciudad de México
+        assert ws.cell(first, 6).value == '01/03/2025 12:45'
+
+    def test_column_widths_follow_content(self, emergency):
+        """Test de anchos calculados a partir de los valores escritos"""
+        roll_call = make_roll_call(1)
+        roll_call['groups'][0]['members'][0]['user_name'] = 'N' * 50
+        roll_call['groups'][0]['members'][0]['notes'] = 'x' * 200
+
+        ws = load_workbook(EmergencyExcelExporter.export_emergency(emergency, roll_call)).active
+
+        assert ws.column_dimensions['A'].width == 20
+        assert ws.column_dimensions['B'].width == 52
+        assert ws.column_dimensions['G'].width == MAX_COLUMN_WIDTH
+
+    def test_large_export_shares_styles(self, emergency):
+        """Test de exportación grande con un número fijo de estilos"""
+        output = io.BytesIO()
+        EmergencyExcelExporter.export_emergency(emergency, make_roll_call(3000), output)
+        wb = load_workbook(output)
+
+        assert wb.active.max_row > 3000
+        assert len(wb._cell_styles) < 40
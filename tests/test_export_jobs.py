@@ -0,0 +1,184 @@
+"""
+Tests para las exportaciones MovPer en segundo plano.
+"""
+import io
+import os
+import time
+import zipfile
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from types import SimpleNamespace
+
+from webapp import export_jobs
+from webapp.export_jobs import DownloadStore, ExportJobManager, ZIP_MIMETYPE
+from webapp.mobper_excel import construir_documento_movper
+
+
+def wait_for(job, timeout=30):
+    """Espera a que el trabajo termine."""
+    deadline = time.monotonic() + timeout
+    while job.finished_at is None and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert job.finished_at is not None, 'El trabajo no terminó a tiempo'
+    return job
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Almacén de descargas en un directorio temporal."""
+    return DownloadStore(str(tmp_path / 'exports'), ttl=60)
+
+
+@pytest.fixture
+def manager(store):
+    """Gestor con pool de hilos y renderizado simulado."""
+    executor = ThreadPoolExecutor(max_workers=2)
+    manager = ExportJobManager(store, executor=executor,
+                               renderizar=lambda doc: doc['contenido'].encode())
+    yield manager
+    executor.shutdown(wait=True)
+
+
+class TestDownloadStore:
+    """Tests del almacén de descargas por token."""
+
+    def test_save_and_get(self, store):
+        """Test de guardar y recuperar un archivo por token"""
+        token = store.guardar(b'datos', 'archivo.xlsx', 'application/test')
+        entry = store.obtener(token)
+
+        assert entry['filename'] == 'archivo.xlsx'
+        assert entry['mimetype'] == 'application/test'
+        assert entry['un_solo_uso'] is True
+        with open(entry['path'], 'rb') as f:
+            assert f.read() == b'datos'
+
+    def test_persists_across_instances(self, store):
+        """Test de token visible desde otra instancia (otro proceso)"""
+        token = store.guardar(b'datos', 'archivo.xlsx', 'application/test')
+        other = DownloadStore(store.directory)
+        assert other.obtener(token)['filename'] == 'archivo.xlsx'
+
+    def test_expired_token(self, store):
+        """Test de token expirado eliminado al consultarlo"""
+        token = store.guardar(b'datos', 'archivo.xlsx', 'application/test', ttl=-1)
+        assert store.obtener(token) is None
+        assert store.limpiar_expirados() == 0
+
+    def test_invalid_token(self, store):
+        """Test de tokens con formato inválido"""
+        assert store.obtener('../../etc/passwd') is None
+        assert store.obtener('') is None
+
+    def test_cleanup_expired(self, store):
+        """Test de limpieza de archivos expirados"""
+        store.guardar(b'a', 'a.xlsx', 'application/test', ttl=-1)
+        vigente = store.guardar(b'b', 'b.xlsx', 'application/test')
+
+        assert store.limpiar_expirados() == 1
+        assert store.obtener(vigente) is not None
+
+
+class TestExportJobManager:
+    """Tests de la cola de exportación."""
+
+    def test_job_builds_zip_with_progress(self, manager, store):
+        """Test de trabajo completo con progreso y ZIP publicado"""
+        job = manager.submit(
+            tareas=[1, 2, 3],
+            construir=lambda t: [{'filename': f'doc_{t}.xlsx', 'contenido': f'contenido {t}'}],
+            zip_filename='grupo.zip',
+            owner_id=7,
+        )
+        wait_for(job)
+
+        data = job.to_dict()
+        assert data['estado'] == 'completado'
+        assert data['procesados'] == 3 and data['porcentaje'] == 100
+        assert data['documentos'] == 3
+        assert manager.get(job.id) is job
+
+        entry = store.obtener(job.token)
+        assert entry['mimetype'] == ZIP_MIMETYPE
+        assert entry['un_solo_uso'] is False
+        with zipfile.ZipFile(entry['path']) as zf:
+            assert sorted(zf.namelist()) == ['doc_1.xlsx', 'doc_2.xlsx', 'doc_3.xlsx']
+            assert zf.read('doc_2.xlsx') == b'contenido 2'
+
+    def test_task_errors_are_reported(self, manager):
+        """Test de errores por tarea sin abortar el trabajo"""
+        def construir(tarea):
+            if tarea == 2:
+                raise ValueError('sin preset')
+            return [{'filename': f'doc_{tarea}.xlsx', 'contenido': 'x'}]
+
+        job = manager.submit([1, 2], construir, 'grupo.zip', etiqueta=lambda t: f'Miembro {t}')
+        wait_for(job)
+
+        assert job.estado == 'completado'
+        assert job.procesados == 2 and job.documentos == 1
+        assert job.errores == [{'tarea': 'Miembro 2', 'error': 'sin preset'}]
+
+    def test_job_state_survives_restart(self, manager, store):
+        """Test de estado y token del trabajo visibles desde otro gestor (reinicio u otro proceso)"""
+        job = manager.submit(
+            tareas=[1, 2],
+            construir=lambda t: [{'filename': f'doc_{t}.xlsx', 'contenido': 'x'}],
+            zip_filename='grupo.zip',
+            owner_id=7,
+        )
+        wait_for(job)
+
+        other = ExportJobManager(DownloadStore(store.directory))
+        restored = other.get(job.id)
+
+        assert restored is not job
+        assert restored.owner_id == 7
+        assert restored.token == job.token
+        assert restored.to_dict() == job.to_dict()
+        assert other.get('0' * 32) is None
+        assert other.get('../../etc/passwd') is None
+
+    def test_expired_job_state_removed(self, manager, store, monkeypatch):
+        """Test de estado persistido descartado al expirar"""
+        job = manager.submit([1], lambda t: [], 'grupo.zip')
+        wait_for(job)
+
+        monkeypatch.setattr(export_jobs, 'EXPORT_JOB_TTL', -1)
+        assert ExportJobManager(store).get(job.id) is None
+        assert not any(name.startswith('job_') for name in os.listdir(store.directory))
+
+    def test_interrupted_job_reported_as_error(self, store, monkeypatch):
+        """Test de trabajo sin terminar y sin avances reportado como interrumpido"""
+        manager = ExportJobManager(store)
+        job = export_jobs.ExportJob(7, 'grupo.zip', 3)
+        job.estado = 'procesando'
+        manager._guardar_estado(job)
+
+        assert ExportJobManager(store).get(job.id).estado == 'procesando'
+        monkeypatch.setattr(export_jobs, 'EXPORT_JOB_STALE_SECONDS', -1)
+        restored = ExportJobManager(store).get(job.id)
+        assert restored.estado == 'error'
+        assert restored.finished_at is not None
+
+    def test_render_in_process_pool(self, store):
+        """Test de renderizado real del formato en el pool de procesos"""
+        user = SimpleNamespace(nombre_completo='JUAN PEREZ', numero_socio='55')
+        preset = SimpleNamespace(nombre_formato=None, departamento_formato='Sistemas',
+                                 jefe_directo_nombre='Ana Ruiz', company=None)
+        quincena = {'inicio': date(2025, 2, 1), 'fin': date(2025, 2, 15)}
+        documento = construir_documento_movper(user, preset, [], quincena)
+
+        manager = ExportJobManager(store, max_workers=1)
+        try:
+            job = manager.submit([1], lambda t: [documento], 'grupo.zip')
+            wait_for(job, timeout=60)
+        finally:
+            manager.shutdown()
+
+        assert job.estado == 'completado', job.errores
+        with zipfile.ZipFile(store.obtener(job.token)['path']) as zf:
+            contenido = zf.read('MovPer_55_20250201.xlsx')
+        with zipfile.ZipFile(io.BytesIO(contenido)) as xlsx:
+            assert 'xl/worksheets/sheet3.xml' in xlsx.namelist()
@@ -0,0 +1,253 @@
+"""
+Tests para la generación del formato F-RH-18 (MovPer) con el motor xml.
+"""
+import os
+import re
+import shutil
+import zipfile
+import pytest
+from datetime import date
+from types import SimpleNamespace
+
+from openpyxl import load_workbook
+
+from webapp import mobper_excel
+from webapp.mobper_excel import (
+    CELDAS, SHAPES, LOGO_SHAPE, construir_documento_movper, obtener_plantilla,
+    generar_formato_excel, generar_aviso_vacaciones, calcular_font_adaptativo,
+    construir_vista_previa, firma_entradas_movper,
+)
+
+QUINCENA = {'inicio': date(2025, 2, 1), 'fin': date(2025, 2, 15)}
+INCIDENCIAS = [
+    {'fecha': date(2025, 2, 3), 'estado_auto': 'RETARDO'},
+    {'fecha': date(2025, 2, 4), 'estado_auto': 'FALTA', 'clasificacion': 'REMOTO'},
+]
+
+
+def make_preset(logo_filename=None):
+    """Preset con los datos mínimos usados por el formato."""
+    company = SimpleNamespace(name='Empresa', logo_filename=logo_filename) if logo_filename else None
+    return SimpleNamespace(
+        nombre_formato=None,
+        departamento_formato='Sistemas',
+        jefe_directo_nombre='Ana Ruiz',
+        company=company,
+    )
+
+
+@pytest.fixture
+def user():
+    """Usuario MovPer simulado."""
+    return SimpleNamespace(nombre_completo='JUAN PEREZ LOPEZ', numero_socio='123')
+
+
+@pytest.fixture(autouse=True)
+def clear_template_cache():
+    """Limpia la cache de plantillas entre tests."""
+    mobper_excel.limpiar_cache_plantillas()
+    yield
+    mobper_excel.limpiar_cache_plantillas()
+
+
+def drawing_anchors(output):
+    """Anchors de nivel superior del dibujo de la hoja activa."""
+    output.seek(0)
+    with zipfile.ZipFile(output) as zf:
+        drawing = zf.read('xl/drawings/drawing3.xml').decode('utf-8')
+    return [m.group(0) for m in mobper_excel._ANCHOR_RE.finditer(drawing)]
+
+
+def is_filled(anchor_xml):
+    """True si el círculo tiene relleno sólido negro."""
+    return bool(re.search(r'</a:prstGeom><a:solidFill><a:srgbClr val="000000"/>', anchor_xml))
+
+
+class TestDocumentoMovPer:
+    """Tests del modelo de documento."""
+
+    def test_circles_follow_incidence_types(self, user):
+        """Test de círculos marcados según las incidencias"""
+        documento = construir_documento_movper(user, make_preset(), INCIDENCIAS, QUINCENA, con_goce=False)
+
+        circulos = documento['circulos']
+        assert set(circulos) == set(SHAPES.values())
+        assert circulos[SHAPES['PARA_FALTAR']] is True
+        assert circulos[SHAPES['PARA_LLEGAR_TARDE']] is True
+        assert circulos[SHAPES['OLVIDO_CHECAR']] is False
+        assert circulos[SHAPES['GOCE_SI']] is False
+        assert circulos[SHAPES['GOCE_NO']] is True
+        assert documento['filename'] == 'MovPer_123_20250201.xlsx'
+        assert documento['logo_path'] is None
+
+    def test_cells_use_adaptive_font(self, user):
+        """Test de tamaño de fuente adaptativo en las operaciones de celda"""
+        documento = construir_documento_movper(user, make_preset(), INCIDENCIAS, QUINCENA)
+        ops = {op['celda']: op for op in documento['celdas']}
+
+        assert ops[CELDAS['NOMBRE']]['valor'] == 'Juan Perez Lopez'
+        assert ops[CELDAS['DEPARTAMENTO']]['font_size'] == calcular_font_adaptativo('SISTEMAS', 'DEPARTAMENTO')
+        assert ops[CELDAS['AUTORIZO_NOMBRE']]['shrink'] is False
+
+
+class TestMotorXml:
+    """Tests del motor xml sobre el template real."""
+
+    def test_generates_without_win32com(self, user):
+        """Test de generación del formato MovPer en Python puro"""
+        output, filename = generar_formato_excel(user, make_preset(), INCIDENCIAS, QUINCENA)
+
+        assert filename == 'MovPer_123_20250201.xlsx'
+        ws = load_workbook(output).active
+        assert ws[CELDAS['NOMBRE']].value == 'Juan Perez Lopez'
+        assert ws[CELDAS['DEPARTAMENTO']].value == 'SISTEMAS'
+        assert ws[CELDAS['DEPARTAMENTO']].font.sz == calcular_font_adaptativo('SISTEMAS', 'DEPARTAMENTO')
+        assert ws[CELDAS['MOTIVO']].value == '3 retardo justificado. 4 falta justificada, trabajo remoto.'
+        assert ws[CELDAS['AUTORIZO_NOMBRE']].value == 'ANA RUIZ'
+
+    def test_circles_toggled_in_drawing(self, user):
+        """Test de relleno de círculos editando el dibujo"""
+        output, _ = generar_formato_excel(user, make_preset(), INCIDENCIAS, QUINCENA, con_goce=True)
+
+        anchors = drawing_anchors(output)
+        assert is_filled(anchors[SHAPES['PARA_FALTAR'] - 1])
+        assert is_filled(anchors[SHAPES['PARA_LLEGAR_TARDE'] - 1])
+        assert is_filled(anchors[SHAPES['GOCE_SI'] - 1])
+        assert not is_filled(anchors[SHAPES['GOCE_NO'] - 1])
+        assert '<a:noFill/>' in anchors[SHAPES['OLVIDO_CHECAR'] - 1]
+
+    def test_shrink_to_fit_for_long_text(self, user):
+        """Test de ShrinkToFit cuando el texto no cabe ni a font_min"""
+        preset = make_preset()
+        preset.departamento_formato = 'Departamento de tecnologías de la información'
+        output, _ = generar_formato_excel(user, preset, INCIDENCIAS, QUINCENA)
+
+        cell = load_workbook(output).active[CELDAS['DEPARTAMENTO']]
+        assert cell.font.sz == 6
+        assert cell.alignment.shrinkToFit is True
+
+    def test_company_logo_replaced(self, user):
+        """Test de reemplazo del logo por el de la empresa"""
+        output, _ = generar_formato_excel(user, make_preset('Ekogolf.jpeg'), INCIDENCIAS, QUINCENA)
+
+        with zipfile.ZipFile(output) as zf:
+            rels = zf.read('xl/drawings/_rels/drawing3.xml.rels').decode('utf-8')
+            content_types = zf.read('[Content_Types].xml').decode('utf-8')
+            assert 'xl/media/logo_empresa.jpeg' in zf.namelist()
+        assert 'Target="../media/logo_empresa.jpeg"' in rels
+        assert 'Extension="jpeg"' in content_types
+
+        logo = drawing_anchors(output)[LOGO_SHAPE - 1]
+        cx, cy = map(int, re.search(r'<xdr:ext cx="(\d+)" cy="(\d+)"/>', logo).groups())
+        # Limites del logo MIT: alto 578981 EMU, ancho 1038225 * 1.5
+        assert cy <= 578981 and cx <= 1038225 * 1.5 + 1
+
+    def test_aviso_vacaciones(self, user):
+        """Test de generación del AVISO DE VACACIONES"""
+        periodo = {
+            'dias': [date(2025, 2, 3), date(2025, 2, 4)],
+            'fecha_salida': date(2025, 2, 3),
+            'fecha_regreso': date(2025, 2, 5),
+            'dias_efectivos': 2,
+        }
+        output, filename = generar_aviso_vacaciones(user, make_preset(), periodo, QUINCENA)
+
+        assert filename == 'VACACIONES_Juan_Perez_Lopez_20250203.xlsx'
+        ws = load_workbook(output).active
+        assert ws[CELDAS['VAC_DIAS_EFECTIVOS']].value == 2
+        assert ws[CELDAS['VAC_FECHA_SALIDA']].value == '03-feb-25'
+        assert ws[CELDAS['VAC_FECHA_REGRESO']].value == '04-feb-25'
+        assert ws[CELDAS['FECHA_APLICACION']].value == '3,4 feb-25'
+        assert ws[CELDAS['MOTIVO']].value is None
+        assert not any(is_filled(drawing_anchors(output)[i - 1]) for i in SHAPES.values())
+
+
+class TestPlantillaCache:
+    """Tests de la cache de plantillas pre-parseadas."""
+
+    def test_template_parsed_once(self, user):
+        """Test de reutilizar la plantilla entre documentos"""
+        plantilla = obtener_plantilla()
+        generar_formato_excel(user, make_preset(), INCIDENCIAS, QUINCENA)
+        generar_formato_excel(user, make_preset(), [], QUINCENA)
+        assert obtener_plantilla() is plantilla
+
+    def test_render_does_not_mutate_template(self, user):
+        """Test de plantilla inmutable tras renderizar"""
+        plantilla = obtener_plantilla()
+        hoja = plantilla.partes[plantilla.hoja]
+        estilos = plantilla.partes['xl/styles.xml']
+
+        generar_formato_excel(user, make_preset(), INCIDENCIAS, QUINCENA)
+
+        assert plantilla.partes[plantilla.hoja] is hoja
+        assert plantilla.partes['xl/styles.xml'] is estilos
+        with pytest.raises(TypeError):
+            plantilla.partes['xl/styles.xml'] = b''
+
+    def test_logo_variant_cached_per_company(self):
+        """Test de variante por empresa con el logo ya aplicado"""
+        logo = os.path.join(mobper_excel.LOGOS_DIR, 'Ekogolf.jpeg')
+        variante = obtener_plantilla(logo)
+
+        assert obtener_plantilla(logo) is variante
+        assert variante is not obtener_plantilla()
+        assert 'xl/media/logo_empresa.jpeg' in variante.partes
+        assert 'xl/media/logo_empresa.jpeg' not in obtener_plantilla().partes
+
+    def test_template_change_invalidates_cache(self, tmp_path, monkeypatch):
+        """Test de recarga cuando el template cambia en disco"""
+        template = tmp_path / 'template.xlsx'
+        shutil.copy(mobper_excel.TEMPLATE_PATH, template)
+        monkeypatch.setattr(mobper_excel, 'TEMPLATE_PATH', str(template))
+
+        plantilla = obtener_plantilla()
+        stat = os.stat(template)
+        os.utime(template, (stat.st_atime, stat.st_mtime + 10))
+
+        assert obtener_plantilla() is not plantilla
+
+
+class TestVistaPrevia:
+    """Tests de la vista previa construida desde el documento."""
+
+    def test_preview_matches_document(self, user):
+        """Test de vista previa con los mismos valores que el Excel"""
+        documento = construir_documento_movper(user, make_preset(), INCIDENCIAS, QUINCENA, con_goce=False)
+        vista = construir_vista_previa(documento)
+        valores = {op['celda']: op['valor'] for op in documento['celdas']}
+
+        assert vista['campos']['NOMBRE'] == valores[CELDAS['NOMBRE']] == 'Juan Perez Lopez'
+        assert vista['campos']['FECHA_APLICACION'] == valores[CELDAS['FECHA_APLICACION']]
+        assert vista['campos']['AUTORIZO_NOMBRE'] == 'ANA RUIZ'
+        assert vista['goce'] == {'si': False, 'no': True}
+        marcadas = {o['etiqueta'] for o in vista['opciones'] if o['marcado']}
+        assert marcadas == {'PARA FALTAR', 'PARA LLEGAR TARDE'}
+        assert vista['logo_filename'] is None
+
+    def test_preview_company_logo(self, user):
+        """Test de logo de la empresa en la vista previa"""
+        documento = construir_documento_movper(user, make_preset('Ekogolf.jpeg'), [], QUINCENA)
+        assert construir_vista_previa(documento)['logo_filename'] == 'Ekogolf.jpeg'
+
+    def test_inputs_hash(self, user):
+        """Test de hash de entradas estable y sensible a cambios"""
+        firma = firma_entradas_movper(user, make_preset(), INCIDENCIAS, True)
+
+        assert firma == firma_entradas_movper(user, make_preset(), INCIDENCIAS, True)
+        assert firma != firma_entradas_movper(user, make_preset(), INCIDENCIAS, False)
+        assert firma != firma_entradas_movper(user, make_preset(), INCIDENCIAS[:1], True)
+        assert firma != firma_entradas_movper(user, None, INCIDENCIAS, True)
+
+    def test_preview_template_renders(self, app, user):
+        """Test de la plantilla HTML con los datos de la vista previa"""
+        from flask import render_template
+
+        documento = construir_documento_movper(user, make_preset('Ekogolf.jpeg'), INCIDENCIAS, QUINCENA)
+        with app.test_request_context():
+            html = render_template('mobper_preview.html', user=user, quincena=QUINCENA,
+                                   vista=construir_vista_previa(documento))
+
+        assert 'Juan Perez Lopez' in html
+        assert 'logos/Ekogolf.jpeg' in html
+        assert html.count('box checked') == 3
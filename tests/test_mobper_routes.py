@@ -0,0 +1,117 @@
+"""
+Tests para las rutas de edición del checklist MovPer.
+"""
+import pytest
+from datetime import date
+
+from webapp.models import db, MobPerUser, IncidenciaDia
+
+
+@pytest.fixture
+def mobper_client(app, client):
+    """Cliente con sesión MovPer iniciada (los datos se confirman y se limpian al final)."""
+    with app.app_context():
+        user = MobPerUser(numero_socio='BATCH1', nombre_completo='Usuario Batch', password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    with client.session_transaction() as sess:
+        sess['mobper_user_id'] = user_id
+
+    yield client, user_id
+
+    with app.app_context():
+        IncidenciaDia.query.filter_by(user_id=user_id).delete()
+        MobPerUser.query.filter_by(id=user_id).delete()
+        db.session.commit()
+
+
+class TestIncidenciasBatch:
+    """Tests del endpoint de ediciones en bloque."""
+
+    def test_batch_applies_all_changes(self, app, mobper_client):
+        """Test de varias ediciones aplicadas en una sola petición"""
+        client, user_id = mobper_client
+        response = client.post('/mobper/api/incidencias/batch', json={'cambios': [
+            {'tipo': 'clasificacion', 'fecha': '2025-02-03', 'clasificacion': 'REMOTO',
+             'estado_auto': 'FALTA', 'numero_dia': 1},
+            {'tipo': 'justificacion', 'fecha': '2025-02-04', 'justificado': False},
+            {'tipo': 'justificacion_salida', 'fecha': '2025-02-04', 'justificado': False},
+            {'tipo': 'justificacion_olvido', 'fecha': '2025-02-05', 'justificado': False},
+        ]})
+
+        data = response.get_json()
+        assert response.status_code == 200 and data['success']
+        assert data['count'] == 4
+        assert data['incidencias']['2025-02-03']['motivo'] == '1 falta justificada, trabajo remoto'
+        assert data['incidencias']['2025-02-04']['justificado'] is False
+        assert data['incidencias']['2025-02-04']['salida_justificado'] is False
+
+        with app.app_context():
+            dias = {inc.fecha: inc for inc in IncidenciaDia.query.filter_by(user_id=user_id)}
+            assert dias[date(2025, 2, 3)].clasificacion == 'REMOTO'
+            assert dias[date(2025, 2, 4)].estado_auto == 'RETARDO'
+            assert dias[date(2025, 2, 4)].motivo_auto == 'Retardo NO justificado'
+            assert dias[date(2025, 2, 5)].olvido_checar_justificado is False
+
+    def test_batch_rejects_invalid_changes(self, app, mobper_client):
+        """Test de lote rechazado completo si una edición es inválida"""
+        client, user_id = mobper_client
+        response = client.post('/mobper/api/incidencias/batch', json={'cambios': [
+            {'tipo': 'justificacion', 'fecha': '2025-02-04', 'justificado': False},
+            {'tipo': 'desconocido', 'fecha': '2025-02-05'},
+        ]})
+
+        assert response.status_code == 400
+        with app.app_context():
+            assert IncidenciaDia.query.filter_by(user_id=user_id).count() == 0
+
+    def test_toggle_updates_existing_day(self, app, mobper_client):
+        """Test de toggle individual sobre un día ya clasificado"""
+        client, user_id = mobper_client
+        client.post('/mobper/api/clasificar-multiple', json={
+            'clasificacion': 'GUARDIA',
+            'items': [{'fecha': '2025-02-03'}, {'fecha': '2025-02-04'}],
+        })
+        response = client.post('/mobper/api/toggle-justificacion-olvido',
+                               json={'fecha': '2025-02-04', 'justificado': False})
+
+        assert response.get_json()['success']
+        with app.app_context():
+            dia = IncidenciaDia.query.filter_by(user_id=user_id, fecha=date(2025, 2, 4)).one()
+            assert dia.clasificacion == 'GUARDIA'
+            assert dia.motivo_auto == '2 falta justificada, guardia'
+            assert dia.olvido_checar_justificado is False
+
+
+class TestPreviewCache:
+    """Tests de la cache de vistas previas."""
+
+    def test_concurrent_hits_and_evictions(self, monkeypatch):
+        """Test de lecturas y expulsiones concurrentes sin errores"""
+        import threading
+        from webapp import mobper_routes
+
+        monkeypatch.setattr(mobper_routes, '_preview_cache', mobper_routes.OrderedDict())
+        monkeypatch.setattr(mobper_routes, '_PREVIEW_CACHE_MAX', 4)
+        monkeypatch.setattr('builtins.print', lambda *args, **kwargs: None)
+        errores = []
+
+        def worker(n):
+            try:
+                for i in range(300):
+                    firma = (n + i) % 8
+                    html = mobper_routes.get_cached_preview(1, 'q', firma, lambda: f'html {firma}')
+                    assert html == f'html {firma}'
+            except Exception as e:
+                errores.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert errores == []
+        assert len(mobper_routes._preview_cache) <= 4
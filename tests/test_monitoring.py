@@ -117,3 +117,77 @@ class TestMonitoringFunctions:
         # No debe lanzar excepción
         monitor_event(12345, 'ACCESS_GRANTED')
         monitor_event(67890, 'ACCESS_DENIED')
+
+
+class TestQueryProfiler:
+    """Tests para el conteo de consultas SQL por request."""
+    
+    @pytest.fixture
+    def profiled_app(self):
+        """App mínima con el perfilado sobre un engine SQLite en memoria."""
+        from flask import Flask
+        from sqlalchemy import create_engine, text
+        from sqlalchemy.pool import StaticPool
+        from webapp.monitoring import init_query_profiler, query_budget
+        
+        engine = create_engine('sqlite://', poolclass=StaticPool)
+        flask_app = Flask(__name__)
+        flask_app.config.update(TESTING=True, QUERY_HEADERS=True, QUERY_REPEAT_THRESHOLD=3,
+                                QUERY_BUDGET=0, QUERY_BUDGET_STRICT=False)
+        init_query_profiler(flask_app, engine)
+        
+        def run(n, distinct=False):
+            with engine.connect() as conn:
+                for i in range(n):
+                    conn.execute(text(f'SELECT {i}' if distinct else 'SELECT :n'), {'n': i})
+            return 'ok'
+        
+        @flask_app.route('/few')
+        def few():
+            return run(2)
+        
+        @flask_app.route('/many')
+        def many():
+            return run(6)
+        
+        @flask_app.route('/budgeted')
+        @query_budget(3)
+        def budgeted():
+            return run(5, distinct=True)
+        
+        yield flask_app
+        engine.dispose()
+    
+    def test_headers_report_queries(self, profiled_app):
+        """Test de headers con número de consultas y tiempo en BD"""
+        response = profiled_app.test_client().get('/few')
+        assert response.headers['X-DB-Queries'] == '2'
+        assert float(response.headers['X-DB-Time-Ms']) >= 0
+    
+    def test_repeated_statements_recorded(self, profiled_app):
+        """Test de sentencia repetida marcada en las métricas"""
+        from webapp.monitoring import get_query_stats
+        
+        profiled_app.test_client().get('/many')
+        stats = get_query_stats()['many']
+        assert stats['max_queries'] == 6
+        assert stats['repeated_requests'] >= 1
+    
+    def test_strict_mode_fails_over_budget(self, profiled_app):
+        """Test de modo estricto con presupuesto de la vista excedido"""
+        from webapp.monitoring import QueryBudgetExceeded
+        
+        client = profiled_app.test_client()
+        assert client.get('/budgeted').status_code == 200
+        
+        profiled_app.config['QUERY_BUDGET_STRICT'] = True
+        with pytest.raises(QueryBudgetExceeded, match='presupuesto 3'):
+            client.get('/budgeted')
+        with pytest.raises(QueryBudgetExceeded, match='repetida'):
+            client.get('/many')
+        assert client.get('/few').status_code == 200
+    
+    def test_queries_outside_request_ignored(self):
+        """Test de consultas fuera de un request sin tracker"""
+        from webapp.monitoring import current_query_tracker
+        assert current_query_tracker() is None
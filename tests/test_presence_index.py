@@ -0,0 +1,191 @@
+"""
+Tests para el índice de presencia en memoria.
+"""
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import pytz
+
+from webapp.presence_index import PresenceIndex, PresenceIngestor
+
+
+def make_event(user_id, device_id, dt, code='4097', device_name=None):
+    """Construye un evento con la estructura de BioStar."""
+    return {
+        'event_type_id': {'code': code},
+        'user_id': {'user_id': user_id, 'name': f'Usuario {user_id}'},
+        'device_id': {'id': str(device_id), 'name': device_name or f'Checador {device_id}'},
+        'datetime': dt.strftime('%Y-%m-%dT%H:%M:%S.00Z'),
+    }
+
+
+@pytest.fixture
+def now():
+    """Momento de referencia en UTC (sin microsegundos)."""
+    return datetime.now(pytz.utc).replace(microsecond=0)
+
+
+class TestPresenceIndex:
+    """Tests para PresenceIndex."""
+
+    def test_keeps_latest_event_per_user(self, now):
+        """Test de conservar la aparición más reciente"""
+        index = PresenceIndex()
+        updated = index.ingest([
+            make_event('1', 100, now - timedelta(minutes=10)),
+            make_event('1', 200, now - timedelta(minutes=2)),
+            make_event('1', 100, now - timedelta(minutes=5)),
+        ])
+
+        assert updated == 2
+        assert index.last_seen('1') == (now - timedelta(minutes=2), 200)
+        assert index.device_name(200) == 'Checador 200'
+
+    def test_ignores_denied_and_anonymous_events(self, now):
+        """Test de ignorar accesos denegados y eventos sin usuario"""
+        index = PresenceIndex()
+        index.ingest([
+            make_event('1', 100, now, code='4353'),
+            make_event('', 100, now),
+            {'event_type_id': {'code': '4097'}, 'datetime': now.isoformat()},
+        ])
+
+        assert len(index) == 0
+
+    def test_seen_since_filters_time_and_devices(self, now):
+        """Test de consulta por ventana de tiempo y dispositivos"""
+        index = PresenceIndex()
+        index.ingest([
+            make_event('1', 100, now - timedelta(minutes=1)),
+            make_event('2', 200, now - timedelta(minutes=1)),
+            make_event('3', 100, now - timedelta(hours=2)),
+        ])
+
+        since = now - timedelta(minutes=30)
+        assert set(index.seen_since(['1', '2', '3', '4'], since)) == {'1', '2'}
+        assert set(index.seen_since(['1', '2', '3'], since, device_ids=[100])) == {'1'}
+
+    def test_prune_old_entries(self, now):
+        """Test de depuración de entradas antiguas"""
+        index = PresenceIndex()
+        index.ingest([
+            make_event('1', 100, now - timedelta(days=2)),
+            make_event('2', 100, now),
+        ])
+
+        assert index.prune(now - timedelta(days=1)) == 1
+        assert index.last_seen('1') is None
+        assert index.last_seen('2') is not None
+
+
+class TestCheckedInToday:
+    """Tests de usuarios con check-in del día desde el índice."""
+
+    def test_requires_coverage(self, now):
+        """Test de respuesta solo si el índice cubre el periodo y está al día"""
+        index = PresenceIndex()
+        index.ingest([
+            make_event('1', 100, now - timedelta(minutes=5)),
+            make_event('2', 200, now - timedelta(hours=3)),
+        ])
+        since = now - timedelta(hours=1)
+        assert index.users_seen_since(since) is None
+
+        index.mark_synced(now - timedelta(hours=2))
+        assert index.users_seen_since(since) == {'1'}
+        assert index.users_seen_since(now - timedelta(hours=4)) is None
+
+        index._synced_at -= 3600
+        assert index.users_seen_since(since) is None
+
+    def test_day_start_is_local(self):
+        """Test de inicio del día a las 5:30 hora de México"""
+        from webapp.presence_index import checkin_day_start
+
+        start = checkin_day_start(pytz.utc.localize(datetime(2025, 3, 10, 18, 0)))
+        assert start.astimezone(pytz.utc) == pytz.utc.localize(datetime(2025, 3, 10, 11, 30))
+
+
+class TestPresenceIngestor:
+    """Tests para la ingesta periódica de eventos."""
+
+    def test_poll_once_queries_all_devices(self, now):
+        """Test de una sola consulta sin filtro de dispositivo"""
+        monitor = MagicMock()
+        monitor.client.search_events.return_value = [make_event('7', 300, now)]
+        index = PresenceIndex()
+        ingestor = PresenceIngestor(lambda: monitor, index)
+
+        assert ingestor.poll_once() == 1
+        conditions = monitor.client.search_events.call_args.args[0]
+        assert [c['column'] for c in conditions] == ['datetime']
+        assert index.last_seen('7') == (now, 300)
+
+    def test_first_poll_backfills_day_in_windows(self, now):
+        """Test de carga inicial del día por ventanas con cobertura completa"""
+        from webapp.presence_index import checkin_day_start
+
+        monitor = MagicMock()
+        monitor.client.search_events.return_value = [make_event('7', 300, now)]
+        index = PresenceIndex()
+        ingestor = PresenceIngestor(lambda: monitor, index)
+
+        ingestor.poll_once()
+        windows = [call.args[0][0]['values'] for call in monitor.client.search_events.call_args_list]
+        assert all(a < b for a, b in windows)
+        assert all(prev[1] == cur[0] for prev, cur in zip(windows, windows[1:]))
+
+        day_start = checkin_day_start()
+        if day_start <= now:
+            assert index.users_seen_since(day_start) == {'7'}
+
+    def test_truncated_window_limits_coverage(self, now):
+        """Test de ventana con el límite de eventos sin cobertura previa"""
+        from webapp.presence_index import PRESENCE_QUERY_LIMIT
+
+        monitor = MagicMock()
+        monitor.client.search_events.return_value = [make_event('7', 300, now)] * PRESENCE_QUERY_LIMIT
+        index = PresenceIndex()
+        ingestor = PresenceIngestor(lambda: monitor, index)
+        ingestor.poll_once()
+
+        assert index.users_seen_since(now - timedelta(minutes=30)) is None
+
+    def test_poll_once_without_monitor(self):
+        """Test de ingesta sin conexión a BioStar"""
+        ingestor = PresenceIngestor(lambda: None, PresenceIndex())
+        assert ingestor.poll_once() == 0
+
+
+class TestZonePresence:
+    """Tests para la presencia por zona usando el índice compartido."""
+
+    def test_reports_each_appearance_once(self, now):
+        """Test de reportar cada aparición una sola vez"""
+        from webapp.emergency_routes import check_zone_presence
+        from webapp.presence_index import presence_index
+
+        presence_index.clear()
+        presence_index.ingest([
+            make_event('1', 100, now - timedelta(minutes=1)),
+            make_event('2', 999, now - timedelta(minutes=1)),
+        ])
+        members = {
+            '1': {'name': 'Ana', 'group_id': 1, 'group_name': 'IT', 'last_seen': None, 'device': None},
+            '2': {'name': 'Beto', 'group_id': 1, 'group_name': 'IT', 'last_seen': None, 'device': None},
+        }
+        since = now - timedelta(minutes=5)
+
+        try:
+            updates = check_zone_presence([100], members, since)
+            assert [u['user_id'] for u in updates] == ['1']
+            assert updates[0]['device'] == 'Checador 100'
+
+            # Sin eventos nuevos no hay actualizaciones repetidas
+            assert check_zone_presence([100], members, since) == []
+
+            presence_index.ingest([make_event('1', 100, now)])
+            assert len(check_zone_presence([100], members, since)) == 1
+        finally:
+            presence_index.clear()
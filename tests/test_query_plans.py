@@ -0,0 +1,77 @@
+"""
+Auditoría de planes de consulta (EXPLAIN) para las consultas más frecuentes.
+"""
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import inspect, text
+
+from webapp.models import (
+    db, apply_schema_updates, CorreccionDia, EmergencySession, GroupMember,
+    PanicModeLog, PresetUsuario, RollCallEntry, ZoneDevice,
+)
+
+
+def query_plan(query):
+    """Devuelve el detalle de EXPLAIN QUERY PLAN (SQLite) de una consulta ORM."""
+    sql = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    rows = db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}')).fetchall()
+    return ' | '.join(row[-1] for row in rows)
+
+
+@pytest.fixture
+def sqlite_only(app):
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            pytest.skip("EXPLAIN QUERY PLAN solo en SQLite")
+        yield
+
+
+class TestHotQueryPlans:
+    """Tests de uso de índices en consultas por request o por tick."""
+
+    @pytest.mark.parametrize('query, index', [
+        (lambda: RollCallEntry.query.filter_by(emergency_id=1, status='pending'),
+         'ix_roll_call_entries_emergency_status'),
+        (lambda: RollCallEntry.query.filter(RollCallEntry.emergency_id == 1,
+                                            RollCallEntry.marked_at > datetime(2026, 1, 1)),
+         'ix_roll_call_entries_emergency_marked_at'),
+        (lambda: EmergencySession.query.filter_by(zone_id=1, status='active'),
+         'ix_emergency_sessions_zone_status'),
+        (lambda: EmergencySession.query.filter_by(status='resolved')
+         .order_by(EmergencySession.resolved_at.desc()),
+         'ix_emergency_sessions_status_resolved_at'),
+        (lambda: ZoneDevice.query.filter_by(zone_id=1, is_active=True),
+         'ix_zone_devices_zone_active'),
+        (lambda: GroupMember.query.filter_by(biostar_user_id='1001'),
+         'ix_group_members_biostar_user_id'),
+        (lambda: PresetUsuario.query.filter_by(user_id=1),
+         'ix_mobper_presets_user_id'),
+        (lambda: CorreccionDia.query.filter(CorreccionDia.activa.is_(True),
+                                            CorreccionDia.fecha.between(date(2026, 1, 1), date(2026, 1, 15))),
+         'ix_mobper_correcciones_dia_activa_fecha'),
+        (lambda: PanicModeLog.query.filter_by(device_id=1).order_by(PanicModeLog.timestamp.desc()),
+         'ix_panic_mode_log_device_timestamp'),
+    ])
+    def test_query_uses_index(self, sqlite_only, query, index):
+        """Test de consulta frecuente resuelta con su índice"""
+        plan = query_plan(query())
+        assert index in plan, plan
+
+
+class TestIndexMigration:
+    """Tests de creación de índices en bases existentes."""
+
+    def test_missing_index_is_created(self, sqlite_only):
+        """Test de índice faltante creado por apply_schema_updates"""
+        db.session.execute(text('DROP INDEX ix_roll_call_entries_emergency_status'))
+        db.session.commit()
+        assert 'ix_roll_call_entries_emergency_status' not in {
+            ix['name'] for ix in inspect(db.engine).get_indexes('roll_call_entries')
+        }
+
+        apply_schema_updates()
+
+        assert 'ix_roll_call_entries_emergency_status' in {
+            ix['name'] for ix in inspect(db.engine).get_indexes('roll_call_entries')
+        }
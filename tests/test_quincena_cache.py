@@ -0,0 +1,240 @@
+"""
+Tests para la cache de quincenas con invalidación por dependencias.
+"""
+import json
+import pytest
+from datetime import date, time
+
+from webapp.models import MobPerUser, PresetUsuario, IncidenciaDia, CorreccionDia, upsert_incidencias_dia
+from webapp import cache_manager as cache_module
+from webapp.quincena_cache import (
+    DependencyCache, quincena_cache, dep_biostar, dep_eventos,
+    dep_incidencia, dependencias_quincena, clave_resumen, tag_usuario, tag_quincena,
+    quincena_key_de, codificar_token, decodificar_token, dep_correccion, invalidar_cache_compartida,
+)
+
+QUINCENA = {'inicio': date(2025, 2, 1), 'fin': date(2025, 2, 15)}
+QUINCENA_KEY = '2025-02-01_2025-02-15'
+
+
+class TestDependencyCache:
+    """Tests de DependencyCache."""
+
+    def test_invalidates_only_dependents(self):
+        """Test de expulsión exacta de las entradas afectadas"""
+        cache = DependencyCache()
+        cache.set('a', [1], deps=[('incidencia', 1, date(2025, 2, 3))])
+        cache.set('b', [2], deps=[('incidencia', 2, date(2025, 2, 3))])
+
+        assert cache.invalidate(('incidencia', 1, date(2025, 2, 3))) == 1
+        assert cache.get('a') is None
+        assert cache.get('b') == [2]
+
+    def test_cascade_through_entries(self):
+        """Test de invalidación en cascada a través de otra entrada"""
+        cache = DependencyCache()
+        cache.set(('eventos', 1, 'q'), {'x': 1}, deps=[('biostar', 1)])
+        cache.set(('quincena', 1, 'q'), [1], deps=[('eventos', 1, 'q')])
+
+        cache.invalidate(('biostar', 1))
+        assert cache.get(('quincena', 1, 'q')) is None
+
+    def test_ttl_bounded_by_dependencies(self):
+        """Test de vigencia acotada por la de sus dependencias"""
+        cache = DependencyCache()
+        cache.set('eventos', 1, ttl=-1)
+        cache.set('resultado', 2, deps=['eventos'])
+        assert cache.get('resultado') is None
+
+    def test_values_are_copied(self):
+        """Test de valores protegidos contra mutación"""
+        cache = DependencyCache()
+        valor = [{'estado': 'FALTA'}]
+        cache.set('a', valor)
+        valor[0]['estado'] = 'X'
+        cache.get('a')[0]['estado'] = 'Y'
+        assert cache.get('a') == [{'estado': 'FALTA'}]
+
+    def test_lru_bound(self):
+        """Test de límite de entradas"""
+        cache = DependencyCache(max_entries=2)
+        cache.set('a', 1, deps=['d'])
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is None and cache.get('a') == 1
+        assert cache.get_stats()['entries'] == 2
+
+
+class TestSessionInvalidation:
+    """Tests de invalidación por eventos de sesión de SQLAlchemy."""
+
+    @pytest.fixture
+    def cached_user(self, app, db_session):
+        """Usuario MovPer con su resultado de quincena en cache."""
+        user = MobPerUser(numero_socio='QCACHE1', nombre_completo='Usuario Cache', password_hash='x')
+        db_session.add(user)
+        db_session.flush()
+
+        quincena_cache.clear()
+        quincena_cache.set(dep_eventos(user.id, QUINCENA_KEY), {}, deps=[dep_biostar(user.id)])
+        quincena_cache.set(('quincena', user.id, QUINCENA_KEY), [],
+                           deps=dependencias_quincena(user.id, QUINCENA, QUINCENA_KEY))
+        quincena_cache.set(('quincena', user.id, 'otra'), [], deps=[dep_incidencia(user.id, date(2025, 3, 3))])
+        yield user
+        quincena_cache.clear()
+
+    def resultado(self, user):
+        return quincena_cache.get(('quincena', user.id, QUINCENA_KEY))
+
+    def test_incidencia_write_evicts_its_quincena(self, cached_user, db_session):
+        """Test de clasificación que invalida solo la quincena del día"""
+        db_session.add(IncidenciaDia(user_id=cached_user.id, fecha=date(2025, 2, 3), clasificacion='REMOTO'))
+        db_session.flush()
+
+        assert self.resultado(cached_user) is None
+        assert quincena_cache.get(('quincena', cached_user.id, 'otra')) == []
+        assert quincena_cache.get(dep_eventos(cached_user.id, QUINCENA_KEY)) == {}
+
+    def test_day_outside_range_keeps_entry(self, cached_user, db_session):
+        """Test de día fuera de la quincena sin invalidar"""
+        db_session.add(IncidenciaDia(user_id=cached_user.id, fecha=date(2025, 2, 20)))
+        db_session.flush()
+        assert self.resultado(cached_user) == []
+
+    def test_bulk_upsert_evicts(self, cached_user):
+        """Test de upsert masivo que invalida los días escritos"""
+        upsert_incidencias_dia(cached_user.id, [{'fecha': date(2025, 2, 4), 'valores': {'justificado': False}}])
+        assert self.resultado(cached_user) is None
+
+    def test_preset_change_evicts(self, cached_user, db_session):
+        """Test de cambio de preset que invalida los resultados del usuario"""
+        db_session.add(PresetUsuario(user_id=cached_user.id, nombre_formato='X'))
+        db_session.flush()
+        assert self.resultado(cached_user) is None
+        assert quincena_cache.get(('quincena', cached_user.id, 'otra')) == []
+
+    def test_correction_evicts_events_and_results(self, cached_user, db_session):
+        """Test de corrección de checador que invalida eventos y resultados de esa fecha"""
+        quincena_cache.set(dep_eventos(cached_user.id, QUINCENA_KEY), {},
+                           deps=[('correccion', date(2025, 2, 10))])
+        quincena_cache.set(('quincena', cached_user.id, QUINCENA_KEY), [],
+                           deps=[dep_eventos(cached_user.id, QUINCENA_KEY)])
+
+        db_session.add(CorreccionDia(fecha=date(2025, 2, 10), offset_minutos=60,
+                                     hora_anomala_inicio=time(17, 0), hora_anomala_fin=time(19, 30)))
+        db_session.flush()
+
+        assert quincena_cache.get(dep_eventos(cached_user.id, QUINCENA_KEY)) is None
+        assert self.resultado(cached_user) is None
+
+    def test_last_login_does_not_evict(self, cached_user, db_session):
+        """Test de cambios irrelevantes del usuario sin invalidar"""
+        from datetime import datetime
+        cached_user.last_login = datetime.utcnow()
+        db_session.flush()
+        assert self.resultado(cached_user) == []
+
+        cached_user.numero_socio = 'QCACHE2'
+        db_session.flush()
+        assert self.resultado(cached_user) is None
+
+    def test_reinvalidates_on_commit(self, cached_user, db_session):
+        """Test de invalidación repetida al confirmar la transacción"""
+        db_session.add(IncidenciaDia(user_id=cached_user.id, fecha=date(2025, 2, 5)))
+        db_session.flush()
+        # Otra petición recalcula antes del commit con datos anteriores
+        quincena_cache.set(('quincena', cached_user.id, QUINCENA_KEY), ['viejo'],
+                           deps=[dep_incidencia(cached_user.id, date(2025, 2, 5))])
+
+        db_session.rollback()
+        assert self.resultado(cached_user) is None
+
+
+class TestSharedSummaryInvalidation:
+    """Tests de invalidación de los resúmenes de grupo en el caché compartido."""
+
+    @pytest.fixture
+    def shared(self, app, db_session):
+        """Caché compartido con los resúmenes de dos miembros."""
+        user = MobPerUser(numero_socio='QCACHE3', nombre_completo='Usuario Grupo', password_hash='x')
+        db_session.add(user)
+        db_session.flush()
+
+        cache = cache_module.cache_manager
+        claves = {
+            'propio': clave_resumen(user.id, QUINCENA_KEY),
+            'otro': clave_resumen(user.id + 1000, QUINCENA_KEY),
+            'otra_quincena': clave_resumen(user.id + 1000, '2025-03-01_2025-03-15'),
+        }
+        cache.set_many({clave: {'estado': 'ok'} for clave in claves.values()}, ttl=60, tags={
+            claves['propio']: [tag_usuario(user.id), tag_quincena(QUINCENA_KEY)],
+            claves['otro']: [tag_usuario(user.id + 1000), tag_quincena(QUINCENA_KEY)],
+            claves['otra_quincena']: [tag_usuario(user.id + 1000), tag_quincena('2025-03-01_2025-03-15')],
+        })
+        yield cache, user, claves
+        cache.delete_many(claves.values())
+
+    def test_quincena_key_de(self):
+        """Test de quincena que contiene una fecha"""
+        assert quincena_key_de(date(2025, 2, 15)) == '2025-02-01_2025-02-15'
+        assert quincena_key_de(date(2024, 2, 16)) == '2024-02-16_2024-02-29'
+
+    def test_classification_evicts_member_summary(self, shared, db_session):
+        """Test de clasificación que invalida solo el resumen del miembro"""
+        cache, user, claves = shared
+        db_session.add(IncidenciaDia(user_id=user.id, fecha=date(2025, 2, 3)))
+        db_session.flush()
+
+        assert set(cache.get_many(claves.values())) == {claves['otro'], claves['otra_quincena']}
+
+    def test_correction_evicts_quincena_summaries(self, shared, db_session):
+        """Test de corrección que invalida los resúmenes de su quincena"""
+        cache, user, claves = shared
+        db_session.add(CorreccionDia(fecha=date(2025, 2, 10), offset_minutos=60,
+                                     hora_anomala_inicio=time(17, 0), hora_anomala_fin=time(19, 30)))
+        db_session.flush()
+
+        assert set(cache.get_many(claves.values())) == {claves['otra_quincena']}
+
+
+class TestCrossProcessInvalidation:
+    """Tests de invalidación de la cache de quincenas entre procesos."""
+
+    @pytest.fixture
+    def publicados(self, app, monkeypatch):
+        """Mensajes publicados en el canal de invalidaciones."""
+        cache = cache_module.cache_manager
+        mensajes = []
+        monkeypatch.setattr(cache, 'enabled', True)
+        monkeypatch.setattr(cache, 'publish_invalidation', lambda **message: mensajes.append(message))
+        yield mensajes
+        quincena_cache.clear()
+
+    def test_token_round_trip(self):
+        """Test de tokens con fechas serializados a JSON y de vuelta"""
+        for token in (dep_incidencia(7, date(2025, 2, 3)), dep_correccion(date(2025, 2, 10)),
+                      dep_eventos(7, QUINCENA_KEY), dep_biostar(7)):
+            assert decodificar_token(json.loads(json.dumps(codificar_token(token)))) == token
+
+    def test_tokens_are_published(self, publicados):
+        """Test de tokens invalidados publicados para los demás procesos"""
+        invalidar_cache_compartida([dep_incidencia(7, date(2025, 2, 3))], kinds=['biostar'])
+
+        assert publicados == [{'deps': [['incidencia', 7, '2025-02-03']], 'dep_kinds': ['biostar']}]
+
+    def test_remote_message_evicts_local_entries(self, app):
+        """Test de mensaje de otro proceso que expulsa las entradas dependientes"""
+        quincena_cache.set(('resultado', 7), 'a', dependencias_quincena(7, QUINCENA, QUINCENA_KEY))
+        quincena_cache.set(('resultado', 8), 'b', dependencias_quincena(8, QUINCENA, QUINCENA_KEY))
+        quincena_cache.set(('eventos', 9, QUINCENA_KEY), 'c', [dep_biostar(9)])
+        cache = cache_module.cache_manager
+
+        mensaje = {'origin': 'otro', 'deps': [codificar_token(dep_incidencia(7, date(2025, 2, 3)))]}
+        cache._on_invalidation({'data': json.dumps(mensaje)})
+        assert quincena_cache.get(('resultado', 7)) is None
+        assert quincena_cache.get(('resultado', 8)) == 'b'
+
+        cache._on_invalidation({'data': json.dumps({'origin': 'otro', 'dep_kinds': ['biostar']})})
+        assert quincena_cache.get(('eventos', 9, QUINCENA_KEY)) is None
+        quincena_cache.clear()
@@ -0,0 +1,51 @@
+"""
+Tests para la escritura de ZIP en streaming.
+"""
+import io
+import zipfile
+
+from webapp.zip_stream import stream_zip, content_disposition
+
+
+class TestStreamZip:
+    """Tests de stream_zip."""
+
+    def test_produces_valid_archive(self):
+        """Test de ZIP válido armado a partir de los fragmentos"""
+        data = b''.join(stream_zip([('a.xlsx', b'PK contenido'), ('notas.txt', b'texto ' * 100)]))
+
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert zf.testzip() is None
+            assert zf.read('a.xlsx') == b'PK contenido'
+            assert zf.getinfo('a.xlsx').compress_type == zipfile.ZIP_STORED
+            assert zf.getinfo('notas.txt').compress_type == zipfile.ZIP_DEFLATED
+
+    def test_streams_before_all_members_exist(self):
+        """Test de primer fragmento enviado antes de generar el siguiente miembro"""
+        generados = []
+
+        def miembros():
+            for i in range(3):
+                generados.append(i)
+                yield f'doc_{i}.xlsx', b'x' * 10
+
+        stream = stream_zip(miembros())
+        primero = next(stream)
+
+        assert primero.startswith(b'PK')
+        assert generados == [0]
+        list(stream)
+        assert generados == [0, 1, 2]
+
+    def test_chunks_are_bounded(self):
+        """Test de fragmentos con tamaño máximo"""
+        chunks = list(stream_zip([('grande.xlsx', b'0' * 10000)], chunk_size=1024))
+        assert all(len(chunk) <= 1024 for chunk in chunks)
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as zf:
+            assert len(zf.read('grande.xlsx')) == 10000
+
+    def test_content_disposition_non_ascii(self):
+        """Test de cabecera de descarga con nombre no ASCII"""
+        header = content_disposition('MOVPER_Raúl_Peña.zip')
+        assert header.startswith('attachment; filename="MOVPER_Ral_Pea.zip"')
+        assert "filename*=UTF-8''MOVPER_Ra%C3%BAl_Pe%C3%B1a.zip" in header
@@ -24,11 +24,12 @@ from webapp.models import (
     MobPerUser, PresetUsuario, IncidenciaDia
 )
 from webapp.realtime_monitor import RealtimeMonitor
+from webapp.presence_index import PresenceIngestor, presence_index
 from webapp.realtime_sse import RealtimeSSE, create_sse_response
 from webapp.cache_manager import init_cache, cache_manager, cached
 from webapp.monitoring import init_monitoring, monitor_error, monitor_event
 from webapp.pagination import paginate_list
-from src.api.device_monitor import DeviceMonitor, EVENT_CODES
+from src.api.device_monitor import DeviceMonitor, EVENT_CODES, register_device_enricher
 from src.utils.config import Config
 
 try:
@@ -261,10 +262,33 @@ def get_monitor():
     return monitor
 
 
+def merge_device_configs(devices):
+    """
+    Agrega la configuración local (DeviceConfig) a los dispositivos del registro compartido.
+    Se ejecuta al construir el registro, posiblemente en un hilo en segundo plano.
+    """
+    with app.app_context():
+        configs = {
+            str(c.device_id): (c.device_type, c.alias, c.category_id)
+            for c in DeviceConfig.query.all()
+        }
+    for device in devices:
+        device_type, alias, category_id = configs.get(str(device.get('id')), ('checador', None, None))
+        device['device_type'] = device_type or 'checador'
+        device['config_alias'] = alias
+        device['category_id'] = category_id
+
+
+register_device_enricher(merge_device_configs)
+
+
 # Initialize real-time monitor
 realtime_monitor = RealtimeMonitor(socketio, get_monitor)
 realtime_monitor.start()
 
+# Ingesta de presencia (se inicia bajo demanda desde los streams de emergencias)
+presence_ingestor = PresenceIngestor(get_monitor, presence_index)
+
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -629,6 +653,23 @@ def dashboard():
                            lazy_load=True)  # Flag para carga lazy
 
 
+# Vigencia del resumen por dispositivo del dashboard (eventos del día)
+DEVICE_SUMMARY_CACHE_TTL = 60
+
+
+def _device_summary_key(device_id) -> str:
+    """Clave del resumen del día de un dispositivo (cambia con la fecha local)."""
+    return f"device_summary:{device_id}:{datetime.now(MEXICO_TZ).date().isoformat()}"
+
+
+def _cacheable_summary(summary: dict) -> dict:
+    """Convierte los Timestamp de pandas del resumen a datetime para poder cachearlo."""
+    return {
+        k: v.to_pydatetime() if hasattr(v, 'to_pydatetime') else v
+        for k, v in summary.items()
+    }
+
+
 @app.route('/api/dashboard-data')
 @login_required
 def api_dashboard_data():
@@ -658,15 +699,6 @@ def api_dashboard_data():
                 'total_devices': 0
             })
         
-        # Get device configurations
-        device_configs = {}
-        try:
-            for config in DeviceConfig.query.all():
-                device_configs[config.device_id] = config
-                device_configs[str(config.device_id)] = config
-        except Exception as e:
-            logger.error(f"Error cargando configuraciones de dispositivos: {e}")
-        
         # Filtrar según permisos
         if current_user.is_admin or current_user.can_see_all_events:
             devices = all_devices
@@ -683,25 +715,43 @@ def api_dashboard_data():
             try:
                 summary, user_ids = monitor.get_debug_summary_with_users(device['id'])
                 summary['total_events'] = summary.get('access_granted', 0)
-                return device['id'], summary, user_ids
+                return device['id'], _cacheable_summary(summary), user_ids, True
             except Exception as e:
                 logger.error(f"Error obteniendo resumen del dispositivo {device.get('id')}: {e}")
-                return device.get('id'), {'access_granted': 0, 'unique_users': 0, 'total_events': 0}, set()
+                return device.get('id'), {'access_granted': 0, 'unique_users': 0, 'total_events': 0}, set(), False
         
         total_granted = 0
         all_user_ids = set()
         device_summaries = {}
         
+        # Resúmenes ya cacheados: un solo viaje a Redis para todos los dispositivos
+        cache_mgr = app.extensions.get('cache_manager')
+        summary_keys = {d['id']: _device_summary_key(d['id']) for d in devices}
+        cached_summaries = cache_mgr.get_many(summary_keys.values()) if cache_mgr else {}
+        for device_id, key in summary_keys.items():
+            entry = cached_summaries.get(key)
+            if entry is not None:
+                device_summaries[device_id] = (entry['summary'], set(entry['user_ids']))
+        
+        pending = [d for d in devices if d['id'] not in device_summaries]
+        to_cache = {}
         with ThreadPoolExecutor(max_workers=8) as executor:
-            futures = {executor.submit(fetch_device_summary, d): d for d in devices}
+            futures = {executor.submit(fetch_device_summary, d): d for d in pending}
             for future in as_completed(futures):
                 try:
-                    device_id, summary, user_ids = future.result()
+                    device_id, summary, user_ids, ok = future.result()
                     device_summaries[device_id] = (summary, user_ids)
+                    if ok:
+                        to_cache[summary_keys[device_id]] = {'summary': summary, 'user_ids': sorted(user_ids)}
                 except Exception as e:
                     logger.error(f"Error procesando future: {e}")
                     continue
         
+        if cache_mgr and to_cache:
+            device_by_key = {key: device_id for device_id, key in summary_keys.items()}
+            cache_mgr.set_many(to_cache, ttl=DEVICE_SUMMARY_CACHE_TTL,
+                               tags={key: [f'device:{device_by_key[key]}'] for key in to_cache})
+        
         # Procesar resultados
         devices_data = []
         for device in devices:
@@ -710,14 +760,11 @@ def api_dashboard_data():
                 total_granted += summary.get('access_granted', 0)
                 all_user_ids.update(user_ids)
                 
-                config = device_configs.get(device.get('id')) or device_configs.get(str(device.get('id')))
-                device_type = config.device_type if config else 'checador'
-                
                 devices_data.append({
                     'id': device.get('id'),
                     'name': device.get('name', 'Sin nombre'),
-                    'alias': config.alias if config else None,
-                    'device_type': device_type,
+                    'alias': device.get('config_alias'),
+                    'device_type': device.get('device_type', 'checador'),
                     'summary': summary
                 })
             except Exception as e:
@@ -746,7 +793,7 @@ def debug_general():
         flash('Error al conectar con BioStar.', 'danger')
         return redirect(url_for('dashboard'))
     
-    devices = monitor.get_all_devices(refresh=True)
+    devices = monitor.get_all_devices()
     
     # Get summary for all devices
     all_summaries = []
@@ -772,10 +819,7 @@ def debug_device(device_id):
     # Get device config
     device_config = DeviceConfig.query.filter_by(device_id=device_id).first()
     
-    # Get all devices first to populate cache
-    all_devices = monitor.get_all_devices(refresh=True)
-    
-    # Get device info
+    # Get device info (registro compartido, sin llamar a la API)
     device = monitor.get_device_by_id(device_id)
     
     if not device:
@@ -952,6 +996,10 @@ def clear_device_cache(device_id):
             return jsonify({'error': 'Error al conectar con BioStar'}), 500
         
         # Clear any cached data (if your monitor has cache)
+        cache_mgr = app.extensions.get('cache_manager')
+        if cache_mgr:
+            cache_mgr.invalidate_tags(f'device:{device_id}')
+        
         # Force re-authentication
         monitor.client.session_id = None
         monitor.client.session_expires = None
@@ -1294,9 +1342,8 @@ def user_create():
         for device in devices:
             if 'id' in device:
                 device['id'] = int(device['id'])
-            config = DeviceConfig.query.filter_by(device_id=device.get('id')).first()
-            if config and config.alias:
-                device['alias'] = config.alias
+            if device.get('config_alias'):
+                device['alias'] = device['config_alias']
     
     return render_template('user_form.html', user=None, action='create', 
                            devices=devices, assigned_devices=[])
@@ -1366,9 +1413,8 @@ def user_edit(user_id):
         devices = monitor.get_all_devices() or []
         # Enrich with local config
         for device in devices:
-            config = DeviceConfig.query.filter_by(device_id=device.get('id')).first()
-            if config and config.alias:
-                device['alias'] = config.alias
+            if device.get('config_alias'):
+                device['alias'] = device['config_alias']
     
     # Get assigned device IDs (as integers)
     assigned_devices = [p.device_id for p in user.device_permissions.all()]
@@ -1466,7 +1512,7 @@ def api_devices():
     if not monitor:
         return jsonify({'error': 'Error al conectar con BioStar'}), 500
     
-    devices = monitor.get_all_devices(refresh=True)
+    devices = monitor.get_all_devices()
     return jsonify(devices)
 
 
@@ -1622,6 +1668,7 @@ def config_device_save(device_id):
         print(f"[CONFIG] Valores: alias={config.alias}, location={config.location}, type={config.device_type}")
         
         db.session.commit()
+        DeviceMonitor.invalidate_device_registry()
         print(f"[CONFIG] Guardado exitoso para {device_id}")
         
         return jsonify({'success': True, 'message': 'Configuración guardada'})
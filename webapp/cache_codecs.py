@@ -0,0 +1,258 @@
+"""
+Codecs de serialización y compresión para los valores del caché.
+
+Cada valor guardado en Redis lleva una cabecera de 3 bytes:
+  b'\x00' + id del codec + id de la compresión
+Los valores sin cabecera (escritos antes como JSON) se siguen leyendo.
+
+Codecs:
+  json     compatible con otros lenguajes, pierde tipos (datetime -> str)
+  pickle   conserva tipos; solo deserializa clases registradas (ver register_cache_type),
+           incluidos datetime con zona horaria pytz o zoneinfo
+  msgpack  si está instalado; datetime/date/time/set se conservan con tipos extendidos
+Compresión (por encima de un umbral): zlib o zstd si está instalado.
+"""
+import io
+import json
+import logging
+import pickle
+import zlib
+from datetime import date, datetime, time as dt_time
+from typing import Any, Dict, Tuple
+from zoneinfo import ZoneInfo
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+HEADER_MAGIC = 0
+HEADER_SIZE = 3
+
+# Tamaño a partir del cual se comprime el valor serializado
+COMPRESS_THRESHOLD = 1024
+
+
+class CacheCodecError(Exception):
+    """Error al serializar o deserializar un valor del caché."""
+
+
+# =============================================================================
+# PICKLE RESTRINGIDO
+# =============================================================================
+
+# Clases que pickle puede reconstruir al leer del caché
+_ALLOWED_GLOBALS = {
+    ('builtins', 'set'), ('builtins', 'frozenset'), ('builtins', 'bytearray'),
+    ('builtins', 'complex'), ('builtins', 'range'), ('builtins', 'slice'),
+    ('datetime', 'date'), ('datetime', 'datetime'), ('datetime', 'time'),
+    ('datetime', 'timedelta'), ('datetime', 'timezone'),
+    ('decimal', 'Decimal'), ('uuid', 'UUID'),
+    ('collections', 'OrderedDict'), ('collections', 'defaultdict'), ('collections', 'deque'),
+    ('pytz', '_p'), ('pytz', '_UTC'),
+    ('zoneinfo', 'ZoneInfo'), ('zoneinfo._zoneinfo', 'ZoneInfo'),
+}
+
+
+def _zoneinfo_getattr(obj, name):
+    """
+    getattr restringido: ZoneInfo se serializa como getattr(ZoneInfo, '_unpickle').
+    Cualquier otro uso de builtins.getattr se rechaza.
+    """
+    if obj is ZoneInfo and name == '_unpickle':
+        return ZoneInfo._unpickle
+    raise CacheCodecError(f"Atributo no permitido en caché: {getattr(obj, '__name__', obj)}.{name}")
+
+
+def register_cache_type(cls):
+    """
+    Permite que una clase propia se deserialice desde el caché con el codec pickle.
+
+    Args:
+        cls: Clase a registrar (se puede usar como decorador)
+
+    Returns:
+        La misma clase
+    """
+    _ALLOWED_GLOBALS.add((cls.__module__, cls.__qualname__))
+    return cls
+
+
+class _RestrictedUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) == ('builtins', 'getattr'):
+            return _zoneinfo_getattr
+        if (module, name) not in _ALLOWED_GLOBALS:
+            raise CacheCodecError(f"Tipo no permitido en caché: {module}.{name}")
+        return super().find_class(module, name)
+
+
+class JSONCodec:
+    name = 'json'
+    codec_id = 1
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value, default=str, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class PickleCodec:
+    name = 'pickle'
+    codec_id = 2
+
+    def dumps(self, value: Any) -> bytes:
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data: bytes) -> Any:
+        return _RestrictedUnpickler(io.BytesIO(data)).load()
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+    codec_id = 3
+
+    _EXT_DATETIME = 1
+    _EXT_DATE = 2
+    _EXT_TIME = 3
+    _EXT_SET = 4
+
+    def _default(self, obj):
+        if isinstance(obj, datetime):
+            return msgpack.ExtType(self._EXT_DATETIME, obj.isoformat().encode())
+        if isinstance(obj, date):
+            return msgpack.ExtType(self._EXT_DATE, obj.isoformat().encode())
+        if isinstance(obj, dt_time):
+            return msgpack.ExtType(self._EXT_TIME, obj.isoformat().encode())
+        if isinstance(obj, (set, frozenset)):
+            return msgpack.ExtType(self._EXT_SET, self.dumps(list(obj)))
+        return str(obj)
+
+    def _ext_hook(self, code, data):
+        if code == self._EXT_DATETIME:
+            return datetime.fromisoformat(data.decode())
+        if code == self._EXT_DATE:
+            return date.fromisoformat(data.decode())
+        if code == self._EXT_TIME:
+            return dt_time.fromisoformat(data.decode())
+        if code == self._EXT_SET:
+            return set(self.loads(data))
+        return msgpack.ExtType(code, data)
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value, default=self._default, use_bin_type=True, strict_types=False)
+
+    def loads(self, data: bytes) -> Any:
+        # strict_map_key=False: las claves date de un dict vuelven como date
+        return msgpack.unpackb(data, ext_hook=self._ext_hook, raw=False, strict_map_key=False)
+
+
+CODECS: Dict[str, Any] = {'json': JSONCodec(), 'pickle': PickleCodec()}
+if MSGPACK_AVAILABLE:
+    CODECS['msgpack'] = MsgpackCodec()
+_CODECS_BY_ID = {codec.codec_id: codec for codec in CODECS.values()}
+
+
+# =============================================================================
+# COMPRESIÓN
+# =============================================================================
+
+_COMPRESSION_NONE = 0
+_COMPRESSION_ZLIB = 1
+_COMPRESSION_ZSTD = 2
+
+COMPRESSIONS = {'none': _COMPRESSION_NONE, 'zlib': _COMPRESSION_ZLIB}
+if ZSTD_AVAILABLE:
+    COMPRESSIONS['zstd'] = _COMPRESSION_ZSTD
+    _zstd_compressor = zstandard.ZstdCompressor(level=3)
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+
+
+def _compress(data: bytes, compression: int) -> bytes:
+    if compression == _COMPRESSION_ZLIB:
+        return zlib.compress(data, 1)
+    if compression == _COMPRESSION_ZSTD:
+        return _zstd_compressor.compress(data)
+    return data
+
+
+def _decompress(data: bytes, compression: int) -> bytes:
+    if compression == _COMPRESSION_ZLIB:
+        return zlib.decompress(data)
+    if compression == _COMPRESSION_ZSTD:
+        if not ZSTD_AVAILABLE:
+            raise CacheCodecError("Valor comprimido con zstd pero zstandard no está instalado")
+        return _zstd_decompressor.decompress(data)
+    return data
+
+
+class NamespaceCodec:
+    """Codec y compresión de un namespace del caché."""
+
+    def __init__(self, codec: str = 'pickle', compression: str = 'zlib',
+                 threshold: int = COMPRESS_THRESHOLD):
+        """
+        Args:
+            codec: 'json', 'pickle' o 'msgpack' (si está instalado)
+            compression: 'none', 'zlib' o 'zstd' (si está instalado)
+            threshold: Bytes a partir de los cuales se comprime
+        """
+        if codec not in CODECS:
+            logger.warning(f"⚠ Codec de caché '{codec}' no disponible, usando pickle")
+            codec = 'pickle'
+        if compression not in COMPRESSIONS:
+            logger.warning(f"⚠ Compresión de caché '{compression}' no disponible, usando zlib")
+            compression = 'zlib'
+        self.codec = CODECS[codec]
+        self.compression = COMPRESSIONS[compression]
+        self.threshold = threshold
+
+    def encode(self, value: Any) -> bytes:
+        """Serializa (y comprime si supera el umbral) un valor."""
+        data = self.codec.dumps(value)
+        compression = _COMPRESSION_NONE
+        if self.compression != _COMPRESSION_NONE and len(data) >= self.threshold:
+            compressed = _compress(data, self.compression)
+            if len(compressed) < len(data):
+                data, compression = compressed, self.compression
+        return bytes((HEADER_MAGIC, self.codec.codec_id, compression)) + data
+
+    def describe(self) -> Tuple[str, str]:
+        compression = next(k for k, v in COMPRESSIONS.items() if v == self.compression)
+        return self.codec.name, compression
+
+
+def decode(data: bytes) -> Any:
+    """
+    Deserializa un valor del caché según su cabecera (o como JSON si no la tiene).
+
+    Raises:
+        CacheCodecError: Si el valor no se puede leer
+    """
+    if isinstance(data, str) or not data or data[0] != HEADER_MAGIC:
+        # Valor sin cabecera escrito como JSON por versiones anteriores
+        try:
+            return json.loads(data)
+        except ValueError as e:
+            raise CacheCodecError(f"Valor de caché sin cabecera ilegible: {e}") from e
+    if len(data) < HEADER_SIZE:
+        raise CacheCodecError("Cabecera de caché incompleta")
+    codec = _CODECS_BY_ID.get(data[1])
+    if codec is None:
+        raise CacheCodecError(f"Codec de caché desconocido: {data[1]}")
+    try:
+        return codec.loads(_decompress(data[HEADER_SIZE:], data[2]))
+    except CacheCodecError:
+        raise
+    except Exception as e:
+        raise CacheCodecError(f"Valor de caché corrupto: {e}") from e
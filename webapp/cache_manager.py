@@ -1,11 +1,28 @@
 """
 Sistema de caché inteligente con Redis para optimizar performance.
 Incluye estrategias de invalidación y TTL configurables.
+
+Dos niveles:
+  L1: LRU en memoria del proceso, acotada por entradas y bytes, con TTL por entrada.
+  L2: Redis (si está disponible), compartido entre procesos.
+Cada escritura o borrado publica un mensaje en Redis para que los demás procesos
+descarten su copia en L1.
+
+Las entradas se pueden registrar con tags ('device:12', 'user:45',
+'quincena:2026-10-1') para invalidarlas en grupo con invalidate_tags().
 """
+import fnmatch
 import json
 import logging
-from datetime import datetime, timedelta
-from typing import Any, Optional, Callable
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Callable, Set
 from functools import wraps
 import hashlib
 
@@ -15,39 +32,327 @@ try:
 except ImportError:
     REDIS_AVAILABLE = False
 
+from webapp.cache_codecs import NamespaceCodec, CacheCodecError, decode as decode_value
+
 logger = logging.getLogger(__name__)
 
+# Codec y compresión por defecto de los valores (ver webapp/cache_codecs.py)
+DEFAULT_CODEC = os.environ.get('CACHE_CODEC', 'pickle')
+DEFAULT_COMPRESSION = os.environ.get('CACHE_COMPRESSION', 'zlib')
+
+# Límites de la caché L1 en memoria (configurables por entorno)
+L1_MAX_ENTRIES = int(os.environ.get('CACHE_L1_MAX_ENTRIES', 5000))
+L1_MAX_BYTES = int(float(os.environ.get('CACHE_L1_MAX_MB', 64)) * 1024 * 1024)
+# Vigencia máxima en L1 de un valor leído de Redis (acota la inconsistencia si se pierde un mensaje)
+L1_TTL = int(os.environ.get('CACHE_L1_TTL', 30))
+
+# Prefijo de todas las claves en Redis: limpiar el caché no toca datos ajenos
+KEY_PREFIX = os.environ.get('CACHE_KEY_PREFIX', 'biostar:')
+TAG_PREFIX = 'tag:'
+# Claves por lote al borrar con SCAN/UNLINK
+SCAN_BATCH_SIZE = 500
+
+# Registra la clave en un tag y extiende la vida del tag hasta la de su clave más longeva
+_TAG_ADD_SCRIPT = """
+redis.call('sadd', KEYS[1], ARGV[1])
+if redis.call('ttl', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('expire', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+# Canal de Redis para las invalidaciones entre procesos
+INVALIDATION_CHANNEL = 'cache:invalidate'
+
+# Callbacks que reciben cada invalidación de otro proceso (cachés locales de otros módulos)
+_invalidation_listeners: List[Callable[[dict], None]] = []
+
+
+def add_invalidation_listener(callback: Callable[[dict], None]):
+    """
+    Registra un callback para las invalidaciones publicadas por otros procesos.
+
+    Args:
+        callback: Función que recibe el mensaje decodificado (sin los de este proceso)
+    """
+    if callback not in _invalidation_listeners:
+        _invalidation_listeners.append(callback)
+
+# Candado distribuido para recalcular una clave (protección contra estampida)
+LOCK_PREFIX = 'lock:'
+LOCK_TIMEOUT = 30          # segundos que dura el candado si el proceso muere
+LOCK_WAIT_TIMEOUT = 10     # segundos que se espera el valor calculado por otro
+LOCK_POLL_INTERVAL = 0.05
+
+# Libera el candado solo si sigue siendo nuestro
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class LRUMemoryCache:
+    """
+    Caché LRU en memoria con TTL por entrada y presupuesto de bytes.
+
+    Los valores se devuelven tal cual (sin copiar), igual que el fallback en
+    memoria anterior: quien los lea no debe mutarlos.
+    """
+
+    def __init__(self, max_entries: int = L1_MAX_ENTRIES, max_bytes: int = L1_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()  # key -> (value, expires_at, size, tags)
+        self._tags: Dict[str, Set[str]] = {}  # tag -> claves
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Obtiene un valor vigente o `default`."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, value: Any, ttl: float, size: int, tags: Iterable[str] = ()):
+        """
+        Guarda un valor.
+
+        Args:
+            key: Clave
+            value: Valor a guardar
+            ttl: Segundos de vigencia
+            size: Tamaño aproximado en bytes (el del valor serializado)
+            tags: Tags con los que se puede invalidar la entrada
+        """
+        if size > self.max_bytes:
+            self.delete(key)
+            return
+        tags = frozenset(tags)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl, size, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            self._bytes += size
+            self._evict()
+
+    def _remove(self, key: str):
+        _, _, size, tags = self._entries.pop(key)
+        self._bytes -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _evict(self):
+        """Expulsa expiradas y, si sigue excedida, las menos usadas (requiere lock)."""
+        if len(self._entries) <= self.max_entries and self._bytes <= self.max_bytes:
+            return
+        now = time.monotonic()
+        for key in [k for k, entry in self._entries.items() if entry[1] <= now]:
+            self._remove(key)
+            self.evictions += 1
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                return True
+            return False
+
+    def delete_tag(self, tag: str) -> List[str]:
+        """Elimina las entradas de un tag y devuelve sus claves."""
+        with self._lock:
+            keys = list(self._tags.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            return keys
+
+    def delete_matching(self, predicate: Callable[[str], bool]) -> int:
+        with self._lock:
+            keys = [k for k in self._entries if predicate(k)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'tags': len(self._tags),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / total, 4) if total else 0,
+            }
+
+
+_MISSING = object()
+
 
 class CacheManager:
     """Gestor de caché con Redis y fallback a memoria."""
     
-    def __init__(self, redis_url: str = 'redis://localhost:6379/0', enabled: bool = True):
+    def __init__(self, redis_url: str = 'redis://localhost:6379/0', enabled: bool = True,
+                 l1_max_entries: int = L1_MAX_ENTRIES, l1_max_bytes: int = L1_MAX_BYTES,
+                 l1_ttl: int = L1_TTL):
         """
         Inicializa el gestor de caché.
         
         Args:
             redis_url: URL de conexión a Redis
             enabled: Si el caché está habilitado
+            l1_max_entries: Máximo de entradas en la caché L1 en memoria
+            l1_max_bytes: Presupuesto de bytes de la caché L1
+            l1_ttl: Vigencia máxima en L1 de los valores guardados en Redis
         """
-        self.enabled = enabled and REDIS_AVAILABLE
+        self.enabled = enabled
         self.redis_client = None
-        self.memory_cache = {}  # Fallback cache
+        self.l1 = LRUMemoryCache(max_entries=l1_max_entries, max_bytes=l1_max_bytes)
+        self.l1_ttl = l1_ttl
+        self.default_codec = NamespaceCodec(DEFAULT_CODEC, DEFAULT_COMPRESSION)
+        self.namespace_codecs = {}
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.instance_id = uuid.uuid4().hex
+        self._pubsub = None
+        self._pubsub_thread = None
+        self._key_locks = {}  # key -> (Lock, usuarios)
+        self._key_locks_guard = threading.Lock()
+        self._refreshing = set()
+        self.stale_served = 0
+        self.refreshes = 0
         
-        if self.enabled:
+        if self.enabled and REDIS_AVAILABLE:
             try:
                 self.redis_client = redis.from_url(
                     redis_url,
-                    decode_responses=True,
+                    decode_responses=False,
                     socket_connect_timeout=2,
                     socket_timeout=2
                 )
                 # Test connection
                 self.redis_client.ping()
                 logger.info("✓ Redis conectado exitosamente")
+                self._subscribe_invalidations()
             except Exception as e:
                 logger.warning(f"⚠ Redis no disponible, usando caché en memoria: {e}")
                 self.redis_client = None
     
+    def _subscribe_invalidations(self):
+        """Escucha las invalidaciones publicadas por otros procesos."""
+        try:
+            self._pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(**{INVALIDATION_CHANNEL: self._on_invalidation})
+            self._pubsub_thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except Exception as e:
+            # Sin suscripción, L1 solo se acota por l1_ttl
+            logger.warning(f"⚠ No se pudo suscribir a invalidaciones de caché: {e}")
+            self._pubsub = None
+    
+    def _publish_invalidation(self, **message):
+        """Publica una invalidación para que los demás procesos limpien su L1."""
+        if not self.redis_client:
+            return
+        try:
+            message['origin'] = self.instance_id
+            self.redis_client.publish(INVALIDATION_CHANNEL, json.dumps(message))
+        except Exception as e:
+            logger.error(f"Error al publicar invalidación de caché: {e}")
+    
+    def publish_invalidation(self, **message):
+        """
+        Publica una invalidación propia de otro módulo en el canal compartido
+        (los campos extra llegan a los callbacks de add_invalidation_listener).
+        """
+        self._publish_invalidation(**message)
+    
+    def _on_invalidation(self, message):
+        """Aplica en L1 una invalidación recibida de otro proceso."""
+        try:
+            data = json.loads(message['data'])
+        except (TypeError, ValueError, KeyError):
+            return
+        if data.get('origin') == self.instance_id:
+            return
+        if data.get('clear'):
+            self.l1.clear()
+        for key in data.get('keys', ()):
+            self.l1.delete(key)
+        if data.get('pattern'):
+            self._delete_pattern_l1(data['pattern'])
+        for tag in data.get('tags', ()):
+            self.l1.delete_tag(tag)
+        for callback in list(_invalidation_listeners):
+            try:
+                callback(data)
+            except Exception as e:
+                logger.error(f"Error al aplicar invalidación remota: {e}")
+    
+    def close(self):
+        """Detiene el hilo de invalidaciones."""
+        if self._pubsub_thread is not None:
+            self._pubsub_thread.stop()
+            self._pubsub_thread = None
+    
+    def configure_namespace(self, namespace: str, codec: str = DEFAULT_CODEC,
+                            compression: str = DEFAULT_COMPRESSION, threshold: Optional[int] = None):
+        """
+        Elige el codec y la compresión de las claves de un namespace.
+        
+        Args:
+            namespace: Primer segmento de la clave (antes de ':')
+            codec: 'json', 'pickle' o 'msgpack'
+            compression: 'none', 'zlib' o 'zstd'
+            threshold: Bytes a partir de los cuales se comprime
+        """
+        kwargs = {'threshold': threshold} if threshold is not None else {}
+        self.namespace_codecs[namespace] = NamespaceCodec(codec, compression, **kwargs)
+    
+    def _codec_for(self, key: str) -> NamespaceCodec:
+        return self.namespace_codecs.get(key.split(':', 1)[0], self.default_codec)
+    
+    @staticmethod
+    def _rk(key: str) -> str:
+        """Clave en Redis."""
+        return KEY_PREFIX + key
+    
+    @staticmethod
+    def _tag_key(tag: str) -> str:
+        return KEY_PREFIX + TAG_PREFIX + tag
+    
     def _generate_key(self, prefix: str, *args, **kwargs) -> str:
         """Genera una clave única para el caché."""
         key_parts = [prefix] + [str(arg) for arg in args]
@@ -56,29 +361,47 @@ class CacheManager:
         return ':'.join(key_parts)
     
     def get(self, key: str) -> Optional[Any]:
-        """Obtiene un valor del caché."""
+        """Obtiene un valor del caché (L1 y después Redis)."""
         if not self.enabled:
             return None
         
+        value = self.l1.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        
+        if not self.redis_client:
+            return None
+        
         try:
-            if self.redis_client:
-                value = self.redis_client.get(key)
-                if value:
-                    return json.loads(value)
-            else:
-                # Fallback a memoria
-                if key in self.memory_cache:
-                    item = self.memory_cache[key]
-                    if item['expires_at'] > datetime.now():
-                        return item['value']
-                    else:
-                        del self.memory_cache[key]
+            serialized = self.redis_client.get(self._rk(key))
+            if serialized:
+                self.l2_hits += 1
+                try:
+                    value = decode_value(serialized)
+                except CacheCodecError as e:
+                    logger.warning(f"⚠ Valor de caché ilegible en {key}, se descarta: {e}")
+                    self.redis_client.delete(self._rk(key))
+                    self.l2_misses += 1
+                    return None
+                self.l1.set(key, value, self._l1_ttl_for(key), len(serialized))
+                return value
+            self.l2_misses += 1
         except Exception as e:
             logger.error(f"Error al obtener del caché: {e}")
         
         return None
     
-    def set(self, key: str, value: Any, ttl: int = 300) -> bool:
+    def _l1_ttl_for(self, key: str) -> float:
+        """Vigencia en L1 de un valor leído de Redis (no excede su TTL restante)."""
+        try:
+            remaining = self.redis_client.pttl(self._rk(key))
+            if remaining and remaining > 0:
+                return min(self.l1_ttl, remaining / 1000)
+        except Exception:
+            pass
+        return self.l1_ttl
+    
+    def set(self, key: str, value: Any, ttl: int = 300, tags: Iterable[str] = ()) -> bool:
         """
         Guarda un valor en el caché.
         
@@ -86,21 +409,25 @@ class CacheManager:
             key: Clave del caché
             value: Valor a guardar
             ttl: Tiempo de vida en segundos (default: 5 minutos)
+            tags: Tags para invalidar en grupo, p. ej. 'device:12', 'user:45'
         """
         if not self.enabled:
             return False
         
         try:
-            serialized = json.dumps(value, default=str)
+            serialized = self._codec_for(key).encode(value)
+            tags = tuple(tags)
             
             if self.redis_client:
-                self.redis_client.setex(key, ttl, serialized)
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.setex(self._rk(key), ttl, serialized)
+                for tag in tags:
+                    pipe.eval(_TAG_ADD_SCRIPT, 1, self._tag_key(tag), key, ttl)
+                pipe.execute()
+                self.l1.set(key, value, min(ttl, self.l1_ttl), len(serialized), tags)
+                self._publish_invalidation(keys=[key])
             else:
-                # Fallback a memoria
-                self.memory_cache[key] = {
-                    'value': value,
-                    'expires_at': datetime.now() + timedelta(seconds=ttl)
-                }
+                self.l1.set(key, value, ttl, len(serialized), tags)
             
             return True
         except Exception as e:
@@ -113,59 +440,422 @@ class CacheManager:
             return False
         
         try:
+            self.l1.delete(key)
             if self.redis_client:
-                self.redis_client.delete(key)
-            else:
-                self.memory_cache.pop(key, None)
+                self.redis_client.unlink(self._rk(key))
+                self._publish_invalidation(keys=[key])
             return True
         except Exception as e:
             logger.error(f"Error al eliminar del caché: {e}")
             return False
     
+    # =========================================================================
+    # OPERACIONES EN LOTE
+    # =========================================================================
+    
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Obtiene varias claves: primero de L1 y las faltantes de Redis en un solo viaje (MGET).
+        
+        Returns:
+            Diccionario {clave: valor} solo con las claves encontradas
+        """
+        if not self.enabled:
+            return {}
+        
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            value = self.l1.get(key, _MISSING)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        
+        if not missing or not self.redis_client:
+            return found
+        
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.mget([self._rk(key) for key in missing])
+            for key in missing:
+                pipe.pttl(self._rk(key))
+            results = pipe.execute()
+        except Exception as e:
+            logger.error(f"Error al obtener lote del caché: {e}")
+            return found
+        
+        corrupt = []
+        for key, serialized, remaining in zip(missing, results[0], results[1:]):
+            if not serialized:
+                self.l2_misses += 1
+                continue
+            try:
+                value = decode_value(serialized)
+            except CacheCodecError as e:
+                logger.warning(f"⚠ Valor de caché ilegible en {key}, se descarta: {e}")
+                corrupt.append(self._rk(key))
+                self.l2_misses += 1
+                continue
+            self.l2_hits += 1
+            l1_ttl = min(self.l1_ttl, remaining / 1000) if remaining and remaining > 0 else self.l1_ttl
+            self.l1.set(key, value, l1_ttl, len(serialized))
+            found[key] = value
+        
+        if corrupt:
+            try:
+                self.redis_client.unlink(*corrupt)
+            except Exception as e:
+                logger.error(f"Error al eliminar valores ilegibles del caché: {e}")
+        return found
+    
+    def set_many(self, mapping: Dict[str, Any], ttl: int = 300,
+                 tags: Optional[Dict[str, Iterable[str]]] = None) -> bool:
+        """
+        Guarda varias claves en un solo pipeline.
+        
+        Args:
+            mapping: Diccionario {clave: valor}
+            ttl: Tiempo de vida en segundos
+            tags: Tags por clave ({clave: [tags]})
+        """
+        if not self.enabled or not mapping:
+            return False
+        
+        tags = tags or {}
+        try:
+            encoded = {key: self._codec_for(key).encode(value) for key, value in mapping.items()}
+            
+            if self.redis_client:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for key, serialized in encoded.items():
+                    pipe.setex(self._rk(key), ttl, serialized)
+                    for tag in tags.get(key, ()):
+                        pipe.eval(_TAG_ADD_SCRIPT, 1, self._tag_key(tag), key, ttl)
+                pipe.execute()
+                l1_ttl = min(ttl, self.l1_ttl)
+                self._publish_invalidation(keys=list(encoded))
+            else:
+                l1_ttl = ttl
+            
+            for key, serialized in encoded.items():
+                self.l1.set(key, mapping[key], l1_ttl, len(serialized), tags.get(key, ()))
+            return True
+        except Exception as e:
+            logger.error(f"Error al guardar lote en caché: {e}")
+            return False
+    
+    def delete_many(self, keys: Iterable[str]) -> int:
+        """
+        Elimina varias claves con un solo UNLINK.
+        
+        Returns:
+            Número de claves eliminadas
+        """
+        if not self.enabled:
+            return 0
+        
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return 0
+        deleted = sum(1 for key in keys if self.l1.delete(key))
+        if not self.redis_client:
+            return deleted
+        
+        try:
+            deleted = self.redis_client.unlink(*[self._rk(key) for key in keys])
+            self._publish_invalidation(keys=keys)
+            return deleted
+        except Exception as e:
+            logger.error(f"Error al eliminar lote del caché: {e}")
+            return 0
+    
+    def invalidate_tags(self, *tags: str) -> int:
+        """
+        Elimina todas las entradas registradas bajo alguno de los tags.
+        
+        Con Redis lee los miembros de los tags y los borra con UNLINK en dos
+        pipelines: el costo es proporcional a las claves afectadas.
+        
+        Returns:
+            Número de claves eliminadas
+        """
+        if not self.enabled or not tags:
+            return 0
+        
+        local_keys = set()
+        for tag in tags:
+            local_keys.update(self.l1.delete_tag(tag))
+        
+        if not self.redis_client:
+            return len(local_keys)
+        
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for tag in tags:
+                pipe.smembers(self._tag_key(tag))
+            keys = set()
+            for members in pipe.execute():
+                keys.update(m.decode() if isinstance(m, bytes) else m for m in members)
+            
+            # Los valores llenados en L1 desde Redis no conocen sus tags:
+            # se borran por clave aquí y en los demás procesos
+            for key in keys:
+                self.l1.delete(key)
+            
+            pipe = self.redis_client.pipeline(transaction=False)
+            batch = [self._rk(key) for key in keys]
+            for i in range(0, len(batch), SCAN_BATCH_SIZE):
+                pipe.unlink(*batch[i:i + SCAN_BATCH_SIZE])
+            pipe.unlink(*[self._tag_key(tag) for tag in tags])
+            results = pipe.execute()
+            deleted = sum(results[:-1])
+            self._publish_invalidation(keys=sorted(keys | local_keys), tags=list(tags))
+            return deleted
+        except Exception as e:
+            logger.error(f"Error al invalidar tags del caché: {e}")
+            return 0
+    
+    def _delete_pattern_l1(self, pattern: str) -> int:
+        return self.l1.delete_matching(lambda key: fnmatch.fnmatchcase(key, pattern))
+    
+    def _scan_unlink(self, match: str) -> int:
+        """Borra incrementalmente (SCAN + UNLINK por lotes) las claves de Redis que coinciden."""
+        deleted = 0
+        batch = []
+        for redis_key in self.redis_client.scan_iter(match=match, count=SCAN_BATCH_SIZE):
+            batch.append(redis_key)
+            if len(batch) >= SCAN_BATCH_SIZE:
+                deleted += self.redis_client.unlink(*batch)
+                batch = []
+        if batch:
+            deleted += self.redis_client.unlink(*batch)
+        return deleted
+    
     def delete_pattern(self, pattern: str) -> int:
-        """Elimina todas las claves que coincidan con el patrón."""
+        """
+        Elimina todas las claves que coincidan con el patrón (glob, p. ej. 'devices:*').
+        
+        Recorre Redis con SCAN en lugar de KEYS para no bloquear el servidor;
+        cuando se pueda, usar invalidate_tags().
+        """
         if not self.enabled:
             return 0
         
         try:
+            deleted = self._delete_pattern_l1(pattern)
             if self.redis_client:
-                keys = self.redis_client.keys(pattern)
-                if keys:
-                    return self.redis_client.delete(*keys)
-            else:
-                # Fallback a memoria
-                keys_to_delete = [k for k in self.memory_cache.keys() if pattern.replace('*', '') in k]
-                for key in keys_to_delete:
-                    del self.memory_cache[key]
-                return len(keys_to_delete)
+                self._publish_invalidation(pattern=pattern)
+                return self._scan_unlink(self._rk(pattern))
+            return deleted
         except Exception as e:
             logger.error(f"Error al eliminar patrón del caché: {e}")
         
         return 0
     
     def clear_all(self) -> bool:
-        """Limpia todo el caché."""
+        """Limpia todo el caché (solo las claves con KEY_PREFIX, sin FLUSHDB)."""
         if not self.enabled:
             return False
         
         try:
+            self.l1.clear()
             if self.redis_client:
-                self.redis_client.flushdb()
-            else:
-                self.memory_cache.clear()
+                self._scan_unlink(KEY_PREFIX + '*')
+                self._publish_invalidation(clear=True)
             logger.info("✓ Caché limpiado completamente")
             return True
         except Exception as e:
             logger.error(f"Error al limpiar caché: {e}")
             return False
     
+    # =========================================================================
+    # PROTECCIÓN CONTRA ESTAMPIDA (stale-while-revalidate)
+    # =========================================================================
+    
+    @contextmanager
+    def _local_lock(self, key: str):
+        """Candado por clave dentro del proceso (se descarta cuando nadie lo usa)."""
+        with self._key_locks_guard:
+            lock, users = self._key_locks.get(key, (None, 0))
+            lock = lock or threading.Lock()
+            self._key_locks[key] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._key_locks_guard:
+                lock, users = self._key_locks[key]
+                if users == 1:
+                    del self._key_locks[key]
+                else:
+                    self._key_locks[key] = (lock, users - 1)
+    
+    def _try_lock(self, key: str) -> Optional[str]:
+        """
+        Reserva el recálculo de una clave en este proceso y, con Redis, en todos.
+        
+        Returns:
+            Token del candado o None si otro ya lo está recalculando
+        """
+        with self._key_locks_guard:
+            if key in self._refreshing:
+                return None
+            self._refreshing.add(key)
+        
+        token = uuid.uuid4().hex
+        if self.redis_client:
+            try:
+                if not self.redis_client.set(self._rk(LOCK_PREFIX + key), token, nx=True, px=LOCK_TIMEOUT * 1000):
+                    with self._key_locks_guard:
+                        self._refreshing.discard(key)
+                    return None
+            except Exception as e:
+                # Sin Redis el candado local sigue evitando la estampida en este proceso
+                logger.error(f"Error al adquirir candado de caché: {e}")
+        return token
+    
+    def _unlock(self, key: str, token: str):
+        with self._key_locks_guard:
+            self._refreshing.discard(key)
+        if self.redis_client:
+            try:
+                self.redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, self._rk(LOCK_PREFIX + key), token)
+            except Exception as e:
+                logger.error(f"Error al liberar candado de caché: {e}")
+    
+    @staticmethod
+    def _is_envelope(entry: Any) -> bool:
+        return isinstance(entry, dict) and entry.get('__swr__') == 1
+    
+    @staticmethod
+    def _needs_refresh(entry: dict, beta: float) -> bool:
+        """
+        Expiración suave con adelanto probabilístico (XFetch): cuanto más tarda
+        el cálculo y más cerca está la expiración, más probable es recalcular antes.
+        """
+        jitter = entry['delta'] * beta * -math.log(1.0 - random.random())
+        return time.time() + jitter >= entry['soft_expires']
+    
+    def _compute_and_store(self, key: str, compute: Callable, ttl: int, stale_ttl: int,
+                           tags: Iterable[str] = ()) -> Any:
+        start = time.perf_counter()
+        value = compute()
+        delta = time.perf_counter() - start
+        self.set(key, {
+            '__swr__': 1,
+            'value': value,
+            'soft_expires': time.time() + ttl,
+            'delta': delta,
+        }, ttl=ttl + stale_ttl, tags=tags)
+        self.refreshes += 1
+        return value
+    
+    def _refresh(self, key: str, compute: Callable, ttl: int, stale_ttl: int, token: str,
+                 tags: Iterable[str] = ()):
+        try:
+            self._compute_and_store(key, compute, ttl, stale_ttl, tags)
+        except Exception as e:
+            logger.error(f"Error al refrescar caché {key}: {e}")
+        finally:
+            self._unlock(key, token)
+    
+    def _wait_for(self, key: str) -> Any:
+        """Espera el valor que otro proceso está calculando."""
+        deadline = time.monotonic() + LOCK_WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            entry = self.get(key)
+            if self._is_envelope(entry):
+                return entry['value']
+        return _MISSING
+    
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: int = 300,
+                       stale_ttl: Optional[int] = None, beta: float = 1.0,
+                       background: bool = True, tags: Iterable[str] = ()) -> Any:
+        """
+        Obtiene un valor calculándolo una sola vez aunque haya peticiones concurrentes.
+        
+        Tras `ttl` el valor queda obsoleto pero se sigue sirviendo hasta
+        `ttl + stale_ttl` mientras un único hilo (con Redis, un único proceso)
+        lo recalcula.
+        
+        Args:
+            key: Clave del caché
+            compute: Función sin argumentos que calcula el valor
+            ttl: Segundos de vigencia (expiración suave)
+            stale_ttl: Segundos extra en que se sirve el valor obsoleto (default: ttl)
+            beta: Factor de adelanto probabilístico de la expiración (0 = sin adelanto)
+            background: Recalcular en un hilo en segundo plano en lugar de en la petición
+            tags: Tags con los que se registra el valor
+        
+        Returns:
+            Valor cacheado o recién calculado
+        """
+        if not self.enabled:
+            return compute()
+        
+        stale_ttl = ttl if stale_ttl is None else stale_ttl
+        tags = tuple(tags)
+        entry = self.get(key)
+        
+        if self._is_envelope(entry):
+            if not self._needs_refresh(entry, beta):
+                return entry['value']
+            
+            token = self._try_lock(key)
+            if token is None:
+                # Otro ya está recalculando: se sirve el valor obsoleto
+                self.stale_served += 1
+                return entry['value']
+            
+            if background:
+                self.stale_served += 1
+                threading.Thread(
+                    target=self._refresh, args=(key, compute, ttl, stale_ttl, token, tags), daemon=True
+                ).start()
+                return entry['value']
+            try:
+                return self._compute_and_store(key, compute, ttl, stale_ttl, tags)
+            finally:
+                self._unlock(key, token)
+        
+        # Sin valor: solo uno calcula, los demás esperan su resultado
+        with self._local_lock(key):
+            entry = self.get(key)
+            if self._is_envelope(entry):
+                return entry['value']
+            
+            token = self._try_lock(key)
+            if token is None:
+                value = self._wait_for(key)
+                if value is not _MISSING:
+                    return value
+            try:
+                return self._compute_and_store(key, compute, ttl, stale_ttl, tags)
+            finally:
+                if token is not None:
+                    self._unlock(key, token)
+    
     def get_stats(self) -> dict:
-        """Obtiene estadísticas del caché."""
+        """Obtiene estadísticas del caché, con la tasa de aciertos de cada nivel."""
+        l1_stats = self.l1.get_stats()
+        l2_total = self.l2_hits + self.l2_misses
+        lookups = l1_stats['hits'] + l1_stats['misses']
         stats = {
             'enabled': self.enabled,
             'backend': 'redis' if self.redis_client else 'memory',
             'keys_count': 0,
-            'memory_usage': 0
+            'memory_usage': 0,
+            'l1': l1_stats,
+            'l2': {
+                'hits': self.l2_hits,
+                'misses': self.l2_misses,
+                'hit_ratio': round(self.l2_hits / l2_total, 4) if l2_total else 0,
+            },
+            'hit_ratio': round((l1_stats['hits'] + self.l2_hits) / lookups, 4) if lookups else 0,
+            'stale_served': self.stale_served,
+            'refreshes': self.refreshes,
         }
         
         try:
@@ -174,25 +864,37 @@ class CacheManager:
                 stats['keys_count'] = self.redis_client.dbsize()
                 stats['memory_usage'] = info.get('used_memory_human', 'N/A')
             else:
-                stats['keys_count'] = len(self.memory_cache)
+                stats['keys_count'] = len(self.l1)
+                stats['memory_usage'] = l1_stats['bytes']
         except Exception as e:
             logger.error(f"Error al obtener estadísticas: {e}")
         
         return stats
 
 
-def cached(ttl: int = 300, key_prefix: str = 'cache'):
+def cached(ttl: int = 300, key_prefix: str = 'cache', stale_ttl: Optional[int] = None,
+           beta: float = 1.0, background: bool = True,
+           tags: Optional[Callable[..., Iterable[str]]] = None):
     """
     Decorador para cachear resultados de funciones.
     
+    Cuando el valor expira se sigue sirviendo (hasta `stale_ttl` segundos más)
+    mientras una sola ejecución lo recalcula; ver CacheManager.get_or_compute.
+    El recálculo en segundo plano corre con contexto de aplicación, sin el de
+    la petición; usar background=False si la función depende de `request`.
+    
     Args:
         ttl: Tiempo de vida en segundos
         key_prefix: Prefijo para la clave del caché
+        stale_ttl: Segundos en que se sirve el valor obsoleto (default: ttl)
+        beta: Factor de expiración anticipada probabilística (0 = desactivada)
+        background: Recalcular en segundo plano
+        tags: Función que recibe los mismos argumentos y devuelve los tags del valor
     
     Example:
-        @cached(ttl=600, key_prefix='devices')
-        def get_all_devices():
-            return expensive_operation()
+        @cached(ttl=600, key_prefix='devices', tags=lambda device_id: [f'device:{device_id}'])
+        def get_device_summary(device_id):
+            return expensive_operation(device_id)
     """
     def decorator(func: Callable) -> Callable:
         @wraps(func)
@@ -211,18 +913,17 @@ def cached(ttl: int = 300, key_prefix: str = 'cache'):
                 **kwargs
             )
             
-            # Intentar obtener del caché
-            cached_value = cache_manager.get(cache_key)
-            if cached_value is not None:
-                logger.debug(f"✓ Cache hit: {cache_key}")
-                return cached_value
+            app = current_app._get_current_object()
             
-            # Ejecutar función y cachear resultado
-            logger.debug(f"✗ Cache miss: {cache_key}")
-            result = func(*args, **kwargs)
-            cache_manager.set(cache_key, result, ttl=ttl)
+            def compute():
+                logger.debug(f"✗ Cache miss: {cache_key}")
+                with app.app_context():
+                    return func(*args, **kwargs)
             
-            return result
+            return cache_manager.get_or_compute(
+                cache_key, compute, ttl=ttl, stale_ttl=stale_ttl, beta=beta, background=background,
+                tags=tags(*args, **kwargs) if tags else ()
+            )
         
         return wrapper
     return decorator
@@ -240,6 +941,9 @@ def init_cache(app, redis_url: str = None, enabled: bool = True):
         app: Instancia de Flask
         redis_url: URL de Redis (default: redis://localhost:6379/0)
         enabled: Si el caché está habilitado
+    
+    El codec de cada namespace se puede fijar en app.config['CACHE_NAMESPACE_CODECS'],
+    p. ej. {'events': {'codec': 'msgpack', 'compression': 'zstd'}}.
     """
     global cache_manager
     
@@ -247,6 +951,8 @@ def init_cache(app, redis_url: str = None, enabled: bool = True):
         redis_url = app.config.get('REDIS_URL', 'redis://localhost:6379/0')
     
     cache_manager = CacheManager(redis_url=redis_url, enabled=enabled)
+    for namespace, options in app.config.get('CACHE_NAMESPACE_CODECS', {}).items():
+        cache_manager.configure_namespace(namespace, **options)
     app.extensions['cache_manager'] = cache_manager
     
     logger.info(f"✓ Sistema de caché inicializado: {cache_manager.get_stats()}")
@@ -1,168 +1,173 @@
 """
 Calendario de Días Inhábiles Oficiales de México
 Incluye días festivos oficiales según la Ley Federal del Trabajo
+
+Los días se generan por reglas (fecha fija, n-ésimo lunes del mes y días
+relativos al Domingo de Pascua) para cualquier año, y se memorizan por año como
+frozenset para que la consulta sea O(1).
 """
 
-from datetime import date
-
-# Días inhábiles oficiales de México para 2026
-DIAS_INHABILES_2026 = [
-    # Año Nuevo
-    date(2026, 1, 1),
-    
-    # Día de la Constitución (primer lunes de febrero)
-    date(2026, 2, 2),
-    
-    # Natalicio de Benito Juárez (tercer lunes de marzo)
-    date(2026, 3, 16),
-    
-    # Jueves Santo (variable)
-    date(2026, 4, 2),
-    
-    # Viernes Santo (variable)
-    date(2026, 4, 3),
-    
-    # Día del Trabajo
-    date(2026, 5, 1),
-    
-    # Día de la Independencia
-    date(2026, 9, 16),
-    
-    # Revolución Mexicana (tercer lunes de noviembre)
-    date(2026, 11, 16),
-    
-    # Transmisión del Poder Ejecutivo Federal (cada 6 años)
-    # date(2024, 10, 1),  # Solo en años de cambio de gobierno
-    
-    # Navidad
-    date(2026, 12, 25),
-]
-
-# Días inhábiles oficiales de México para 2027
-DIAS_INHABILES_2027 = [
-    # Año Nuevo
-    date(2027, 1, 1),
-    
-    # Día de la Constitución (primer lunes de febrero)
-    date(2027, 2, 1),
-    
-    # Natalicio de Benito Juárez (tercer lunes de marzo)
-    date(2027, 3, 15),
-    
-    # Jueves Santo (variable)
-    date(2027, 3, 25),
-    
-    # Viernes Santo (variable)
-    date(2027, 3, 26),
-    
-    # Día del Trabajo
-    date(2027, 5, 1),
-    
-    # Día de la Independencia
-    date(2027, 9, 16),
-    
-    # Revolución Mexicana (tercer lunes de noviembre)
-    date(2027, 11, 15),
-    
-    # Navidad
-    date(2027, 12, 25),
-]
-
-# Días inhábiles oficiales de México para 2025
-DIAS_INHABILES_2025 = [
-    # Año Nuevo
-    date(2025, 1, 1),
-    
-    # Día de la Constitución (primer lunes de febrero)
-    date(2025, 2, 3),
-    
-    # Natalicio de Benito Juárez (tercer lunes de marzo)
-    date(2025, 3, 17),
-    
-    # Jueves Santo (variable)
-    date(2025, 4, 17),
-    
-    # Viernes Santo (variable)
-    date(2025, 4, 18),
-    
-    # Día del Trabajo
-    date(2025, 5, 1),
-    
-    # Día de la Independencia
-    date(2025, 9, 16),
-    
-    # Revolución Mexicana (tercer lunes de noviembre)
-    date(2025, 11, 17),
-    
-    # Navidad
-    date(2025, 12, 25),
-]
-
-# Diccionario completo por año
-DIAS_INHABILES_POR_ANIO = {
-    2025: DIAS_INHABILES_2025,
-    2026: DIAS_INHABILES_2026,
-    2027: DIAS_INHABILES_2027,
-}
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, Optional
+
+# Máximo de combinaciones (rango, lista del preset) memorizadas
+MAX_CONJUNTOS_EN_CACHE = 512
+
+
+def calcular_domingo_pascua(anio):
+    """
+    Calcula el Domingo de Pascua (calendario gregoriano, algoritmo anónimo).
+
+    Args:
+        anio (int): Año
+
+    Returns:
+        date: Fecha del Domingo de Pascua
+    """
+    a = anio % 19
+    b, c = divmod(anio, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mes, dia = divmod(h + l - 7 * m + 114, 31)
+    return date(anio, mes, dia + 1)
+
+
+def n_esimo_lunes(anio, mes, n):
+    """
+    Obtiene el n-ésimo lunes de un mes.
+
+    Args:
+        anio (int): Año
+        mes (int): Mes (1-12)
+        n (int): Ordinal del lunes (1 = primer lunes)
+
+    Returns:
+        date: Fecha del lunes
+    """
+    primero = date(anio, mes, 1)
+    return primero + timedelta(days=(7 - primero.weekday()) % 7 + 7 * (n - 1))
+
+
+def _transmision_poder_ejecutivo(anio):
+    """Fecha de transmisión del Poder Ejecutivo Federal si corresponde a ese año."""
+    # Desde 2024 es el 1 de octubre; antes, el 1 de diciembre (cada seis años)
+    if anio >= 2024 and (anio - 2024) % 6 == 0:
+        return date(anio, 10, 1)
+    if anio < 2024 and (anio - 2018) % 6 == 0:
+        return date(anio, 12, 1)
+    return None
+
+
+@lru_cache(maxsize=None)
+def _nombres_por_anio(anio) -> Dict[date, str]:
+    """Mapa {fecha: nombre} de los días inhábiles oficiales de un año."""
+    pascua = calcular_domingo_pascua(anio)
+    dias = {
+        date(anio, 1, 1): "Año Nuevo",
+        n_esimo_lunes(anio, 2, 1): "Día de la Constitución",
+        n_esimo_lunes(anio, 3, 3): "Natalicio de Benito Juárez",
+        pascua - timedelta(days=3): "Jueves Santo",
+        pascua - timedelta(days=2): "Viernes Santo",
+        date(anio, 5, 1): "Día del Trabajo",
+        date(anio, 9, 16): "Día de la Independencia",
+        n_esimo_lunes(anio, 11, 3): "Revolución Mexicana",
+        date(anio, 12, 25): "Navidad",
+    }
+    transmision = _transmision_poder_ejecutivo(anio)
+    if transmision:
+        dias[transmision] = "Transmisión del Poder Ejecutivo Federal"
+    return dias
+
+
+@lru_cache(maxsize=None)
+def calendario_inhabiles(anio) -> FrozenSet[date]:
+    """
+    Obtiene el conjunto de días inhábiles oficiales de un año (memorizado).
+
+    Args:
+        anio (int): Año
+
+    Returns:
+        frozenset: Fechas inhábiles oficiales
+    """
+    return frozenset(_nombres_por_anio(anio))
+
 
 def obtener_dias_inhabiles(anio):
     """
     Obtiene la lista de días inhábiles oficiales para un año específico.
-    
+
     Args:
         anio (int): Año para el cual se requieren los días inhábiles
-        
+
     Returns:
-        list: Lista de objetos date con los días inhábiles oficiales
+        list: Lista ordenada de objetos date con los días inhábiles oficiales
     """
-    return DIAS_INHABILES_POR_ANIO.get(anio, [])
+    return sorted(calendario_inhabiles(anio))
+
 
 def es_dia_inhabil(fecha):
     """
     Verifica si una fecha es día inhábil oficial.
-    
+
     Args:
         fecha (date): Fecha a verificar
-        
+
     Returns:
         bool: True si es día inhábil oficial, False en caso contrario
     """
-    dias_inhabiles = obtener_dias_inhabiles(fecha.year)
-    return fecha in dias_inhabiles
+    return fecha in calendario_inhabiles(fecha.year)
+
 
 def obtener_nombre_dia_inhabil(fecha):
     """
     Obtiene el nombre del día inhábil si aplica.
-    
+
     Args:
         fecha (date): Fecha a verificar
-        
+
     Returns:
         str: Nombre del día inhábil o None si no es inhábil
     """
-    if not es_dia_inhabil(fecha):
+    return _nombres_por_anio(fecha.year).get(fecha)
+
+
+def _normalizar_fecha(valor) -> Optional[date]:
+    """Convierte una fecha del preset (date o texto ISO) a date."""
+    if isinstance(valor, date):
+        return valor
+    try:
+        return date.fromisoformat(str(valor)[:10])
+    except ValueError:
         return None
-    
-    nombres = {
-        (1, 1): "Año Nuevo",
-        (2, 2): "Día de la Constitución",
-        (2, 3): "Día de la Constitución",
-        (2, 1): "Día de la Constitución",
-        (3, 15): "Natalicio de Benito Juárez",
-        (3, 16): "Natalicio de Benito Juárez",
-        (3, 17): "Natalicio de Benito Juárez",
-        (3, 25): "Jueves Santo",
-        (3, 26): "Viernes Santo",
-        (4, 2): "Jueves Santo",
-        (4, 3): "Viernes Santo",
-        (4, 17): "Jueves Santo",
-        (4, 18): "Viernes Santo",
-        (5, 1): "Día del Trabajo",
-        (9, 16): "Día de la Independencia",
-        (11, 15): "Revolución Mexicana",
-        (11, 16): "Revolución Mexicana",
-        (11, 17): "Revolución Mexicana",
-        (12, 25): "Navidad",
-    }
-    
-    return nombres.get((fecha.month, fecha.day), "Día Inhábil Oficial")
+
+
+@lru_cache(maxsize=MAX_CONJUNTOS_EN_CACHE)
+def _conjunto_inhabiles(inicio, fin, extra) -> FrozenSet[date]:
+    dias = set(extra)
+    for anio in range(inicio.year, fin.year + 1):
+        dias.update(calendario_inhabiles(anio))
+    return frozenset(d for d in dias if inicio <= d <= fin)
+
+
+def inhabiles_en_rango(inicio, fin, lista_extra: Iterable = ()) -> FrozenSet[date]:
+    """
+    Combina los días inhábiles oficiales de un rango con los de un usuario.
+
+    Args:
+        inicio (date): Primer día del rango
+        fin (date): Último día del rango
+        lista_extra: Días inhábiles adicionales (p. ej. preset.lista_inhabiles),
+            como date o texto ISO
+
+    Returns:
+        frozenset: Días inhábiles dentro del rango (memorizado por rango y lista)
+    """
+    extra = frozenset(filter(None, (_normalizar_fecha(v) for v in lista_extra or ())))
+    return _conjunto_inhabiles(inicio, fin, extra)
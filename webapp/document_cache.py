@@ -0,0 +1,187 @@
+"""
+Cache en disco de documentos MovPer generados, direccionada por contenido.
+
+La clave es el SHA-256 de todo lo que determina el archivo: el documento
+(preset, incidencias clasificadas, con_goce, fechas), la firma del template,
+la firma del logo de la empresa y el backend. Mismas entradas => mismo archivo.
+El tamaño total está acotado y se expulsan primero los menos usados (LRU).
+
+Solo se ahorra el renderizado: la clave necesita las incidencias ya calculadas,
+así que calcular_incidencias_quincena corre antes de consultar esta cache. Ese
+cálculo tiene su propia cache por dependencias (quincena_cache); una clave de
+entradas baratas (usuario, quincena, con_goce) serviría documentos viejos
+cuando cambian los eventos de BioStar, que no generan escrituras en la BD.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DOC_CACHE_DIR = os.environ.get('MOVPER_DOC_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'movper_doc_cache'))
+DOC_CACHE_MAX_BYTES = int(os.environ.get('MOVPER_DOC_CACHE_MAX_MB', 200)) * 1024 * 1024
+
+_EXTENSION = '.xlsx'
+
+
+def _firma_archivo(path: Optional[str]):
+    """(mtime, tamaño) del archivo o None si no existe."""
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime, stat.st_size]
+
+
+class DocumentCache:
+    """Cache LRU en disco {sha256: bytes} acotada por tamaño total."""
+
+    def __init__(self, directory: str = DOC_CACHE_DIR, max_bytes: int = DOC_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._index: 'OrderedDict[str, int]' = OrderedDict()  # clave -> bytes, de menos a más reciente
+        self._total = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._cargar_indice()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + _EXTENSION)
+
+    def _cargar_indice(self):
+        """Reconstruye el índice desde disco ordenando por última modificación."""
+        entradas = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(_EXTENSION):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entradas.append((stat.st_mtime, name[:-len(_EXTENSION)], stat.st_size))
+
+        self._index.clear()
+        for _, key, size in sorted(entradas):
+            self._index[key] = size
+        self._total = sum(self._index.values())
+
+    @staticmethod
+    def clave(documento: Dict, plantilla_path: str, backend: str) -> str:
+        """
+        Calcula la clave de un documento a partir de todas sus entradas.
+
+        Args:
+            documento: Documento de construir_documento_movper/vacaciones
+            plantilla_path: Ruta del template usado
+            backend: Backend de renderizado
+
+        Returns:
+            Hash SHA-256 en hexadecimal
+        """
+        # El nombre del archivo no afecta el contenido generado
+        entradas = {
+            'documento': {k: v for k, v in documento.items() if k != 'filename'},
+            'plantilla': _firma_archivo(plantilla_path),
+            'logo': _firma_archivo(documento.get('logo_path')),
+            'backend': backend,
+        }
+        canonico = json.dumps(entradas, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(canonico.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Devuelve el documento en cache (y lo marca como reciente) o None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+                if key in self._index:
+                    self._total -= self._index.pop(key)
+            return None
+
+        with self._lock:
+            self.hits += 1
+            if key in self._index:
+                self._index.move_to_end(key)
+            else:
+                # Escrito por otro proceso
+                self._index[key] = len(data)
+                self._total += len(data)
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Guarda un documento y expulsa los menos usados si se excede el límite."""
+        if len(data) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"⚠ No se pudo guardar documento en cache: {e}")
+            return
+
+        with self._lock:
+            if key in self._index:
+                self._total -= self._index.pop(key)
+            self._index[key] = len(data)
+            self._total += len(data)
+            if self._total > self.max_bytes:
+                self._expulsar()
+
+    def _expulsar(self):
+        """Elimina entradas LRU hasta quedar bajo el límite (requiere lock)."""
+        # Otros procesos comparten el directorio: se recalcula desde disco
+        self._cargar_indice()
+        while self._total > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        """Vacía la cache."""
+        with self._lock:
+            for key in list(self._index):
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            self._index.clear()
+            self._total = 0
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self) -> Dict:
+        """Estadísticas de uso de la cache."""
+        with self._lock:
+            total_requests = self.hits + self.misses
+            return {
+                'entries': len(self._index),
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total_requests * 100, 2) if total_requests else 0,
+            }
+
+
+# Cache compartida por la generación de documentos
+document_cache = DocumentCache()
@@ -3,8 +3,12 @@ Rutas API para el sistema de emergencias con soporte de tiempo real.
 """
 from flask import Blueprint, jsonify, request, render_template, Response, stream_with_context, send_file
 from flask_login import login_required, current_user
-from webapp.models import db, Zone, Group, GroupMember, EmergencySession, RollCallEntry, ZoneDevice
+from webapp.models import db, User, Zone, Group, GroupMember, EmergencySession, RollCallEntry, ZoneDevice
 from webapp.excel_exporter import EmergencyExcelExporter
+from webapp.monitoring import query_budget
+from webapp.presence_index import checkin_day_start, presence_index
+from sqlalchemy import and_, func, insert
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
 import logging
 import json
@@ -41,6 +45,8 @@ def emergency_page():
     """Página de emergencias"""
     if not current_user.can_manage_emergencies():
         return "Acceso denegado", 403
+    # El índice de presencia resuelve "check-in hoy" al activar una emergencia
+    ensure_presence_ingestion()
     return render_template('emergency_center.html')
 
 
@@ -59,10 +65,17 @@ def history_page():
 
 @emergency_bp.route('/api/zones', methods=['GET'])
 @login_required
+@query_budget(5)
 def get_zones():
     """Obtener todas las zonas"""
     try:
-        zones = Zone.query.filter_by(is_active=True).all()
+        # Una sola consulta con el conteo de grupos activos por zona
+        zones = db.session.query(
+            Zone.id, Zone.name, Zone.description, Zone.color, Zone.icon,
+            func.count(Group.id).label('groups_count')
+        ).outerjoin(
+            Group, and_(Group.zone_id == Zone.id, Group.is_active == True)
+        ).filter(Zone.is_active == True).group_by(Zone.id).order_by(Zone.id).all()
         logger.info(f"📍 Obteniendo zonas: {len(zones)} encontradas")
         
         result = {
@@ -73,7 +86,7 @@ def get_zones():
                 'description': z.description,
                 'color': z.color,
                 'icon': z.icon,
-                'groups_count': z.groups.filter_by(is_active=True).count()
+                'groups_count': z.groups_count
             } for z in zones]
         }
         
@@ -179,10 +192,18 @@ def delete_zone(zone_id):
 
 @emergency_bp.route('/api/zones/<int:zone_id>/groups', methods=['GET'])
 @login_required
+@query_budget(5)
 def get_groups(zone_id):
     """Obtener grupos de una zona"""
     try:
-        groups = Group.query.filter_by(zone_id=zone_id, is_active=True).all()
+        # Una sola consulta con el conteo de miembros por grupo
+        groups = db.session.query(
+            Group.id, Group.name, Group.description, Group.color,
+            func.count(GroupMember.id).label('members_count')
+        ).outerjoin(GroupMember, GroupMember.group_id == Group.id).filter(
+            Group.zone_id == zone_id,
+            Group.is_active == True
+        ).group_by(Group.id).order_by(Group.id).all()
         return jsonify({
             'success': True,
             'groups': [{
@@ -190,7 +211,7 @@ def get_groups(zone_id):
                 'name': g.name,
                 'description': g.description,
                 'color': g.color,
-                'members_count': g.members.count()
+                'members_count': g.members_count
             } for g in groups]
         })
     except Exception as e:
@@ -298,10 +319,16 @@ def delete_group(group_id):
 
 @emergency_bp.route('/api/groups/all', methods=['GET'])
 @login_required
+@query_budget(5)
 def get_all_groups():
     """Obtener todos los grupos activos de todas las zonas (para autocompletado)"""
     try:
-        groups = Group.query.filter_by(is_active=True).all()
+        groups = db.session.query(
+            Group.id, Group.name, Group.description, Group.color, Group.zone_id,
+            Zone.name.label('zone_name')
+        ).join(Zone, Group.zone_id == Zone.id).filter(
+            Group.is_active == True
+        ).order_by(Group.id).all()
         
         result = {
             'success': True,
@@ -311,7 +338,7 @@ def get_all_groups():
                 'description': g.description,
                 'color': g.color,
                 'zone_id': g.zone_id,
-                'zone_name': g.zone.name
+                'zone_name': g.zone_name
             } for g in groups]
         }
         
@@ -418,10 +445,13 @@ def get_all_biostar_users():
 
 @emergency_bp.route('/api/groups/<int:group_id>/members', methods=['GET'])
 @login_required
+@query_budget(5)
 def get_group_members(group_id):
     """Obtener miembros de un grupo"""
     try:
-        members = GroupMember.query.filter_by(group_id=group_id).all()
+        members = db.session.query(
+            GroupMember.id, GroupMember.biostar_user_id, GroupMember.user_name, GroupMember.added_at
+        ).filter(GroupMember.group_id == group_id).all()
         return jsonify({
             'success': True,
             'members': [{
@@ -498,7 +528,10 @@ def remove_group_member(group_id, member_id):
 def get_emergency_status():
     """Obtener estado de emergencias activas"""
     try:
-        active = EmergencySession.query.filter_by(status='active').all()
+        active = EmergencySession.query.options(
+            joinedload(EmergencySession.zone),
+            joinedload(EmergencySession.started_by_user)
+        ).filter_by(status='active').all()
         return jsonify({
             'success': True,
             'has_active': len(active) > 0,
@@ -517,6 +550,179 @@ def get_emergency_status():
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+def create_roll_call_entries(emergency_id, zone_id, users_checked_in_today):
+    """
+    Crea el pase de lista de una emergencia con una sola consulta y un solo INSERT.
+    
+    Args:
+        emergency_id: ID de la sesión de emergencia
+        zone_id: ID de la zona
+        users_checked_in_today: Conjunto de biostar_user_id (str) con check-in hoy
+        
+    Returns:
+        Tupla (entradas_creadas, miembros_omitidos)
+    """
+    members = db.session.query(
+        GroupMember.group_id,
+        GroupMember.biostar_user_id,
+        GroupMember.user_name
+    ).join(Group, GroupMember.group_id == Group.id).filter(
+        Group.zone_id == zone_id,
+        Group.is_active == True
+    ).all()
+    
+    rows = [
+        {
+            'emergency_id': emergency_id,
+            'group_id': group_id,
+            'biostar_user_id': biostar_user_id,
+            'user_name': user_name,
+            'status': 'pending'
+        }
+        for group_id, biostar_user_id, user_name in members
+        if str(biostar_user_id) in users_checked_in_today
+    ]
+    
+    if rows:
+        db.session.execute(insert(RollCallEntry), rows)
+    
+    return len(rows), len(members) - len(rows)
+
+
+def get_roll_call_stats(emergency_ids):
+    """
+    Calcula las estadísticas del pase de lista de varias emergencias en una sola consulta.
+    
+    Args:
+        emergency_ids: IDs de las emergencias
+        
+    Returns:
+        Diccionario {emergency_id: {'total', 'present', 'absent', 'pending'}}
+    """
+    stats = {
+        emergency_id: {'total': 0, 'present': 0, 'absent': 0, 'pending': 0}
+        for emergency_id in emergency_ids
+    }
+    if not stats:
+        return stats
+    
+    rows = db.session.query(
+        RollCallEntry.emergency_id,
+        RollCallEntry.status,
+        db.func.count(RollCallEntry.id)
+    ).filter(
+        RollCallEntry.emergency_id.in_(list(stats))
+    ).group_by(RollCallEntry.emergency_id, RollCallEntry.status).all()
+    
+    for emergency_id, status, count in rows:
+        stats[emergency_id]['total'] += count
+        if status in stats[emergency_id]:
+            stats[emergency_id][status] += count
+    
+    return stats
+
+
+def roll_call_rows(emergency_id):
+    """
+    Pase de lista de una emergencia como tuplas, con grupo y usuario que marcó
+    resueltos en la misma consulta (sin objetos ORM ni cargas perezosas por fila).
+    
+    Args:
+        emergency_id: ID de la sesión de emergencia
+        
+    Returns:
+        Lista de filas con id, biostar_user_id, user_name, status, marked_at,
+        notes, marked_by, group_id, manual_group_name, group_name, group_color,
+        marked_by_name
+    """
+    return db.session.query(
+        RollCallEntry.id,
+        RollCallEntry.biostar_user_id,
+        RollCallEntry.user_name,
+        RollCallEntry.status,
+        RollCallEntry.marked_at,
+        RollCallEntry.notes,
+        RollCallEntry.marked_by,
+        RollCallEntry.group_id,
+        RollCallEntry.manual_group_name,
+        Group.name.label('group_name'),
+        Group.color.label('group_color'),
+        func.coalesce(func.nullif(User.full_name, ''), User.username).label('marked_by_name')
+    ).outerjoin(
+        Group, RollCallEntry.group_id == Group.id
+    ).outerjoin(
+        User, RollCallEntry.marked_by == User.id
+    ).filter(
+        RollCallEntry.emergency_id == emergency_id
+    ).order_by(RollCallEntry.id).all()
+
+
+def group_roll_call(rows, mark_temporary=True):
+    """
+    Agrupa las filas de roll_call_rows por grupo (real o temporal).
+    
+    Args:
+        rows: Filas devueltas por roll_call_rows
+        mark_temporary: Incluir 'is_temporary' en cada grupo
+        
+    Returns:
+        Lista de grupos con sus miembros
+    """
+    grouped = {}
+    for row in rows:
+        # Usar manual_group_name si existe, sino usar el grupo real
+        if row.manual_group_name:
+            # Entrada manual con grupo temporal (no en BD)
+            group_name = row.manual_group_name
+            group_id = None
+            group_color = '#6c757d'  # Color gris para grupos temporales
+        elif row.group_name is not None:
+            # Entrada con grupo real de BD
+            group_name = row.group_name
+            group_id = row.group_id
+            group_color = row.group_color
+        else:
+            # Entrada sin grupo (fallback)
+            group_name = 'Sin Grupo'
+            group_id = None
+            group_color = '#6c757d'
+        
+        if group_name not in grouped:
+            grouped[group_name] = {
+                'group_id': group_id,
+                'group_name': group_name,
+                'group_color': group_color,
+                'members': []
+            }
+            if mark_temporary:
+                grouped[group_name]['is_temporary'] = bool(row.manual_group_name)
+        
+        grouped[group_name]['members'].append({
+            'id': row.id,
+            'biostar_user_id': row.biostar_user_id,
+            'user_name': row.user_name,
+            'status': row.status,
+            'marked_at': row.marked_at.isoformat() if row.marked_at else None,
+            'marked_by': row.marked_by_name if row.marked_by else None,
+            'notes': row.notes
+        })
+    
+    return list(grouped.values())
+
+
+def refresh_roll_call_stats(emergency_id):
+    """
+    Recalcula y guarda las estadísticas desnormalizadas del pase de lista.
+    Debe llamarse antes del commit de cualquier escritura sobre roll_call_entries.
+    """
+    stats = get_roll_call_stats([emergency_id])[emergency_id]
+    EmergencySession.query.filter_by(id=emergency_id).update(
+        {'roll_call_stats': json.dumps(stats)},
+        synchronize_session=False
+    )
+    return stats
+
+
 @emergency_bp.route('/api/emergency/activate', methods=['POST'])
 @login_required
 def activate_emergency():
@@ -537,6 +743,9 @@ def activate_emergency():
         if existing:
             return jsonify({'success': False, 'message': 'Ya hay una emergencia activa en esta zona'}), 400
         
+        if not Zone.query.get(zone_id):
+            return jsonify({'success': False, 'message': 'Zona no encontrada'}), 404
+        
         # Crear sesión de emergencia
         emergency = EmergencySession(
             zone_id=zone_id,
@@ -548,80 +757,34 @@ def activate_emergency():
         db.session.flush()  # Para obtener el ID
         
         # Crear entradas de pase de lista SOLO para miembros que hicieron check-in HOY
-        # Usar la MISMA lógica que el dashboard "Usuarios del Día"
-        zone = Zone.query.get(zone_id)
-        
-        # Obtener usuarios únicos del día usando la misma lógica del dashboard
-        from webapp.app import get_monitor
-        from src.api.device_monitor import EVENT_CODES
-        
-        monitor = get_monitor()
-        users_checked_in_today = set()
+        # Usar la MISMA lógica que el dashboard "Usuarios del Día": desde el índice
+        # de presencia si cubre el día; si no, consultando los dispositivos
+        users_checked_in_today = presence_index.users_seen_since(checkin_day_start())
         
-        if monitor:
-            try:
-                # Obtener todos los dispositivos
-                all_devices = monitor.get_all_devices(refresh=False)
-                
-                logger.info(f"🔍 Obteniendo usuarios del día desde {len(all_devices)} dispositivos...")
-                
-                # Recolectar usuarios únicos con accesos concedidos HOY
-                for device in all_devices:
-                    try:
-                        events = monitor.get_device_events_today(device['id'])
-                        events = monitor._filter_events_by_time(events)
-                        
-                        for event in events:
-                            # Solo accesos concedidos
-                            event_code = event.get('event_type_id', {}).get('code', '')
-                            if event_code not in EVENT_CODES['ACCESS_GRANTED']:
-                                continue
-                            
-                            # Extraer user_id (misma lógica que dashboard)
-                            user_data = event.get('user_id', {})
-                            if isinstance(user_data, dict):
-                                user_id = user_data.get('user_id') or user_data.get('id')
-                            else:
-                                user_id = user_data
-                            
-                            if not user_id or str(user_id) in ['', 'None', 'nan']:
-                                continue
-                            
-                            users_checked_in_today.add(str(user_id))
-                    except Exception as e:
-                        logger.error(f"Error obteniendo eventos del dispositivo {device['id']}: {e}")
-                        continue
-                
-                logger.info(f"✅ {len(users_checked_in_today)} usuarios únicos con check-in hoy")
-            except Exception as e:
-                logger.error(f"❌ Error obteniendo usuarios del día: {e}")
+        if users_checked_in_today is not None:
+            logger.info(f"✅ {len(users_checked_in_today)} usuarios únicos con check-in hoy (índice de presencia)")
         else:
-            logger.error(f"❌ Monitor no disponible")
-        
-        # Crear entradas del pase de lista SOLO para usuarios con check-in hoy
-        entries_created = 0
-        entries_skipped = 0
+            from webapp.app import get_monitor
+            
+            monitor = get_monitor()
+            users_checked_in_today = set()
+            
+            if monitor:
+                try:
+                    users_checked_in_today = monitor.get_checked_in_user_ids_today()
+                    logger.info(f"✅ {len(users_checked_in_today)} usuarios únicos con check-in hoy")
+                except Exception as e:
+                    logger.error(f"❌ Error obteniendo usuarios del día: {e}")
+            else:
+                logger.error(f"❌ Monitor no disponible")
         
-        for group in zone.groups.filter_by(is_active=True):
-            for member in group.members:
-                user_id_str = str(member.biostar_user_id)
-                
-                # SOLO incluir si el usuario hizo check-in hoy
-                if user_id_str in users_checked_in_today:
-                    entry = RollCallEntry(
-                        emergency_id=emergency.id,
-                        group_id=group.id,
-                        biostar_user_id=member.biostar_user_id,
-                        user_name=member.user_name,
-                        status='pending'
-                    )
-                    db.session.add(entry)
-                    entries_created += 1
-                else:
-                    entries_skipped += 1
+        entries_created, entries_skipped = create_roll_call_entries(
+            emergency.id, zone_id, users_checked_in_today
+        )
         
         logger.info(f"📋 Pase de lista creado: {entries_created} personas con check-in hoy, {entries_skipped} omitidas (sin check-in)")
         
+        refresh_roll_call_stats(emergency.id)
         db.session.commit()
         
         # ========== ACTIVAR DISPOSITIVOS DE LA ZONA ==========
@@ -644,51 +807,42 @@ def activate_emergency():
             monitor = get_monitor()
             
             if monitor and monitor.client:
+                # Desbloqueo y alarmas en paralelo, con una sola consulta de puertas
+                results = monitor.client.execute_emergency_actions(
+                    [zd.device_id for zd in zone_devices],
+                    unlock=unlock_doors,
+                    alarm=trigger_alarms
+                )
+                
                 for zd in zone_devices:
                     device_id = zd.device_id
                     device_name = zd.device_name or f"Dispositivo {device_id}"
+                    result = results.get(device_id, {})
+                    unlocked = result.get('unlocked', False)
+                    door_id = result.get('door_id')
+                    alarm_triggered = result.get('alarm', False)
                     
-                    try:
-                        unlocked = False
-                        door_id = None
-                        alarm_triggered = False
-                        
-                        # Desbloquear puerta PERMANENTEMENTE si está habilitado
-                        if unlock_doors:
-                            logger.info(f"   🔓 Desbloqueando puerta del dispositivo {device_id} (permanente)...")
-                            # Usar unlock_door_by_device para mantener abierta hasta resolver
-                            unlocked, door_id = monitor.client.unlock_door_by_device(device_id)
-                            if door_id:
-                                unlocked_door_ids.append(door_id)
-                        
-                        # Activar alarma si está habilitado
-                        if trigger_alarms:
-                            logger.info(f"   🔔 Activando alarma del dispositivo {device_id}...")
-                            alarm_triggered = monitor.client.trigger_alarm(device_id)
-                        
-                        if unlocked or alarm_triggered:
-                            devices_activated.append({
-                                'device_id': device_id,
-                                'door_id': door_id,
-                                'name': device_name,
-                                'unlocked': unlocked,
-                                'alarm': alarm_triggered
-                            })
-                            logger.info(f"   ✓ Dispositivo {device_name} - Puerta {door_id}: {unlocked}, Alarma: {alarm_triggered}")
-                        else:
-                            devices_failed.append({
-                                'device_id': device_id,
-                                'name': device_name,
-                                'error': 'No se pudo activar (puede que el dispositivo no soporte estas funciones)'
-                            })
-                            logger.warning(f"   ⚠ Dispositivo {device_name} no respondió")
-                    except Exception as dev_error:
-                        logger.error(f"   ✗ Error en dispositivo {device_name}: {dev_error}")
+                    # Guardar toda puerta cuyo desbloqueo se envió, aunque falle o exceda
+                    # el deadline: la petición puede completarse después en BioStar
+                    if door_id and door_id not in unlocked_door_ids:
+                        unlocked_door_ids.append(door_id)
+                    
+                    if unlocked or alarm_triggered:
+                        devices_activated.append({
+                            'device_id': device_id,
+                            'door_id': door_id,
+                            'name': device_name,
+                            'unlocked': unlocked,
+                            'alarm': alarm_triggered
+                        })
+                        logger.info(f"   ✓ Dispositivo {device_name} - Puerta {door_id}: {unlocked}, Alarma: {alarm_triggered}")
+                    else:
                         devices_failed.append({
                             'device_id': device_id,
                             'name': device_name,
-                            'error': str(dev_error)
+                            'error': result.get('error') or 'No se pudo activar (puede que el dispositivo no soporte estas funciones)'
                         })
+                        logger.warning(f"   ⚠ Dispositivo {device_name} no respondió")
                 
                 # Guardar las puertas desbloqueadas en la emergencia
                 if unlocked_door_ids:
@@ -786,53 +940,13 @@ def resolve_emergency(emergency_id):
 
 @emergency_bp.route('/api/emergency/<int:emergency_id>/roll-call', methods=['GET'])
 @login_required
+@query_budget(5)
 def get_roll_call(emergency_id):
     """Obtener pase de lista de una emergencia"""
     try:
-        entries = RollCallEntry.query.filter_by(emergency_id=emergency_id).all()
-        
-        # Agrupar por grupo (real o temporal)
-        grouped = {}
-        for entry in entries:
-            # Usar manual_group_name si existe, sino usar el grupo real
-            if entry.manual_group_name:
-                # Entrada manual con grupo temporal (no en BD)
-                group_name = entry.manual_group_name
-                group_id = None
-                group_color = '#6c757d'  # Color gris para grupos temporales
-            elif entry.group:
-                # Entrada con grupo real de BD
-                group_name = entry.group.name
-                group_id = entry.group_id
-                group_color = entry.group.color
-            else:
-                # Entrada sin grupo (fallback)
-                group_name = 'Sin Grupo'
-                group_id = None
-                group_color = '#6c757d'
-            
-            if group_name not in grouped:
-                grouped[group_name] = {
-                    'group_id': group_id,
-                    'group_name': group_name,
-                    'group_color': group_color,
-                    'is_temporary': bool(entry.manual_group_name),  # Indicar si es temporal
-                    'members': []
-                }
-            
-            grouped[group_name]['members'].append({
-                'id': entry.id,
-                'biostar_user_id': entry.biostar_user_id,
-                'user_name': entry.user_name,
-                'status': entry.status,
-                'marked_at': entry.marked_at.isoformat() if entry.marked_at else None,
-                'marked_by': entry.marked_by_user.full_name or entry.marked_by_user.username if entry.marked_by else None,
-                'notes': entry.notes
-            })
-        
         return jsonify({
             'success': True,
-            'groups': list(grouped.values())
+            'groups': group_roll_call(roll_call_rows(emergency_id))
         })
     except Exception as e:
         logger.error(f"Error obteniendo pase de lista: {e}")
@@ -855,6 +969,7 @@ def mark_attendance(entry_id):
         entry.marked_at = now_cdmx()
         entry.notes = data.get('notes', '')
         
+        refresh_roll_call_stats(entry.emergency_id)
         db.session.commit()
         
         return jsonify({'success': True, 'message': 'Asistencia marcada'})
@@ -875,61 +990,23 @@ def export_emergency_excel(emergency_id):
         # Obtener emergencia
         emergency = EmergencySession.query.get_or_404(emergency_id)
         
-        # Obtener pase de lista
-        entries = RollCallEntry.query.filter_by(emergency_id=emergency_id).all()
-        
-        # Agrupar por grupo (misma lógica que get_roll_call)
-        grouped = {}
-        for entry in entries:
-            # Usar manual_group_name si existe, sino usar el grupo real
-            if entry.manual_group_name:
-                # Entrada manual con grupo temporal (no en BD)
-                group_name = entry.manual_group_name
-                group_id = None
-                group_color = '#6c757d'  # Color gris para grupos temporales
-            elif entry.group:
-                # Entrada con grupo real de BD
-                group_name = entry.group.name
-                group_id = entry.group_id
-                group_color = entry.group.color
-            else:
-                # Entrada sin grupo (fallback)
-                group_name = 'Sin Grupo'
-                group_id = None
-                group_color = '#6c757d'
-            
-            if group_name not in grouped:
-                grouped[group_name] = {
-                    'group_id': group_id,
-                    'group_name': group_name,
-                    'group_color': group_color,
-                    'members': []
-                }
-            
-            grouped[group_name]['members'].append({
-                'id': entry.id,
-                'biostar_user_id': entry.biostar_user_id,
-                'user_name': entry.user_name,
-                'status': entry.status,
-                'marked_by': entry.marked_by_user.full_name or entry.marked_by_user.username if entry.marked_by else None,
-                'marked_at': entry.marked_at.isoformat() if entry.marked_at else None,
-                'notes': entry.notes
-            })
+        # Obtener pase de lista agrupado (misma lógica que get_roll_call)
+        rows = roll_call_rows(emergency_id)
         
         # Calcular estadísticas
         stats = {
-            'total': len(entries),
-            'present': sum(1 for e in entries if e.status == 'present'),
-            'absent': sum(1 for e in entries if e.status == 'absent'),
-            'pending': sum(1 for e in entries if e.status == 'pending')
+            'total': len(rows),
+            'present': sum(1 for r in rows if r.status == 'present'),
+            'absent': sum(1 for r in rows if r.status == 'absent'),
+            'pending': sum(1 for r in rows if r.status == 'pending')
         }
         
         roll_call_data = {
-            'groups': list(grouped.values()),
+            'groups': group_roll_call(rows, mark_temporary=False),
             'stats': stats
         }
         
-        # Generar Excel
+        # Generar Excel en un archivo temporal; send_file lo envía por bloques y lo cierra al terminar
         excel_file = EmergencyExcelExporter.export_emergency(emergency, roll_call_data)
         
         # Nombre del archivo
@@ -999,6 +1076,7 @@ def add_manual_entry(emergency_id):
             notes='Entrada manual'
         )
         db.session.add(entry)
+        refresh_roll_call_stats(emergency_id)
         db.session.commit()
         
         group_display = group.name if group else (manual_group_name or 'Sin grupo')
@@ -1046,6 +1124,7 @@ def delete_roll_call_entry(emergency_id, entry_id):
         
         # Eliminar entrada
         db.session.delete(entry)
+        refresh_roll_call_stats(emergency_id)
         db.session.commit()
         
         logger.info(f"🗑️ Entrada eliminada: {user_name} por {current_user.username}")
@@ -1076,6 +1155,7 @@ def stream_emergency(emergency_id):
         # Inicializar con margen de seguridad de 2 segundos atrás para no perder cambios iniciales
         last_check = now_cdmx() - timedelta(seconds=2)
         poll_count = 0
+        ensure_presence_ingestion()
         
         # Enviar mensaje de conexión
         yield f"event: connection\ndata: {json.dumps({'type': 'connected', 'emergency_id': emergency_id})}\n\n"
@@ -1099,7 +1179,9 @@ def stream_emergency(emergency_id):
                     break
                 
                 # Obtener estado actual del pase de lista con sesión fresca
-                entries = RollCallEntry.query.filter_by(emergency_id=emergency_id).all()
+                entries = RollCallEntry.query.options(
+                    joinedload(RollCallEntry.marked_by_user)
+                ).filter_by(emergency_id=emergency_id).all()
                 
                 stats = {
                     'total': len(entries),
@@ -1263,7 +1345,7 @@ def get_available_devices():
         if not monitor.login():
             return jsonify({'success': False, 'message': 'Error conectando a BioStar'}), 500
         
-        devices = monitor.get_all_devices(refresh=True)
+        devices = monitor.get_all_devices()
         
         return jsonify({
             'success': True,
@@ -1289,8 +1371,10 @@ def stream_zone_presence(zone_id):
     Detecta eventos de BioStar en los dispositivos asignados a la zona.
     """
     def generate():
-        last_check = now_cdmx()
+        # Reportar accesos desde 5 minutos antes de conectar; luego solo los nuevos
+        since = now_cdmx() - timedelta(minutes=5)
         poll_count = 0
+        ensure_presence_ingestion()
         
         # Obtener dispositivos de la zona
         zone_devices = ZoneDevice.query.filter_by(zone_id=zone_id, is_active=True).all()
@@ -1302,18 +1386,22 @@ def stream_zone_presence(zone_id):
             yield f"event: error\ndata: {json.dumps({'error': 'No hay dispositivos asignados a esta zona'})}\n\n"
             return
         
-        # Obtener miembros de todos los grupos de la zona
-        zone = Zone.query.get(zone_id)
+        # Obtener miembros de todos los grupos activos de la zona en una consulta
+        members = db.session.query(
+            GroupMember.biostar_user_id, GroupMember.user_name, Group.id, Group.name
+        ).join(Group, GroupMember.group_id == Group.id).filter(
+            Group.zone_id == zone_id,
+            Group.is_active == True
+        ).order_by(Group.id, GroupMember.id).all()
         all_members = {}
-        for group in zone.groups.filter_by(is_active=True):
-            for member in group.members:
-                all_members[str(member.biostar_user_id)] = {
-                    'name': member.user_name,
-                    'group_id': group.id,
-                    'group_name': group.name,
-                    'last_seen': None,
-                    'device': None
-                }
+        for biostar_user_id, user_name, group_id, group_name in members:
+            all_members[str(biostar_user_id)] = {
+                'name': user_name,
+                'group_id': group_id,
+                'group_name': group_name,
+                'last_seen': None,
+                'device': None
+            }
         
         yield f"event: members\ndata: {json.dumps({'members': list(all_members.values()), 'total': len(all_members)})}\n\n"
         
@@ -1322,7 +1410,7 @@ def stream_zone_presence(zone_id):
                 poll_count += 1
                 
                 # Buscar eventos recientes en los dispositivos de la zona
-                presence_updates = check_zone_presence(device_ids, all_members, last_check)
+                presence_updates = check_zone_presence(device_ids, all_members, since)
                 
                 if presence_updates:
                     yield f"event: presence\ndata: {json.dumps({'updates': presence_updates, 'timestamp': now_cdmx().isoformat()})}\n\n"
@@ -1331,7 +1419,6 @@ def stream_zone_presence(zone_id):
                 if poll_count % 8 == 0:
                     yield f"event: heartbeat\ndata: {json.dumps({'status': 'alive'})}\n\n"
                 
-                last_check = now_cdmx()
                 time.sleep(2)
                 
             except Exception as e:
@@ -1350,68 +1437,46 @@ def stream_zone_presence(zone_id):
     )
 
 
-def check_zone_presence(device_ids, members_map, last_check):
+def ensure_presence_ingestion():
+    """Inicia (si no está corriendo) la ingesta compartida del índice de presencia."""
+    try:
+        from webapp.app import presence_ingestor
+        presence_ingestor.start()
+    except Exception as e:
+        logger.error(f"Error iniciando ingesta de presencia: {e}")
+
+
+def check_zone_presence(device_ids, members_map, since):
     """
     Verifica presencia de miembros en los dispositivos de la zona.
-    Retorna lista de actualizaciones de presencia.
+    Consulta el índice de presencia en memoria (sin llamadas a BioStar).
+    Retorna lista de actualizaciones de presencia nuevas desde la última consulta.
     """
     updates = []
     
     try:
-        from src.api.device_monitor import DeviceMonitor, EVENT_CODES
-        from src.utils.config import Config
-        from datetime import timedelta
+        seen = presence_index.seen_since(members_map.keys(), since, device_ids=device_ids)
         
-        config = Config()
-        monitor = DeviceMonitor(config)
-        
-        if not monitor.login():
-            return updates
-        
-        now = datetime.now()
-        start_time = now - timedelta(minutes=5)
-        
-        for device_id in device_ids:
-            try:
-                events = monitor.get_device_events(device_id, start_time, now, limit=50)
-                
-                for event in events:
-                    # Solo procesar accesos concedidos
-                    event_code = event.get('event_type_id', {}).get('code', '')
-                    if event_code not in EVENT_CODES.get('ACCESS_GRANTED', []):
-                        continue
-                    
-                    # Extraer user_id
-                    user_data = event.get('user_id', {})
-                    if isinstance(user_data, dict):
-                        user_id = str(user_data.get('user_id') or user_data.get('id', ''))
-                        user_name = user_data.get('name', 'Desconocido')
-                    else:
-                        user_id = str(user_data) if user_data else ''
-                        user_name = 'Desconocido'
-                    
-                    # Verificar si es miembro de la zona
-                    if user_id in members_map:
-                        event_time = event.get('datetime')
-                        device_name = event.get('device_id', {}).get('name', f'Dispositivo {device_id}')
-                        
-                        # Actualizar info del miembro
-                        members_map[user_id]['last_seen'] = str(event_time)
-                        members_map[user_id]['device'] = device_name
-                        
-                        updates.append({
-                            'user_id': user_id,
-                            'user_name': members_map[user_id]['name'],
-                            'group_name': members_map[user_id]['group_name'],
-                            'device': device_name,
-                            'time': str(event_time),
-                            'type': 'present'
-                        })
-                        
-            except Exception as e:
-                logger.error(f"Error procesando dispositivo {device_id}: {e}")
+        for user_id, (event_time, device_id) in seen.items():
+            member = members_map[user_id]
+            event_time_str = event_time.astimezone(MEXICO_TZ).isoformat()
+            
+            # Ya reportado en un ciclo anterior
+            if member['last_seen'] == event_time_str:
                 continue
-        
+            
+            device_name = presence_index.device_name(device_id)
+            member['last_seen'] = event_time_str
+            member['device'] = device_name
+            
+            updates.append({
+                'user_id': user_id,
+                'user_name': member['name'],
+                'group_name': member['group_name'],
+                'device': device_name,
+                'time': event_time_str,
+                'type': 'present'
+            })
     except Exception as e:
         logger.error(f"Error en check_zone_presence: {e}")
     
@@ -1420,81 +1485,47 @@ def check_zone_presence(device_ids, members_map, last_check):
 
 def auto_mark_presence_from_biostar(emergency_id, entries):
     """
-    Auto-marca usuarios como presentes si tienen eventos recientes en BioStar.
+    Auto-marca usuarios como presentes si tienen accesos en los últimos 30 minutos
+    en cualquier dispositivo, según el índice de presencia en memoria.
     Retorna lista de usuarios auto-marcados.
     """
     auto_marked = []
     
     try:
-        # Importar monitor de dispositivos
-        from src.api.device_monitor import DeviceMonitor, EVENT_CODES
-        from src.utils.config import Config
-        
-        config = Config()
-        monitor = DeviceMonitor(config)
-        
-        if not monitor.login():
-            return auto_marked
-        
-        # Obtener todos los dispositivos
-        devices = monitor.get_all_devices(refresh=False)
-        
         # Obtener IDs de usuarios pendientes
         pending_entries = {str(e.biostar_user_id): e for e in entries if e.status == 'pending'}
         
         if not pending_entries:
             return auto_marked
         
-        # Buscar eventos recientes (últimos 30 minutos)
-        from datetime import timedelta
         now = now_cdmx()
-        start_time = now - timedelta(minutes=30)
+        seen = presence_index.seen_since(pending_entries.keys(), now - timedelta(minutes=30))
         
-        for device in devices[:5]:  # Limitar a 5 dispositivos para no sobrecargar
-            try:
-                events = monitor.get_device_events(device['id'], start_time, now, limit=100)
-                
-                for event in events:
-                    # Solo procesar accesos concedidos
-                    event_code = event.get('event_type_id', {}).get('code', '')
-                    if event_code not in EVENT_CODES['ACCESS_GRANTED']:
-                        continue
-                    
-                    # Extraer user_id del evento
-                    user_data = event.get('user_id', {})
-                    if isinstance(user_data, dict):
-                        user_id = str(user_data.get('user_id') or user_data.get('id', ''))
-                    else:
-                        user_id = str(user_data) if user_data else ''
-                    
-                    # Verificar si este usuario está pendiente
-                    if user_id in pending_entries:
-                        entry = pending_entries[user_id]
-                        
-                        # Auto-marcar como presente
-                        entry.status = 'present'
-                        entry.marked_at = now_cdmx()
-                        entry.notes = f"Auto-detectado en {device.get('name', 'dispositivo')} a las {event.get('datetime', 'N/A')}"
-                        
-                        db.session.commit()
-                        
-                        auto_marked.append({
-                            'user_name': entry.user_name,
-                            'biostar_user_id': user_id,
-                            'device': device.get('name', 'Desconocido'),
-                            'time': str(event.get('datetime', ''))
-                        })
-                        
-                        # Remover de pendientes
-                        del pending_entries[user_id]
-                        
-                        logger.info(f"✅ Auto-marcado: {entry.user_name} detectado en {device.get('name')}")
-                        
-            except Exception as e:
-                logger.error(f"Error procesando dispositivo {device.get('id')}: {e}")
-                continue
+        for user_id, (event_time, device_id) in seen.items():
+            entry = pending_entries[user_id]
+            device_name = presence_index.device_name(device_id)
+            event_time_str = event_time.astimezone(MEXICO_TZ).isoformat()
+            
+            # Auto-marcar como presente
+            entry.status = 'present'
+            entry.marked_at = now
+            entry.notes = f"Auto-detectado en {device_name} a las {event_time_str}"
+            
+            auto_marked.append({
+                'user_name': entry.user_name,
+                'biostar_user_id': user_id,
+                'device': device_name,
+                'time': event_time_str
+            })
+            
+            logger.info(f"✅ Auto-marcado: {entry.user_name} detectado en {device_name}")
+        
+        if auto_marked:
+            refresh_roll_call_stats(emergency_id)
+            db.session.commit()
         
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error en auto-marcado: {e}")
     
     return auto_marked
@@ -1518,7 +1549,10 @@ def get_emergencies_history():
         type_filter = request.args.get('type', '').strip()
         date_filter = request.args.get('date', '').strip()
         
-        query = EmergencySession.query.filter_by(status='resolved')
+        query = EmergencySession.query.options(
+            joinedload(EmergencySession.zone),
+            joinedload(EmergencySession.started_by_user)
+        ).filter_by(status='resolved')
         
         if current_user.is_auditor and not current_user.is_admin:
             query = query.filter_by(started_by=current_user.id)
@@ -1540,16 +1574,22 @@ def get_emergencies_history():
         pagination = query.paginate(page=page, per_page=per_page, error_out=False)
         emergencies = pagination.items
         
+        # Estadísticas desnormalizadas; las emergencias sin ellas se calculan
+        # con una sola consulta agregada y se guardan para la próxima vez
+        stats_by_id = {}
+        missing_ids = []
+        for emergency in emergencies:
+            if emergency.roll_call_stats:
+                stats_by_id[emergency.id] = json.loads(emergency.roll_call_stats)
+            else:
+                missing_ids.append(emergency.id)
+        
+        if missing_ids:
+            stats_by_id.update(get_roll_call_stats(missing_ids))
+        
         result = []
         for emergency in emergencies:
-            # Calcular estadísticas
-            entries = RollCallEntry.query.filter_by(emergency_id=emergency.id).all()
-            stats = {
-                'total': len(entries),
-                'present': sum(1 for e in entries if e.status == 'present'),
-                'absent': sum(1 for e in entries if e.status == 'absent'),
-                'pending': sum(1 for e in entries if e.status == 'pending')
-            }
+            stats = stats_by_id[emergency.id]
             
             # Calcular duración
             duration = 'N/A'
@@ -1579,6 +1619,17 @@ def get_emergencies_history():
                 'can_delete': current_user.is_admin
             })
         
+        if missing_ids:
+            # Guardar después de serializar para no recargar las filas expiradas
+            try:
+                for emergency in emergencies:
+                    if emergency.id in missing_ids:
+                        emergency.roll_call_stats = json.dumps(stats_by_id[emergency.id])
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error guardando estadísticas de pase de lista: {e}")
+        
         return jsonify({
             'success': True,
             'emergencies': result,
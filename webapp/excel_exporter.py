@@ -1,17 +1,50 @@
 """
 Exportador de pase de lista a Excel con diseño profesional.
+
+Usa hojas write_only de openpyxl: las filas se escriben por streaming a un
+archivo temporal y los estilos son named styles registrados una sola vez por
+libro, así las exportaciones con miles de entradas no crean objetos de estilo
+por celda ni mantienen toda la hoja en memoria.
 """
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
 from openpyxl.utils import get_column_letter
 from datetime import datetime, timedelta
 import pytz
-import io
+import tempfile
+
+MEXICO_TZ = pytz.timezone('America/Mexico_City')
+
+# Columnas de la tabla y ancho mínimo de cada una
+TABLE_HEADERS = ["Grupo", "Nombre", "ID BioStar", "Estado", "Marcado por", "Fecha/Hora", "Notas"]
+MIN_COLUMN_WIDTHS = [20, 35, 15, 15, 20, 18, 30]
+MAX_COLUMN_WIDTH = 60
+
+
+class _ColumnWidths:
+    """Anchos de columna calculados a medida que se preparan las filas."""
+
+    def __init__(self, minimums, maximum=MAX_COLUMN_WIDTH):
+        self.widths = list(minimums)
+        self.maximum = maximum
+
+    def update(self, values):
+        for idx, value in enumerate(values):
+            if value is None:
+                continue
+            width = min(len(str(value)) + 2, self.maximum)
+            if width > self.widths[idx]:
+                self.widths[idx] = width
+
+    def apply(self, ws):
+        for idx, width in enumerate(self.widths, start=1):
+            ws.column_dimensions[get_column_letter(idx)].width = width
 
 
 class EmergencyExcelExporter:
     """Exportador profesional de pase de lista a Excel."""
-    
+
     # Colores corporativos - Paleta café elegante
     COLOR_HEADER = "3E2723"  # Café oscuro
     COLOR_SUBHEADER = "5D4037"  # Café medio
@@ -19,43 +52,141 @@ class EmergencyExcelExporter:
     COLOR_ABSENT = "8D6E63"  # Café medio (ausentes)
     COLOR_PENDING = "D7CCC8"  # Beige claro
     COLOR_ALT_ROW = "F5F5F5"  # Gris muy claro para filas alternas
-    
+
+    STATUS_TEXT = {
+        'present': 'PRESENTE',
+        'absent': 'AUSENTE',
+        'pending': 'PENDIENTE'
+    }
+
+    # Estilo de la columna Estado según el status
+    STATUS_STYLES = {
+        'present': 'pl_status_present',
+        'absent': 'pl_status_absent',
+        'pending': 'pl_status_pending'
+    }
+
+    # Estilo base de cada columna de datos (Estado se resuelve por status)
+    DATA_COLUMN_STYLES = ['pl_group', 'pl_text', 'pl_center', None, 'pl_center', 'pl_center', 'pl_notes']
+
+    _SIDE = Side(style='thin', color="000000")
+    _BORDER = Border(left=_SIDE, right=_SIDE, top=_SIDE, bottom=_SIDE)
+    _ALT_FILL = PatternFill(start_color=COLOR_ALT_ROW, end_color=COLOR_ALT_ROW, fill_type="solid")
+    _CENTER = Alignment(horizontal='center', vertical='center')
+    _LEFT = Alignment(horizontal='left', vertical='center')
+
+    @staticmethod
+    def _solid(color):
+        return PatternFill(start_color=color, end_color=color, fill_type="solid")
+
+    @classmethod
+    def _style_specs(cls):
+        """Definición de los named styles del documento {nombre: atributos}."""
+        specs = {
+            'pl_title': dict(font=Font(name='Arial', size=18, bold=True, color="FFFFFF"),
+                             fill=cls._solid(cls.COLOR_HEADER), alignment=cls._CENTER),
+            'pl_section': dict(font=Font(name='Arial', size=14, bold=True, color="FFFFFF"),
+                               fill=cls._solid(cls.COLOR_SUBHEADER), alignment=cls._CENTER),
+            'pl_info_label': dict(font=Font(name='Arial', size=11, bold=True)),
+            'pl_info_value': dict(font=Font(name='Arial', size=11)),
+            'pl_stat_label': dict(font=Font(name='Arial', size=10, bold=True)),
+            'pl_stat_value': dict(font=Font(name='Arial', size=10), alignment=Alignment(horizontal='center')),
+            'pl_table_header': dict(font=Font(name='Arial', size=11, bold=True, color="FFFFFF"),
+                                    fill=cls._solid(cls.COLOR_SUBHEADER), alignment=cls._CENTER,
+                                    border=cls._BORDER),
+            'pl_footer': dict(font=Font(name='Arial', size=9, italic=True, color="7F8C8D"),
+                              alignment=cls._CENTER),
+        }
+
+        # Celdas de datos: variante normal y con fondo alterno
+        data_specs = {
+            'pl_group': dict(font=Font(name='Arial', size=10, bold=True), alignment=cls._LEFT),
+            'pl_text': dict(font=Font(name='Arial', size=10), alignment=cls._LEFT),
+            'pl_center': dict(font=Font(name='Arial', size=10), alignment=cls._CENTER),
+            'pl_notes': dict(font=Font(name='Arial', size=9, italic=True), alignment=cls._LEFT),
+        }
+        for name, attrs in data_specs.items():
+            specs[name] = dict(attrs, border=cls._BORDER)
+            specs[f'{name}_alt'] = dict(attrs, border=cls._BORDER, fill=cls._ALT_FILL)
+
+        status_font = Font(name='Arial', size=10, bold=True, color="FFFFFF")
+        status_colors = {
+            'pl_status_present': cls.COLOR_PRESENT,
+            'pl_status_absent': cls.COLOR_ABSENT,
+            'pl_status_pending': '6D4C41',  # Café claro para pendientes
+            'pl_status_other': '95A5A6',
+        }
+        for name, color in status_colors.items():
+            specs[name] = dict(font=status_font, fill=cls._solid(color),
+                               alignment=cls._CENTER, border=cls._BORDER)
+        return specs
+
     def __init__(self, emergency, roll_call_data):
         """
         Inicializar exportador.
-        
+
         Args:
             emergency: Objeto EmergencySession
             roll_call_data: Dict con grupos y miembros del pase de lista
         """
         self.emergency = emergency
         self.roll_call_data = roll_call_data
-        self.wb = Workbook()
-        self.ws = self.wb.active
-        self.ws.title = "Pase de Lista"
-        
-    def _create_border(self, style='thin'):
-        """Crear borde para celdas."""
-        side = Side(style=style, color="000000")
-        return Border(left=side, right=side, top=side, bottom=side)
-    
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet("Pase de Lista")
+        self.widths = _ColumnWidths(MIN_COLUMN_WIDTHS)
+        self._row = 0
+        self._register_styles()
+
+    def _register_styles(self):
+        """Registrar los named styles en el libro (una vez por exportación)."""
+        for name, attrs in self._style_specs().items():
+            self.wb.add_named_style(NamedStyle(name=name, **attrs))
+
+    def _cell(self, value, style=None):
+        """Crear celda write_only con un named style."""
+        cell = WriteOnlyCell(self.ws, value=value)
+        if style:
+            cell.style = style
+        return cell
+
+    def _append(self, cells, height=None, merge=None):
+        """
+        Escribir una fila en la hoja.
+
+        Args:
+            cells: Celdas o valores de la fila
+            height: Alto de la fila
+            merge: Columnas (inicio, fin) a combinar en la fila
+        """
+        self._row += 1
+        if height:
+            self.ws.row_dimensions[self._row].height = height
+        if merge:
+            self.ws.merged_cells.add(f'{merge[0]}{self._row}:{merge[1]}{self._row}')
+        self.ws.append(cells)
+        return self._row
+
+    @staticmethod
+    def _format_marked_at(marked_at):
+        """Fecha/Hora de marcado en zona horaria de México."""
+        if not marked_at:
+            return 'Sin marcar'
+        try:
+            # Parsear timestamp UTC y convertir a zona horaria de México
+            marked_dt = datetime.fromisoformat(marked_at.replace('Z', '+00:00'))
+            return marked_dt.astimezone(MEXICO_TZ).strftime('%d/%m/%Y %H:%M')
+        except (ValueError, TypeError, AttributeError):
+            return marked_at
+
     def _write_header(self):
         """Escribir encabezado del documento."""
         # Título principal
-        self.ws.merge_cells('A1:G1')
-        cell = self.ws['A1']
-        cell.value = "PASE DE LISTA DE EMERGENCIA"
-        cell.font = Font(name='Arial', size=18, bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color=self.COLOR_HEADER, end_color=self.COLOR_HEADER, fill_type="solid")
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        self.ws.row_dimensions[1].height = 30
-        
-        # Información de la emergencia
-        row = 3
-        # Convertir fechas a zona horaria de México
-        mexico_tz = pytz.timezone('America/Mexico_City')
-        started_at_local = self.emergency.started_at.replace(tzinfo=pytz.UTC).astimezone(mexico_tz)
-        
+        self._append([self._cell("PASE DE LISTA DE EMERGENCIA", 'pl_title')], height=30, merge=('A', 'G'))
+        self._append([])
+
+        # Información de la emergencia (convertir fechas a zona horaria de México)
+        started_at_local = self.emergency.started_at.replace(tzinfo=pytz.UTC).astimezone(MEXICO_TZ)
+
         info_data = [
             ("Zona:", self.emergency.zone.name),
             ("Tipo:", self.emergency.emergency_type.upper()),
@@ -63,214 +194,117 @@ class EmergencyExcelExporter:
             ("Fecha de inicio:", started_at_local.strftime('%d/%m/%Y %H:%M:%S')),
             ("Estado:", "RESUELTA" if self.emergency.status == 'resolved' else "ACTIVA"),
         ]
-        
+
         if self.emergency.resolved_at:
-            resolved_at_local = self.emergency.resolved_at.replace(tzinfo=pytz.UTC).astimezone(mexico_tz)
+            resolved_at_local = self.emergency.resolved_at.replace(tzinfo=pytz.UTC).astimezone(MEXICO_TZ)
             info_data.append(("Fecha de resolución:", resolved_at_local.strftime('%d/%m/%Y %H:%M:%S')))
-        
+
         for label, value in info_data:
-            self.ws[f'A{row}'] = label
-            self.ws[f'A{row}'].font = Font(name='Arial', size=11, bold=True)
-            self.ws[f'B{row}'] = value
-            self.ws[f'B{row}'].font = Font(name='Arial', size=11)
-            self.ws.merge_cells(f'B{row}:G{row}')
-            row += 1
-        
+            self._append([self._cell(label, 'pl_info_label'), self._cell(value, 'pl_info_value')], merge=('B', 'G'))
+
         # Estadísticas
-        row += 1
+        self._append([])
         stats = self.roll_call_data.get('stats', {})
-        self.ws.merge_cells(f'A{row}:G{row}')
-        cell = self.ws[f'A{row}']
-        cell.value = "ESTADÍSTICAS"
-        cell.font = Font(name='Arial', size=14, bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color=self.COLOR_SUBHEADER, end_color=self.COLOR_SUBHEADER, fill_type="solid")
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        self.ws.row_dimensions[row].height = 25
-        
-        row += 1
-        stats_row = row
-        self.ws[f'A{stats_row}'] = "Total"
-        self.ws[f'B{stats_row}'] = stats.get('total', 0)
-        self.ws[f'C{stats_row}'] = "Presentes"
-        self.ws[f'D{stats_row}'] = stats.get('present', 0)
-        self.ws[f'E{stats_row}'] = "Ausentes"
-        self.ws[f'F{stats_row}'] = stats.get('absent', 0)
-        self.ws[f'G{stats_row}'] = f"Pendientes: {stats.get('pending', 0)}"
-        
-        for col in ['A', 'C', 'E', 'G']:
-            self.ws[f'{col}{stats_row}'].font = Font(name='Arial', size=10, bold=True)
-        for col in ['B', 'D', 'F']:
-            self.ws[f'{col}{stats_row}'].font = Font(name='Arial', size=10)
-            self.ws[f'{col}{stats_row}'].alignment = Alignment(horizontal='center')
-        
-        return row + 2
-    
-    def _write_table_header(self, start_row):
+        self._append([self._cell("ESTADÍSTICAS", 'pl_section')], height=25, merge=('A', 'G'))
+        self._append([
+            self._cell("Total", 'pl_stat_label'),
+            self._cell(stats.get('total', 0), 'pl_stat_value'),
+            self._cell("Presentes", 'pl_stat_label'),
+            self._cell(stats.get('present', 0), 'pl_stat_value'),
+            self._cell("Ausentes", 'pl_stat_label'),
+            self._cell(stats.get('absent', 0), 'pl_stat_value'),
+            self._cell(f"Pendientes: {stats.get('pending', 0)}", 'pl_stat_label'),
+        ])
+        self._append([])
+
+    def _write_table_header(self):
         """Escribir encabezado de la tabla."""
-        headers = ["Grupo", "Nombre", "ID BioStar", "Estado", "Marcado por", "Fecha/Hora", "Notas"]
-        
-        for col_idx, header in enumerate(headers, start=1):
-            cell = self.ws.cell(row=start_row, column=col_idx)
-            cell.value = header
-            cell.font = Font(name='Arial', size=11, bold=True, color="FFFFFF")
-            cell.fill = PatternFill(start_color=self.COLOR_SUBHEADER, end_color=self.COLOR_SUBHEADER, fill_type="solid")
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.border = self._create_border()
-        
-        self.ws.row_dimensions[start_row].height = 20
-        return start_row + 1
-    
-    def _write_data_rows(self, start_row):
-        """Escribir filas de datos."""
-        current_row = start_row
-        
+        self._append([self._cell(header, 'pl_table_header') for header in TABLE_HEADERS], height=20)
+
+    def _build_data_rows(self):
+        """
+        Preparar las filas de datos como (valor, estilo) actualizando los anchos.
+        En modo write_only los anchos se escriben antes que las filas, por eso
+        se calculan al preparar los valores y no recorriendo las celdas después.
+
+        Returns:
+            Lista de filas [(valor, nombre_de_estilo), ...]
+        """
+        rows = []
         for group in self.roll_call_data.get('groups', []):
             group_name = group['group_name']
-            group_color = group.get('group_color', '#6c757d')
-            
+
             for idx, member in enumerate(group['members']):
-                # Alternar color de fondo
-                if idx % 2 == 0:
-                    bg_fill = PatternFill(start_color=self.COLOR_ALT_ROW, end_color=self.COLOR_ALT_ROW, fill_type="solid")
-                else:
-                    bg_fill = PatternFill(fill_type=None)
-                
-                # Grupo
-                cell = self.ws.cell(row=current_row, column=1, value=group_name)
-                cell.font = Font(name='Arial', size=10, bold=True)
-                cell.fill = bg_fill
-                cell.border = self._create_border()
-                cell.alignment = Alignment(horizontal='left', vertical='center')
-                
-                # Nombre
-                cell = self.ws.cell(row=current_row, column=2, value=member['user_name'])
-                cell.font = Font(name='Arial', size=10)
-                cell.fill = bg_fill
-                cell.border = self._create_border()
-                cell.alignment = Alignment(horizontal='left', vertical='center')
-                
-                # ID BioStar
-                cell = self.ws.cell(row=current_row, column=3, value=member['biostar_user_id'])
-                cell.font = Font(name='Arial', size=10)
-                cell.fill = bg_fill
-                cell.border = self._create_border()
-                cell.alignment = Alignment(horizontal='center', vertical='center')
-                
-                # Estado
                 status = member['status']
-                status_text = {
-                    'present': 'PRESENTE',
-                    'absent': 'AUSENTE',
-                    'pending': 'PENDIENTE'
-                }.get(status, status.upper())
-                
-                status_color = {
-                    'present': self.COLOR_PRESENT,
-                    'absent': self.COLOR_ABSENT,
-                    'pending': '6D4C41'  # Café claro para pendientes
-                }.get(status, '95A5A6')
-                
-                cell = self.ws.cell(row=current_row, column=4, value=status_text)
-                cell.font = Font(name='Arial', size=10, bold=True, color="FFFFFF")
-                cell.fill = PatternFill(start_color=status_color, end_color=status_color, fill_type="solid")
-                cell.border = self._create_border()
-                cell.alignment = Alignment(horizontal='center', vertical='center')
-                
-                # Marcado por
-                marked_by = member.get('marked_by', 'N/A')
-                cell = self.ws.cell(row=current_row, column=5, value=marked_by)
-                cell.font = Font(name='Arial', size=10)
-                cell.fill = bg_fill
-                cell.border = self._create_border()
-                cell.alignment = Alignment(horizontal='center', vertical='center')
-                
-                # Fecha/Hora (convertir a zona horaria México UTC-6)
-                if member.get('marked_at'):
-                    try:
-                        # Parsear timestamp UTC
-                        marked_dt = datetime.fromisoformat(member['marked_at'].replace('Z', '+00:00'))
-                        # Convertir a zona horaria de México (UTC-6)
-                        mexico_tz = pytz.timezone('America/Mexico_City')
-                        marked_dt_local = marked_dt.astimezone(mexico_tz)
-                        marked_str = marked_dt_local.strftime('%d/%m/%Y %H:%M')
-                    except:
-                        marked_str = member['marked_at']
-                else:
-                    marked_str = 'Sin marcar'
-                
-                cell = self.ws.cell(row=current_row, column=6, value=marked_str)
-                cell.font = Font(name='Arial', size=10)
-                cell.fill = bg_fill
-                cell.border = self._create_border()
-                cell.alignment = Alignment(horizontal='center', vertical='center')
-                
-                # Notas
-                notes = member.get('notes', '')
-                cell = self.ws.cell(row=current_row, column=7, value=notes)
-                cell.font = Font(name='Arial', size=9, italic=True)
-                cell.fill = bg_fill
-                cell.border = self._create_border()
-                cell.alignment = Alignment(horizontal='left', vertical='center')
-                
-                current_row += 1
-        
-        return current_row
-    
-    def _adjust_column_widths(self):
-        """Ajustar anchos de columna."""
-        column_widths = {
-            'A': 20,  # Grupo
-            'B': 35,  # Nombre
-            'C': 15,  # ID BioStar
-            'D': 15,  # Estado
-            'E': 20,  # Marcado por
-            'F': 18,  # Fecha/Hora
-            'G': 30,  # Notas
-        }
-        
-        for col, width in column_widths.items():
-            self.ws.column_dimensions[col].width = width
-    
-    def _add_footer(self, last_row):
+                values = (
+                    group_name,
+                    member['user_name'],
+                    member['biostar_user_id'],
+                    self.STATUS_TEXT.get(status, status.upper()),
+                    member.get('marked_by', 'N/A'),
+                    self._format_marked_at(member.get('marked_at')),
+                    member.get('notes', ''),
+                )
+                self.widths.update(values)
+
+                # Alternar color de fondo
+                suffix = '_alt' if idx % 2 == 0 else ''
+                styles = [f'{style}{suffix}' if style else self.STATUS_STYLES.get(status, 'pl_status_other')
+                          for style in self.DATA_COLUMN_STYLES]
+                rows.append(list(zip(values, styles)))
+        return rows
+
+    def _write_data_rows(self, rows):
+        """Escribir filas de datos."""
+        for row in rows:
+            self._append([self._cell(value, style) for value, style in row])
+
+    def _add_footer(self):
         """Agregar pie de página."""
-        footer_row = last_row + 2
-        self.ws.merge_cells(f'A{footer_row}:G{footer_row}')
-        cell = self.ws[f'A{footer_row}']
+        self._append([])
         # Usar zona horaria de México
-        mexico_tz = pytz.timezone('America/Mexico_City')
-        now_local = datetime.now(mexico_tz)
-        cell.value = f"Documento generado el {now_local.strftime('%d/%m/%Y a las %H:%M:%S')}"
-        cell.font = Font(name='Arial', size=9, italic=True, color="7F8C8D")
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-    
-    def generate(self):
-        """Generar el archivo Excel completo."""
+        now_local = datetime.now(MEXICO_TZ)
+        self._append([self._cell(f"Documento generado el {now_local.strftime('%d/%m/%Y a las %H:%M:%S')}", 'pl_footer')],
+                     merge=('A', 'G'))
+
+    def generate(self, output=None):
+        """
+        Generar el archivo Excel completo.
+
+        Args:
+            output: Archivo o buffer destino (por defecto un archivo temporal en disco)
+
+        Returns:
+            El destino con el archivo, posicionado al inicio
+        """
+        data_rows = self._build_data_rows()
+        # Los anchos deben fijarse antes de escribir la primera fila
+        self.widths.apply(self.ws)
+
         # Escribir secciones
-        data_start_row = self._write_header()
-        table_start_row = self._write_table_header(data_start_row)
-        last_data_row = self._write_data_rows(table_start_row)
-        
-        # Ajustes finales
-        self._adjust_column_widths()
-        self._add_footer(last_data_row)
-        
-        # Retornar archivo en memoria
-        output = io.BytesIO()
+        self._write_header()
+        self._write_table_header()
+        self._write_data_rows(data_rows)
+        self._add_footer()
+
+        if output is None:
+            output = tempfile.TemporaryFile()
         self.wb.save(output)
         output.seek(0)
         return output
-    
+
     @staticmethod
-    def export_emergency(emergency, roll_call_data):
+    def export_emergency(emergency, roll_call_data, output=None):
         """
         Método estático para exportar una emergencia.
-        
+
         Args:
             emergency: Objeto EmergencySession
             roll_call_data: Dict con grupos y miembros
-            
+            output: Archivo o buffer destino (por defecto un archivo temporal)
+
         Returns:
-            BytesIO con el archivo Excel
+            Archivo Excel listo para enviarse por streaming (se elimina al cerrarlo)
         """
         exporter = EmergencyExcelExporter(emergency, roll_call_data)
-        return exporter.generate()
+        return exporter.generate(output)
@@ -0,0 +1,442 @@
+"""
+Exportaciones masivas de MovPer en segundo plano.
+
+- DownloadStore: archivos listos para descargar por token, guardados en disco
+  con expiración (sobreviven a reinicios y los ve cualquier proceso).
+- ExportJobManager: trabajos que construyen los documentos en un hilo con
+  contexto de aplicación, los renderizan en un pool de procesos y arman un ZIP
+  con progreso consultable. El estado de cada trabajo se guarda junto a las
+  descargas, así que se puede consultar tras un reinicio o desde otro proceso.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from webapp.mobper_excel import renderizar_documento_bytes
+
+logger = logging.getLogger(__name__)
+
+# Directorio de descargas pendientes (compartido por todos los procesos)
+EXPORTS_DIR = os.environ.get('MOVPER_EXPORTS_DIR', os.path.join(tempfile.gettempdir(), 'movper_exports'))
+# Tiempo de vida de un archivo pendiente de descarga (segundos)
+DOWNLOAD_TTL = 3600
+# Tiempo que se conserva el estado de un trabajo terminado (segundos)
+EXPORT_JOB_TTL = 3600
+# Segundos sin avance tras los que un trabajo sin terminar se da por interrumpido
+EXPORT_JOB_STALE_SECONDS = 600
+# Procesos para renderizar documentos
+EXPORT_WORKERS = int(os.environ.get('MOVPER_EXPORT_WORKERS', min(4, os.cpu_count() or 1)))
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+ZIP_MIMETYPE = 'application/zip'
+
+_TOKEN_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+class DownloadStore:
+    """
+    Archivos pendientes de descarga {token: archivo + metadatos} en disco.
+    Cada token tiene un `<token>.bin` con el contenido y un `<token>.json` con
+    nombre, mimetype, expiración y si se elimina tras la primera descarga.
+    """
+
+    def __init__(self, directory: str = EXPORTS_DIR, ttl: int = DOWNLOAD_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, token: str):
+        return (os.path.join(self.directory, f'{token}.bin'),
+                os.path.join(self.directory, f'{token}.json'))
+
+    def reservar(self) -> Tuple[str, str]:
+        """
+        Reserva un token y la ruta donde escribir su contenido.
+        El archivo no es descargable hasta llamar a `publicar`.
+
+        Returns:
+            (token, ruta_del_contenido)
+        """
+        token = uuid.uuid4().hex
+        return token, self._paths(token)[0]
+
+    def publicar(self, token: str, filename: str, mimetype: str,
+                 ttl: Optional[int] = None, un_solo_uso: bool = True) -> str:
+        """Publica un token reservado cuyo contenido ya está escrito."""
+        _, meta_path = self._paths(token)
+        meta = {
+            'filename': filename,
+            'mimetype': mimetype,
+            'expires_at': time.time() + (ttl or self.ttl),
+            'un_solo_uso': un_solo_uso,
+        }
+        tmp_path = f'{meta_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+        return token
+
+    def guardar(self, contenido: bytes, filename: str, mimetype: str,
+                ttl: Optional[int] = None, un_solo_uso: bool = True) -> str:
+        """
+        Guarda un archivo y devuelve su token de descarga.
+
+        Args:
+            contenido: Bytes del archivo
+            filename: Nombre con el que se descargará
+            mimetype: Tipo MIME
+            ttl: Segundos de vigencia (por defecto self.ttl)
+            un_solo_uso: Si se elimina tras la primera descarga
+
+        Returns:
+            Token de descarga
+        """
+        token, data_path = self.reservar()
+        with open(data_path, 'wb') as f:
+            f.write(contenido)
+        return self.publicar(token, filename, mimetype, ttl, un_solo_uso)
+
+    def obtener(self, token: str) -> Optional[Dict]:
+        """
+        Devuelve {'path', 'filename', 'mimetype', 'un_solo_uso'} o None si el
+        token no existe, es inválido o expiró.
+        """
+        if not token or not _TOKEN_RE.match(token):
+            return None
+
+        data_path, meta_path = self._paths(token)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if meta.get('expires_at', 0) < time.time() or not os.path.exists(data_path):
+            self.eliminar(token)
+            return None
+
+        meta['path'] = data_path
+        return meta
+
+    def eliminar(self, token: str):
+        """Elimina el archivo y los metadatos de un token."""
+        for path in self._paths(token):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def limpiar_expirados(self) -> int:
+        """Elimina los archivos expirados y los reservados nunca publicados."""
+        eliminados = 0
+        now = time.time()
+        for name in os.listdir(self.directory):
+            token, ext = os.path.splitext(name)
+            if ext != '.bin' or not _TOKEN_RE.match(token):
+                continue
+
+            data_path, meta_path = self._paths(token)
+            if os.path.exists(meta_path):
+                if self.obtener(token) is None:
+                    eliminados += 1
+                continue
+
+            # Sin metadatos: reserva abandonada si ya pasó el TTL
+            try:
+                if os.path.getmtime(data_path) + self.ttl < now:
+                    os.remove(data_path)
+                    eliminados += 1
+            except OSError:
+                pass
+        return eliminados
+
+
+class ExportJob:
+    """Estado de un trabajo de exportación."""
+
+    def __init__(self, owner_id: Any, zip_filename: str, total: int):
+        self.id = uuid.uuid4().hex
+        self.owner_id = owner_id
+        self.zip_filename = zip_filename
+        self.estado = 'pendiente'  # pendiente | procesando | completado | error
+        self.total = total
+        self.procesados = 0
+        self.documentos = 0
+        self.errores: List[Dict] = []
+        self.token: Optional[str] = None
+        self.mensaje: Optional[str] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.finished_at: Optional[float] = None
+
+    def to_state(self) -> Dict:
+        """Estado completo del trabajo para persistirlo en disco."""
+        return {
+            'id': self.id,
+            'owner_id': self.owner_id,
+            'zip_filename': self.zip_filename,
+            'estado': self.estado,
+            'total': self.total,
+            'procesados': self.procesados,
+            'documentos': self.documentos,
+            'errores': list(self.errores),
+            'token': self.token,
+            'mensaje': self.mensaje,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+            'finished_at': self.finished_at,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'ExportJob':
+        """Reconstruye un trabajo a partir de su estado persistido."""
+        job = cls(state['owner_id'], state['zip_filename'], state['total'])
+        for key, value in state.items():
+            setattr(job, key, value)
+        return job
+
+    def to_dict(self) -> Dict:
+        """Convierte el trabajo a diccionario para la API."""
+        return {
+            'job_id': self.id,
+            'estado': self.estado,
+            'total': self.total,
+            'procesados': self.procesados,
+            'documentos': self.documentos,
+            'porcentaje': round(self.procesados * 100 / self.total) if self.total else 100,
+            'errores': list(self.errores),
+            'mensaje': self.mensaje,
+            'filename': self.zip_filename,
+        }
+
+
+class ExportJobManager:
+    """
+    Cola de trabajos de exportación.
+
+    Cada trabajo recibe una lista de tareas (ej. ids de miembros) y una función
+    que convierte cada tarea en documentos MovPer. La construcción corre en un
+    hilo con contexto de aplicación (acceso a BD) y el renderizado de cada
+    documento se reparte en un pool de procesos.
+
+    El estado de cada trabajo se escribe en `job_<id>.json` dentro del
+    directorio del almacén en cada avance; `get` lo lee de ahí cuando el
+    trabajo no corre en este proceso.
+    """
+
+    def __init__(self, store: DownloadStore, max_workers: int = EXPORT_WORKERS,
+                 executor=None, renderizar: Callable[[Dict], bytes] = renderizar_documento_bytes):
+        """
+        Inicializa el gestor.
+
+        Args:
+            store: Almacén donde se publica el ZIP terminado
+            max_workers: Procesos del pool de renderizado
+            executor: Executor a usar en lugar del pool de procesos
+            renderizar: Función documento -> bytes (debe ser serializable)
+        """
+        self.store = store
+        self.max_workers = max_workers
+        self.renderizar = renderizar
+        self._executor = executor
+        self._jobs: Dict[str, ExportJob] = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """Pool de procesos creado bajo demanda (spawn: seguro con hilos activos)."""
+        with self._lock:
+            if self._executor is None:
+                try:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+                except (OSError, NotImplementedError) as e:
+                    logger.warning(f"⚠ Pool de procesos no disponible, usando hilos: {e}")
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def submit(self, tareas: Iterable, construir: Callable[[Any], List[Dict]],
+               zip_filename: str, owner_id: Any = None, app=None,
+               etiqueta: Callable[[Any], str] = str) -> ExportJob:
+        """
+        Encola un trabajo de exportación.
+
+        Args:
+            tareas: Elementos a procesar (uno por unidad de progreso)
+            construir: Función tarea -> lista de documentos (corre con contexto de app)
+            zip_filename: Nombre del ZIP resultante
+            owner_id: Usuario dueño del trabajo
+            app: Aplicación Flask para abrir contexto en el hilo del trabajo
+            etiqueta: Función tarea -> texto para reportar errores
+
+        Returns:
+            ExportJob encolado
+        """
+        tareas = list(tareas)
+        self.store.limpiar_expirados()
+        job = ExportJob(owner_id, zip_filename, len(tareas))
+        with self._lock:
+            self._limpiar_trabajos()
+            self._jobs[job.id] = job
+        self._guardar_estado(job)
+
+        thread = threading.Thread(target=self._run, args=(job, tareas, construir, etiqueta, app), daemon=True)
+        thread.start()
+        logger.info(f"📦 Exportación {job.id} encolada ({job.total} tareas)")
+        return job
+
+    def get(self, job_id: str) -> Optional[ExportJob]:
+        """
+        Obtiene un trabajo por id: primero los que corren en este proceso y
+        después el estado persistido (reinicios u otros procesos).
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        return self.obtener(job_id)
+
+    def obtener(self, job_id: str) -> Optional[ExportJob]:
+        """
+        Lee el estado persistido de un trabajo.
+
+        Returns:
+            ExportJob reconstruido, o None si no existe, es inválido o expiró.
+            Un trabajo sin terminar que no avanza desde hace más de
+            EXPORT_JOB_STALE_SECONDS se reporta como interrumpido.
+        """
+        if not job_id or not _TOKEN_RE.match(job_id):
+            return None
+
+        path = self._job_path(job_id)
+        try:
+            with open(path, encoding='utf-8') as f:
+                job = ExportJob.from_state(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        now = time.time()
+        if job.finished_at and job.finished_at + EXPORT_JOB_TTL < now:
+            self._eliminar_estado(job_id)
+            return None
+        if job.finished_at is None and job.updated_at + EXPORT_JOB_STALE_SECONDS < now:
+            job.estado = 'error'
+            job.mensaje = 'Trabajo interrumpido'
+            job.finished_at = job.updated_at
+        return job
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.store.directory, f'job_{job_id}.json')
+
+    def _guardar_estado(self, job: ExportJob):
+        """Escribe el estado del trabajo de forma atómica."""
+        job.updated_at = time.time()
+        path = self._job_path(job.id)
+        tmp_path = f'{path}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(job.to_state(), f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"⚠ No se pudo guardar el estado de la exportación {job.id}: {e}")
+
+    def _eliminar_estado(self, job_id: str):
+        try:
+            os.remove(self._job_path(job_id))
+        except OSError:
+            pass
+
+    def _limpiar_trabajos(self):
+        """Descarta trabajos terminados hace más de EXPORT_JOB_TTL (requiere lock)."""
+        limite = time.time() - EXPORT_JOB_TTL
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < limite]:
+            del self._jobs[job_id]
+
+        # Estados persistidos por este u otros procesos
+        for name in os.listdir(self.store.directory):
+            if name.startswith('job_') and name.endswith('.json'):
+                self.obtener(name[len('job_'):-len('.json')])
+
+    def _run(self, job: ExportJob, tareas: List, construir: Callable, etiqueta: Callable, app):
+        """Ejecuta el trabajo, con contexto de aplicación si se indicó."""
+        if app is not None:
+            with app.app_context():
+                self._procesar(job, tareas, construir, etiqueta)
+        else:
+            self._procesar(job, tareas, construir, etiqueta)
+
+    def _procesar(self, job: ExportJob, tareas: List, construir: Callable, etiqueta: Callable):
+        job.estado = 'procesando'
+        self._guardar_estado(job)
+        token, zip_path = self.store.reservar()
+        executor = self._get_executor()
+        pendientes = {}  # future -> (indice de tarea, documento)
+        restantes = {}   # indice de tarea -> documentos sin renderizar
+
+        try:
+            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for indice, tarea in enumerate(tareas):
+                    try:
+                        documentos = construir(tarea)
+                    except Exception as e:
+                        job.errores.append({'tarea': etiqueta(tarea), 'error': str(e)})
+                        job.procesados += 1
+                        self._guardar_estado(job)
+                        continue
+
+                    if not documentos:
+                        job.procesados += 1
+                        self._guardar_estado(job)
+                        continue
+                    restantes[indice] = len(documentos)
+                    for documento in documentos:
+                        pendientes[executor.submit(self.renderizar, documento)] = (indice, tarea, documento)
+
+                for future in as_completed(pendientes):
+                    indice, tarea, documento = pendientes[future]
+                    try:
+                        # Los .xlsx ya vienen comprimidos: se guardan sin deflate
+                        zf.writestr(documento['filename'], future.result(), compress_type=zipfile.ZIP_STORED)
+                        job.documentos += 1
+                    except Exception as e:
+                        job.errores.append({'tarea': etiqueta(tarea), 'error': str(e)})
+                    restantes[indice] -= 1
+                    if restantes[indice] == 0:
+                        job.procesados += 1
+                        self._guardar_estado(job)
+
+            self.store.publicar(token, job.zip_filename, ZIP_MIMETYPE, un_solo_uso=False)
+            job.token = token
+            job.estado = 'completado'
+            logger.info(f"✓ Exportación {job.id}: {job.documentos} documentos, {len(job.errores)} errores")
+
+        except Exception as e:
+            logger.error(f"Error en exportación {job.id}: {e}")
+            job.estado = 'error'
+            job.mensaje = str(e)
+            self.store.eliminar(token)
+        finally:
+            job.finished_at = time.time()
+            self._guardar_estado(job)
+
+    def shutdown(self):
+        """Detiene el pool de renderizado."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+# Instancias compartidas por las rutas de MovPer
+download_store = DownloadStore()
+export_jobs = ExportJobManager(download_store)
@@ -1,22 +1,50 @@
 """
 Modulo de generacion de formato Excel para MovPer
-Usa win32com (pywin32) para llenar el template Excel preservando completamente el formato y shapes.
+Llena el template Excel preservando completamente el formato y shapes.
+
+Backends:
+    - xml: motor en Python puro que edita directamente las partes OOXML del
+      template (celdas, estilos, círculos y logo). Multiplataforma y sin Excel.
+    - win32com: automatiza Excel con pywin32 (solo Windows, opcional).
 """
 
-import win32com.client as win32
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import os
+import re
 import shutil
 import tempfile
-from datetime import datetime, timedelta
-import pythoncom
-from typing import List, Dict, Tuple
+import posixpath
+import threading
+import zipfile
+import copy
+import hashlib
+import json
+from io import BytesIO
+from types import MappingProxyType
+from typing import List, Dict, Tuple, Optional
+from xml.sax.saxutils import escape
+
+from webapp.document_cache import document_cache
+
+# win32com es opcional: solo disponible en Windows con Excel instalado
+try:
+    import win32com.client as win32
+    import pythoncom
+    WIN32COM_AVAILABLE = True
+except ImportError:
+    win32 = None
+    pythoncom = None
+    WIN32COM_AVAILABLE = False
 
 # Directorio base
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # Configuracion de rutas
 TEMPLATE_PATH = os.path.join(BASE_DIR, 'templates', 'F-RH-18-MIT-FORMATO-DE-MOVIMIENTO-DE-PERSONAL-3(1).xlsx')
+LOGOS_DIR = os.path.join(BASE_DIR, 'static', 'logos')
+
+# Backend de generacion: 'xml' (por defecto) o 'win32com'
+EXCEL_BACKEND = os.environ.get('MOVPER_EXCEL_BACKEND', 'xml').lower()
 
 # =============================================================================
 # MAPEO DE CELDAS DEL TEMPLATE EXCEL
@@ -81,6 +109,9 @@ SHAPES = {
     'GOCE_NO': 10,              # Shape #10 en R17
 }
 
+# Logo de la empresa (Shape #25 - "Imagen 12")
+LOGO_SHAPE = 25
+
 # Colores RGB para Excel (formato BGR)
 def rgb_to_excel(r, g, b):
     return r + (g << 8) + (b << 16)
@@ -95,6 +126,11 @@ MESES_ES = {
     9: 'septiembre', 10: 'octubre', 11: 'noviembre', 12: 'diciembre'
 }
 
+MESES_CORTOS_ES = {
+    1: 'ene', 2: 'feb', 3: 'mar', 4: 'abr', 5: 'may', 6: 'jun',
+    7: 'jul', 8: 'ago', 9: 'sep', 10: 'oct', 11: 'nov', 12: 'dic'
+}
+
 
 # =============================================================================
 # FUNCIONES AUXILIARES
@@ -228,6 +264,36 @@ def calcular_tamano_letra(texto: str, max_size: int = 12, min_size: int = 8) ->
 NO_SHRINK_FIELDS = {'AUTORIZO_NOMBRE', 'SOLICITO_NOMBRE'}
 
 
+def resolver_formato_celda(texto: str, campo: str) -> Tuple[int, Optional[bool]]:
+    """
+    Calcula el formato de una celda de texto: tamaño de fuente adaptativo y
+    si debe activarse ShrinkToFit como respaldo.
+
+    Args:
+        texto: Texto a escribir
+        campo: Clave en CAMPO_CONFIG
+
+    Returns:
+        (font_size, shrink): shrink es None si el campo no define capacidad
+        y el ajuste del template debe conservarse.
+    """
+    font_size = calcular_font_adaptativo(texto, campo)
+
+    if campo in NO_SHRINK_FIELDS:
+        return font_size, False
+
+    config = CAMPO_CONFIG.get(campo)
+    if not config:
+        return font_size, None
+
+    col_width, font_max, font_min, wrap_lines, ratio = config
+    cap_min = col_width / ratio * (11.0 / font_min) * wrap_lines
+    if len(texto) > cap_min:
+        print(f"[MOVPER EXCEL] {campo} '{texto}' ({len(texto)}c) -> ShrinkToFit activado (cap_min={cap_min:.1f})")
+        return font_size, True
+    return font_size, False
+
+
 def set_cell_text(sheet, celda: str, texto: str, campo: str):
     """
     Escribe texto en una celda aplicando tamaño de fuente adaptativo.
@@ -241,22 +307,11 @@ def set_cell_text(sheet, celda: str, texto: str, campo: str):
         campo: Clave en CAMPO_CONFIG para calcular el font size
     """
     rng = sheet.Range(celda)
-    font_size = calcular_font_adaptativo(texto, campo)
+    font_size, shrink = resolver_formato_celda(texto, campo)
     rng.Value = texto
     rng.Font.Size = font_size
-
-    if campo in NO_SHRINK_FIELDS:
-        rng.ShrinkToFit = False
-    else:
-        config = CAMPO_CONFIG.get(campo)
-        if config:
-            col_width, font_max, font_min, wrap_lines, ratio = config
-            cap_min = col_width / ratio * (11.0 / font_min) * wrap_lines
-            if len(texto) > cap_min:
-                rng.ShrinkToFit = True
-                print(f"[MOVPER EXCEL] {campo} '{texto}' ({len(texto)}c) -> ShrinkToFit activado (cap_min={cap_min:.1f})")
-            else:
-                rng.ShrinkToFit = False
+    if shrink is not None:
+        rng.ShrinkToFit = shrink
     print(f"[MOVPER EXCEL] {campo} '{texto}' ({len(texto)} chars) -> font {font_size}pt")
 
 
@@ -314,7 +369,7 @@ def reemplazar_logo(sheet, logo_path: str) -> bool:
         print(f"[MOVPER EXCEL] Reemplazando logo con: {logo_abs_path}")
         
         # Obtener propiedades del logo original MIT (Shape 25)
-        original_logo = sheet.Shapes(25)
+        original_logo = sheet.Shapes(LOGO_SHAPE)
         logo_left = original_logo.Left
         logo_top = original_logo.Top
         mit_width = original_logo.Width   # 83.4 puntos
@@ -527,14 +582,146 @@ def agrupar_periodos_vacaciones(incidencias: List[Dict]) -> List[Dict]:
     return result
 
 
-def generar_aviso_vacaciones(
+# =============================================================================
+# MODELO DE DOCUMENTO
+# =============================================================================
+# Los generadores construyen primero un documento independiente del backend:
+#   {
+#       'filename': 'MovPer_123_20250201.xlsx',
+#       'celdas':   [{'celda': 'E8', 'valor': 'Juan', 'font_size': 10, 'shrink': False}, ...],
+#       'circulos': {shape_index: seleccionado, ...},
+#       'logo_path': ruta absoluta del logo de la empresa o None,
+#   }
+# Cada backend (xml / win32com) solo aplica ese documento sobre el template.
+
+def formatear_fecha_corta(fecha) -> str:
+    """Formatea una fecha como dd-mmm-yy con mes en español (ej. 05-feb-25)."""
+    return f"{fecha.day:02d}-{MESES_CORTOS_ES[fecha.month]}-{fecha.strftime('%y')}"
+
+
+def celda_texto(celda: str, texto: str, campo: str) -> Dict:
+    """Operacion de celda con texto y formato adaptativo segun CAMPO_CONFIG."""
+    font_size, shrink = resolver_formato_celda(texto, campo)
+    print(f"[MOVPER EXCEL] {campo} '{texto}' ({len(texto)} chars) -> font {font_size}pt")
+    return {'celda': celda, 'valor': texto, 'font_size': font_size, 'shrink': shrink}
+
+
+def celda_valor(celda: str, valor, font_size: Optional[int] = None) -> Dict:
+    """Operacion de celda con valor fijo (None o '' limpian la celda)."""
+    return {'celda': celda, 'valor': valor, 'font_size': font_size, 'shrink': None}
+
+
+def obtener_logo_empresa(preset) -> Optional[str]:
+    """
+    Devuelve la ruta del logo de la empresa del preset, si existe.
+
+    Args:
+        preset: PresetUsuario (puede ser None)
+
+    Returns:
+        Ruta absoluta del logo o None para conservar el logo por defecto (MIT)
+    """
+    if not (preset and preset.company and preset.company.logo_filename):
+        print(f"[MOVPER EXCEL] Sin empresa configurada, usando logo por defecto (MIT)")
+        return None
+
+    logo_path = os.path.join(LOGOS_DIR, preset.company.logo_filename)
+    if not os.path.exists(logo_path):
+        print(f"[MOVPER EXCEL] Logo no encontrado para empresa {preset.company.name}: {logo_path}")
+        return None
+
+    print(f"[MOVPER EXCEL] Empresa: {preset.company.name}")
+    return os.path.abspath(logo_path)
+
+
+def construir_documento_movper(
+    user,
+    preset,
+    incidencias: List[Dict],
+    quincena: Dict,
+    con_goce: bool = True
+) -> Dict:
+    """
+    Construye el documento del formato de movimiento de personal.
+
+    Args:
+        user: MovPerUser - Usuario actual
+        preset: PresetUsuario - Configuracion del usuario
+        incidencias: List[Dict] - Lista de incidencias clasificadas
+        quincena: Dict - Info de la quincena {inicio, fin, nombre}
+        con_goce: bool - Si es con goce de sueldo
+
+    Returns:
+        Dict: Documento listo para renderizar
+    """
+    fecha_str = quincena['inicio'].strftime('%Y%m%d')
+    celdas = []
+
+    # Solo incluir: retardos justificados + faltas clasificadas (excepto INCAPACIDAD)
+    incidencias_justificadas = filtrar_incidencias_a_justificar(incidencias)
+    print(f"[MOVPER EXCEL] Incidencias totales: {len(incidencias)}")
+    print(f"[MOVPER EXCEL] Incidencias a justificar: {len(incidencias_justificadas)}")
+
+    # Encabezado: nombre en Title Case (Raúl Abel Cetina Pool)
+    nombre = preset.nombre_formato if preset and preset.nombre_formato else user.nombre_completo
+    nombre_display = nombre.title()
+    celdas.append(celda_texto(CELDAS['NOMBRE'], nombre_display, 'NOMBRE'))
+
+    departamento = preset.departamento_formato if preset and preset.departamento_formato else "Sin departamento"
+    celdas.append(celda_texto(CELDAS['DEPARTAMENTO'], departamento.upper(), 'DEPARTAMENTO'))
+
+    # Fecha de autorizacion (hoy) y fechas de aplicacion (dias del periodo)
+    fecha_auth = formatear_fecha_corta(datetime.now())
+    celdas.append(celda_texto(CELDAS['FECHA_AUTORIZACION'], fecha_auth, 'FECHA_AUTORIZACION'))
+    dias_periodo = construir_fechas_aplicacion(incidencias_justificadas, quincena)
+    celdas.append(celda_texto(CELDAS['FECHA_APLICACION'], dias_periodo, 'FECHA_APLICACION'))
+
+    # Circulos: todos en blanco y se marcan segun los tipos encontrados
+    tipos = analizar_tipos_incidencias(incidencias_justificadas)
+    circulos = {shape_idx: False for shape_idx in SHAPES.values()}
+
+    # PARA FALTAR: cualquier tipo de falta (genérica, remoto, guardia, permiso, vacaciones)
+    tiene_faltas = tipos['faltas'] or tipos['remotos'] or tipos['guardias'] or tipos['permisos'] or tipos['vacaciones']
+    if tiene_faltas:
+        circulos[SHAPES['PARA_FALTAR']] = True
+    if tipos['retardos']:
+        circulos[SHAPES['PARA_LLEGAR_TARDE']] = True
+    if tipos['salir_regresar']:
+        circulos[SHAPES['PARA_SALIR_REGRESAR']] = True
+    if tipos['olvido_checar']:
+        circulos[SHAPES['OLVIDO_CHECAR']] = True
+    if tipos['retirarse_temprano']:
+        circulos[SHAPES['PARA_RETIRARSE']] = True
+
+    # Goce de sueldo
+    circulos[SHAPES['GOCE_SI']] = bool(con_goce)
+    circulos[SHAPES['GOCE_NO']] = not con_goce
+
+    motivo = generar_texto_motivo(incidencias_justificadas, tipos)
+    celdas.append(celda_texto(CELDAS['MOTIVO'], motivo, 'MOTIVO'))
+
+    # Firmas: solicito (empleado), autorizo (jefe directo) y recibio (RH)
+    celdas.append(celda_texto(CELDAS['SOLICITO_NOMBRE'], nombre_display, 'SOLICITO_NOMBRE'))
+    jefe = preset.jefe_directo_nombre if preset and preset.jefe_directo_nombre else "PENDIENTE"
+    celdas.append(celda_texto(CELDAS['AUTORIZO_NOMBRE'], jefe.upper(), 'AUTORIZO_NOMBRE'))
+    celdas.append(celda_texto(CELDAS['RECIBIO_NOMBRE'], "RECURSOS HUMANOS", 'RECIBIO_NOMBRE'))
+
+    return {
+        'filename': f"MovPer_{user.numero_socio}_{fecha_str}.xlsx",
+        'celdas': celdas,
+        'circulos': circulos,
+        'logo_path': obtener_logo_empresa(preset),
+    }
+
+
+def construir_documento_vacaciones(
     user,
     preset,
     periodo_vac: Dict,
     quincena: Dict,
-) -> Tuple[str, str]:
+) -> Dict:
     """
-    Genera un AVISO DE VACACIONES llenando la seccion inferior del template Excel.
+    Construye el documento del AVISO DE VACACIONES (seccion inferior del template).
 
     Args:
         user: MobPerUser
@@ -543,117 +730,620 @@ def generar_aviso_vacaciones(
         quincena: Dict con info de la quincena
 
     Returns:
-        (output_path, filename)
+        Dict: Documento listo para renderizar
     """
-    import shutil, tempfile
-
-    if not os.path.exists(TEMPLATE_PATH):
-        raise FileNotFoundError(f"Template no encontrado: {TEMPLATE_PATH}")
-
-    # Crear copia temporal
-    tmp_dir = tempfile.mkdtemp()
     nombre = preset.nombre_formato if preset and preset.nombre_formato else user.nombre_completo
     nombre_display = nombre.title()
     safe_name = nombre_display.replace(' ', '_')[:30]
-    fecha_salida = periodo_vac['fecha_salida']
-    filename = f"VACACIONES_{safe_name}_{fecha_salida.strftime('%Y%m%d')}.xlsx"
-    output_path = os.path.join(tmp_dir, filename)
-    shutil.copy2(TEMPLATE_PATH, output_path)
+    f_salida = periodo_vac['fecha_salida']
+    # fecha_regreso = ultimo dia de vacaciones (NO el dia siguiente)
+    f_regreso = max(periodo_vac['dias'])
+    dias_ef = periodo_vac['dias_efectivos']
+    celdas = []
+
+    # --- Encabezado superior (mismo que MovPer) ---
+    celdas.append(celda_texto(CELDAS['NOMBRE'], nombre_display, 'NOMBRE'))
+    depto = preset.departamento_formato if preset and preset.departamento_formato else ''
+    celdas.append(celda_texto(CELDAS['DEPARTAMENTO'], depto.upper(), 'DEPARTAMENTO'))
+    celdas.append(celda_texto(CELDAS['FECHA_AUTORIZACION'], formatear_fecha_corta(datetime.now()), 'FECHA_AUTORIZACION'))
+
+    # --- Limpiar seccion SOLICITUD DE PERMISO (viene con datos del template base) ---
+    celdas.append(celda_valor(CELDAS['MOTIVO'], ''))
+    circulos = {shape_idx: False for shape_idx in SHAPES.values()}
+
+    # --- FECHA_APLICACION: dias de vacaciones ---
+    dias_vac_nums = sorted([d.day for d in periodo_vac['dias']])
+    mes_nombre = MESES_CORTOS_ES[f_salida.month]
+    if len(dias_vac_nums) == 1:
+        fecha_aplic_str = f"{dias_vac_nums[0]:02d}-{mes_nombre}-{str(f_salida.year)[2:]}"
+    else:
+        dias_str = ','.join(str(d) for d in dias_vac_nums)
+        fecha_aplic_str = f"{dias_str} {mes_nombre}-{str(f_salida.year)[2:]}"
+    celdas.append(celda_texto(CELDAS['FECHA_APLICACION'], fecha_aplic_str, 'FECHA_APLICACION'))
+
+    # --- AVISO DE VACACIONES ---
+    celdas.append(celda_valor(CELDAS['VAC_DIAS_EFECTIVOS'], dias_ef, font_size=10))
+    celdas.append(celda_valor(CELDAS['VAC_FECHA_SALIDA'], formatear_fecha_corta(f_salida), font_size=10))
+    celdas.append(celda_valor(CELDAS['VAC_FECHA_REGRESO'], formatear_fecha_corta(f_regreso), font_size=10))
+    celdas.append(celda_texto(CELDAS['VAC_DEPARTAMENTO'], depto.upper(), 'DEPARTAMENTO'))
+
+    # Firmas
+    celdas.append(celda_texto(CELDAS['VAC_SOLICITO'], nombre_display, 'SOLICITO_NOMBRE'))
+    jefe = preset.jefe_directo_nombre if preset and preset.jefe_directo_nombre else 'PENDIENTE'
+    celdas.append(celda_texto(CELDAS['VAC_AUTORIZO'], jefe.upper(), 'AUTORIZO_NOMBRE'))
+    celdas.append(celda_texto(CELDAS['VAC_RECIBIO'], 'RECURSOS HUMANOS', 'RECIBIO_NOMBRE'))
+
+    print(f"[MOVPER VACACIONES] Periodo {f_salida} - {f_regreso}: {dias_ef} dias")
+
+    return {
+        'filename': f"VACACIONES_{safe_name}_{f_salida.strftime('%Y%m%d')}.xlsx",
+        'celdas': celdas,
+        'circulos': circulos,
+        'logo_path': obtener_logo_empresa(preset),
+    }
+
+
+# =============================================================================
+# MOTOR XML (Python puro)
+# =============================================================================
+# Edita directamente las partes OOXML del template. openpyxl no conserva los
+# shapes (círculos) ni los controles de formulario al guardar, por eso el
+# template se trata como un paquete zip y solo se reescriben:
+#   - la hoja activa (valores de celda),
+#   - styles.xml (variantes de fuente / ShrinkToFit),
+#   - el dibujo de la hoja (relleno de círculos y logo).
+
+# 1 pulgada = 914400 EMU
+EMU_POR_PIXEL = 9525
+
+_ANCHOR_RE = re.compile(
+    r'<(xdr:twoCellAnchor|xdr:oneCellAnchor|xdr:absoluteAnchor|mc:AlternateContent)\b.*?</\1>', re.S
+)
+_SPPR_RE = re.compile(r'<xdr:spPr\b[^>]*>.*?</xdr:spPr>', re.S)
+_GEOM_FILL_RE = re.compile(
+    r'(<a:prstGeom\b[^>]*/>|<a:prstGeom\b.*?</a:prstGeom>|<a:custGeom\b.*?</a:custGeom>)'
+    r'(<a:noFill/>|<a:solidFill>.*?</a:solidFill>|<a:gradFill\b.*?</a:gradFill>'
+    r'|<a:pattFill\b.*?</a:pattFill>|<a:grpFill/>)?',
+    re.S
+)
+_FILL_SELECCIONADO = '<a:solidFill><a:srgbClr val="000000"/></a:solidFill>'
+_FILL_VACIO = '<a:noFill/>'
+
+
+def _set_attr(tag: str, nombre: str, valor) -> str:
+    """Agrega o reemplaza un atributo en una etiqueta de apertura XML."""
+    patron = re.compile(r'\s%s="[^"]*"' % re.escape(nombre))
+    if patron.search(tag):
+        return patron.sub(f' {nombre}="{valor}"', tag, count=1)
+    fin = len(tag) - (2 if tag.endswith('/>') else 1)
+    return f'{tag[:fin]} {nombre}="{valor}"{tag[fin:]}'
+
+
+def _quitar_attr(tag: str, nombre: str) -> str:
+    """Elimina un atributo de una etiqueta de apertura XML."""
+    return re.sub(r'\s%s="[^"]*"' % re.escape(nombre), '', tag)
+
+
+def _get_attr(tag: str, nombre: str) -> Optional[str]:
+    """Lee un atributo de una etiqueta XML."""
+    match = re.search(r'\s%s="([^"]*)"' % re.escape(nombre), tag)
+    return match.group(1) if match else None
+
+
+def _columna_a_indice(columna: str) -> int:
+    """Convierte letras de columna a indice (A=1, Z=26, AA=27)."""
+    indice = 0
+    for letra in columna:
+        indice = indice * 26 + (ord(letra) - 64)
+    return indice
+
+
+def _separar_celda(ref: str) -> Tuple[str, int]:
+    """Separa una referencia 'E8' en ('E', 8)."""
+    match = re.match(r'^([A-Z]+)(\d+)$', ref)
+    if not match:
+        raise ValueError(f"Referencia de celda invalida: {ref}")
+    return match.group(1), int(match.group(2))
+
+
+def _dimensiones_imagen(data: bytes) -> Tuple[int, int, str]:
+    """
+    Obtiene (ancho, alto, extension) de una imagen en pixeles.
+
+    Raises:
+        ValueError: Si el formato no es soportado
+    """
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as img:
+        extension = {'PNG': 'png', 'JPEG': 'jpeg', 'GIF': 'gif', 'BMP': 'bmp'}.get(img.format)
+        if not extension:
+            raise ValueError(f"Formato de logo no soportado: {img.format}")
+        return img.width, img.height, extension
+
+
+class EstilosXlsx:
+    """Variantes de estilo de celda (fuente / ShrinkToFit) sobre styles.xml."""
+
+    def __init__(self, xml: str):
+        self.xml = xml
+        fonts = re.search(r'(<fonts\b[^>]*>)(.*?)</fonts>', xml, re.S)
+        xfs = re.search(r'(<cellXfs\b[^>]*>)(.*?)</cellXfs>', xml, re.S)
+        self.fonts = re.findall(r'<font\b[^>]*?(?:/>|>.*?</font>)', fonts.group(2), re.S)
+        self.xfs = re.findall(r'<xf\b[^>]*?(?:/>|>.*?</xf>)', xfs.group(2), re.S)
+        self._fonts_originales = len(self.fonts)
+        self._xfs_originales = len(self.xfs)
+        self._variantes: Dict[Tuple, int] = {}
+
+    def clonar(self) -> 'EstilosXlsx':
+        """Copia independiente para agregar variantes sin tocar el original."""
+        clon = copy.copy(self)
+        clon.fonts = list(self.fonts)
+        clon.xfs = list(self.xfs)
+        clon._variantes = dict(self._variantes)
+        return clon
+
+    def _font_con_tamano(self, font_id: int, font_size: int) -> int:
+        """Indice de una fuente igual a font_id pero con otro tamaño."""
+        font = self.fonts[font_id]
+        sz = f'<sz val="{font_size}"/>'
+        if re.search(r'<sz\b[^>]*/>', font):
+            nueva = re.sub(r'<sz\b[^>]*/>', sz, font, count=1)
+        elif font.endswith('/>'):
+            nueva = f'<font>{sz}</font>'
+        else:
+            # sz va antes de color/name/family segun el esquema
+            match = re.search(r'<(color|name|family|charset|scheme)\b', font)
+            pos = match.start() if match else font.rindex('</font>')
+            nueva = font[:pos] + sz + font[pos:]
+
+        if nueva in self.fonts:
+            return self.fonts.index(nueva)
+        self.fonts.append(nueva)
+        return len(self.fonts) - 1
+
+    def variante(self, style_id: int, font_size: Optional[int], shrink: Optional[bool]) -> int:
+        """
+        Devuelve el indice de cellXfs para el estilo base con fuente y ShrinkToFit dados.
+
+        Args:
+            style_id: Indice del estilo actual de la celda
+            font_size: Tamaño de fuente (None = conservar)
+            shrink: ShrinkToFit (None = conservar)
+
+        Returns:
+            Indice del estilo (nuevo o existente)
+        """
+        if font_size is None and shrink is None:
+            return style_id
+
+        key = (style_id, font_size, shrink)
+        if key in self._variantes:
+            return self._variantes[key]
+
+        xf = self.xfs[style_id]
+        apertura = re.match(r'<xf\b[^>]*?/?>', xf).group(0)
+        cerrada = apertura.endswith('/>')
+        contenido = '' if cerrada else xf[len(apertura):-len('</xf>')]
+        apertura = apertura[:-2] + '>' if cerrada else apertura
+
+        if font_size is not None:
+            font_id = self._font_con_tamano(int(_get_attr(apertura, 'fontId') or 0), font_size)
+            apertura = _set_attr(apertura, 'fontId', font_id)
+            apertura = _set_attr(apertura, 'applyFont', 1)
+
+        if shrink is not None:
+            alignment = re.search(r'<alignment\b[^>]*/>', contenido)
+            if shrink:
+                if alignment:
+                    contenido = contenido.replace(
+                        alignment.group(0), _set_attr(alignment.group(0), 'shrinkToFit', 1), 1
+                    )
+                else:
+                    contenido = '<alignment shrinkToFit="1"/>' + contenido
+                apertura = _set_attr(apertura, 'applyAlignment', 1)
+            elif alignment:
+                contenido = contenido.replace(
+                    alignment.group(0), _quitar_attr(alignment.group(0), 'shrinkToFit'), 1
+                )
+
+        nuevo = f'{apertura}{contenido}</xf>'
+        if nuevo in self.xfs:
+            indice = self.xfs.index(nuevo)
+        else:
+            self.xfs.append(nuevo)
+            indice = len(self.xfs) - 1
+        self._variantes[key] = indice
+        return indice
+
+    def serializar(self) -> str:
+        """Devuelve styles.xml con las fuentes y estilos agregados."""
+        if len(self.fonts) == self._fonts_originales and len(self.xfs) == self._xfs_originales:
+            return self.xml
+
+        def reemplazar(xml, etiqueta, elementos):
+            patron = re.compile(r'(<%s\b[^>]*>).*?</%s>' % (etiqueta, etiqueta), re.S)
+            apertura = _set_attr(patron.search(xml).group(1), 'count', len(elementos))
+            bloque = apertura + ''.join(elementos) + f'</{etiqueta}>'
+            return patron.sub(lambda _: bloque, xml, count=1)
+
+        xml = reemplazar(self.xml, 'fonts', self.fonts)
+        return reemplazar(xml, 'cellXfs', self.xfs)
+
+
+class PlantillaXlsx:
+    """
+    Template F-RH-18 leido una sola vez como paquete OOXML inmutable.
+    Resuelve la hoja activa y su dibujo igual que `wb.ActiveSheet` en win32com.
+    Cada documento es una copia superficial de las partes mas los parches de
+    celdas y círculos.
+    """
+
+    def __init__(self, path: str = TEMPLATE_PATH):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Template no encontrado: {path}")
+
+        self.path = path
+        self.logo_path = None
+        with zipfile.ZipFile(path) as zf:
+            infos = zf.infolist()
+            partes = {info.filename: zf.read(info) for info in infos}
+            compresion = {info.filename: info.compress_type for info in infos}
+
+        self.partes = partes
+        self.hoja = self._resolver_hoja_activa()
+        self.dibujo = self._resolver_relacion(self.hoja, '/drawing')
+        self.dibujo_rels = self._rels_path(self.dibujo) if self.dibujo else None
+        self._congelar(partes, [info.filename for info in infos], compresion)
+
+    def _congelar(self, partes: Dict, orden: List[str], compresion: Dict):
+        """Fija las partes del paquete y pre-parsea lo que se parchea en cada documento."""
+        self.partes = MappingProxyType(partes)
+        self.orden = tuple(orden)
+        self.compresion = MappingProxyType(compresion)
+        self._hoja_xml = partes[self.hoja].decode('utf-8')
+        self._dibujo_xml = partes[self.dibujo].decode('utf-8') if self.dibujo else None
+        self._estilos = EstilosXlsx(partes['xl/styles.xml'].decode('utf-8'))
+
+    def con_logo(self, logo_path: str) -> 'PlantillaXlsx':
+        """
+        Variante del template con el logo de la empresa ya reemplazado.
+
+        Args:
+            logo_path: Ruta del logo de la empresa
+
+        Returns:
+            PlantillaXlsx: Nueva plantilla (la original no se modifica)
+        """
+        partes = dict(self.partes)
+        orden = list(self.orden)
+        compresion = dict(self.compresion)
+
+        if self.dibujo:
+            dibujo = self._aplicar_logo(partes, orden, compresion, self._dibujo_xml, logo_path)
+            partes[self.dibujo] = dibujo.encode('utf-8')
+
+        variante = copy.copy(self)
+        variante.logo_path = logo_path
+        variante._congelar(partes, orden, compresion)
+        return variante
+
+    @staticmethod
+    def _rels_path(parte: str) -> str:
+        carpeta, nombre = posixpath.split(parte)
+        return posixpath.join(carpeta, '_rels', f'{nombre}.rels')
+
+    def _leer_rels(self, parte: str) -> Dict[str, Tuple[str, str]]:
+        """Relaciones de una parte: {rId: (tipo, ruta_absoluta)}."""
+        rels_xml = self.partes.get(self._rels_path(parte), b'').decode('utf-8')
+        carpeta = posixpath.dirname(parte)
+        rels = {}
+        for tag in re.findall(r'<Relationship\b[^>]*>', rels_xml):
+            target = _get_attr(tag, 'Target') or ''
+            ruta = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join(carpeta, target))
+            rels[_get_attr(tag, 'Id')] = (_get_attr(tag, 'Type') or '', ruta)
+        return rels
+
+    def _resolver_relacion(self, parte: str, tipo_sufijo: str) -> Optional[str]:
+        for tipo, ruta in self._leer_rels(parte).values():
+            if tipo.endswith(tipo_sufijo):
+                return ruta
+        return None
+
+    def _resolver_hoja_activa(self) -> str:
+        workbook = self.partes['xl/workbook.xml'].decode('utf-8')
+        vista = re.search(r'<workbookView\b[^>]*>', workbook)
+        active_tab = int(_get_attr(vista.group(0), 'activeTab') or 0) if vista else 0
+        hojas = re.findall(r'<sheet\b[^>]*>', workbook)
+        rid = _get_attr(hojas[active_tab], 'r:id')
+        return self._leer_rels('xl/workbook.xml')[rid][1]
+
+    def renderizar(self, documento: Dict, destino=None):
+        """
+        Escribe el documento sobre una copia del template.
+        El logo no se toca aqui: viene aplicado en la variante (ver con_logo).
+
+        Args:
+            documento: Documento de construir_documento_movper/vacaciones
+            destino: Ruta o archivo binario de salida (por defecto un BytesIO nuevo)
+
+        Returns:
+            El destino; si es un BytesIO queda posicionado al inicio
+        """
+        partes = dict(self.partes)
+
+        estilos = self._estilos.clonar()
+        hoja = self._hoja_xml
+        for op in documento['celdas']:
+            hoja = _escribir_celda(hoja, estilos, op)
+        partes[self.hoja] = hoja.encode('utf-8')
+        partes['xl/styles.xml'] = estilos.serializar().encode('utf-8')
+
+        if self.dibujo:
+            dibujo = _aplicar_circulos(self._dibujo_xml, documento.get('circulos', {}))
+            partes[self.dibujo] = dibujo.encode('utf-8')
+
+        if destino is None:
+            destino = BytesIO()
+        with zipfile.ZipFile(destino, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name in self.orden:
+                zf.writestr(name, partes[name], compress_type=self.compresion.get(name, zipfile.ZIP_DEFLATED))
+        if hasattr(destino, 'seek'):
+            destino.seek(0)
+        return destino
+
+    def _aplicar_logo(self, partes: Dict, orden: List[str], compresion: Dict, dibujo: str, logo_path: str) -> str:
+        """Reemplaza el logo (Shape 25) manteniendo posicion y limites del logo MIT."""
+        try:
+            with open(logo_path, 'rb') as f:
+                data = f.read()
+            width_px, height_px, extension = _dimensiones_imagen(data)
+        except (OSError, ValueError) as e:
+            print(f"[MOVPER EXCEL] Error reemplazando logo: {e}")
+            return dibujo
+
+        anchors = list(_ANCHOR_RE.finditer(dibujo))
+        if len(anchors) < LOGO_SHAPE or '<xdr:pic>' not in anchors[LOGO_SHAPE - 1].group(0):
+            print(f"[MOVPER EXCEL] Logo no encontrado en el dibujo (Shape {LOGO_SHAPE})")
+            return dibujo
+
+        anchor = anchors[LOGO_SHAPE - 1]
+        pic = re.search(r'<xdr:pic>.*?</xdr:pic>', anchor.group(0), re.S).group(0)
+        off = re.search(r'<a:off x="(-?\d+)" y="(-?\d+)"/>', pic)
+        ext = re.search(r'<a:ext cx="(\d+)" cy="(\d+)"/>', pic)
+        logo_left, logo_top = int(off.group(1)), int(off.group(2))
+        mit_width, mit_height = int(ext.group(1)), int(ext.group(2))
+
+        # Límite vertical = altura MIT, límite horizontal = ancho MIT × 1.5
+        max_height = mit_height
+        max_width = mit_width * 1.5
+        scale_factor = min(max_height / height_px, max_width / width_px)
+        final_width = int(round(width_px * scale_factor))
+        final_height = int(round(height_px * scale_factor))
+
+        # Centrar verticalmente dentro del espacio disponible
+        top = logo_top + (max_height - final_height) // 2
+
+        nuevo_pic = pic.replace(off.group(0), f'<a:off x="{logo_left}" y="{top}"/>', 1)
+        nuevo_pic = nuevo_pic.replace(ext.group(0), f'<a:ext cx="{final_width}" cy="{final_height}"/>', 1)
+        nuevo_anchor = (
+            f'<xdr:absoluteAnchor><xdr:pos x="{logo_left}" y="{top}"/>'
+            f'<xdr:ext cx="{final_width}" cy="{final_height}"/>'
+            f'{nuevo_pic}<xdr:clientData/></xdr:absoluteAnchor>'
+        )
+
+        # Nueva imagen en el paquete y relacion del dibujo apuntando a ella
+        media = f'xl/media/logo_empresa.{extension}'
+        if media not in partes:
+            orden.append(media)
+        partes[media] = data
+        # Las imagenes ya vienen comprimidas
+        compresion[media] = zipfile.ZIP_STORED
+
+        rid = re.search(r'r:embed="([^"]+)"', pic).group(1)
+        rels = partes[self.dibujo_rels].decode('utf-8')
+        rel_tag = re.search(r'<Relationship\b[^>]*\sId="%s"[^>]*>' % re.escape(rid), rels).group(0)
+        target = posixpath.relpath(media, posixpath.dirname(self.dibujo))
+        partes[self.dibujo_rels] = rels.replace(rel_tag, _set_attr(rel_tag, 'Target', target), 1).encode('utf-8')
+
+        content_types = partes['[Content_Types].xml'].decode('utf-8')
+        if f'Extension="{extension}"' not in content_types:
+            default = f'<Default Extension="{extension}" ContentType="image/{extension}"/>'
+            content_types = content_types.replace('<Default ', default + '<Default ', 1)
+            partes['[Content_Types].xml'] = content_types.encode('utf-8')
+
+        print(f"[MOVPER EXCEL] Logo reemplazado: {os.path.basename(logo_path)} "
+              f"({width_px}x{height_px}px -> {final_width}x{final_height} EMU)")
+        return dibujo[:anchor.start()] + nuevo_anchor + dibujo[anchor.end():]
+
+
+def _escribir_celda(hoja: str, estilos: EstilosXlsx, op: Dict) -> str:
+    """
+    Escribe el valor de una operacion de celda en el XML de la hoja.
+    Texto como inlineStr, numeros como valor y None/'' limpia la celda.
+    """
+    ref = op['celda']
+    valor = op['valor']
+    patron = re.compile(r'<c r="%s"(?P<attrs>[^>]*?)(?:/>|>.*?</c>)' % ref, re.S)
+    actual = patron.search(hoja)
+
+    style_id = int(_get_attr(actual.group('attrs'), 's') or 0) if actual else 0
+    style_id = estilos.variante(style_id, op.get('font_size'), op.get('shrink'))
+    estilo = f' s="{style_id}"' if style_id else ''
+
+    if valor is None or valor == '':
+        nueva = f'<c r="{ref}"{estilo}/>'
+    elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        nueva = f'<c r="{ref}"{estilo}><v>{valor}</v></c>'
+    else:
+        texto = escape(str(valor))
+        nueva = f'<c r="{ref}"{estilo} t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+    if actual:
+        return hoja[:actual.start()] + nueva + hoja[actual.end():]
+
+    # La celda no existe: insertarla en su fila respetando el orden de columnas
+    columna, fila = _separar_celda(ref)
+    fila_match = re.search(r'<row r="%d"[^>]*?(?:/>|>.*?</row>)' % fila, hoja, re.S)
+    if not fila_match:
+        raise ValueError(f"La fila {fila} no existe en la hoja del template")
+
+    fila_xml = fila_match.group(0)
+    if fila_xml.endswith('/>'):
+        fila_xml = fila_xml[:-2] + '></row>'
+    pos = fila_xml.rindex('</row>')
+    for celda in re.finditer(r'<c r="([A-Z]+)\d+"', fila_xml):
+        if _columna_a_indice(celda.group(1)) > _columna_a_indice(columna):
+            pos = celda.start()
+            break
+    fila_xml = fila_xml[:pos] + nueva + fila_xml[pos:]
+    return hoja[:fila_match.start()] + fila_xml + hoja[fila_match.end():]
+
+
+def _aplicar_circulos(dibujo: str, circulos: Dict[int, bool]) -> str:
+    """
+    Cambia el relleno de los círculos del dibujo.
+    El indice de shape es el orden del anchor en el dibujo (igual que sheet.Shapes(n)).
+    Negro = seleccionado, sin relleno = no seleccionado (solo contorno).
+    """
+    anchors = list(_ANCHOR_RE.finditer(dibujo))
+    reemplazos = []
+
+    for shape_index, is_selected in circulos.items():
+        if not 1 <= shape_index <= len(anchors):
+            print(f"[MOVPER EXCEL] Error en shape {shape_index}: no existe en el dibujo")
+            continue
+
+        anchor = anchors[shape_index - 1]
+        anchor_xml = anchor.group(0)
+        sppr = _SPPR_RE.search(anchor_xml)
+        if not sppr:
+            print(f"[MOVPER EXCEL] Error en shape {shape_index}: sin propiedades de forma")
+            continue
+
+        fill = _FILL_SELECCIONADO if is_selected else _FILL_VACIO
+        nuevo_sppr = _GEOM_FILL_RE.sub(lambda m: m.group(1) + fill, sppr.group(0), count=1)
+        nuevo_anchor = anchor_xml[:sppr.start()] + nuevo_sppr + anchor_xml[sppr.end():]
+        reemplazos.append((anchor.start(), anchor.end(), nuevo_anchor))
+
+    for start, end, nuevo in sorted(reemplazos, reverse=True):
+        dibujo = dibujo[:start] + nuevo + dibujo[end:]
+    return dibujo
+
+
+# =============================================================================
+# CACHE DE PLANTILLAS
+# =============================================================================
+# El template (y cada variante con el logo de una empresa) se parsea una sola
+# vez. Se invalida si cambia la fecha de modificacion del template o del logo.
+
+_plantillas_cache: Dict[Tuple[str, Optional[str]], Tuple[Tuple, PlantillaXlsx]] = {}
+_plantillas_lock = threading.Lock()
+
+
+def _firma_archivo(path: str) -> Tuple[float, int]:
+    """Firma (mtime, tamaño) para detectar cambios en disco."""
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def obtener_plantilla(logo_path: Optional[str] = None) -> PlantillaXlsx:
+    """
+    Devuelve el template parseado desde cache, con el logo ya aplicado si se indica.
+
+    Args:
+        logo_path: Ruta del logo de la empresa (None = logo por defecto MIT)
+
+    Returns:
+        PlantillaXlsx inmutable compartida entre documentos
+    """
+    key = (TEMPLATE_PATH, logo_path)
+    firma = (_firma_archivo(TEMPLATE_PATH), _firma_archivo(logo_path) if logo_path else None)
+
+    with _plantillas_lock:
+        entry = _plantillas_cache.get(key)
+        if entry and entry[0] == firma:
+            return entry[1]
+
+    if logo_path:
+        plantilla = obtener_plantilla(None).con_logo(logo_path)
+    else:
+        plantilla = PlantillaXlsx(TEMPLATE_PATH)
+        print(f"[MOVPER EXCEL] Template cargado en cache: {os.path.basename(TEMPLATE_PATH)}")
+
+    with _plantillas_lock:
+        _plantillas_cache[key] = (firma, plantilla)
+    return plantilla
+
+
+def limpiar_cache_plantillas():
+    """Descarta todas las plantillas en cache."""
+    with _plantillas_lock:
+        _plantillas_cache.clear()
+
+
+# =============================================================================
+# BACKENDS Y GENERACION
+# =============================================================================
+
+def obtener_backend() -> str:
+    """
+    Backend de generacion configurado (MOVPER_EXCEL_BACKEND).
+    Si se pide win32com pero pywin32 no esta disponible se usa el motor xml.
+    """
+    if EXCEL_BACKEND == 'win32com':
+        if WIN32COM_AVAILABLE:
+            return 'win32com'
+        print("[MOVPER EXCEL] win32com no disponible, usando motor xml")
+    return 'xml'
+
+
+def _renderizar_win32(documento: Dict) -> BytesIO:
+    """Aplica el documento automatizando Excel con win32com (requiere archivo en disco)."""
+    temp_file = tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False)
+    output_path = temp_file.name
+    temp_file.close()
+
+    # IMPORTANTE: Copiar template PRIMERO, luego abrir la copia
+    shutil.copy(TEMPLATE_PATH, output_path)
 
     pythoncom.CoInitialize()
+    # Usar gencache.EnsureDispatch (mas estable que Dispatch)
     excel = win32.gencache.EnsureDispatch('Excel.Application')
-    excel.Visible = False
+    excel.Visible = False  # NO mostrar Excel
     excel.DisplayAlerts = False
 
     try:
         wb = excel.Workbooks.Open(os.path.abspath(output_path))
         sheet = wb.ActiveSheet
 
-        # --- Logo ---
-        if preset and preset.company and preset.company.logo_filename:
-            logo_path = os.path.join(BASE_DIR, 'static', 'logos', preset.company.logo_filename)
-            if os.path.exists(logo_path):
-                reemplazar_logo(sheet, logo_path)
-
-        # --- Encabezado superior (mismo que MovPer) ---
-        set_cell_text(sheet, CELDAS['NOMBRE'], nombre_display, 'NOMBRE')
-        depto = preset.departamento_formato if preset and preset.departamento_formato else ''
-        set_cell_text(sheet, CELDAS['DEPARTAMENTO'], depto.upper(), 'DEPARTAMENTO')
-        now = datetime.now()
-        mes_corto = {1:'ene',2:'feb',3:'mar',4:'abr',5:'may',6:'jun',7:'jul',8:'ago',
-                     9:'sep',10:'oct',11:'nov',12:'dic'}
-        fecha_auth = f"{now.day:02d}-{mes_corto[now.month]}-{now.strftime('%y')}"
-        set_cell_text(sheet, CELDAS['FECHA_AUTORIZACION'], fecha_auth, 'FECHA_AUTORIZACION')
-
-        # --- Limpiar seccion SOLICITUD DE PERMISO (viene con datos del template base) ---
-        sheet.Range(CELDAS['MOTIVO']).Value = ''
-        # Limpiar todos los shapes (circulos) - dejarlos sin relleno
-        for shape_idx in SHAPES.values():
-            try:
-                set_circle_color(sheet, shape_idx, False)
-            except Exception:
-                pass
-        # Limpiar FECHA_APLICACION del encabezado (se llenara con fechas de vacaciones)
-        sheet.Range(CELDAS['FECHA_APLICACION']).Value = ''
-
-        # --- FECHA_APLICACION: dias de vacaciones ---
-        dias_ef = periodo_vac['dias_efectivos']
-        f_salida = periodo_vac['fecha_salida']
-        # fecha_regreso = ultimo dia de vacaciones (NO el dia siguiente)
-        f_regreso = max(periodo_vac['dias'])
-
-        # Fechas de aplicacion: lista de dias de vacaciones
-        dias_vac_nums = sorted([d.day for d in periodo_vac['dias']])
-        mes_nombre = mes_corto[f_salida.month]
-        if len(dias_vac_nums) == 1:
-            fecha_aplic_str = f"{dias_vac_nums[0]:02d}-{mes_nombre}-{str(f_salida.year)[2:]}"
-        else:
-            dias_str = ','.join(str(d) for d in dias_vac_nums)
-            fecha_aplic_str = f"{dias_str} {mes_nombre}-{str(f_salida.year)[2:]}"
-        set_cell_text(sheet, CELDAS['FECHA_APLICACION'], fecha_aplic_str, 'FECHA_APLICACION')
-
-        # --- AVISO DE VACACIONES ---
-        # Dias efectivos
-        sheet.Range(CELDAS['VAC_DIAS_EFECTIVOS']).Value = dias_ef
-        sheet.Range(CELDAS['VAC_DIAS_EFECTIVOS']).Font.Size = 10
-
-        # Fecha de salida: dd-mmm-yy (primer dia de vacaciones)
-        f_sal_str = f"{f_salida.day:02d}-{mes_corto[f_salida.month]}-{str(f_salida.year)[2:]}"
-        # Escribir directamente en la celda del merge area
-        rng_sal = sheet.Range(CELDAS['VAC_FECHA_SALIDA'])
-        rng_sal.Value = f_sal_str
-        rng_sal.Font.Size = 10
-        print(f"[MOVPER VACACIONES] VAC_FECHA_SALIDA={CELDAS['VAC_FECHA_SALIDA']} -> '{f_sal_str}'")
-
-        # Fecha de regreso: dd-mmm-yy (ultimo dia de vacaciones)
-        f_reg_str = f"{f_regreso.day:02d}-{mes_corto[f_regreso.month]}-{str(f_regreso.year)[2:]}"
-        rng_reg = sheet.Range(CELDAS['VAC_FECHA_REGRESO'])
-        rng_reg.Value = f_reg_str
-        rng_reg.Font.Size = 10
-        print(f"[MOVPER VACACIONES] VAC_FECHA_REGRESO={CELDAS['VAC_FECHA_REGRESO']} -> '{f_reg_str}'")
-
-        # Departamento
-        set_cell_text(sheet, CELDAS['VAC_DEPARTAMENTO'], depto.upper(), 'DEPARTAMENTO')
-
-        # Firmas
-        set_cell_text(sheet, CELDAS['VAC_SOLICITO'], nombre_display, 'SOLICITO_NOMBRE')
-        jefe = preset.jefe_directo_nombre if preset and preset.jefe_directo_nombre else 'PENDIENTE'
-        set_cell_text(sheet, CELDAS['VAC_AUTORIZO'], jefe.upper(), 'AUTORIZO_NOMBRE')
-        set_cell_text(sheet, CELDAS['VAC_RECIBIO'], 'RECURSOS HUMANOS', 'RECIBIO_NOMBRE')
-
-        print(f"[MOVPER VACACIONES] Periodo {f_salida} - {f_regreso}: {dias_ef} dias")
+        if documento.get('logo_path'):
+            reemplazar_logo(sheet, documento['logo_path'])
+
+        for op in documento['celdas']:
+            rng = sheet.Range(op['celda'])
+            rng.Value = op['valor']
+            if op.get('font_size') is not None:
+                rng.Font.Size = op['font_size']
+            if op.get('shrink') is not None:
+                rng.ShrinkToFit = op['shrink']
+
+        for shape_idx, is_selected in documento.get('circulos', {}).items():
+            set_circle_color(sheet, shape_idx, is_selected)
 
         wb.Save()
-        wb.Close(False)
-        print(f"[MOVPER VACACIONES] Guardado: {output_path}")
-        return output_path, filename
+        wb.Close(SaveChanges=False)  # Ya guardamos con Save()
+
+        with open(output_path, 'rb') as f:
+            return BytesIO(f.read())
 
     except Exception as e:
-        print(f"[MOVPER VACACIONES] Error: {e}")
+        print(f"[MOVPER EXCEL] ERROR durante generacion: {e}")
         import traceback
-        traceback.print_exc()
+        import sys
+        traceback.print_exc(file=sys.stderr)
         try:
-            wb.Close(False)
+            wb.Close(SaveChanges=False)
         except Exception:
             pass
         raise
@@ -663,6 +1353,72 @@ def generar_aviso_vacaciones(
         except Exception:
             pass
         pythoncom.CoUninitialize()
+        try:
+            os.remove(output_path)
+        except OSError:
+            pass
+
+
+def renderizar_documento(documento: Dict, backend: Optional[str] = None, usar_cache: bool = True) -> BytesIO:
+    """
+    Genera el .xlsx del documento en memoria con el backend indicado.
+    Si ya se genero un documento con las mismas entradas se sirve desde la
+    cache en disco (document_cache). Solo se evita el renderizado: el documento
+    ya trae las incidencias calculadas (cacheadas aparte en quincena_cache).
+
+    Args:
+        documento: Documento de construir_documento_movper/vacaciones
+        backend: 'xml' o 'win32com' (por defecto obtener_backend())
+        usar_cache: Consultar y alimentar la cache de documentos
+
+    Returns:
+        BytesIO con el archivo, posicionado al inicio
+    """
+    backend = backend or obtener_backend()
+
+    key = document_cache.clave(documento, TEMPLATE_PATH, backend) if usar_cache else None
+    if key:
+        data = document_cache.get(key)
+        if data is not None:
+            print(f"[MOVPER EXCEL] {documento['filename']} servido desde cache")
+            return BytesIO(data)
+
+    print(f"[MOVPER EXCEL] Generando {documento['filename']} (backend={backend})")
+    if backend == 'win32com':
+        contenido = _renderizar_win32(documento)
+    else:
+        contenido = obtener_plantilla(documento.get('logo_path')).renderizar(documento)
+
+    if key:
+        document_cache.put(key, contenido.getvalue())
+    return contenido
+
+
+def renderizar_documento_bytes(documento: Dict) -> bytes:
+    """Renderiza el documento y devuelve los bytes del .xlsx (apto para pools de procesos)."""
+    return renderizar_documento(documento).getvalue()
+
+
+def generar_aviso_vacaciones(
+    user,
+    preset,
+    periodo_vac: Dict,
+    quincena: Dict,
+) -> Tuple[BytesIO, str]:
+    """
+    Genera un AVISO DE VACACIONES llenando la seccion inferior del template Excel.
+
+    Args:
+        user: MobPerUser
+        preset: PresetUsuario
+        periodo_vac: Dict con 'dias', 'fecha_salida', 'fecha_regreso', 'dias_efectivos'
+        quincena: Dict con info de la quincena
+
+    Returns:
+        (contenido, filename): contenido es un BytesIO con el .xlsx
+    """
+    documento = construir_documento_vacaciones(user, preset, periodo_vac, quincena)
+    return renderizar_documento(documento), documento['filename']
 
 
 def generar_formato_excel(
@@ -671,7 +1427,7 @@ def generar_formato_excel(
     incidencias: List[Dict],
     quincena: Dict,
     con_goce: bool = True
-) -> Tuple[str, str]:
+) -> Tuple[BytesIO, str]:
     """
     Genera el formato de movimiento de personal editando la plantilla Excel.
     
@@ -683,182 +1439,12 @@ def generar_formato_excel(
         con_goce: bool - Si es con goce de sueldo
     
     Returns:
-        Tuple[str, str]: (ruta_archivo, nombre_archivo)
+        Tuple[BytesIO, str]: (contenido del archivo, nombre_archivo)
     """
-    
-    # Crear archivo temporal para el Excel (se borra automáticamente después de usarse)
-    fecha_str = quincena['inicio'].strftime('%Y%m%d')
-    output_filename = f"MovPer_{user.numero_socio}_{fecha_str}.xlsx"
-    
-    # Crear archivo temporal con nombre descriptivo
-    temp_file = tempfile.NamedTemporaryFile(
-        mode='wb',
-        suffix='.xlsx',
-        prefix=f'MovPer_{user.numero_socio}_',
-        delete=False  # No borrar automáticamente, lo haremos manualmente después de enviarlo
-    )
-    output_path = temp_file.name
-    temp_file.close()
-    
-    print(f"[MOVPER EXCEL] Iniciando generación de Excel con win32com")
-    print(f"[MOVPER EXCEL] Template: {TEMPLATE_PATH}")
-    print(f"[MOVPER EXCEL] Output temporal: {output_path}")
     print(f"[MOVPER EXCEL] Usuario: {user.nombre_completo}")
     print(f"[MOVPER EXCEL] Incidencias: {len(incidencias)}")
-    
-    # IMPORTANTE: Copiar template PRIMERO, luego abrir la copia
-    print(f"[MOVPER EXCEL] Copiando template a archivo temporal...")
-    shutil.copy(TEMPLATE_PATH, output_path)
-    
-    # Inicializar COM
-    pythoncom.CoInitialize()
-    
-    # Usar gencache.EnsureDispatch (mas estable que Dispatch)
-    excel = win32.gencache.EnsureDispatch('Excel.Application')
-    excel.Visible = False  # NO mostrar Excel
-    excel.DisplayAlerts = False
-    
-    try:
-        # Abrir la COPIA (no el template original)
-        wb = excel.Workbooks.Open(os.path.abspath(output_path))
-        sheet = wb.ActiveSheet
-        print(f"[MOVPER EXCEL] Archivo abierto con win32com")
-        
-        # =============================================================
-        # REEMPLAZAR LOGO SEGÚN EMPRESA DEL USUARIO
-        # =============================================================
-        if preset and preset.company and preset.company.logo_filename:
-            logo_path = os.path.join(BASE_DIR, 'static', 'logos', preset.company.logo_filename)
-            if os.path.exists(logo_path):
-                print(f"[MOVPER EXCEL] Empresa: {preset.company.name}")
-                reemplazar_logo(sheet, logo_path)
-            else:
-                print(f"[MOVPER EXCEL] Logo no encontrado para empresa {preset.company.name}: {logo_path}")
-        else:
-            print(f"[MOVPER EXCEL] Sin empresa configurada, usando logo por defecto (MIT)")
-        
-        # =============================================================
-        # FILTRAR INCIDENCIAS QUE VAN A JUSTIFICARSE
-        # =============================================================
-        # Solo incluir: retardos justificados + faltas clasificadas (excepto INCAPACIDAD)
-        incidencias_justificadas = filtrar_incidencias_a_justificar(incidencias)
-        print(f"[MOVPER EXCEL] Incidencias totales: {len(incidencias)}")
-        print(f"[MOVPER EXCEL] Incidencias a justificar: {len(incidencias_justificadas)}")
-        
-        # =============================================================
-        # LLENAR DATOS DEL ENCABEZADO
-        # =============================================================
-        
-        # Nombre del empleado (Title Case: Raúl Abel Cetina Pool)
-        nombre = preset.nombre_formato if preset and preset.nombre_formato else user.nombre_completo
-        nombre_display = nombre.title()
-        set_cell_text(sheet, CELDAS['NOMBRE'], nombre_display, 'NOMBRE')
-        
-        # Departamento
-        departamento = preset.departamento_formato if preset and preset.departamento_formato else "Sin departamento"
-        depto_upper = departamento.upper()
-        set_cell_text(sheet, CELDAS['DEPARTAMENTO'], depto_upper, 'DEPARTAMENTO')
-        
-        # Fecha de autorizacion (hoy) en formato dd-mmm-yy con mes en espanol
-        now = datetime.now()
-        mes_corto = {1:'ene',2:'feb',3:'mar',4:'abr',5:'may',6:'jun',7:'jul',8:'ago',9:'sep',10:'oct',11:'nov',12:'dic'}
-        fecha_auth = f"{now.day:02d}-{mes_corto[now.month]}-{now.strftime('%y')}"
-        set_cell_text(sheet, CELDAS['FECHA_AUTORIZACION'], fecha_auth, 'FECHA_AUTORIZACION')
-        
-        # Fecha de aplicacion (dias del periodo)
-        dias_periodo = construir_fechas_aplicacion(incidencias_justificadas, quincena)
-        set_cell_text(sheet, CELDAS['FECHA_APLICACION'], dias_periodo, 'FECHA_APLICACION')
-        
-        # =============================================================
-        # ANALIZAR TIPOS DE INCIDENCIAS Y MARCAR CIRCULOS REALES
-        # =============================================================
-        
-        tipos = analizar_tipos_incidencias(incidencias_justificadas)
-        
-        # Primero, poner todos los circulos en blanco (no seleccionado)
-        print(f"[MOVPER EXCEL] Reseteando todos los circulos a blanco...")
-        for shape_name, shape_idx in SHAPES.items():
-            set_circle_color(sheet, shape_idx, False)
-        
-        # Marcar los circulos correspondientes segun tipos encontrados
-        print(f"[MOVPER EXCEL] Marcando círculos según incidencias...")
-        # PARA FALTAR: cualquier tipo de falta (genérica, remoto, guardia, permiso, vacaciones)
-        tiene_faltas = tipos['faltas'] or tipos['remotos'] or tipos['guardias'] or tipos['permisos'] or tipos['vacaciones']
-        if tiene_faltas:
-            set_circle_color(sheet, SHAPES['PARA_FALTAR'], True)
-        if tipos['retardos']:
-            set_circle_color(sheet, SHAPES['PARA_LLEGAR_TARDE'], True)
-        if tipos['salir_regresar']:
-            set_circle_color(sheet, SHAPES['PARA_SALIR_REGRESAR'], True)
-        if tipos['olvido_checar']:
-            set_circle_color(sheet, SHAPES['OLVIDO_CHECAR'], True)
-        if tipos['retirarse_temprano']:
-            set_circle_color(sheet, SHAPES['PARA_RETIRARSE'], True)
-        
-        # Goce de sueldo
-        if con_goce:
-            set_circle_color(sheet, SHAPES['GOCE_SI'], True)
-            set_circle_color(sheet, SHAPES['GOCE_NO'], False)
-        else:
-            set_circle_color(sheet, SHAPES['GOCE_SI'], False)
-            set_circle_color(sheet, SHAPES['GOCE_NO'], True)
-        
-        # =============================================================
-        # GENERAR TEXTO DEL MOTIVO
-        # =============================================================
-        
-        motivo = generar_texto_motivo(incidencias_justificadas, tipos)
-        set_cell_text(sheet, CELDAS['MOTIVO'], motivo, 'MOTIVO')
-        
-        # =============================================================
-        # FIRMAS
-        # =============================================================
-        
-        # Solicito (el empleado) - mismo nombre que encabezado
-        set_cell_text(sheet, CELDAS['SOLICITO_NOMBRE'], nombre_display, 'SOLICITO_NOMBRE')
-        
-        # Autorizo (jefe directo)
-        jefe = preset.jefe_directo_nombre if preset and preset.jefe_directo_nombre else "PENDIENTE"
-        jefe_upper = jefe.upper()
-        set_cell_text(sheet, CELDAS['AUTORIZO_NOMBRE'], jefe_upper, 'AUTORIZO_NOMBRE')
-        
-        # Recibio (RH)
-        set_cell_text(sheet, CELDAS['RECIBIO_NOMBRE'], "RECURSOS HUMANOS", 'RECIBIO_NOMBRE')
-        
-        # =============================================================
-        # GUARDAR Y CERRAR
-        # =============================================================
-        
-        print(f"[MOVPER EXCEL] Guardando archivo...")
-        wb.Save()
-        
-        print(f"[MOVPER EXCEL] Cerrando workbook...")
-        wb.Close(SaveChanges=False)  # Ya guardamos con Save()
-        
-        print(f"[MOVPER EXCEL] Archivo guardado exitosamente: {output_path}")
-        print(f"[MOVPER EXCEL] Verificando que el archivo existe...")
-        if os.path.exists(output_path):
-            print(f"[MOVPER EXCEL] [OK] Archivo confirmado: {os.path.getsize(output_path)} bytes")
-        else:
-            print(f"[MOVPER EXCEL] [ERROR] Archivo no existe después de guardar")
-        
-    except Exception as e:
-        print(f"[MOVPER EXCEL] ERROR durante generacion: {e}")
-        import traceback
-        import sys
-        traceback.print_exc(file=sys.stderr)
-        try:
-            wb.Close(SaveChanges=False)
-        except:
-            pass
-        raise
-    finally:
-        print(f"[MOVPER EXCEL] Cerrando Excel...")
-        excel.Quit()
-        pythoncom.CoUninitialize()
-        print(f"[MOVPER EXCEL] Excel cerrado")
-    
-    return output_path, output_filename
+    documento = construir_documento_movper(user, preset, incidencias, quincena, con_goce)
+    return renderizar_documento(documento), documento['filename']
 
 
 def construir_fechas_aplicacion(incidencias: List[Dict], quincena: Dict) -> str:
@@ -1012,53 +1598,81 @@ def marcar_circulo_activo(sheet, nombre_celda: str):
         pass
 
 
-def excel_to_html_preview(excel_path: str) -> str:
+# =============================================================================
+# VISTA PREVIA
+# =============================================================================
+# La vista previa se arma con el mismo documento que llena el template, sin
+# escribir ni volver a leer el .xlsx, asi coincide con el archivo descargable.
+
+PREVIEW_CAMPOS = (
+    'NOMBRE', 'DEPARTAMENTO', 'FECHA_AUTORIZACION', 'FECHA_APLICACION',
+    'MOTIVO', 'SOLICITO_NOMBRE', 'AUTORIZO_NOMBRE', 'RECIBIO_NOMBRE',
+)
+
+PREVIEW_OPCIONES = (
+    ('PARA_FALTAR', 'PARA FALTAR'),
+    ('PARA_RETIRARSE', 'PARA RETIRARSE TEMPRANO'),
+    ('PARA_SALIR_REGRESAR', 'PARA SALIR Y REGRESAR'),
+    ('OLVIDO_CHECAR', 'OLVIDO CHECAR TARJETA'),
+    ('PARA_LLEGAR_TARDE', 'PARA LLEGAR TARDE'),
+)
+
+
+def construir_vista_previa(documento: Dict) -> Dict:
     """
-    Convierte un archivo Excel a HTML para vista previa en navegador.
-    Usa openpyxl para leer los datos.
-    
+    Convierte un documento MovPer en los datos de la vista previa HTML.
+
+    Args:
+        documento: Documento de construir_documento_movper
+
     Returns:
-        str: Contenido HTML del Excel
+        Dict con 'campos' {CAMPO: valor}, 'opciones' [{etiqueta, marcado}],
+        'goce' {si, no} y 'logo_filename'
     """
-    return generar_html_preview_fallback(excel_path, "")
+    valores = {op['celda']: op['valor'] for op in documento['celdas']}
+    circulos = documento.get('circulos', {})
+
+    campos = {campo: valores.get(CELDAS[campo]) or '' for campo in PREVIEW_CAMPOS}
+    opciones = [
+        {'etiqueta': etiqueta, 'marcado': bool(circulos.get(SHAPES[nombre]))}
+        for nombre, etiqueta in PREVIEW_OPCIONES
+    ]
+    logo_path = documento.get('logo_path')
+
+    return {
+        'campos': campos,
+        'opciones': opciones,
+        'goce': {
+            'si': bool(circulos.get(SHAPES['GOCE_SI'])),
+            'no': bool(circulos.get(SHAPES['GOCE_NO'])),
+        },
+        'logo_filename': os.path.basename(logo_path) if logo_path else None,
+    }
 
 
-def generar_html_preview_fallback(excel_path: str, error_msg: str = "") -> str:
+def firma_entradas_movper(user, preset, incidencias: List[Dict], con_goce: bool = True) -> str:
     """
-    Genera un preview HTML básico.
-    Usa openpyxl para leer los datos.
+    Hash de las entradas que determinan el documento MovPer de un usuario.
+    Incluye la fecha de hoy porque la fecha de autorizacion es la del dia.
+
+    Returns:
+        Hash SHA-256 en hexadecimal
     """
-    try:
-        from openpyxl import load_workbook
-        
-        wb = load_workbook(excel_path)
-        ws = wb.active
-        
-        html = ['<style>']
-        html.append('table { border-collapse: collapse; width: 100%; font-family: Arial, sans-serif; }')
-        html.append('td, th { border: 1px solid #ddd; padding: 8px; text-align: left; }')
-        html.append('th { background: #5D4037; color: white; }')
-        html.append('tr:nth-child(even) { background: #f9f9f9; }')
-        html.append('.merged { font-weight: bold; }')
-        html.append('</style>')
-        html.append('<table>')
-        
-        for row in ws.iter_rows(min_row=1, max_row=40, max_col=10):
-            html.append('<tr>')
-            for cell in row:
-                value = cell.value if cell.value else ''
-                html.append(f'<td>{value}</td>')
-            html.append('</tr>')
-        
-        html.append('</table>')
-        
-        if error_msg:
-            html.append(f'<p style="color: #888; font-size: 12px; margin-top: 20px;">Nota: Vista simplificada. {error_msg}</p>')
-        
-        return '\n'.join(html)
-        
-    except Exception as e:
-        return f'<div style="padding: 20px; background: #fff3cd; border: 1px solid #ffc107; border-radius: 8px;"><strong>Error al generar vista previa:</strong><br>{error_msg}<br><br>Error adicional: {str(e)}</div>'
+    entradas = {
+        'nombre': user.nombre_completo,
+        'numero_socio': user.numero_socio,
+        'preset': [
+            getattr(preset, 'nombre_formato', None),
+            getattr(preset, 'departamento_formato', None),
+            getattr(preset, 'jefe_directo_nombre', None),
+            obtener_logo_empresa(preset),
+        ],
+        'incidencias': incidencias,
+        'con_goce': bool(con_goce),
+        'hoy': date.today(),
+    }
+    canonico = json.dumps(entradas, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(canonico.encode('utf-8')).hexdigest()
 
 
 def obtener_formatos_generados(user_id: int) -> List[Dict]:
@@ -5,7 +5,8 @@ Sistema de regularización de asistencias quincenal
 Este módulo funciona como una aplicación independiente con su propio login.
 """
 
-from flask import Blueprint, render_template, request, jsonify, send_file, session, redirect, url_for, after_this_request
+from flask import (Blueprint, render_template, request, jsonify, send_file, session, redirect, url_for,
+                   after_this_request, current_app, Response, stream_with_context)
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta, date, time as time_type
 from calendar import monthrange
@@ -13,18 +14,26 @@ import os
 import pytz
 import json
 import os
+import threading
 from io import BytesIO
 from openpyxl import load_workbook
 from openpyxl.styles import Font, Alignment
 from sqlalchemy import and_, or_, func
 from sqlalchemy.orm.attributes import flag_modified
-from webapp.models import db, MobPerUser, PresetUsuario, IncidenciaDia, Company, CorreccionDia
+from webapp.models import db, MobPerUser, PresetUsuario, IncidenciaDia, Company, CorreccionDia, upsert_incidencias_dia
 from src.api.biostar_client import BioStarAPIClient
-from webapp.dias_inhabiles import obtener_dias_inhabiles, obtener_nombre_dia_inhabil
+from webapp.dias_inhabiles import inhabiles_en_rango, obtener_nombre_dia_inhabil
+from webapp.export_jobs import download_store, export_jobs, XLSX_MIMETYPE
+from webapp.zip_stream import stream_zip, content_disposition
+from webapp.quincena_cache import (quincena_cache, dep_biostar, dep_eventos,
+                                   dependencias_eventos, dependencias_quincena,
+                                   clave_resumen, tag_usuario, tag_quincena,
+                                   invalidar_cache_compartida)
 from src.utils.config import Config
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import login_user, logout_user
 import time as time_module
+from collections import OrderedDict
 
 mobper_bp = Blueprint('mobper', __name__, url_prefix='/mobper')
 
@@ -40,7 +49,6 @@ _biostar_client_cache = {
     'ttl': 300  # 5 minutos de sesión válida
 }
 
-_biostar_events_cache = {}
 _EVENTS_CACHE_TTL = 300  # 5 minutos
 
 def get_biostar_client():
@@ -72,34 +80,60 @@ def get_biostar_client():
         cache['client'] = None
         return None
 
-def get_cached_events(user_id, quincena_key, fetch_fn):
-    """Cache de eventos por usuario+quincena. fetch_fn() se llama solo si no hay cache."""
-    now = time_module.time()
-    cache_key = f"{user_id}_{quincena_key}"
-    
-    if cache_key in _biostar_events_cache:
-        entry = _biostar_events_cache[cache_key]
-        if (now - entry['timestamp']) < _EVENTS_CACHE_TTL:
-            print(f"[MOVPER CACHE] HIT eventos para {cache_key} (age: {now - entry['timestamp']:.0f}s)")
-            return entry['data']
-        else:
-            print(f"[MOVPER CACHE] EXPIRED eventos para {cache_key}")
+def get_cached_events(user_id, quincena_key, fetch_fn, deps=()):
+    """
+    Cache de eventos por usuario+quincena. fetch_fn() se llama solo si no hay cache.
+    deps: tokens adicionales de los que dependen los eventos procesados (ej. correcciones).
+    """
+    key = dep_eventos(user_id, quincena_key)
+    data = quincena_cache.get(key)
+    if data is not None:
+        print(f"[MOVPER CACHE] HIT eventos para {user_id}_{quincena_key}")
+        return data
     
     # Cache miss - fetch
     t0 = time_module.time()
     data = fetch_fn()
-    _biostar_events_cache[cache_key] = {'data': data, 'timestamp': now}
-    print(f"[MOVPER CACHE] MISS eventos para {cache_key} - fetched en {time_module.time()-t0:.2f}s")
+    quincena_cache.set(key, data, [dep_biostar(user_id), *deps], ttl=_EVENTS_CACHE_TTL)
+    print(f"[MOVPER CACHE] MISS eventos para {user_id}_{quincena_key} - fetched en {time_module.time()-t0:.2f}s")
     return data
 
 def invalidate_events_cache(user_id=None):
-    """Invalida cache de eventos. Si user_id=None, invalida todo."""
+    """
+    Invalida cache de eventos (y en cascada los resultados de quincena que dependen
+    de ellos). Si user_id=None, invalida todo.
+    """
     if user_id is None:
-        _biostar_events_cache.clear()
+        quincena_cache.invalidate_kind('biostar')
+        invalidar_cache_compartida(kinds=['biostar'])
     else:
-        keys_to_remove = [k for k in _biostar_events_cache if k.startswith(f"{user_id}_")]
-        for k in keys_to_remove:
-            del _biostar_events_cache[k]
+        quincena_cache.invalidate(dep_biostar(user_id))
+        invalidar_cache_compartida([dep_biostar(user_id)])
+
+# Vistas previas HTML por (usuario, quincena, hash de entradas), LRU acotada
+# (el lock protege lectura + move_to_end y la expulsión entre hilos del servidor)
+_preview_cache = OrderedDict()
+_preview_cache_lock = threading.Lock()
+_PREVIEW_CACHE_MAX = 256
+
+def get_cached_preview(user_id, quincena_key, firma, render_fn):
+    """Cache de vistas previas. render_fn() se llama solo si las entradas cambiaron."""
+    cache_key = (user_id, quincena_key, firma)
+    with _preview_cache_lock:
+        html = _preview_cache.get(cache_key)
+        if html is not None:
+            _preview_cache.move_to_end(cache_key)
+    if html is not None:
+        print(f"[MOVPER CACHE] HIT preview para {user_id}_{quincena_key}")
+        return html
+
+    # Se renderiza fuera del lock para no serializar las vistas previas
+    html = render_fn()
+    with _preview_cache_lock:
+        _preview_cache[cache_key] = html
+        while len(_preview_cache) > _PREVIEW_CACHE_MAX:
+            _preview_cache.popitem(last=False)
+    return html
 
 def prewarm_biostar_client():
     """Pre-calienta la conexión BioStar en background para que el primer request sea rápido."""
@@ -198,6 +232,64 @@ def generar_motivo_auto(estado_auto, clasificacion, numero_dia):
         return motivos.get(clasificacion, f"{numero_dia} falta")
     return ""
 
+
+# Ediciones del checklist soportadas por upsert_incidencias_dia / api_incidencias_batch
+TIPOS_CAMBIO_INCIDENCIA = ('clasificacion', 'justificacion', 'justificacion_salida', 'justificacion_olvido')
+MAX_CAMBIOS_BATCH = 200
+
+def cambio_incidencia(tipo, item, numero_dia=1):
+    """
+    Convierte una edición del checklist en un cambio para upsert_incidencias_dia.
+
+    Args:
+        tipo: Uno de TIPOS_CAMBIO_INCIDENCIA
+        item: Dict con 'fecha' (YYYY-MM-DD) y los datos de la edición
+        numero_dia: Número de día para el motivo si el item no lo trae
+
+    Returns:
+        Dict {'fecha', 'valores', 'al_crear'}
+
+    Raises:
+        ValueError: Si el tipo, la fecha o los datos son inválidos
+    """
+    if tipo not in TIPOS_CAMBIO_INCIDENCIA:
+        raise ValueError(f'Tipo de cambio inválido: {tipo}')
+    fecha = datetime.strptime(str(item.get('fecha')), '%Y-%m-%d').date()
+
+    if tipo == 'clasificacion':
+        clasificacion = item.get('clasificacion')
+        if not clasificacion:
+            raise ValueError('Clasificación requerida')
+        estado_auto = item.get('estado_auto')
+        motivo = generar_motivo_auto(estado_auto, clasificacion, item.get('numero_dia', numero_dia))
+        return {
+            'fecha': fecha,
+            'valores': {'clasificacion': clasificacion, 'motivo_auto': motivo},
+            'al_crear': {'estado_auto': estado_auto},
+        }
+
+    justificado = bool(item.get('justificado', True))
+    if tipo == 'justificacion':
+        return {
+            'fecha': fecha,
+            'valores': {
+                'justificado': justificado,
+                'motivo_auto': 'Retardo justificado' if justificado else 'Retardo NO justificado',
+            },
+            'al_crear': {'estado_auto': 'RETARDO'},
+        }
+    if tipo == 'justificacion_salida':
+        return {
+            'fecha': fecha,
+            'valores': {'salida_justificado': justificado},
+            'al_crear': {'salida_estado': 'SALIDA_TEMPRANA'},
+        }
+    return {
+        'fecha': fecha,
+        'valores': {'olvido_checar_justificado': justificado},
+        'al_crear': {},
+    }
+
 def now_cdmx():
     """Retorna datetime actual en zona horaria CDMX"""
     return datetime.now(MEXICO_TZ)
@@ -461,7 +553,8 @@ def obtener_primer_registro_dia(biostar_user_id, fecha):
 def calcular_incidencias_quincena(user, quincena):
     """
     Calcula las incidencias automáticas para una quincena completa.
-    OPTIMIZADO: Obtiene todos los registros en UNA sola llamada API.
+    El resultado se cachea con sus dependencias (eventos, preset, correcciones y
+    días clasificados) y se invalida solo cuando alguna de ellas cambia.
     
     Args:
         user: Usuario MovPer
@@ -470,6 +563,25 @@ def calcular_incidencias_quincena(user, quincena):
     Returns:
         Lista de diccionarios con información de cada día
     """
+    quincena_key = f"{quincena['inicio']}_{quincena['fin']}"
+    key = ('quincena', user.id, quincena_key)
+    
+    incidencias = quincena_cache.get(key)
+    if incidencias is not None:
+        print(f"[MOVPER CACHE] HIT quincena para {user.id}_{quincena_key}")
+        return incidencias
+    
+    incidencias = _calcular_incidencias_quincena(user, quincena)
+    # El TTL acota lo que depende de la fecha actual y de eventos no cacheados
+    quincena_cache.set(key, incidencias, dependencias_quincena(user.id, quincena, quincena_key),
+                       ttl=_EVENTS_CACHE_TTL)
+    return incidencias
+
+def _calcular_incidencias_quincena(user, quincena):
+    """
+    Calcula las incidencias sin cache.
+    OPTIMIZADO: Obtiene todos los registros en UNA sola llamada API.
+    """
     # Obtener o crear preset del usuario
     preset = PresetUsuario.query.filter_by(user_id=user.id).first()
     
@@ -496,13 +608,8 @@ def calcular_incidencias_quincena(user, quincena):
     tolerancia_salida_segundos = _tol_sal if _tol_sal is not None else 0
     dias_descanso = preset.dias_descanso or [5, 6]
     
-    # Obtener días inhábiles oficiales del año de la quincena
-    anio_quincena = quincena['inicio'].year
-    dias_inhabiles_oficiales = obtener_dias_inhabiles(anio_quincena)
-    
-    # Combinar días inhábiles del preset con los oficiales
-    lista_inhabiles_preset = preset.lista_inhabiles or []
-    lista_inhabiles = list(set(lista_inhabiles_preset + dias_inhabiles_oficiales))
+    # Días inhábiles oficiales de la quincena combinados con los del preset (conjunto memorizado)
+    lista_inhabiles = inhabiles_en_rango(quincena['inicio'], quincena['fin'], preset.lista_inhabiles or ())
     
     # Usar numero_socio como biostar_user_id
     biostar_user_id = user.numero_socio
@@ -634,7 +741,8 @@ def calcular_incidencias_quincena(user, quincena):
         return registros
     
     try:
-        registros_quincena = get_cached_events(user.id, quincena_key, fetch_events)
+        registros_quincena = get_cached_events(user.id, quincena_key, fetch_events,
+                                               deps=dependencias_eventos(user.id, quincena))
     except Exception as e:
         print(f"[MOVPER OPTIMIZADO] Error obteniendo registros de quincena: {e}")
         import traceback
@@ -1101,47 +1209,15 @@ def api_clasificar_dia():
         
         print(f"[MOVPER API] Datos recibidos: {data}")
         
-        fecha_str = data.get('fecha')
-        clasificacion = data.get('clasificacion')
-        estado_auto = data.get('estado_auto')
-        numero_dia = data.get('numero_dia', 1)
-        
-        print(f"[MOVPER API] Procesando: fecha={fecha_str}, clasificacion={clasificacion}, estado_auto={estado_auto}, numero_dia={numero_dia}")
-        
-        if not fecha_str or not clasificacion:
+        if not data.get('fecha') or not data.get('clasificacion'):
             print(f"[MOVPER API] Error: Datos incompletos")
             return jsonify({'success': False, 'error': 'Datos incompletos'}), 400
         
-        # Parsear fecha
-        from datetime import datetime as dt
-        fecha = dt.strptime(fecha_str, '%Y-%m-%d').date()
-        
-        # Buscar o crear incidencia
-        incidencia = IncidenciaDia.query.filter_by(
-            user_id=user.id,
-            fecha=fecha
-        ).first()
-        
-        if not incidencia:
-            print(f"[MOVPER API] Creando nueva incidencia para {fecha}")
-            incidencia = IncidenciaDia(
-                user_id=user.id,
-                fecha=fecha,
-                estado_auto=estado_auto
-            )
-            db.session.add(incidencia)
-        else:
-            print(f"[MOVPER API] Actualizando incidencia existente para {fecha}")
-        
-        incidencia.clasificacion = clasificacion
-        incidencia.motivo_auto = generar_motivo_auto(estado_auto, clasificacion, numero_dia)
-        incidencia.updated_at = datetime.utcnow()
-        
-        print(f"[MOVPER API] Guardando: clasificacion={incidencia.clasificacion}, motivo={incidencia.motivo_auto}")
-        
+        cambio = cambio_incidencia('clasificacion', data)
+        incidencia = upsert_incidencias_dia(user.id, [cambio])[cambio['fecha']]
         db.session.commit()
         
-        print(f"[MOVPER API] Guardado exitoso")
+        print(f"[MOVPER API] Guardado: clasificacion={incidencia.clasificacion}, motivo={incidencia.motivo_auto}")
         
         return jsonify({
             'success': True,
@@ -1169,41 +1245,71 @@ def api_clasificar_multiple():
         if not items or not clasificacion:
             return jsonify({'success': False, 'error': 'Datos incompletos'}), 400
         
-        from datetime import datetime as dt
-        count = 0
-        
-        for item in items:
-            fecha = dt.strptime(item['fecha'], '%Y-%m-%d').date()
-            estado_auto = item.get('estado_auto', 'FALTA')
-            numero_dia = item.get('numero_dia', count + 1)
-            
-            incidencia = IncidenciaDia.query.filter_by(
-                user_id=user.id,
-                fecha=fecha
-            ).first()
-            
-            if not incidencia:
-                incidencia = IncidenciaDia(
-                    user_id=user.id,
-                    fecha=fecha,
-                    estado_auto=estado_auto
-                )
-                db.session.add(incidencia)
-            
-            incidencia.clasificacion = clasificacion
-            incidencia.motivo_auto = generar_motivo_auto(estado_auto, clasificacion, numero_dia)
-            incidencia.updated_at = datetime.utcnow()
-            count += 1
-        
+        cambios = [
+            cambio_incidencia('clasificacion', {
+                'estado_auto': 'FALTA',
+                **item,
+                'clasificacion': clasificacion,
+            }, numero_dia=idx + 1)
+            for idx, item in enumerate(items)
+        ]
+        upsert_incidencias_dia(user.id, cambios)
         db.session.commit()
         
-        return jsonify({'success': True, 'count': count})
+        return jsonify({'success': True, 'count': len(cambios)})
     
     except Exception as e:
         db.session.rollback()
         print(f"[MOVPER] Error en api_clasificar_multiple: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+
+@mobper_bp.route('/api/incidencias/batch', methods=['POST'])
+@mobper_login_required
+def api_incidencias_batch():
+    """
+    Aplica varias ediciones del checklist en una sola petición.
+    Body: {'cambios': [{'tipo', 'fecha', ...}]} con tipo en TIPOS_CAMBIO_INCIDENCIA:
+      - clasificacion: clasificacion, estado_auto, numero_dia
+      - justificacion / justificacion_salida / justificacion_olvido: justificado
+    """
+    user = get_current_mobper_user()
+    data = request.get_json(silent=True) or {}
+    items = data.get('cambios') or []
+    
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'error': 'Datos incompletos'}), 400
+    if len(items) > MAX_CAMBIOS_BATCH:
+        return jsonify({'success': False, 'error': f'Máximo {MAX_CAMBIOS_BATCH} cambios por petición'}), 400
+    
+    try:
+        cambios = [cambio_incidencia(item.get('tipo'), item) for item in items]
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    try:
+        incidencias = upsert_incidencias_dia(user.id, cambios)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"[MOVPER] Error en api_incidencias_batch: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    return jsonify({
+        'success': True,
+        'count': len(cambios),
+        'incidencias': {
+            fecha.isoformat(): {
+                'clasificacion': inc.clasificacion,
+                'motivo': inc.motivo_auto,
+                'justificado': inc.justificado,
+                'salida_justificado': inc.salida_justificado,
+                'olvido_checar_justificado': inc.olvido_checar_justificado,
+            }
+            for fecha, inc in incidencias.items()
+        }
+    })
+
 @mobper_bp.route('/api/check-user', methods=['POST'])
 def api_check_user():
     """Verifica si un número de socio ya está registrado"""
@@ -1363,7 +1469,7 @@ def api_calcular_quincena():
 def api_exportar_excel():
     """
     Exporta el formato Excel prellenado con las incidencias.
-    Usa win32com para preservar formatos y shapes.
+    Preserva formatos y shapes del template (motor xml o win32com).
     """
     from webapp.mobper_excel import generar_formato_excel
     
@@ -1386,8 +1492,8 @@ def api_exportar_excel():
     con_goce = data.get('con_goce', True)
     
     try:
-        # Generar Excel con win32com
-        output_path, output_filename = generar_formato_excel(
+        # Generar Excel sobre el template (en memoria)
+        output, output_filename = generar_formato_excel(
             user=user,
             preset=preset,
             incidencias=incidencias,
@@ -1395,18 +1501,8 @@ def api_exportar_excel():
             con_goce=con_goce
         )
         
-        # Enviar archivo al cliente y borrar después
-        @after_this_request
-        def remove_file(response):
-            try:
-                os.remove(output_path)
-                print(f"[MOVPER ROUTES] Archivo temporal eliminado: {output_path}")
-            except Exception as e:
-                print(f"[MOVPER ROUTES] Error al eliminar archivo temporal: {e}")
-            return response
-        
         return send_file(
-            output_path,
+            output,
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
             as_attachment=True,
             download_name=output_filename
@@ -1426,9 +1522,13 @@ def api_exportar_excel():
 def api_previsualizar():
     """
     Genera una vista previa del formato en HTML.
+    Se arma con el mismo documento que llena el Excel y se cachea por
+    usuario, quincena y hash de las entradas.
     """
+    from webapp.mobper_excel import construir_documento_movper, construir_vista_previa, firma_entradas_movper
+
     user = get_current_mobper_user()
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     
     # Calcular quincena
     if 'fecha' in data:
@@ -1438,19 +1538,20 @@ def api_previsualizar():
     
     quincena = calcular_quincena_actual(fecha)
     incidencias = calcular_incidencias_quincena(user, quincena)
-    
-    # Filtrar incidencias
-    dias_con_incidencias = [
-        inc for inc in incidencias
-        if inc['estado_auto'] in ['RETARDO', 'FALTA']
-    ]
-    
-    return render_template(
-        'mobper_preview.html',
-        user=user,
-        quincena=quincena,
-        incidencias=dias_con_incidencias
-    )
+    preset = PresetUsuario.query.filter_by(user_id=user.id).first()
+    con_goce = bool(data.get('con_goce', True))
+
+    def render():
+        documento = construir_documento_movper(user, preset, incidencias, quincena, con_goce=con_goce)
+        return render_template(
+            'mobper_preview.html',
+            user=user,
+            quincena=quincena,
+            vista=construir_vista_previa(documento)
+        )
+
+    firma = firma_entradas_movper(user, preset, incidencias, con_goce)
+    return get_cached_preview(user.id, quincena['inicio'].isoformat(), firma, render)
 
 # ============================================================================
 # UTILIDADES
@@ -1499,28 +1600,7 @@ def toggle_justificacion():
         justificado = data.get('justificado', True)
         
         user = get_current_mobper_user()
-        fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-        
-        # Buscar o crear registro de incidencia
-        incidencia = IncidenciaDia.query.filter_by(
-            user_id=user.id,
-            fecha=fecha
-        ).first()
-        
-        if not incidencia:
-            incidencia = IncidenciaDia(
-                user_id=user.id,
-                fecha=fecha,
-                estado_auto='RETARDO'
-            )
-            db.session.add(incidencia)
-        
-        incidencia.justificado = justificado
-        if justificado:
-            incidencia.motivo_auto = 'Retardo justificado'
-        else:
-            incidencia.motivo_auto = 'Retardo NO justificado'
-        
+        upsert_incidencias_dia(user.id, [cambio_incidencia('justificacion', data)])
         db.session.commit()
         
         return jsonify({
@@ -1544,23 +1624,7 @@ def toggle_justificacion_salida():
         justificado = data.get('justificado', True)
         
         user = get_current_mobper_user()
-        fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-        
-        incidencia = IncidenciaDia.query.filter_by(
-            user_id=user.id,
-            fecha=fecha
-        ).first()
-        
-        if not incidencia:
-            incidencia = IncidenciaDia(
-                user_id=user.id,
-                fecha=fecha,
-                salida_estado='SALIDA_TEMPRANA'
-            )
-            db.session.add(incidencia)
-        
-        incidencia.salida_justificado = justificado
-        
+        upsert_incidencias_dia(user.id, [cambio_incidencia('justificacion_salida', data)])
         db.session.commit()
         
         return jsonify({
@@ -1584,22 +1648,7 @@ def toggle_justificacion_olvido():
         justificado = data.get('justificado', True)
 
         user = get_current_mobper_user()
-        fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-
-        incidencia = IncidenciaDia.query.filter_by(
-            user_id=user.id,
-            fecha=fecha
-        ).first()
-
-        if not incidencia:
-            incidencia = IncidenciaDia(
-                user_id=user.id,
-                fecha=fecha,
-            )
-            db.session.add(incidencia)
-
-        incidencia.olvido_checar_justificado = justificado
-
+        upsert_incidencias_dia(user.id, [cambio_incidencia('justificacion_olvido', data)])
         db.session.commit()
 
         return jsonify({
@@ -1678,7 +1727,6 @@ def generar_excel():
             agrupar_periodos_vacaciones,
             generar_aviso_vacaciones,
         )
-        import uuid
 
         # Respetar impersonacion
         base_user = get_current_mobper_user()
@@ -1717,7 +1765,7 @@ def generar_excel():
             periodos_seleccionados = []
 
         # Generar MovPer normal
-        output_path, filename = generar_formato_excel(
+        output, filename = generar_formato_excel(
             user=user, preset=preset,
             incidencias=incidencias_dict,
             quincena=quincena, con_goce=con_goce
@@ -1725,32 +1773,26 @@ def generar_excel():
 
         if not periodos_seleccionados:
             # Solo MovPer, sin vacaciones
-            @after_this_request
-            def remove_file(response):
-                try: os.remove(output_path)
-                except Exception: pass
-                return response
             return send_file(
-                output_path, as_attachment=True,
+                output, as_attachment=True,
                 download_name=filename,
                 mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
             )
 
         # MovPer + AVISO DE VACACIONES por cada periodo seleccionado
-        archivos = [(output_path, filename)]
+        archivos = [(output, filename)]
         for periodo in periodos_seleccionados:
-            vac_path, vac_filename = generar_aviso_vacaciones(
+            vac_output, vac_filename = generar_aviso_vacaciones(
                 user=user, preset=preset,
                 periodo_vac=periodo, quincena=quincena,
             )
-            archivos.append((vac_path, vac_filename))
+            archivos.append((vac_output, vac_filename))
             print(f"[MOVPER ROUTES] Vacaciones generado: {vac_filename}")
 
         # Devolver tokens de descarga
         tokens = []
-        for path, fname in archivos:
-            token = uuid.uuid4().hex
-            _excel_download_store[token] = (path, fname)
+        for contenido, fname in archivos:
+            token = _excel_download_store.guardar(contenido.getvalue(), fname, XLSX_MIMETYPE)
             tokens.append({
                 'url': url_for('mobper.descargar_excel_token', token=token),
                 'filename': fname,
@@ -1763,32 +1805,29 @@ def generar_excel():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-# Store temporal de archivos Excel pendientes de descarga {token: (path, filename)}
-_excel_download_store = {}
+# Store de archivos pendientes de descarga por token (en disco, con expiracion)
+_excel_download_store = download_store
 
 
 @mobper_bp.route('/generar-excel/download/<token>')
 @mobper_login_required
 def descargar_excel_token(token):
-    """Sirve un archivo Excel generado previamente por su token de descarga."""
-    entry = _excel_download_store.pop(token, None)
+    """Sirve un archivo generado previamente por su token de descarga."""
+    entry = _excel_download_store.obtener(token)
     if not entry:
         return jsonify({'error': 'Token invalido o expirado'}), 404
-    path, filename = entry
 
-    @after_this_request
-    def remove_file(response):
-        try:
-            os.remove(path)
-        except Exception:
-            pass
-        return response
+    if entry['un_solo_uso']:
+        @after_this_request
+        def remove_file(response):
+            _excel_download_store.eliminar(token)
+            return response
 
     return send_file(
-        path,
+        entry['path'],
         as_attachment=True,
-        download_name=filename,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        download_name=entry['filename'],
+        mimetype=entry['mimetype']
     )
 
 
@@ -2216,6 +2255,41 @@ def calcular_resumen_miembro(user, quincena):
         }
 
 
+def resumenes_miembros(members, quincena):
+    """
+    Resúmenes de incidencias de varios miembros para una quincena.
+    Los ya calculados se leen del caché compartido en un solo viaje y los
+    faltantes se calculan y se guardan juntos.
+    
+    Args:
+        members: Lista de MobPerUser
+        quincena: Dict con 'inicio' y 'fin'
+        
+    Returns:
+        Dict {user_id: resumen} (sin la lista de incidencias)
+    """
+    quincena_key = f"{quincena['inicio']}_{quincena['fin']}"
+    cache_mgr = current_app.extensions.get('cache_manager')
+    claves = {m.id: clave_resumen(m.id, quincena_key) for m in members}
+    cacheados = cache_mgr.get_many(claves.values()) if cache_mgr else {}
+    
+    resumenes, nuevos, tags = {}, {}, {}
+    for m in members:
+        resumen = cacheados.get(claves[m.id])
+        if resumen is None:
+            resumen = calcular_resumen_miembro(m, quincena)
+            resumen.pop('incidencias', None)
+            if resumen['estado'] != 'error':
+                nuevos[claves[m.id]] = resumen
+                tags[claves[m.id]] = [tag_usuario(m.id), tag_quincena(quincena_key)]
+        resumenes[m.id] = resumen
+    
+    if cache_mgr and nuevos:
+        # Mismo TTL que los eventos de BioStar de los que depende
+        cache_mgr.set_many(nuevos, ttl=_EVENTS_CACHE_TTL, tags=tags)
+    return resumenes
+
+
 @mobper_bp.route('/grupo')
 @mobper_admin_required
 def grupo_dashboard():
@@ -2247,8 +2321,9 @@ def grupo_api_resumen():
     miembros_data = []
     totals = {'a_tiempo': 0, 'retardos': 0, 'faltas': 0, 'pendientes': 0}
 
+    resumenes = resumenes_miembros(members, quincena)
     for m in members:
-        resumen = calcular_resumen_miembro(m, quincena)
+        resumen = resumenes[m.id]
         preset = PresetUsuario.query.filter_by(user_id=m.id).first()
         miembros_data.append({
             'id': m.id,
@@ -2350,6 +2425,15 @@ def grupo_api_miembro_detalle(user_id):
     })
 
 
+def _zip_streaming_response(miembros, zip_filename):
+    """Respuesta que envia el ZIP por fragmentos mientras se generan los miembros."""
+    return Response(
+        stream_with_context(stream_zip(miembros)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': content_disposition(zip_filename)},
+    )
+
+
 @mobper_bp.route('/grupo/api/generar-excel/<int:user_id>', methods=['GET'])
 @mobper_admin_required
 def grupo_api_generar_excel_miembro(user_id):
@@ -2360,7 +2444,6 @@ def grupo_api_generar_excel_miembro(user_id):
             agrupar_periodos_vacaciones,
             generar_aviso_vacaciones,
         )
-        import zipfile, tempfile
         user = MobPerUser.query.get_or_404(user_id)
         preset = PresetUsuario.query.filter_by(user_id=user.id).first()
         year = request.args.get('year', type=int)
@@ -2376,56 +2459,30 @@ def grupo_api_generar_excel_miembro(user_id):
         incidencias = calcular_incidencias_quincena(user, quincena)
         periodos_vac = agrupar_periodos_vacaciones(incidencias)
 
-        output_path, filename = generar_formato_excel(
+        output, filename = generar_formato_excel(
             user=user, preset=preset, incidencias=incidencias,
             quincena=quincena, con_goce=con_goce
         )
 
         if not periodos_vac:
-            @after_this_request
-            def remove_file_grupo_single(response):
-                try:
-                    os.remove(output_path)
-                except Exception:
-                    pass
-                return response
-
             return send_file(
-                output_path, as_attachment=True, download_name=filename,
+                output, as_attachment=True, download_name=filename,
                 mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
             )
 
-        archivos = [(output_path, filename)]
-        for periodo in periodos_vac:
-            vac_path, vac_filename = generar_aviso_vacaciones(
-                user=user, preset=preset, periodo_vac=periodo, quincena=quincena)
-            archivos.append((vac_path, vac_filename))
-
         nombre_safe = (preset.nombre_formato if preset and preset.nombre_formato else user.nombre_completo)
         nombre_safe = nombre_safe.replace(' ', '_')[:25]
         zip_filename = f"MOVPER_{nombre_safe}_{quincena['nombre'].replace(' ', '_')}.zip"
-        tmp_zip_dir = tempfile.mkdtemp()
-        zip_path = os.path.join(tmp_zip_dir, zip_filename)
-
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for path, fname in archivos:
-                zf.write(path, fname)
-        for path, _ in archivos:
-            try:
-                os.remove(path)
-            except Exception:
-                pass
 
-        @after_this_request
-        def remove_zip_grupo(response):
-            try:
-                os.remove(zip_path)
-            except Exception:
-                pass
-            return response
+        def miembros_zip():
+            # Los avisos de vacaciones se renderizan mientras se envia el MovPer
+            yield filename, output.getvalue()
+            for periodo in periodos_vac:
+                vac_output, vac_filename = generar_aviso_vacaciones(
+                    user=user, preset=preset, periodo_vac=periodo, quincena=quincena)
+                yield vac_filename, vac_output.getvalue()
 
-        return send_file(zip_path, as_attachment=True, download_name=zip_filename,
-                         mimetype='application/zip')
+        return _zip_streaming_response(miembros_zip(), zip_filename)
 
     except Exception as e:
         import traceback
@@ -2436,9 +2493,7 @@ def grupo_api_generar_excel_miembro(user_id):
 @mobper_bp.route('/grupo/api/generar-excel-todos', methods=['GET'])
 @mobper_admin_required
 def grupo_api_generar_excel_todos():
-    """API: Genera un ZIP con los Excel de todos los miembros del grupo."""
-    import zipfile
-    import tempfile
+    """API: Genera un ZIP con los Excel de todos los miembros del grupo (en streaming)."""
     try:
         from webapp.mobper_excel import generar_formato_excel
         leader = get_current_mobper_user()
@@ -2453,46 +2508,90 @@ def grupo_api_generar_excel_todos():
         else:
             quincena = calcular_quincena_actual()
 
-        zip_dir = tempfile.mkdtemp()
-        zip_path = os.path.join(zip_dir, 'MovPer_Grupo.zip')
-        generated_files = []
-
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        def miembros_zip():
+            # Cada miembro se renderiza cuando el anterior ya salio hacia el cliente
             for m in members:
                 try:
                     preset = PresetUsuario.query.filter_by(user_id=m.id).first()
                     incidencias = calcular_incidencias_quincena(m, quincena)
-                    output_path, filename = generar_formato_excel(
+                    output, filename = generar_formato_excel(
                         user=m, preset=preset, incidencias=incidencias,
                         quincena=quincena, con_goce=con_goce
                     )
-                    zf.write(output_path, filename)
-                    generated_files.append(output_path)
+                    yield filename, output.getvalue()
                 except Exception as e:
                     print(f"[GRUPO ZIP] Error con {m.nombre_completo}: {e}")
 
-        for fp in generated_files:
-            try:
-                os.remove(fp)
-            except Exception:
-                pass
+        q_name = quincena['nombre'].replace(' ', '_')
+        return _zip_streaming_response(miembros_zip(), f'MovPer_Grupo_{q_name}.zip')
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-        @after_this_request
-        def cleanup_grupo_zip(response):
-            try:
-                os.remove(zip_path)
-                os.rmdir(zip_dir)
-            except Exception:
-                pass
-            return response
 
+def _construir_documentos_miembro(member_id, quincena, con_goce):
+    """Documentos MovPer de un miembro (se ejecuta en el hilo del trabajo de exportacion)."""
+    from webapp.mobper_excel import construir_documento_movper
+
+    member = MobPerUser.query.get(member_id)
+    if member is None:
+        raise ValueError(f'Usuario {member_id} no encontrado')
+    preset = PresetUsuario.query.filter_by(user_id=member.id).first()
+    incidencias = calcular_incidencias_quincena(member, quincena)
+    return [construir_documento_movper(member, preset, incidencias, quincena, con_goce)]
+
+
+@mobper_bp.route('/grupo/api/exportar-excel-todos', methods=['POST'])
+@mobper_admin_required
+def grupo_api_exportar_excel_todos():
+    """API: Encola en segundo plano el ZIP con los Excel de todos los miembros del grupo."""
+    try:
+        leader = get_current_mobper_user()
+        members = get_group_members(leader)
+        year = request.args.get('year', type=int)
+        month = request.args.get('month', type=int)
+        quincena_num = request.args.get('quincena_num', type=int)
+        con_goce = request.args.get('con_goce', '1') == '1'
+
+        if year and month and quincena_num:
+            quincena = calcular_quincena(year, month, quincena_num)
+        else:
+            quincena = calcular_quincena_actual()
+
+        nombres = {m.id: m.nombre_completo for m in members}
         q_name = quincena['nombre'].replace(' ', '_')
-        return send_file(
-            zip_path, as_attachment=True,
-            download_name=f'MovPer_Grupo_{q_name}.zip',
-            mimetype='application/zip'
+        job = export_jobs.submit(
+            tareas=list(nombres),
+            construir=lambda member_id: _construir_documentos_miembro(member_id, quincena, con_goce),
+            zip_filename=f'MovPer_Grupo_{q_name}.zip',
+            owner_id=leader.id,
+            app=current_app._get_current_object(),
+            etiqueta=lambda member_id: nombres.get(member_id, str(member_id)),
         )
+        print(f"[GRUPO ZIP] Exportacion {job.id} encolada: {job.total} miembros")
+
+        return jsonify({
+            'success': True,
+            'job': job.to_dict(),
+            'status_url': url_for('mobper.grupo_api_estado_exportacion', job_id=job.id),
+        }), 202
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@mobper_bp.route('/grupo/api/exportar/<job_id>', methods=['GET'])
+@mobper_admin_required
+def grupo_api_estado_exportacion(job_id):
+    """API: Progreso de un trabajo de exportacion y URL de descarga al terminar."""
+    leader = get_current_mobper_user()
+    job = export_jobs.get(job_id)
+    if not job or job.owner_id != leader.id:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado o expirado'}), 404
+
+    result = job.to_dict()
+    if job.token:
+        result['download_url'] = url_for('mobper.descargar_excel_token', token=job.token)
+    return jsonify({'success': True, 'job': result})
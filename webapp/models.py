@@ -1,13 +1,37 @@
 """
 Database models for the web application.
 """
+import os
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, inspect, text
 from datetime import datetime
 
 db = SQLAlchemy()
 
+# Conexión SQLite: PRAGMAs aplicados a cada conexión nueva
+# (WAL permite lectores concurrentes mientras otro hilo/worker escribe)
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_MMAP_SIZE_MB = int(os.environ.get('SQLITE_MMAP_SIZE_MB', 256))
+SQLITE_CACHE_SIZE_MB = int(os.environ.get('SQLITE_CACHE_SIZE_MB', 64))
+
+# Pool de conexiones para servidores de BD (PostgreSQL/MySQL)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+# Columnas agregadas a tablas que ya existían (db.create_all no altera tablas)
+# (tabla, columna, tipo SQL)
+# Los índices declarados en los modelos (db.Index / index=True) que falten en
+# tablas existentes también se crean en apply_schema_updates()
+SCHEMA_COLUMN_UPDATES = [
+    ('emergency_sessions', 'roll_call_stats', 'TEXT'),
+]
+
 
 # ============================================
 # DEVICE CONFIGURATION MODELS
@@ -263,12 +287,117 @@ def get_or_create_device_config(device_id, device_name=None, location=None):
     return config
 
 
+def apply_schema_updates():
+    """
+    Add columns from SCHEMA_COLUMN_UPDATES and model indexes that are missing
+    in existing tables (SQLite, PostgreSQL).
+    """
+    inspector = inspect(db.engine)
+    
+    for table, column, column_type in SCHEMA_COLUMN_UPDATES:
+        if not inspector.has_table(table):
+            continue
+        existing = {c['name'] for c in inspector.get_columns(table)}
+        if column not in existing:
+            db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}'))
+            print(f"[OK] Columna '{table}.{column}' agregada")
+    
+    db.session.commit()
+    
+    for table in db.metadata.sorted_tables:
+        if not table.indexes or not inspector.has_table(table.name):
+            continue
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                print(f"[OK] Índice '{index.name}' creado")
+
+
+def sqlite_pragmas(config=None):
+    """
+    PRAGMAs de conexión SQLite según la configuración.
+    
+    Args:
+        config: Configuración de la app (usa SQLITE_* si están definidas)
+    
+    Returns:
+        Lista de (pragma, valor) en el orden en que se aplican
+    """
+    config = config or {}
+    cache_mb = int(config.get('SQLITE_CACHE_SIZE_MB', SQLITE_CACHE_SIZE_MB))
+    mmap_mb = int(config.get('SQLITE_MMAP_SIZE_MB', SQLITE_MMAP_SIZE_MB))
+    return [
+        # busy_timeout primero: cambiar journal_mode también puede esperar el lock
+        ('busy_timeout', int(config.get('SQLITE_BUSY_TIMEOUT_MS', SQLITE_BUSY_TIMEOUT_MS))),
+        ('journal_mode', config.get('SQLITE_JOURNAL_MODE', SQLITE_JOURNAL_MODE)),
+        ('synchronous', config.get('SQLITE_SYNCHRONOUS', SQLITE_SYNCHRONOUS)),
+        # Valor negativo = KiB
+        ('cache_size', -cache_mb * 1024),
+        ('mmap_size', mmap_mb * 1024 * 1024),
+    ]
+
+
+def engine_options(database_uri, config=None):
+    """
+    Opciones de create_engine según el motor (SQLALCHEMY_ENGINE_OPTIONS).
+    
+    Args:
+        database_uri: URL de la base de datos
+        config: Configuración de la app (usa DB_POOL_* si están definidas)
+    
+    Returns:
+        Dict de opciones para SQLAlchemy
+    """
+    config = config or {}
+    if database_uri.startswith('sqlite'):
+        # El pool lo elige Flask-SQLAlchemy (StaticPool en memoria); la espera por
+        # locks la controla busy_timeout
+        return {}
+    return {
+        'pool_size': int(config.get('DB_POOL_SIZE', DB_POOL_SIZE)),
+        'max_overflow': int(config.get('DB_MAX_OVERFLOW', DB_MAX_OVERFLOW)),
+        'pool_timeout': int(config.get('DB_POOL_TIMEOUT', DB_POOL_TIMEOUT)),
+        'pool_recycle': int(config.get('DB_POOL_RECYCLE', DB_POOL_RECYCLE)),
+        'pool_pre_ping': True,
+    }
+
+
+def register_sqlite_pragmas(engine, pragmas):
+    """Aplica los PRAGMAs a cada conexión SQLite que abra el engine."""
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma, value in pragmas:
+                cursor.execute(f'PRAGMA {pragma}={value}')
+        finally:
+            cursor.close()
+    
+    event.listen(engine, 'connect', set_pragmas)
+
+
+def configure_engine(app):
+    """
+    Configura el engine antes de db.init_app: opciones de pool y PRAGMAs de SQLite.
+    Los valores de app.config (SQLITE_*, DB_POOL_*, SQLALCHEMY_ENGINE_OPTIONS)
+    tienen prioridad sobre las variables de entorno.
+    """
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI') or 'sqlite://'
+    options = engine_options(uri, app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
 def init_db(app):
     """Initialize database with default data."""
+    configure_engine(app)
     db.init_app(app)
     
     with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            register_sqlite_pragmas(db.engine, sqlite_pragmas(app.config))
         db.create_all()
+        apply_schema_updates()
         
         # Crear categorías por defecto si no existen
         default_categories = [
@@ -387,6 +516,8 @@ class GroupMember(db.Model):
     
     __table_args__ = (
         db.UniqueConstraint('group_id', 'biostar_user_id', name='unique_group_member'),
+        # Búsqueda de los grupos de un usuario (la restricción única empieza por group_id)
+        db.Index('ix_group_members_biostar_user_id', 'biostar_user_id'),
     )
     
     def __repr__(self):
@@ -406,11 +537,19 @@ class EmergencySession(db.Model):
     status = db.Column(db.String(20), default='active')
     notes = db.Column(db.Text)
     unlocked_doors = db.Column(db.Text)
+    roll_call_stats = db.Column(db.Text)  # JSON {total, present, absent, pending}, se actualiza en cada escritura
     
     zone = db.relationship('Zone', backref='emergencies')
     started_by_user = db.relationship('User', backref='started_emergencies')
     roll_call_entries = db.relationship('RollCallEntry', backref='emergency', lazy='dynamic', cascade='all, delete-orphan')
     
+    __table_args__ = (
+        # Emergencia activa de una zona
+        db.Index('ix_emergency_sessions_zone_status', 'zone_id', 'status'),
+        # Activas / historial de resueltas ordenado por fecha de resolución
+        db.Index('ix_emergency_sessions_status_resolved_at', 'status', 'resolved_at'),
+    )
+    
     def __repr__(self):
         return f'<EmergencySession {self.zone.name} - {self.status}>'
 
@@ -433,6 +572,13 @@ class RollCallEntry(db.Model):
     group = db.relationship('Group', backref='roll_call_entries')
     marked_by_user = db.relationship('User', backref='marked_roll_calls')
     
+    __table_args__ = (
+        # Pase de lista de una emergencia y conteos por estado
+        db.Index('ix_roll_call_entries_emergency_status', 'emergency_id', 'status'),
+        # Cambios recientes del stream de pase de lista
+        db.Index('ix_roll_call_entries_emergency_marked_at', 'emergency_id', 'marked_at'),
+    )
+    
     def __repr__(self):
         return f'<RollCallEntry {self.user_name} - {self.status}>'
 
@@ -452,6 +598,8 @@ class ZoneDevice(db.Model):
     
     __table_args__ = (
         db.UniqueConstraint('zone_id', 'device_id', name='unique_zone_device'),
+        # Dispositivos activos de una zona (consultado en cada tick de presencia)
+        db.Index('ix_zone_devices_zone_active', 'zone_id', 'is_active'),
     )
     
     def __repr__(self):
@@ -501,6 +649,10 @@ class PanicModeLog(db.Model):
     
     user = db.relationship('User', backref='panic_logs')
     
+    __table_args__ = (
+        db.Index('ix_panic_mode_log_device_timestamp', 'device_id', 'timestamp'),
+    )
+    
     def __repr__(self):
         return f'<PanicModeLog {self.device_name} - {self.action} by {self.username}>'
 
@@ -555,7 +707,7 @@ class PresetUsuario(db.Model):
     __tablename__ = 'mobper_presets'
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('mobper_users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('mobper_users.id'), nullable=False, index=True)
     
     # Datos para el formato
     nombre_formato = db.Column(db.String(200))
@@ -660,6 +812,119 @@ class IncidenciaDia(db.Model):
         return f'<IncidenciaDia {self.user_id} {self.fecha} - {self.clasificacion}>'
 
 
+def _valores_iniciales_incidencia(now):
+    """Valores por defecto de cada columna de IncidenciaDia para un INSERT explícito."""
+    valores = {}
+    for column in IncidenciaDia.__table__.columns:
+        if column.primary_key:
+            continue
+        default = column.default
+        if default is None:
+            valores[column.name] = None
+        elif default.is_scalar:
+            valores[column.name] = default.arg
+        else:
+            valores[column.name] = now
+    return valores
+
+
+def upsert_incidencias_dia(user_id, cambios):
+    """
+    Inserta o actualiza varias IncidenciaDia de un usuario en bloque.
+
+    Con SQLite, PostgreSQL y MySQL se escribe con INSERT ... ON CONFLICT
+    (user_id, fecha) DO UPDATE (ON DUPLICATE KEY UPDATE en MySQL): una sola
+    sentencia por cada conjunto de columnas actualizadas. En otros motores se
+    consultan los días existentes con un solo IN y se actualizan/insertan.
+
+    Args:
+        user_id: ID del MobPerUser
+        cambios: Lista de dicts {'fecha': date, 'valores': {columna: valor},
+                 'al_crear': {columna: valor}}. 'valores' se escribe siempre y
+                 'al_crear' solo si el día no existía. Si una fecha se repite,
+                 los cambios posteriores se combinan con los anteriores.
+
+    Returns:
+        Dict {fecha: IncidenciaDia} con el estado final de los días afectados
+    """
+    if not cambios:
+        return {}
+
+    # Combinar cambios por fecha
+    por_fecha = {}
+    for cambio in cambios:
+        entry = por_fecha.setdefault(cambio['fecha'], {'valores': {}, 'al_crear': {}})
+        entry['valores'].update(cambio.get('valores') or {})
+        entry['al_crear'].update(cambio.get('al_crear') or {})
+
+    now = datetime.utcnow()
+    fechas = list(por_fecha)
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in ('sqlite', 'postgresql', 'mysql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        elif dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.mysql import insert as dialect_insert
+
+        # Agrupar por columnas actualizadas: el SET debe ser igual para todas las filas
+        grupos = {}
+        for fecha, entry in por_fecha.items():
+            grupos.setdefault(frozenset(entry['valores']), []).append(fecha)
+
+        base = _valores_iniciales_incidencia(now)
+        for columnas, fechas_grupo in grupos.items():
+            rows = []
+            for fecha in fechas_grupo:
+                entry = por_fecha[fecha]
+                row = dict(base, user_id=user_id, fecha=fecha)
+                row.update(entry['al_crear'])
+                row.update(entry['valores'])
+                rows.append(row)
+
+            stmt = dialect_insert(IncidenciaDia).values(rows)
+            if dialect == 'mysql':
+                nuevos = stmt.inserted
+            else:
+                nuevos = stmt.excluded
+            set_ = {columna: nuevos[columna] for columna in columnas}
+            set_['updated_at'] = nuevos.updated_at
+
+            if dialect == 'mysql':
+                stmt = stmt.on_duplicate_key_update(**set_)
+            else:
+                stmt = stmt.on_conflict_do_update(index_elements=['user_id', 'fecha'], set_=set_)
+            # Días afectados, para invalidar solo sus resultados cacheados
+            db.session.execute(stmt, execution_options={
+                'incidencias_afectadas': [(user_id, fecha) for fecha in fechas_grupo]
+            })
+    else:
+        existentes = {
+            inc.fecha: inc for inc in IncidenciaDia.query.filter(
+                IncidenciaDia.user_id == user_id,
+                IncidenciaDia.fecha.in_(fechas)
+            )
+        }
+        for fecha, entry in por_fecha.items():
+            incidencia = existentes.get(fecha)
+            if incidencia is None:
+                incidencia = IncidenciaDia(user_id=user_id, fecha=fecha, **entry['al_crear'])
+                db.session.add(incidencia)
+            for columna, valor in entry['valores'].items():
+                setattr(incidencia, columna, valor)
+            incidencia.updated_at = now
+        db.session.flush()
+
+    # Estado final con un solo IN (refrescando objetos ya cargados en la sesión)
+    resultado = IncidenciaDia.query.filter(
+        IncidenciaDia.user_id == user_id,
+        IncidenciaDia.fecha.in_(fechas)
+    ).execution_options(populate_existing=True).all()
+    return {inc.fecha: inc for inc in resultado}
+
+
 class CorreccionDia(db.Model):
     """
     Regla de corrección permanente para un día específico.
@@ -699,5 +964,10 @@ class CorreccionDia(db.Model):
     activa = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Correcciones activas de una quincena (fecha ya es única, pero se filtra por activa)
+        db.Index('ix_mobper_correcciones_dia_activa_fecha', 'activa', 'fecha'),
+    )
+
     def __repr__(self):
         return f'<CorreccionDia {self.fecha} offset={self.offset_minutos}min>'
@@ -2,13 +2,17 @@
 Sistema de monitoreo y health checks para la aplicación.
 Incluye métricas de Prometheus y endpoints de salud.
 """
+import os
 import time
 import psutil
 import logging
+import threading
+from collections import Counter as StatementCounter
 from datetime import datetime
 from functools import wraps
-from typing import Callable, Dict, Any
-from flask import request, g
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from flask import request, g, has_request_context
+from sqlalchemy import event
 
 try:
     from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
@@ -73,6 +77,28 @@ if PROMETHEUS_AVAILABLE:
         'Total de errores',
         ['error_type']
     )
+    
+    # Consultas SQL por request
+    db_queries_per_request = Histogram(
+        'db_queries_per_request',
+        'Consultas SQL ejecutadas por request',
+        ['endpoint'],
+        buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+    )
+    
+    # Tiempo total en base de datos por request
+    db_time_per_request_seconds = Histogram(
+        'db_time_per_request_seconds',
+        'Tiempo total de consultas SQL por request en segundos',
+        ['endpoint']
+    )
+    
+    # Requests con la misma sentencia repetida (posible N+1)
+    db_repeated_statements_total = Counter(
+        'db_repeated_statements_total',
+        'Requests con sentencias SQL repetidas (posible N+1)',
+        ['endpoint']
+    )
 
 
 # ==================== DECORADORES DE MONITOREO ====================
@@ -119,6 +145,181 @@ def monitor_event(device_id: int, event_type: str):
         events_processed_total.labels(device_id=str(device_id), event_type=event_type).inc()
 
 
+# ==================== PERFILADO DE CONSULTAS SQL ====================
+
+# Veces que una misma sentencia (mismo SQL, distintos parámetros) puede repetirse
+# en un request antes de marcarse como posible N+1
+QUERY_REPEAT_THRESHOLD = int(os.environ.get('QUERY_REPEAT_THRESHOLD', 5))
+
+# Presupuesto de consultas por request (0 = sin límite); las vistas pueden
+# declarar el suyo con @query_budget(n)
+QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', 0))
+
+# En modo estricto exceder el presupuesto o repetir sentencias es un error
+QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', 'false').lower() == 'true'
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Un request excedió su presupuesto de consultas en modo estricto."""
+
+
+class QueryTracker:
+    """Consultas SQL ejecutadas durante un request."""
+    
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.statements = StatementCounter()
+    
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.total_time += duration
+        self.statements[statement] += 1
+    
+    def repeated(self, threshold: int = None) -> List[Tuple[str, int]]:
+        """
+        Sentencias ejecutadas al menos `threshold` veces.
+        
+        Args:
+            threshold: Mínimo de repeticiones (default: QUERY_REPEAT_THRESHOLD)
+            
+        Returns:
+            Lista de (sentencia, veces) de mayor a menor
+        """
+        threshold = threshold or QUERY_REPEAT_THRESHOLD
+        return [(sql, n) for sql, n in self.statements.most_common() if n >= threshold]
+
+
+def query_budget(max_queries: int):
+    """
+    Decorador que fija el máximo de consultas SQL de una vista.
+    
+    Args:
+        max_queries: Consultas permitidas por request
+    """
+    def decorator(func):
+        func.query_budget = max_queries
+        return func
+    return decorator
+
+
+def current_query_tracker() -> Optional[QueryTracker]:
+    """Tracker del request actual (None fuera de un request)."""
+    if not has_request_context():
+        return None
+    tracker = g.get('_query_tracker')
+    if tracker is None:
+        tracker = g._query_tracker = QueryTracker()
+    return tracker
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_start_time'].pop()
+    tracker = current_query_tracker()
+    if tracker is not None:
+        tracker.record(statement, time.perf_counter() - started)
+
+
+# Agregados por endpoint para /metrics/app
+_query_stats: Dict[str, Dict[str, Any]] = {}
+_query_stats_lock = threading.Lock()
+
+
+def get_query_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Resumen de consultas SQL por endpoint desde el arranque.
+    
+    Returns:
+        Dict {endpoint: {'requests', 'queries', 'avg_queries', 'max_queries',
+                         'db_time_ms', 'repeated_requests'}}
+    """
+    with _query_stats_lock:
+        return {
+            endpoint: dict(stats, avg_queries=round(stats['queries'] / stats['requests'], 1))
+            for endpoint, stats in _query_stats.items()
+        }
+
+
+def _record_query_stats(endpoint: str, tracker: QueryTracker, repeated: bool) -> None:
+    with _query_stats_lock:
+        stats = _query_stats.setdefault(endpoint, {
+            'requests': 0, 'queries': 0, 'max_queries': 0,
+            'db_time_ms': 0.0, 'repeated_requests': 0
+        })
+        stats['requests'] += 1
+        stats['queries'] += tracker.count
+        stats['max_queries'] = max(stats['max_queries'], tracker.count)
+        stats['db_time_ms'] = round(stats['db_time_ms'] + tracker.total_time * 1000, 3)
+        stats['repeated_requests'] += int(repeated)
+    
+    if PROMETHEUS_AVAILABLE:
+        db_queries_per_request.labels(endpoint=endpoint).observe(tracker.count)
+        db_time_per_request_seconds.labels(endpoint=endpoint).observe(tracker.total_time)
+        if repeated:
+            db_repeated_statements_total.labels(endpoint=endpoint).inc()
+
+
+def init_query_profiler(app, engine):
+    """
+    Cuenta las consultas SQL y el tiempo en BD de cada request.
+    
+    Agrega los headers X-DB-Queries / X-DB-Time-Ms (QUERY_HEADERS), registra
+    métricas por endpoint y avisa de sentencias repetidas (posible N+1).
+    Con QUERY_BUDGET_STRICT un request que excede su presupuesto lanza
+    QueryBudgetExceeded.
+    
+    Args:
+        app: Instancia de Flask
+        engine: Engine de SQLAlchemy a instrumentar
+    """
+    app.config.setdefault('QUERY_HEADERS', os.environ.get('FLASK_ENV') != 'production')
+    app.config.setdefault('QUERY_BUDGET', QUERY_BUDGET)
+    app.config.setdefault('QUERY_BUDGET_STRICT', QUERY_BUDGET_STRICT)
+    app.config.setdefault('QUERY_REPEAT_THRESHOLD', QUERY_REPEAT_THRESHOLD)
+    
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    
+    @app.after_request
+    def report_queries(response):
+        tracker = g.pop('_query_tracker', None)
+        if tracker is None:
+            tracker = QueryTracker()
+        endpoint = request.endpoint or 'unknown'
+        
+        repeated = tracker.repeated(app.config['QUERY_REPEAT_THRESHOLD'])
+        for statement, times in repeated:
+            logger.warning(
+                f"⚠ Posible N+1 en {endpoint}: sentencia ejecutada {times} veces: "
+                f"{' '.join(statement.split())[:200]}"
+            )
+        _record_query_stats(endpoint, tracker, bool(repeated))
+        
+        if app.config['QUERY_HEADERS']:
+            response.headers['X-DB-Queries'] = str(tracker.count)
+            response.headers['X-DB-Time-Ms'] = f"{tracker.total_time * 1000:.1f}"
+        
+        view = app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', None) or app.config['QUERY_BUDGET']
+        over_budget = bool(budget) and tracker.count > budget
+        if over_budget:
+            logger.warning(f"⚠ {endpoint} ejecutó {tracker.count} consultas (presupuesto: {budget})")
+        
+        if app.config['QUERY_BUDGET_STRICT'] and (over_budget or repeated):
+            detail = f"{tracker.count} consultas, presupuesto {budget or 'sin límite'}"
+            if repeated:
+                detail += f", sentencia repetida {repeated[0][1]} veces: {repeated[0][0][:200]}"
+            raise QueryBudgetExceeded(f"{endpoint}: {detail}")
+        
+        return response
+    
+    logger.info("[OK] Perfilado de consultas SQL por request habilitado")
+
+
 # ==================== HEALTH CHECKS ====================
 
 class HealthChecker:
@@ -272,6 +473,7 @@ class HealthChecker:
                     'threads': process.num_threads(),
                     'open_files': len(process.open_files()),
                 },
+                'database_queries': get_query_stats(),
                 'timestamp': datetime.utcnow().isoformat()
             }
         except Exception as e:
@@ -296,6 +498,11 @@ def init_monitoring(app):
     health_checker = HealthChecker(app)
     app.extensions['health_checker'] = health_checker
     
+    if 'sqlalchemy' in app.extensions:
+        from webapp.models import db
+        with app.app_context():
+            init_query_profiler(app, db.engine)
+    
     logger.info("[OK] Sistema de monitoreo inicializado")
     
     # Registrar rutas de monitoreo
@@ -0,0 +1,324 @@
+"""
+Índice en memoria de "última vez visto" por usuario.
+Alimentado por la ingesta compartida de eventos de BioStar para que la
+presencia por zona y el auto-marcado de emergencias se resuelvan con
+búsquedas en diccionario, sin consultar BioStar en cada tick.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import logging
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+# Ventana inicial de eventos a cargar cuando arranca la ingesta
+PRESENCE_BACKFILL_MINUTES = 30
+# Solapamiento entre consultas consecutivas (la ingesta es idempotente)
+PRESENCE_OVERLAP_SECONDS = 10
+# Entradas más antiguas que esto se descartan del índice
+PRESENCE_RETENTION_HOURS = 24
+# Al arrancar, la ingesta carga desde el inicio del día en ventanas de este tamaño
+PRESENCE_BACKFILL_CHUNK_MINUTES = 60
+# Eventos máximos por consulta (si se alcanza, la ventana pudo quedar incompleta)
+PRESENCE_QUERY_LIMIT = 2000
+# Sin una ingesta exitosa en este tiempo el índice no se considera al día
+PRESENCE_STALE_SECONDS = 30
+
+MEXICO_TZ = pytz.timezone('America/Mexico_City')
+
+
+def checkin_day_start(now: Optional[datetime] = None) -> datetime:
+    """
+    Inicio del día de check-in (5:30 hora de México, igual que "Usuarios del Día").
+
+    Args:
+        now: Momento de referencia (default: ahora)
+
+    Returns:
+        datetime con zona horaria
+    """
+    local_now = (now or datetime.now(pytz.utc)).astimezone(MEXICO_TZ)
+    return MEXICO_TZ.localize(datetime(local_now.year, local_now.month, local_now.day, 5, 30))
+
+
+def parse_event_time(value) -> Optional[datetime]:
+    """
+    Convierte el datetime de un evento de BioStar a datetime con zona horaria.
+    Los valores sin zona se interpretan como UTC (igual que _filter_events_by_time).
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            from dateutil import parser
+            value = parser.parse(value)
+        except (ValueError, OverflowError):
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = pytz.utc.localize(value)
+    return value
+
+
+class PresenceIndex:
+    """Índice thread-safe {user_id: (timestamp, device_id)} de accesos concedidos."""
+
+    def __init__(self):
+        self._last_seen: Dict[str, Tuple[datetime, int]] = {}
+        self._device_names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        # Desde cuándo el índice tiene todos los eventos (None = sin cobertura)
+        self._complete_since: Optional[datetime] = None
+        self._synced_at = 0.0
+
+    def ingest(self, events: Iterable[Dict]) -> int:
+        """
+        Incorpora eventos al índice conservando el más reciente por usuario.
+
+        Args:
+            events: Eventos de BioStar (se ignoran los que no son acceso concedido)
+
+        Returns:
+            Número de usuarios cuya última aparición cambió
+        """
+        from src.api.device_monitor import DeviceMonitor, EVENT_CODES
+
+        granted_codes = EVENT_CODES['ACCESS_GRANTED']
+        updated = 0
+
+        with self._lock:
+            for event in events:
+                event_code = str(event.get('event_type_id', {}).get('code', ''))
+                if event_code not in granted_codes:
+                    continue
+
+                user_id = DeviceMonitor.extract_user_id(event)
+                timestamp = parse_event_time(event.get('datetime'))
+                device_data = event.get('device_id', {})
+                if not user_id or timestamp is None or not isinstance(device_data, dict):
+                    continue
+
+                try:
+                    device_id = int(device_data.get('id'))
+                except (TypeError, ValueError):
+                    continue
+
+                if device_data.get('name'):
+                    self._device_names[device_id] = device_data['name']
+
+                current = self._last_seen.get(user_id)
+                if current is None or timestamp > current[0]:
+                    self._last_seen[user_id] = (timestamp, device_id)
+                    updated += 1
+
+        return updated
+
+    def last_seen(self, user_id) -> Optional[Tuple[datetime, int]]:
+        """Devuelve (timestamp, device_id) de la última aparición de un usuario."""
+        return self._last_seen.get(str(user_id))
+
+    def device_name(self, device_id: int) -> str:
+        """Nombre del dispositivo según los eventos ingeridos."""
+        return self._device_names.get(device_id, f'Dispositivo {device_id}')
+
+    def seen_since(self, user_ids: Iterable, since: datetime,
+                   device_ids: Optional[Iterable[int]] = None) -> Dict[str, Tuple[datetime, int]]:
+        """
+        Filtra qué usuarios aparecieron desde `since`.
+
+        Args:
+            user_ids: Usuarios a consultar
+            since: Momento a partir del cual contar (con o sin zona horaria)
+            device_ids: Si se indica, solo cuenta apariciones en estos dispositivos
+
+        Returns:
+            Diccionario {user_id: (timestamp, device_id)}
+        """
+        since = parse_event_time(since)
+        allowed = set(int(d) for d in device_ids) if device_ids is not None else None
+
+        result = {}
+        for user_id in user_ids:
+            user_id = str(user_id)
+            entry = self._last_seen.get(user_id)
+            if entry is None or entry[0] < since:
+                continue
+            if allowed is not None and entry[1] not in allowed:
+                continue
+            result[user_id] = entry
+        return result
+
+    def mark_synced(self, complete_since: Optional[datetime] = None):
+        """
+        Registra una ingesta exitosa.
+
+        Args:
+            complete_since: Si se indica, el índice tiene todos los eventos desde
+                este momento (reemplaza la cobertura anterior)
+        """
+        with self._lock:
+            if complete_since is not None:
+                self._complete_since = parse_event_time(complete_since)
+            self._synced_at = time.time()
+
+    def users_seen_since(self, since: datetime) -> Optional[Set[str]]:
+        """
+        Usuarios con acceso concedido desde `since`, sin consultar BioStar.
+
+        Args:
+            since: Momento a partir del cual contar
+
+        Returns:
+            Conjunto de user_ids, o None si el índice no cubre ese periodo o no
+            está al día (el llamador debe consultar BioStar)
+        """
+        since = parse_event_time(since)
+        with self._lock:
+            if (self._complete_since is None or self._complete_since > since
+                    or time.time() - self._synced_at > PRESENCE_STALE_SECONDS):
+                return None
+            return {uid for uid, (ts, _) in self._last_seen.items() if ts >= since}
+
+    def prune(self, older_than: datetime) -> int:
+        """Elimina entradas anteriores a `older_than`. Retorna cuántas se eliminaron."""
+        older_than = parse_event_time(older_than)
+        with self._lock:
+            stale = [uid for uid, (ts, _) in self._last_seen.items() if ts < older_than]
+            for uid in stale:
+                del self._last_seen[uid]
+            if self._complete_since is not None and self._complete_since < older_than:
+                self._complete_since = older_than
+        return len(stale)
+
+    def clear(self):
+        """Vacía el índice."""
+        with self._lock:
+            self._last_seen.clear()
+            self._device_names.clear()
+            self._complete_since = None
+            self._synced_at = 0.0
+
+    def __len__(self):
+        return len(self._last_seen)
+
+
+class PresenceIngestor:
+    """
+    Ingesta periódica de eventos de TODOS los dispositivos hacia el PresenceIndex.
+    Una sola consulta por ciclo (sin filtro de dispositivo) desde el último ciclo.
+    """
+
+    def __init__(self, device_monitor, index: PresenceIndex, interval: float = 2.0):
+        """
+        Inicializa la ingesta.
+
+        Args:
+            device_monitor: Función para obtener DeviceMonitor autenticado
+            index: Índice a alimentar
+            interval: Segundos entre consultas
+        """
+        self.get_monitor = device_monitor
+        self.index = index
+        self.interval = interval
+        self.is_running = False
+        self.thread = None
+        self.monitor_instance = None
+        self.last_login = None
+        self.last_poll: Optional[datetime] = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Inicia la ingesta (idempotente)."""
+        with self._start_lock:
+            if not self.is_running:
+                self.is_running = True
+                self.thread = threading.Thread(target=self._ingest_loop, daemon=True)
+                self.thread.start()
+                logger.info("[OK] Ingesta de presencia iniciada")
+
+    def stop(self):
+        """Detiene la ingesta."""
+        self.is_running = False
+        if self.thread:
+            self.thread.join(timeout=5)
+        logger.info("[STOPPED] Ingesta de presencia detenida")
+
+    def _get_or_create_monitor(self):
+        """Reutiliza el monitor y reautentica cada 5 minutos."""
+        now = datetime.now()
+        if self.monitor_instance is None or (self.last_login and (now - self.last_login).seconds > 300):
+            self.monitor_instance = self.get_monitor()
+            if self.monitor_instance:
+                self.last_login = now
+        return self.monitor_instance
+
+    def poll_once(self) -> int:
+        """
+        Consulta los eventos nuevos de todos los dispositivos y los ingiere.
+
+        Returns:
+            Número de usuarios actualizados en el índice
+        """
+        monitor = self._get_or_create_monitor()
+        if not monitor:
+            return 0
+
+        now = datetime.now()
+        first_poll = self.last_poll is None
+        if first_poll:
+            # Desde el inicio del día de check-in para poder responder "usuarios del día"
+            day_start = checkin_day_start(pytz.utc.localize(now)).astimezone(pytz.utc).replace(tzinfo=None)
+            start = min(now - timedelta(minutes=PRESENCE_BACKFILL_MINUTES), day_start)
+            step = timedelta(minutes=PRESENCE_BACKFILL_CHUNK_MINUTES)
+        else:
+            start = self.last_poll - timedelta(seconds=PRESENCE_OVERLAP_SECONDS)
+            step = now - start
+
+        end = now + timedelta(seconds=1)
+        complete_since = start if first_poll else None
+        updated = 0
+        window_start = start
+        while window_start < end:
+            window_end = min(window_start + step, end)
+            conditions = [{
+                "column": "datetime",
+                "operator": 3,  # Between
+                "values": [
+                    window_start.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                    window_end.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+                ]
+            }]
+            events = monitor.client.search_events(conditions, limit=PRESENCE_QUERY_LIMIT)
+            updated += self.index.ingest(events)
+            if len(events) >= PRESENCE_QUERY_LIMIT:
+                # Ventana truncada: solo hay cobertura completa después de ella
+                complete_since = window_end
+            window_start = window_end
+        self.last_poll = now
+
+        self.index.mark_synced(pytz.utc.localize(complete_since) if complete_since else None)
+        if updated:
+            logger.info(f"👣 Presencia: {updated} usuarios actualizados ({len(self.index)} en índice)")
+        return updated
+
+    def _ingest_loop(self):
+        """Loop principal de ingesta."""
+        cycles = 0
+        while self.is_running:
+            try:
+                self.poll_once()
+                cycles += 1
+                if cycles % 300 == 0:
+                    self.index.prune(datetime.now(pytz.utc) - timedelta(hours=PRESENCE_RETENTION_HOURS))
+                time.sleep(self.interval)
+            except Exception as e:
+                logger.error(f"Error en ingesta de presencia: {e}")
+                time.sleep(5)
+
+
+# Índice compartido por el monitor en tiempo real y las rutas de emergencias
+presence_index = PresenceIndex()
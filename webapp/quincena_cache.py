@@ -0,0 +1,403 @@
+"""
+Cache de resultados de quincena con invalidación por dependencias.
+
+Cada entrada registra las entradas de las que depende (tokens):
+  ('biostar', user_id)              eventos del usuario en BioStar
+  ('eventos', user_id, quincena)    eventos ya procesados de la quincena (otra entrada)
+  ('usuario', user_id)              número de socio / nombre del MobPerUser
+  ('preset', user_id)               PresetUsuario del usuario
+  ('correccion', fecha)             CorreccionDia de esa fecha
+  ('incidencia', user_id, fecha)    IncidenciaDia clasificada de ese día
+
+Los eventos de sesión de SQLAlchemy traducen cada escritura de esos modelos a
+sus tokens y se expulsan exactamente las entradas afectadas (y en cascada las
+que dependen de ellas).
+
+Los resúmenes por miembro del panel de grupo viven en el caché compartido
+(CacheManager) con los tags 'user:<id>' y 'quincena:<inicio>_<fin>'; las mismas
+escrituras invalidan esos tags.
+
+La cache de quincenas es local a cada proceso: los tokens invalidados se
+publican en el canal de invalidaciones del CacheManager ('deps'/'dep_kinds')
+y cada proceso expulsa las mismas entradas al recibirlos.
+"""
+import calendar
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect as sa_inspect
+
+from webapp import cache_manager as cache_module
+from webapp.models import db, IncidenciaDia, PresetUsuario, CorreccionDia, MobPerUser
+
+logger = logging.getLogger(__name__)
+
+Token = Tuple
+
+# Máximo de entradas en memoria (LRU)
+QUINCENA_CACHE_MAX_ENTRIES = 2048
+
+# Clave en session.info con los tokens pendientes hasta el commit
+_SESSION_KEY = 'quincena_cache_deps'
+
+# Columnas de MobPerUser que afectan el cálculo (last_login no invalida nada)
+_USUARIO_COLUMNAS = ('numero_socio', 'nombre_completo')
+
+
+def dep_biostar(user_id) -> Token:
+    return ('biostar', user_id)
+
+
+def dep_eventos(user_id, quincena_key) -> Token:
+    return ('eventos', user_id, quincena_key)
+
+
+def dep_usuario(user_id) -> Token:
+    return ('usuario', user_id)
+
+
+def dep_preset(user_id) -> Token:
+    return ('preset', user_id)
+
+
+def dep_correccion(fecha) -> Token:
+    return ('correccion', fecha)
+
+
+def dep_incidencia(user_id, fecha) -> Token:
+    return ('incidencia', user_id, fecha)
+
+
+# Namespace de los resúmenes por miembro en el caché compartido
+RESUMEN_NAMESPACE = 'grupo_resumen'
+
+
+def clave_resumen(user_id, quincena_key) -> str:
+    return f"{RESUMEN_NAMESPACE}:{user_id}:{quincena_key}"
+
+
+def tag_usuario(user_id) -> str:
+    return f"user:{user_id}"
+
+
+def tag_quincena(quincena_key) -> str:
+    return f"quincena:{quincena_key}"
+
+
+def quincena_key_de(fecha) -> str:
+    """Clave '<inicio>_<fin>' de la quincena que contiene una fecha."""
+    if fecha.day <= 15:
+        inicio, fin = fecha.replace(day=1), fecha.replace(day=15)
+    else:
+        inicio = fecha.replace(day=16)
+        fin = fecha.replace(day=calendar.monthrange(fecha.year, fecha.month)[1])
+    return f"{inicio}_{fin}"
+
+
+def _fechas(quincena: Dict):
+    fecha = quincena['inicio']
+    while fecha <= quincena['fin']:
+        yield fecha
+        fecha += timedelta(days=1)
+
+
+def dependencias_eventos(user_id, quincena: Dict) -> List[Token]:
+    """Tokens de los eventos procesados de una quincena (incluyen correcciones de checador)."""
+    deps = [dep_biostar(user_id), dep_usuario(user_id)]
+    deps.extend(dep_correccion(fecha) for fecha in _fechas(quincena))
+    return deps
+
+
+def dependencias_quincena(user_id, quincena: Dict, quincena_key: str) -> List[Token]:
+    """Tokens del resultado calculado de una quincena."""
+    deps = [dep_eventos(user_id, quincena_key), dep_usuario(user_id), dep_preset(user_id)]
+    for fecha in _fechas(quincena):
+        deps.append(dep_correccion(fecha))
+        deps.append(dep_incidencia(user_id, fecha))
+    return deps
+
+
+class DependencyCache:
+    """
+    Cache LRU en memoria {clave: valor} donde cada entrada declara sus
+    dependencias. Invalidar un token expulsa las entradas que dependen de él y,
+    en cascada, las que dependen de esas entradas (las claves también son tokens).
+    Los valores se copian al guardar y al leer para que nadie los mute.
+    """
+
+    def __init__(self, max_entries: int = QUINCENA_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Token, Tuple[Any, frozenset, Optional[float]]]' = OrderedDict()
+        self._dependientes: Dict[Token, Set[Token]] = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: Token) -> Optional[Any]:
+        """Devuelve una copia del valor o None si no existe o expiró."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.time():
+                self._expulsar(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = entry[0]
+        return copy.deepcopy(value)
+
+    def set(self, key: Token, value: Any, deps: Iterable[Token] = (), ttl: Optional[float] = None):
+        """
+        Guarda un valor con sus dependencias.
+
+        Args:
+            key: Clave de la entrada (también usable como token por otras entradas)
+            value: Valor a guardar (se copia)
+            deps: Tokens de los que depende
+            ttl: Segundos de vigencia; nunca excede la de las entradas de las que depende
+        """
+        deps = frozenset(deps)
+        value = copy.deepcopy(value)
+        with self._lock:
+            expires_at = time.time() + ttl if ttl is not None else None
+            for dep in deps:
+                dep_entry = self._entries.get(dep)
+                if dep_entry is not None and dep_entry[2] is not None:
+                    expires_at = dep_entry[2] if expires_at is None else min(expires_at, dep_entry[2])
+
+            if key in self._entries:
+                self._quitar(key)
+            self._entries[key] = (value, deps, expires_at)
+            for dep in deps:
+                self._dependientes.setdefault(dep, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._expulsar(oldest)
+
+    def _quitar(self, key: Token):
+        """Elimina una entrada y su registro en el índice inverso (requiere lock)."""
+        _, deps, _ = self._entries.pop(key)
+        for dep in deps:
+            keys = self._dependientes.get(dep)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._dependientes[dep]
+
+    def _expulsar(self, key: Token) -> int:
+        """Elimina una entrada y en cascada sus dependientes (requiere lock)."""
+        count = 0
+        pendientes = [key]
+        while pendientes:
+            token = pendientes.pop()
+            if token in self._entries:
+                self._quitar(token)
+                count += 1
+            pendientes.extend(self._dependientes.pop(token, ()))
+        return count
+
+    def invalidate(self, *deps: Token) -> int:
+        """
+        Expulsa las entradas que dependen de los tokens indicados.
+
+        Returns:
+            Número de entradas eliminadas
+        """
+        with self._lock:
+            count = sum(self._expulsar(dep) for dep in deps)
+            self.invalidations += count
+        if count:
+            logger.debug(f"🗑 Cache de quincenas: {count} entradas invalidadas por {deps}")
+        return count
+
+    def invalidate_kind(self, kind: str) -> int:
+        """Expulsa todas las entradas que dependen de algún token del tipo indicado."""
+        with self._lock:
+            tokens = [dep for dep in self._dependientes if dep[0] == kind]
+            tokens.extend(key for key in self._entries if key[0] == kind)
+        return self.invalidate(*tokens)
+
+    def clear(self):
+        """Vacía la cache."""
+        with self._lock:
+            self._entries.clear()
+            self._dependientes.clear()
+
+    def get_stats(self) -> Dict:
+        """Estadísticas de uso de la cache."""
+        with self._lock:
+            total_requests = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'dependencies': len(self._dependientes),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / total_requests * 100, 2) if total_requests else 0,
+            }
+
+
+# Cache compartida por los cálculos de quincena
+quincena_cache = DependencyCache()
+
+
+# =============================================================================
+# INVALIDACIÓN POR EVENTOS DE SESIÓN
+# =============================================================================
+
+def _valores(obj, attr: str) -> Set:
+    """Valor actual y anterior (si cambió en este flush) de un atributo."""
+    state = sa_inspect(obj)
+    history = state.attrs[attr].history
+    valores = set(history.added) | set(history.deleted) | set(history.unchanged)
+    if not valores:
+        valores.add(getattr(obj, attr, None))
+    return {v for v in valores if v is not None}
+
+
+def tokens_de_objeto(obj, borrado: bool = False) -> List[Token]:
+    """Tokens afectados por insertar, modificar o borrar un objeto."""
+    if isinstance(obj, IncidenciaDia):
+        return [dep_incidencia(user_id, fecha)
+                for user_id in _valores(obj, 'user_id')
+                for fecha in _valores(obj, 'fecha')]
+    if isinstance(obj, PresetUsuario):
+        return [dep_preset(user_id) for user_id in _valores(obj, 'user_id')]
+    if isinstance(obj, CorreccionDia):
+        return [dep_correccion(fecha) for fecha in _valores(obj, 'fecha')]
+    if isinstance(obj, MobPerUser):
+        state = sa_inspect(obj)
+        if borrado or any(state.attrs[col].history.has_changes() for col in _USUARIO_COLUMNAS):
+            return [dep_usuario(obj.id), dep_biostar(obj.id)]
+    return []
+
+
+def tags_compartidos(tokens: Iterable[Token]) -> Set[str]:
+    """Tags del caché compartido afectados por unos tokens."""
+    tags = set()
+    for token in tokens:
+        if token[0] in ('incidencia', 'preset', 'usuario', 'biostar', 'eventos'):
+            tags.add(tag_usuario(token[1]))
+        elif token[0] == 'correccion':
+            tags.add(tag_quincena(quincena_key_de(token[1])))
+    return tags
+
+
+# Posiciones con fechas dentro de cada tipo de token (viajan como ISO en JSON)
+_POSICIONES_FECHA = {'correccion': (1,), 'incidencia': (2,)}
+
+
+def codificar_token(token: Token) -> List:
+    """Token serializable en JSON para publicarlo a otros procesos."""
+    return [v.isoformat() if isinstance(v, date) else v for v in token]
+
+
+def decodificar_token(valores: List) -> Token:
+    """Reconstruye un token publicado por codificar_token."""
+    posiciones = _POSICIONES_FECHA.get(valores[0], ())
+    return tuple(date.fromisoformat(v) if i in posiciones else v for i, v in enumerate(valores))
+
+
+def invalidar_cache_compartida(tokens: Iterable[Token] = (), kinds: Iterable[str] = ()):
+    """
+    Invalida en el caché compartido los resúmenes afectados por tokens o tipos
+    de token y publica los tokens para que los demás procesos expulsen las
+    mismas entradas de su cache de quincenas.
+    """
+    shared = cache_module.cache_manager
+    if shared is None or not shared.enabled:
+        return
+    tokens, kinds = list(tokens), list(kinds)
+    tags = tags_compartidos(tokens)
+    if tags:
+        shared.invalidate_tags(*tags)
+    if kinds:
+        shared.delete_pattern(f"{RESUMEN_NAMESPACE}:*")
+    if tokens or kinds:
+        shared.publish_invalidation(deps=[codificar_token(t) for t in tokens], dep_kinds=kinds)
+
+
+def _aplicar_invalidacion_remota(data: Dict):
+    """Expulsa de la cache local los tokens publicados por otro proceso."""
+    tokens = [decodificar_token(valores) for valores in data.get('deps', ())]
+    if tokens:
+        quincena_cache.invalidate(*tokens)
+    for kind in data.get('dep_kinds', ()):
+        quincena_cache.invalidate_kind(kind)
+
+
+cache_module.add_invalidation_listener(_aplicar_invalidacion_remota)
+
+
+def _registrar(session, tokens: Iterable[Token]):
+    """Invalida ya (lecturas de la misma sesión) y otra vez al confirmar el commit."""
+    tokens = set(tokens)
+    if not tokens:
+        return
+    session.info.setdefault(_SESSION_KEY, set()).update(tokens)
+    quincena_cache.invalidate(*tokens)
+    invalidar_cache_compartida(tokens)
+
+
+def _after_flush(session, flush_context):
+    tokens = []
+    for obj in list(session.new) + list(session.dirty):
+        if session.is_modified(obj, include_collections=False) or obj in session.new:
+            tokens.extend(tokens_de_objeto(obj))
+    for obj in session.deleted:
+        tokens.extend(tokens_de_objeto(obj, borrado=True))
+    _registrar(session, tokens)
+
+
+def _do_orm_execute(orm_execute_state):
+    """Escrituras masivas (INSERT/UPDATE/DELETE por sentencia) sobre modelos rastreados."""
+    if orm_execute_state.is_select:
+        return
+    mapper = orm_execute_state.bind_mapper
+    clase = mapper.class_ if mapper is not None else None
+    if clase not in (IncidenciaDia, PresetUsuario, CorreccionDia, MobPerUser):
+        return
+
+    afectadas = orm_execute_state.execution_options.get('incidencias_afectadas')
+    if clase is IncidenciaDia and afectadas is not None:
+        _registrar(orm_execute_state.session,
+                   [dep_incidencia(user_id, fecha) for user_id, fecha in afectadas])
+        return
+
+    # Sin claves conocidas: se invalida todo lo que depende de ese modelo
+    kind = {IncidenciaDia: 'incidencia', PresetUsuario: 'preset',
+            CorreccionDia: 'correccion', MobPerUser: 'usuario'}[clase]
+    orm_execute_state.session.info.setdefault(_SESSION_KEY + '_kinds', set()).add(kind)
+    quincena_cache.invalidate_kind(kind)
+    invalidar_cache_compartida(kinds=[kind])
+
+
+def _after_commit(session):
+    tokens = session.info.pop(_SESSION_KEY, None)
+    kinds = session.info.pop(_SESSION_KEY + '_kinds', None)
+    if tokens:
+        quincena_cache.invalidate(*tokens)
+    for kind in kinds or ():
+        quincena_cache.invalidate_kind(kind)
+    if tokens or kinds:
+        invalidar_cache_compartida(tokens or (), kinds or ())
+
+
+def _after_rollback(session):
+    # Lo leído entre el flush y el rollback pudo cachear datos descartados
+    _after_commit(session)
+
+
+event.listen(db.session, 'after_flush', _after_flush)
+event.listen(db.session, 'do_orm_execute', _do_orm_execute)
+event.listen(db.session, 'after_commit', _after_commit)
+event.listen(db.session, 'after_soft_rollback', lambda session, previous_transaction: _after_rollback(session))
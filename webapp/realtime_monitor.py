@@ -9,6 +9,8 @@ from datetime import datetime, timedelta
 from typing import Dict, Set, List, Optional
 import logging
 
+from webapp.presence_index import presence_index
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
@@ -131,6 +133,7 @@ class RealtimeMonitor:
                     
                     if events:
                         logger.info(f"🔔 {len(events)} nuevos eventos en dispositivo {device_id}")
+                        presence_index.ingest(events)
                         self._emit_new_events(device_id, events)
                         
                         # Actualizar timestamp al más reciente
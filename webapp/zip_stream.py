@@ -0,0 +1,75 @@
+"""
+Escritura de ZIP en streaming.
+Genera el archivo por fragmentos a medida que llegan los miembros, sin
+archivos temporales ni el ZIP completo en memoria.
+"""
+import time
+import zipfile
+from typing import Iterable, Iterator, Tuple
+from urllib.parse import quote
+
+# Tamaño máximo de cada fragmento entregado al cliente
+ZIP_CHUNK_SIZE = 64 * 1024
+
+# Formatos que ya vienen comprimidos: se guardan sin deflate
+STORED_EXTENSIONS = ('.xlsx', '.zip', '.png', '.jpg', '.jpeg', '.pdf')
+
+
+class _ChunkBuffer:
+    """Destino de escritura no posicionable: acumula bytes hasta que se drenan."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _fragmentar(data: bytes, chunk_size: int) -> Iterator[bytes]:
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+
+def stream_zip(miembros: Iterable[Tuple[str, bytes]], chunk_size: int = ZIP_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Genera un ZIP por fragmentos.
+
+    Cada miembro se escribe en cuanto el iterable lo produce, así el primer
+    byte sale antes de que se rendericen los siguientes. Como el destino no es
+    posicionable, zipfile usa descriptores de datos tras cada miembro.
+
+    Args:
+        miembros: Iterable de (nombre, contenido)
+        chunk_size: Tamaño máximo de cada fragmento
+
+    Yields:
+        Fragmentos del archivo ZIP
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for nombre, contenido in miembros:
+            info = zipfile.ZipInfo(nombre, date_time=time.localtime()[:6])
+            if nombre.lower().endswith(STORED_EXTENSIONS):
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            zf.writestr(info, contenido)
+            yield from _fragmentar(buffer.drain(), chunk_size)
+
+    # Directorio central
+    yield from _fragmentar(buffer.drain(), chunk_size)
+
+
+def content_disposition(filename: str) -> str:
+    """Cabecera Content-Disposition de descarga con nombre ASCII y UTF-8 (RFC 6266)."""
+    ascii_name = filename.encode('ascii', 'ignore').decode('ascii').replace('"', '') or 'descarga'
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"